@@ -20,6 +20,7 @@ setup(name="ssap",
       author="Indra Sistemas S.A.",
       author_email="plataformasofia2@indra.es",
       url="http://www.sofia2.org",
-      packages=["ssap", "ssap.implementations", "ssap.utils", "ssap.messages", "ssap.tests.utils", "ssap.tests.websockets"],
+      packages=["ssap", "ssap.implementations", "ssap.utils", "ssap.messages", "ssap.tests.utils", "ssap.tests.websockets",
+                "ssap.tests.benchmarks", "ssap.tests.loopback"],
       package_dir = {"" : "src"}
      )
@@ -9,8 +9,8 @@
  All rights reserved
 '''
 from ssap.utils.enums import enum
-from inspect import getargspec
 from ssap.exceptions import InvalidSSAPCallback
+from ssap.utils.filters import IndicationFilter, FilteredHandler, parseIndicationData
 
 SSAP_MESSAGE_TYPE = enum("JOIN", "LEAVE", "INSERT", "UPDATE", "DELETE", "QUERY", "SUBSCRIBE", "UNSUBSCRIBE", "INDICATION", "CONFIG", "BULK")
 
@@ -21,6 +21,8 @@ SSAP_MESSAGE_DIRECTION = enum("REQUEST", "RESPONSE", "ERROR")
 SSAP_ERROR_CODE = enum("AUTHENTICATION", "AUTHORIZATION", "PROCESSOR", "PERSISTENCE", "PARSE_SQL", "ONTOLOGY_NOT_FOUND",
     "SIB_DEFINED_QUERY_NOT_FOUND", "OTHER")
 
+SSAP_REQUEST_PRIORITY = enum("CONTROL", "INTERACTIVE", "BULK")
+
 class BasicSSAPCallback(object):
     '''
     The simplest SSAP callback. It defines an unique handler for all the incoming SSAP messages.
@@ -35,9 +37,103 @@ class BasicSSAPCallback(object):
         '''
         raise NotImplementedError
     
+class SSAPRowHandler(object):
+    '''
+    Processes the rows of a QUERY response one by one, while the response is still being decoded.
+    The received message is kept in memory, but its data field is unescaped in small chunks and
+    neither the serialized nor the deserialized result set are ever stored as a whole.
+    '''
+    
+    def onRow(self, row):
+        '''
+        This method will be invoked for each row of the QUERY response.
+        
+        Keyword arguments:
+        row     -- the deserialized row.
+        '''
+        raise NotImplementedError
+    
+    def onQueryCompleted(self, message):
+        '''
+        This method will be invoked after processing all the rows of the QUERY response.
+        
+        Keyword arguments:
+        message     -- the QUERY response. Its data field will be empty.
+        '''
+        pass
+    
+class SSAPConnectionListener(object):
+    '''
+    Receives the events of the connection between an endpoint and the SIB.
+    '''
+    
+    def onConnectionLost(self, reason):
+        '''
+        This method will be invoked when the connection with the SIB is declared dead. The unanswered
+        requests have already failed.
+        
+        Keyword arguments:
+        reason     -- a string that describes why the connection was declared dead. When the endpoint
+                      fails over to another server, the unanswered requests that do not depend on the
+                      lost session will be sent again instead.
+        '''
+        pass
+    
+    def onConnectionRestored(self, serverUrl):
+        '''
+        This method will be invoked when the endpoint has failed over to another server and has
+        joined it again.
+        
+        Keyword arguments:
+        serverUrl  -- the URL of the server that the endpoint is connected to.
+        '''
+        pass
+    
+class SSAPPreparedQuery(object):
+    '''
+    A query whose QUERY message has been serialized in advance. Only the query parameters and
+    the session key are serialized when it is executed. Use SSAPEndpoint.prepare() to build it.
+    '''
+    
+    def __init__(self, template, submitFunction):
+        '''
+        Initializes the state of the query.
+        
+        Keyword arguments:
+        template          -- the template of the QUERY message.
+        submitFunction    -- the function that sends the bound QUERY messages. It receives the message and the row handler.
+        '''
+        self.__template = template
+        self.__submit = submitFunction
+        
+    def execute(self, queryParams=None, rowHandler=None):
+        '''
+        Sends a QUERY request. The response will be passed to the endpoint callback.
+        
+        Keyword arguments:
+        queryParams    -- an object containing the parameters of the query.
+        rowHandler     -- a SSAPRowHandler that will process the result rows one by one.
+        '''
+        self.__submit(self.__template.bind(queryParams=queryParams), rowHandler)
+        
+    def executeBatch(self, queryParamSets, rowHandler=None):
+        '''
+        Sends a QUERY request for each parameter set. The requests are queued in order, so the
+        responses will also be received in order.
+        
+        Keyword arguments:
+        queryParamSets -- an iterable of query parameter objects.
+        rowHandler     -- a SSAPRowHandler that will process the result rows of all the queries.
+        '''
+        for queryParams in queryParamSets:
+            self.__submit(self.__template.bind(queryParams=queryParams), rowHandler)
+    
 class MultiHandlerSSAPCallback(BasicSSAPCallback):
     '''
     A SSAP callback that define one or more handlers for each SSAP message type.
+    
+    All the handlers receive the same message object. If the endpoint generates compact messages,
+    it will be read-only, so a handler will not be able to modify the message that the others receive.
     '''
     def __init__(self):
         '''
@@ -62,9 +158,18 @@ class MultiHandlerSSAPCallback(BasicSSAPCallback):
         handler -- a function that will handle a SSAP message.
         '''
         if not handler is None and hasattr(handler, '__call__') :
-            (args, _varargs, _keywords, _locals) = getargspec(handler)
-            if len(args) == 1 or (len(args) == 2 and 'self' in args) :
+            # The inspect module is expensive to import, and it's only needed when a handler is registered
+            from inspect import signature
+            try:
+                handlerSignature = signature(handler)
+            except ValueError:
+                return # Some built-in callables have no signature: we cannot check them
+            try:
+                # The handlers receive the message as their only argument
+                handlerSignature.bind(None)
                 return
+            except TypeError:
+                pass
         raise InvalidSSAPCallback("The given object is not a valid SSAP callback function")
     
     @staticmethod
@@ -92,7 +197,7 @@ class MultiHandlerSSAPCallback(BasicSSAPCallback):
             raise InvalidSSAPCallback("The given message type is associated to a subscription. Please use registerSubscriptionHandler() instead.")
         self.__handlers[messageType].append(handler)
     
-    def registerSubscriptionHandler(self, messageType, ontology, handler):
+    def registerSubscriptionHandler(self, messageType, ontology, handler, where=None, fields=None):
         '''
         Registers a new SSAP subscription message handler.
         
@@ -100,10 +205,19 @@ class MultiHandlerSSAPCallback(BasicSSAPCallback):
         messageType    -- the type of the SSAP message that the handler will process.
         ontology       -- the target ontology of the SSAP subscription messages.
         handler        -- the function that will handle the subscription messages.
+        where          -- a filter expression (e.g. "Sensor.measure > 30"). The handler will only receive the
+                          INDICATION messages with matching instances, and the other instances will be removed.
+        fields         -- the instance fields that the handler will receive (e.g. ["Sensor.assetId", "Sensor.measure"]).
+                          By default, all of them.
         '''
         MultiHandlerSSAPCallback.__checkCallable(handler)
         if (MultiHandlerSSAPCallback.__isNotSubscriptionMessage(messageType)):
             raise InvalidSSAPCallback("The given message type not is associated to a subscription. Please use registerHandler() instead.")
+        if (not where is None or not fields is None):
+            if (messageType != SSAP_MESSAGE_TYPE.INDICATION):
+                raise InvalidSSAPCallback("Filters and projections can only be applied to INDICATION messages.")
+            # The expressions are compiled once, and the handler will only receive the filtered messages
+            handler = FilteredHandler(handler, IndicationFilter(where, fields))
         
         if (ontology in self.__handlers[messageType]):
             self.__handlers[messageType][ontology].append(handler)
@@ -146,8 +260,15 @@ class MultiHandlerSSAPCallback(BasicSSAPCallback):
                 callbacksToInvoke = callbacksToInvoke[message["ontology"]]
             else:
                 callbacksToInvoke = []
+        data = None
         for callback in callbacksToInvoke:
-            callback(message)
+            if (isinstance(callback, FilteredHandler)):
+                # The data of the message is deserialized once for all the filtered handlers
+                if (data is None):
+                    data = parseIndicationData(message)
+                callback(message, data)
+            else:
+                callback(message)
             
 class SSAPEndpoint(object):
     '''
@@ -208,6 +329,20 @@ class SSAPEndpoint(object):
         '''
         raise NotImplementedError
     
+    def insertColumns(self, ontology, template, columns, rowsPerMessage=1000):
+        '''
+        Inserts the rows of a set of columns in the RTDB. The rows are sent in BULK requests, and
+        they are serialized without building a dictionary per row. Returns the number of BULK requests.
+        
+        Keyword arguments:
+        ontology         -- the target ontology of the INSERT operations.
+        template         -- an ontology instance whose string values can reference a column with the
+                            "$<column name>" syntax (i.e. {"Sensor" : {"measure" : "$measure"}}).
+        columns          -- a dictionary that maps the column names to lists or NumPy arrays.
+        rowsPerMessage   -- the maximum number of rows of each BULK request.
+        '''
+        raise NotImplementedError
+    
     def update(self, ontology, query, data, queryType=SSAP_QUERY_TYPE.NATIVE):
         '''
         Updates data in the RTDB.
@@ -231,7 +366,7 @@ class SSAPEndpoint(object):
         '''
         raise NotImplementedError
     
-    def query(self, ontology, query, queryType=SSAP_QUERY_TYPE.NATIVE):
+    def query(self, ontology, query, queryType=SSAP_QUERY_TYPE.NATIVE, queryParams=None, rowHandler=None):
         '''
         Retrieves data stored in the RTDB, the HDB, the CDB or the SIB.
         
@@ -239,6 +374,21 @@ class SSAPEndpoint(object):
         ontology         -- the target ontology of the QUERY operation.
         query            -- the query that selects the data that will be returned.
         queryType        -- the type of the query (NATIVE, SQL-LIKE, CDB, SIB-DEFINED).  
+        queryParams      -- an object containing the parameters of the query.
+        rowHandler       -- a SSAPRowHandler. If it is set, the result rows will be decoded incrementally and
+                            passed to it one by one instead of being included in the QUERY response.
+        '''
+        raise NotImplementedError
+    
+    def prepare(self, ontology, query, queryType=SSAP_QUERY_TYPE.NATIVE):
+        '''
+        Prepares a query that will be executed many times with different parameters. The QUERY
+        message is serialized only once. Returns a SSAPPreparedQuery.
+        
+        Keyword arguments:
+        ontology         -- the target ontology of the QUERY operations.
+        query            -- the query that selects the data that will be returned.
+        queryType        -- the type of the query (NATIVE, SQL-LIKE, CDB, SIB-DEFINED).
         '''
         raise NotImplementedError
 
@@ -0,0 +1,156 @@
+# -*- coding: utf8 -*-
+'''
+De-duplication of INDICATION messages.
+
+Resubscriptions, overlapping subscriptions and gap backfills may deliver the same instance to
+a handler more than once. A DeduplicatingHandler sits in front of a subscription handler and
+discards the instances that it has already delivered. It remembers a bounded number of instance
+identities, optionally for a limited period of time.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.subscriptions import _removeInstances
+from ssap.utils.filters import compileFieldGetter
+
+class DeduplicatingHandler(object):
+    '''
+    Wraps an INDICATION handler and discards the instances that it has already handled. The
+    instances are identified by a key field (by default, their _id) and, optionally, by a
+    timestamp field. The instances without a key are always handled.
+
+    Beware: an UPDATE keeps the _id of the instance, so the INDICATION that it generates has the
+    same identity as the INSERT one. That's why the _id key requires a timestamp field (which tells
+    the versions of an instance apart) or a time window (which makes the handler forget the
+    identities). The same applies to any key that does not change when an instance is updated.
+    '''
+
+    def __init__(self, handler, key="_id", timestampField=None, maxEntries=10000, windowInSeconds=None):
+        '''
+        Initializes the state of the handler.
+
+        Keyword arguments:
+        handler          -- the function that will handle the INDICATION messages without duplicates.
+        key              -- the dotted path of the field that identifies the instances (e.g. "Sensor.assetId").
+        timestampField   -- the dotted path of a timestamp field. If it is set, the instances with the same key
+                            and different timestamps are considered different. The _id key requires this
+                            field or a time window.
+        maxEntries       -- the maximum number of identities that will be remembered. When it is reached, the
+                            least recently seen identity is forgotten.
+        windowInSeconds  -- if it is set, the identities that have not been seen during this period of time
+                            are forgotten.
+        '''
+        if (maxEntries is None or maxEntries <= 0):
+            raise InvalidSSAPOperation("The maximum number of entries must be a positive integer")
+        if (not windowInSeconds is None and windowInSeconds <= 0):
+            raise InvalidSSAPOperation("The time window must be positive")
+        if (key == "_id" and timestampField is None and windowInSeconds is None):
+            # Otherwise, the INDICATION messages of the updates would be discarded forever
+            raise InvalidSSAPOperation("The updated instances keep their _id: set a timestamp field or a time window")
+        self.__handler = handler
+        self.__getKey = compileFieldGetter(key)
+        if (timestampField is None):
+            self.__getTimestamp = None
+        else:
+            self.__getTimestamp = compileFieldGetter(timestampField)
+        self.__maxEntries = maxEntries
+        self.__windowInSeconds = windowInSeconds
+        self.__lock = Lock()
+        # Identity -> the last time it was seen. The least recently seen identities come first.
+        self.__entries = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__unkeyed = 0
+        self.__evictions = 0
+        self.__expirations = 0
+
+    def __call__(self, message):
+        '''
+        Hands an INDICATION message to the wrapped handler without the duplicate instances. The
+        messages that only contain duplicates are discarded.
+        '''
+        with self.__lock:
+            now = monotonic()
+            self.__expire(now)
+            message = _removeInstances(message, lambda instance: self.__isDuplicate(instance, now))
+        if (not message is None):
+            self.__handler(message)
+
+    def getStats(self):
+        '''
+        Returns a dictionary with the number of duplicate instances (hits), new instances (misses),
+        instances without a key (unkeyed), forgotten identities (evictions and expirations) and
+        remembered identities (size).
+        '''
+        with self.__lock:
+            self.__expire(monotonic())
+            return {"hits" : self.__hits, "misses" : self.__misses, "unkeyed" : self.__unkeyed,
+                    "evictions" : self.__evictions, "expirations" : self.__expirations,
+                    "size" : len(self.__entries), "maxEntries" : self.__maxEntries}
+
+    def clear(self):
+        '''
+        Forgets all the identities. The counters are not reset.
+        '''
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+    def __isDuplicate(self, instance, now):
+        identity = self.__getIdentity(instance)
+        if (identity is None):
+            self.__unkeyed += 1
+            return False
+        duplicate = identity in self.__entries
+        if (duplicate):
+            self.__hits += 1
+            self.__entries.move_to_end(identity)
+        else:
+            self.__misses += 1
+            if (len(self.__entries) >= self.__maxEntries):
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+        self.__entries[identity] = now
+        return duplicate
+
+    def __getIdentity(self, instance):
+        if (not isinstance(instance, dict)):
+            return None
+        key = self.__getKey(instance)
+        if (key is None):
+            return None
+        if (self.__getTimestamp is None):
+            return _hashable(key)
+        return (_hashable(key), _hashable(self.__getTimestamp(instance)))
+
+    def __expire(self, now):
+        if (self.__windowInSeconds is None):
+            return
+        limit = now - self.__windowInSeconds
+        while (self.__entries):
+            (identity, lastSeen) = next(iter(self.__entries.items()))
+            if (lastSeen > limit):
+                break
+            del self.__entries[identity]
+            self.__expirations += 1
+
+def _hashable(value):
+    '''
+    Converts the dictionaries and lists of an identity (e.g. {"$oid": "..."}) to strings.
+    '''
+    if (isinstance(value, (dict, list))):
+        return json.dumps(value, sort_keys=True)
+    return value
@@ -25,4 +25,9 @@ class InvalidSSAPCallback(Exception):
     Exception class for SSAP callback configuration errors.
     '''
     pass
-        
\ No newline at end of file
+        
+class InvalidSSAPFilter(Exception):
+    '''
+    Exception class for syntax errors in filter expressions.
+    '''
+    pass
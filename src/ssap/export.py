@@ -0,0 +1,417 @@
+# -*- coding: utf8 -*-
+'''
+A parallel exporter of ontology data.
+
+A "db.<ontology>.find(<criteria>)" query is split into partitions that select consecutive
+ranges of a timestamp field or of a key field. The partition queries are run concurrently
+through several sessions, and the rows of each partition are streamed to its own JSONL or CSV
+file while the response is being decoded, so the result set is never stored in memory. The
+failed partitions are retried individually. The files are written as "<file>.part" and renamed
+when the partition is complete, so an interrupted export can be resumed: the partitions whose
+files already exist are skipped.
+
+Usage: python -m ssap.export --url ws://sofia2.com/sib/api_websocket --token TOKEN --instance KP:INSTANCE
+       --ontology TestSensorTemperatura --field TestSensorTemperatura.timestamp
+       --start 2014-04-01T00:00:00Z --end 2014-05-01T00:00:00Z --partitions 30 --output-dir export
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from collections import deque
+from threading import Event, Lock, Thread
+from time import monotonic
+from ssap.core import BasicSSAPCallback, SSAPRowHandler, SSAP_MESSAGE_TYPE, SSAP_QUERY_TYPE
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.factories import SSAPEndpointFactory
+from ssap.utils.filters import compileFieldGetter
+from ssap.utils.queries import restrictNativeQuery
+from ssap.utils.timestamps import toEpochSeconds, toExtendedJsonDate
+
+def buildTimePartitions(query, timestampField, start, end, partitionCount):
+    '''
+    Splits a native query into queries that select consecutive intervals of a timestamp field.
+    The intervals have the same length, include their start and exclude their end.
+
+    Keyword arguments:
+    query             -- a "db.<ontology>.find(<criteria>)" query.
+    timestampField    -- the dotted path of the timestamp field.
+    start             -- the start of the exported period (in seconds since the epoch).
+    end               -- the end of the exported period (in seconds since the epoch). It is excluded.
+    partitionCount    -- the number of partitions.
+    '''
+    if (end <= start):
+        raise InvalidSSAPOperation("The end of the exported period must be after its start")
+    if (partitionCount <= 0):
+        raise InvalidSSAPOperation("The number of partitions must be positive")
+    # Every partition must be at least a millisecond long
+    partitionCount = min(partitionCount, max(1, int((end - start) * 1000)))
+    step = (end - start) / partitionCount
+    bounds = [start + index * step for index in range(partitionCount)] + [end]
+    partitions = []
+    for index in range(partitionCount):
+        condition = {timestampField : {"$gte" : toExtendedJsonDate(bounds[index]),
+                                       "$lt" : toExtendedJsonDate(bounds[index + 1])}}
+        partitions.append(restrictNativeQuery(query, condition, timestampField))
+    return partitions
+
+def buildKeyPartitions(query, keyField, boundaries):
+    '''
+    Splits a native query into queries that select consecutive ranges of a key field. The first
+    range ends at the first boundary and the last one starts at the last boundary, so n boundaries
+    define n + 1 partitions. The ranges include their start and exclude their end.
+
+    Keyword arguments:
+    query       -- a "db.<ontology>.find(<criteria>)" query.
+    keyField    -- the dotted path of the key field.
+    boundaries  -- the ordered key values that separate the partitions.
+    '''
+    if (len(boundaries) == 0):
+        raise InvalidSSAPOperation("At least one boundary is required")
+    if (any(boundaries[index] >= boundaries[index + 1] for index in range(len(boundaries) - 1))):
+        raise InvalidSSAPOperation("The boundaries must be sorted and unique")
+    conditions = [{keyField : {"$lt" : boundaries[0]}}]
+    for index in range(len(boundaries) - 1):
+        conditions.append({keyField : {"$gte" : boundaries[index], "$lt" : boundaries[index + 1]}})
+    conditions.append({keyField : {"$gte" : boundaries[-1]}})
+    return [restrictNativeQuery(query, condition, keyField) for condition in conditions]
+
+class _Partition(object):
+    '''
+    A partition query and the state of its export.
+    '''
+
+    __slots__ = ("index", "query", "path", "attempts", "rows", "error")
+
+    def __init__(self, index, query, path):
+        self.index = index
+        self.query = query
+        self.path = path
+        self.attempts = 0
+        self.rows = 0
+        self.error = None
+
+class _PartitionWriter(SSAPRowHandler):
+    '''
+    Writes the rows of a QUERY response to the temporary file of a partition. Once it is aborted,
+    it ignores the rows of a late response.
+    '''
+
+    def __init__(self, path, fileFormat, fields):
+        self.__lock = Lock()
+        self.__file = io.open(path, "w", encoding="utf-8", newline="")
+        self.__aborted = False
+        self.__rows = 0
+        if (fileFormat == "csv"):
+            self.__getters = [compileFieldGetter(field) for field in fields]
+            self.__writer = csv.writer(self.__file)
+            self.__writer.writerow(fields)
+        else:
+            self.__writer = None
+
+    def getRowCount(self):
+        return self.__rows
+
+    def onRow(self, row):
+        with self.__lock:
+            if (self.__aborted):
+                return
+            if (self.__writer is None):
+                self.__file.write(json.dumps(row, sort_keys=True))
+                self.__file.write("\n")
+            else:
+                self.__writer.writerow([_toCsvValue(getter(row)) for getter in self.__getters])
+            self.__rows += 1
+
+    def close(self):
+        with self.__lock:
+            self.__aborted = True
+            self.__file.close()
+
+def _toCsvValue(value):
+    if (value is None):
+        return ""
+    if (isinstance(value, dict) and len(value) == 1 and "$date" in value):
+        return value["$date"]
+    if (isinstance(value, (dict, list))):
+        return json.dumps(value, sort_keys=True)
+    if (isinstance(value, bool)):
+        return "true" if value else "false"
+    return value
+
+class _ExportSession(BasicSSAPCallback):
+    '''
+    A SSAP session that runs one partition query at a time.
+    '''
+
+    def __init__(self, options, transportFactory):
+        self.__options = options
+        self.__joined = Event()
+        self.__joinOk = False
+        self.__responseReceived = Event()
+        self.__response = None
+        if (transportFactory is None):
+            self.__endpoint = SSAPEndpointFactory.buildEndpoint(options.url, self, options.transport)
+        else:
+            self.__endpoint = SSAPEndpointFactory.buildWebsocketBasedSSAPEndpoint(options.url, self, False, None,
+                                                                                   transportFactory)
+
+    def join(self, timeout):
+        '''
+        Joins the SIB. Returns True if the JOIN request succeeded.
+        '''
+        self.__endpoint.joinWithToken(self.__options.token, self.__options.instance)
+        self.__joined.wait(timeout)
+        return self.__joinOk
+
+    def query(self, query, rowHandler, timeout):
+        '''
+        Runs a query and waits for its response. Returns None if it succeeded, or the error otherwise.
+        '''
+        self.__responseReceived.clear()
+        self.__response = None
+        self.__endpoint.query(self.__options.ontology, query, self.__options.queryType, rowHandler=rowHandler)
+        if (not self.__responseReceived.wait(timeout)):
+            return "The QUERY request timed out"
+        if (not self.__response["ok"]):
+            return str(self.__response.get("error"))
+        return None
+
+    def leave(self):
+        try:
+            self.__endpoint.leave()
+        except Exception:
+            pass
+
+    def onSSAPMessageReceived(self, message):
+        # Do not call this method from client code!!!
+        if (message["messageType"] == SSAP_MESSAGE_TYPE.JOIN and not self.__joined.is_set()):
+            self.__joinOk = bool(message["body"].get("ok"))
+            self.__joined.set()
+        elif (message["messageType"] == SSAP_MESSAGE_TYPE.QUERY):
+            self.__response = message["body"]
+            self.__responseReceived.set()
+
+class OntologyExporter(object):
+    '''
+    Exports the partitions of a query through several sessions.
+    '''
+
+    def __init__(self, options, partitionQueries, transportFactory=None):
+        '''
+        Initializes the state of the exporter.
+
+        Keyword arguments:
+        options            -- the parsed command line options.
+        partitionQueries   -- the queries of the partitions (see buildTimePartitions() and buildKeyPartitions()).
+        transportFactory   -- if it is set, it will be used instead of the transport selected in the command
+                              line (i.e. to share a loopback SIB between all the sessions).
+        '''
+        if (options.format == "csv" and not options.fields):
+            raise ValueError("The fields of the CSV files must be set")
+        self.__options = options
+        self.__transportFactory = transportFactory
+        self.__lock = Lock()
+        self.__partitions = []
+        for (index, query) in enumerate(partitionQueries):
+            fileName = "{0}-{1:04d}.{2}".format(options.ontology, index, options.format)
+            self.__partitions.append(_Partition(index, query, os.path.join(options.output_dir, fileName)))
+        self.__pending = deque()
+
+    def run(self):
+        '''
+        Exports the partitions. Returns a dictionary with the results. Its "failed" field lists
+        the partitions that could not be exported.
+        '''
+        options = self.__options
+        if (not os.path.isdir(options.output_dir)):
+            os.makedirs(options.output_dir)
+        skipped = 0
+        for partition in self.__partitions:
+            if (not options.restart and os.path.exists(partition.path)):
+                skipped += 1
+            else:
+                self.__pending.append(partition)
+        transportFactory = self.__transportFactory
+        if (transportFactory is None and options.transport == "loopback"):
+            transportFactory = SSAPEndpointFactory.buildTransportFactory("loopback")
+        start = monotonic()
+        workers = [Thread(target=self.__work, args=(transportFactory,), name="SSAPExporter")
+                   for _i in range(min(options.sessions, len(self.__pending)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = monotonic() - start
+        exported = [partition for partition in self.__partitions if partition.attempts > 0 and partition.error is None]
+        failed = [partition for partition in self.__partitions if not partition.error is None]
+        rows = sum(partition.rows for partition in exported)
+        return {"ontology" : options.ontology, "partitions" : len(self.__partitions), "exported" : len(exported),
+                "skipped" : skipped, "rows" : rows, "duration" : round(elapsed, 3),
+                "throughput" : round(rows / elapsed, 1) if elapsed > 0 else None,
+                "failed" : [{"index" : partition.index, "query" : partition.query, "attempts" : partition.attempts,
+                             "error" : partition.error} for partition in failed]}
+
+    def __nextPartition(self):
+        with self.__lock:
+            if (not self.__pending):
+                return None
+            return self.__pending.popleft()
+
+    def __work(self, transportFactory):
+        options = self.__options
+        session = None
+        try:
+            partition = self.__nextPartition()
+            while (not partition is None):
+                partition.attempts += 1
+                if (session is None):
+                    session = _ExportSession(options, transportFactory)
+                    if (not session.join(options.timeout)):
+                        session.leave()
+                        session = None
+                        self.__onPartitionFailed(partition, "Couldn't join the SIB")
+                        partition = self.__nextPartition()
+                        continue
+                error = self.__export(session, partition)
+                if (not error is None):
+                    # The session might still be busy with the failed request
+                    session.leave()
+                    session = None
+                    self.__onPartitionFailed(partition, error)
+                partition = self.__nextPartition()
+        finally:
+            if (not session is None):
+                session.leave()
+
+    def __export(self, session, partition):
+        temporaryPath = partition.path + ".part"
+        writer = _PartitionWriter(temporaryPath, self.__options.format, self.__options.fields)
+        try:
+            error = session.query(partition.query, writer, self.__options.timeout)
+        except Exception as e:
+            error = str(e)
+        finally:
+            writer.close()
+        if (error is None):
+            partition.rows = writer.getRowCount()
+            partition.error = None
+            os.replace(temporaryPath, partition.path)
+            if (not self.__options.quiet):
+                sys.stderr.write("Partition {0}: {1} rows exported\n".format(partition.index, partition.rows))
+        else:
+            try:
+                os.remove(temporaryPath)
+            except OSError:
+                pass
+        return error
+
+    def __onPartitionFailed(self, partition, error):
+        partition.error = error
+        if (not self.__options.quiet):
+            sys.stderr.write("Partition {0} failed (attempt {1}): {2}\n".format(partition.index, partition.attempts, error))
+        if (partition.attempts <= self.__options.retries):
+            with self.__lock:
+                self.__pending.append(partition)
+
+def _parseTime(value):
+    try:
+        epochSeconds = toEpochSeconds(float(value))
+    except ValueError:
+        epochSeconds = toEpochSeconds(value)
+    if (epochSeconds is None):
+        raise argparse.ArgumentTypeError("Invalid time: {0}".format(value))
+    return epochSeconds
+
+def _parseBoundaries(value):
+    boundaries = []
+    for item in value.split(","):
+        try:
+            boundaries.append(json.loads(item))
+        except ValueError:
+            boundaries.append(item.strip())
+    return boundaries
+
+def buildArgumentParser():
+    parser = argparse.ArgumentParser(prog="python -m ssap.export",
+                                     description="Exports the data of an ontology to JSONL or CSV files in parallel")
+    parser.add_argument("--url", required=True, help="the SIB websocket URL. loopback:// uses an in-process SIB stand-in")
+    parser.add_argument("--transport", default=None, help="the transport name (ws4py, native...). By default, ws4py "
+                        "or loopback, depending on the URL")
+    parser.add_argument("--token", required=True, help="the token used to join the SIB")
+    parser.add_argument("--instance", required=True, help="the KP instance")
+    parser.add_argument("--ontology", required=True, help="the exported ontology")
+    parser.add_argument("--query", default=None, help="a db.<ontology>.find(<criteria>) query that selects the exported "
+                        "instances. By default, all of them")
+    parser.add_argument("--query-type", choices=("NATIVE", "HDB", "CDB"), default="HDB", help="the query type")
+    parser.add_argument("--field", required=True, help="the dotted path of the field that partitions the data")
+    parser.add_argument("--start", type=_parseTime, default=None, help="the start of the exported period (ISO 8601 or "
+                        "seconds since the epoch)")
+    parser.add_argument("--end", type=_parseTime, default=None, help="the end of the exported period. It is excluded")
+    parser.add_argument("--partitions", type=int, default=None, help="the number of time partitions")
+    parser.add_argument("--partition-seconds", type=float, default=None, help="the length of the time partitions")
+    parser.add_argument("--boundaries", type=_parseBoundaries, default=None, help="comma-separated key values that "
+                        "separate the partitions. They are used instead of a time range")
+    parser.add_argument("--output-dir", default=".", help="the directory of the output files")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl", help="the format of the output files")
+    parser.add_argument("--fields", default=None, help="comma-separated dotted paths of the CSV columns")
+    parser.add_argument("--sessions", type=int, default=4, help="the number of parallel sessions")
+    parser.add_argument("--retries", type=int, default=3, help="the number of times that a failed partition is exported again")
+    parser.add_argument("--restart", action="store_true", help="export again the partitions whose files already exist")
+    parser.add_argument("--timeout", type=float, default=300.0, help="the JOIN and QUERY response timeout in seconds")
+    parser.add_argument("--quiet", action="store_true", help="do not report the progress")
+    return parser
+
+def main(argv=None):
+    parser = buildArgumentParser()
+    options = parser.parse_args(argv)
+    if (options.transport is None):
+        options.transport = "loopback" if options.url.startswith("loopback:") else "ws4py"
+    if (options.query is None):
+        options.query = "db.{0}.find({{}})".format(options.ontology)
+    options.queryType = SSAP_QUERY_TYPE.fromString(options.query_type)
+    options.fields = None if options.fields is None else [field.strip() for field in options.fields.split(",")]
+    options.sessions = max(1, options.sessions)
+    try:
+        if (not options.boundaries is None):
+            partitions = buildKeyPartitions(options.query, options.field, options.boundaries)
+        else:
+            if (options.start is None or options.end is None):
+                raise ValueError("--start and --end, or --boundaries, must be set")
+            partitionCount = options.partitions
+            if (partitionCount is None):
+                if (options.partition_seconds is None):
+                    raise ValueError("--partitions or --partition-seconds must be set")
+                partitionCount = int(-(-(options.end - options.start) // options.partition_seconds))
+            partitions = buildTimePartitions(options.query, options.field, options.start, options.end, partitionCount)
+        exporter = OntologyExporter(options, partitions)
+    except (InvalidSSAPOperation, TypeError, ValueError) as e:
+        parser.error(str(e))
+    try:
+        results = exporter.run()
+    except (IOError, RuntimeError) as e:
+        sys.stderr.write("Error: {0}\n".format(e))
+        return 1
+    print("{0} rows of {1} exported in {2} s ({3} rows/s): {4} partitions exported, {5} skipped, {6} failed".format(
+        results["rows"], results["ontology"], results["duration"], results["throughput"], results["exported"],
+        results["skipped"], len(results["failed"])))
+    if (results["failed"]):
+        for failure in results["failed"]:
+            sys.stderr.write("Partition {0} failed after {1} attempts: {2}\n".format(failure["index"], failure["attempts"],
+                                                                                    failure["error"]))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
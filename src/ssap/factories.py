@@ -2,29 +2,186 @@
 '''
  Python SSAP API
  Version 1.5
- 
+
  © Indra Sistemas, S.A.
  2014  SPAIN
-  
+
  All rights reserved
 '''
-from ssap.implementations.websockets import WebsocketBasedSSAPEndpoint, WebsocketConnectionData
+from importlib import import_module
+from threading import Lock
+from ssap.exceptions import InvalidSSAPOperation
+
+# Third-party packages can register their transports in this entry point group. The entry point
+# name is the transport name, and its object must be a transport factory class.
+TRANSPORT_ENTRY_POINT_GROUP = "ssap.transports"
 
 class SSAPEndpointFactory(object):
     '''
     The SSAP endpoint factory. Currently, it can only instantiate websocket-based endpoints.
+
+    The websocket transports are stored in a registry and their modules are imported when they
+    are requested for the first time, so importing this module does not import ws4py.
     '''
-    
+
+    # The registered transport factory classes. The strings are "module:attribute" references that
+    # have not been imported yet.
+    __transports = {"ws4py" : "ssap.implementations.ws4pyclient:Ws4pyTransportFactory",
+                    "native" : "ssap.implementations.rfc6455:NativeWebsocketTransportFactory",
+                    "record" : "ssap.implementations.capture:RecordingTransportFactory",
+                    "replay" : "ssap.implementations.capture:ReplayTransportFactory",
+                    "loopback" : "ssap.implementations.loopback:LoopbackTransportFactory"}
+
+    __transportsLock = Lock()
+
+    @staticmethod
+    def registerTransport(name, transportFactoryClass):
+        '''
+        Registers a websocket transport.
+
+        Keyword arguments:
+        name                    -- the name of the transport.
+        transportFactoryClass   -- a class (or a "module:attribute" reference to a class) whose instances
+                                   build the transport objects. Its constructor will receive the transport
+                                   options as keyword arguments.
+        '''
+        with SSAPEndpointFactory.__transportsLock:
+            SSAPEndpointFactory.__transports[name] = transportFactoryClass
+
+    @staticmethod
+    def getTransportNames():
+        '''
+        Returns a list with the names of the registered transports. The transports that are
+        registered through entry points will only be included after they have been requested.
+        '''
+        with SSAPEndpointFactory.__transportsLock:
+            return sorted(SSAPEndpointFactory.__transports.keys())
+
+    @staticmethod
+    def buildTransportFactory(name, **transportOptions):
+        '''
+        Instantiates the factory of a registered transport. Its module will be imported if necessary.
+
+        Keyword arguments:
+        name               -- the name of the transport.
+        transportOptions   -- the keyword arguments that will be passed to the transport factory class.
+        '''
+        return SSAPEndpointFactory.__getTransportFactoryClass(name)(**transportOptions)
+
+    @staticmethod
+    def __getTransportFactoryClass(name):
+        '''
+        Returns the transport factory class of a transport, importing it if necessary.
+        '''
+        with SSAPEndpointFactory.__transportsLock:
+            transportFactoryClass = SSAPEndpointFactory.__transports.get(name)
+            if (transportFactoryClass is None):
+                transportFactoryClass = SSAPEndpointFactory.__findEntryPoint(name)
+            elif (isinstance(transportFactoryClass, str)):
+                (moduleName, attribute) = transportFactoryClass.split(":")
+                transportFactoryClass = getattr(import_module(moduleName), attribute)
+            SSAPEndpointFactory.__transports[name] = transportFactoryClass
+            return transportFactoryClass
+
     @staticmethod
-    def buildWebsocketBasedSSAPEndpoint(server_url, callback, debugMode=False):
+    def __findEntryPoint(name):
+        '''
+        Looks for a transport in the installed entry points.
+        '''
+        # importlib.metadata scans the installed distributions, so we only import it when a transport is missing
+        from importlib.metadata import entry_points
+        entryPoints = entry_points()
+        if (hasattr(entryPoints, "select")):
+            entryPoints = entryPoints.select(group=TRANSPORT_ENTRY_POINT_GROUP)
+        else:
+            entryPoints = entryPoints.get(TRANSPORT_ENTRY_POINT_GROUP, ())
+        for entryPoint in entryPoints:
+            if (entryPoint.name == name):
+                return entryPoint.load()
+        raise InvalidSSAPOperation("Unknown SSAP transport: {0}".format(name))
+
+    @staticmethod
+    def buildEndpoint(server_url, callback, transport="ws4py", transportOptions=None, debugMode=False, flowController=None,
+                      compactMessages=False, connectTimeout=30):
+        '''
+        Instantiates a websocket-based SSAP endpoint that uses a registered transport.
+
+        Keyword arguments:
+        server_url        -- the URL of the websocket server, or a list with the URLs of several servers of the SIB.
+        callback          -- the callback that will process the incoming SSAP messages.
+        transport         -- the name of the transport.
+        transportOptions  -- a dictionary with the keyword arguments that will be passed to the transport factory class.
+        debugMode         -- enables debug log messages.
+        flowController    -- an object that limits the outbound requests (i.e. an AIMDFlowController).
+        compactMessages   -- if True, the callback will receive read-only SSAPMessage objects instead of dictionaries.
+        connectTimeout    -- the maximum number of seconds to wait for the connection to be established.
+        '''
+        from ssap.implementations.websockets import WebsocketBasedSSAPEndpoint, WebsocketConnectionData
+        if (transportOptions is None):
+            transportOptions = {}
+        transportFactory = SSAPEndpointFactory.buildTransportFactory(transport, **transportOptions)
+        connectionData = WebsocketConnectionData(server_url, transportFactory, connectTimeout)
+        return WebsocketBasedSSAPEndpoint(callback, connectionData, debugMode, flowController, compactMessages)
+
+    @staticmethod
+    def buildWebsocketBasedSSAPEndpoint(server_url, callback, debugMode=False, flowController=None, transportFactory=None,
+                                         compactMessages=False):
         '''
         Instantiates a websocket-based SSAp endpoint.
-        
+
         Keyword arguments:
-        server_url     -- the URl of the websocket server.
+        server_url     -- the URL of the websocket server, or a list with the URLs of several servers of the SIB.
         callback       -- the callback that will process the incoming SSAP messages.
         debugMode      -- enables debug log messages.
+        flowController -- an object that limits the outbound requests (i.e. an AIMDFlowController).
+        transportFactory -- a callable that builds the websocket client (i.e. a RecordingTransportFactory).
+        compactMessages  -- if True, the callback will receive read-only SSAPMessage objects instead of dictionaries.
+        '''
+        from ssap.implementations.websockets import WebsocketBasedSSAPEndpoint, WebsocketConnectionData
+        connectionData = WebsocketConnectionData(server_url, transportFactory)
+        endpoint = WebsocketBasedSSAPEndpoint(callback, connectionData, debugMode, flowController, compactMessages)
+        return endpoint
+
+    @staticmethod
+    def buildNativeWebsocketBasedSSAPEndpoint(server_url, callback, debugMode=False, flowController=None, connectTimeout=10,
+                                              tcpNoDelay=True, sendBufferSize=None, receiveBufferSize=None, compactMessages=False,
+                                              sendTimeout=30):
+        '''
+        Instantiates a websocket-based SSAP endpoint that uses the built-in RFC 6455 client instead of ws4py.
+
+        Keyword arguments:
+        server_url        -- the URL of the websocket server, or a list with the URLs of several servers of the SIB.
+        callback          -- the callback that will process the incoming SSAP messages.
+        debugMode         -- enables debug log messages.
+        flowController    -- an object that limits the outbound requests (i.e. an AIMDFlowController).
+        connectTimeout    -- the maximum number of seconds to wait for the connection to be established.
+        tcpNoDelay        -- if True, Nagle's algorithm will be disabled.
+        sendBufferSize    -- the size of the socket send buffer. None keeps the system default.
+        receiveBufferSize -- the size of the socket receive buffer. None keeps the system default.
+        compactMessages   -- if True, the callback will receive read-only SSAPMessage objects instead of dictionaries.
+        sendTimeout       -- the maximum number of seconds to wait for the server to accept the data of a frame.
+        '''
+        transportOptions = {"connectTimeout" : connectTimeout, "tcpNoDelay" : tcpNoDelay,
+                            "sendBufferSize" : sendBufferSize, "receiveBufferSize" : receiveBufferSize,
+                            "sendTimeout" : sendTimeout}
+        return SSAPEndpointFactory.buildEndpoint(server_url, callback, "native", transportOptions, debugMode, flowController,
+                                                 compactMessages, connectTimeout)
+
+    @staticmethod
+    def buildMultiplexedWebsocketConnection(server_url, debugMode=False, flowController=None, transportFactory=None,
+                                            compactMessages=False):
+        '''
+        Instantiates a websocket connection that can be shared by several SSAP sessions. The sessions
+        are created with its createSession() method.
+
+        Keyword arguments:
+        server_url       -- the URl of the websocket server.
+        debugMode        -- enables debug log messages.
+        flowController   -- an object that limits the outbound requests (i.e. an AIMDFlowController).
+        transportFactory -- a callable that builds the websocket client.
+        compactMessages  -- if True, the sessions will receive read-only SSAPMessage objects instead of dictionaries.
         '''
-        connectionData = WebsocketConnectionData(server_url)
-        endpoint = WebsocketBasedSSAPEndpoint(callback, connectionData, debugMode)
-        return endpoint
\ No newline at end of file
+        from ssap.implementations.websockets import WebsocketConnectionData
+        from ssap.implementations.multiplex import MultiplexedWebsocketConnection
+        connectionData = WebsocketConnectionData(server_url, transportFactory)
+        return MultiplexedWebsocketConnection(connectionData, debugMode, flowController, compactMessages)
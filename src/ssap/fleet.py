@@ -0,0 +1,359 @@
+# -*- coding: utf8 -*-
+'''
+A multi-process KP fleet runner.
+
+A single Python process can only use one core to build and parse SSAP messages. The fleet
+starts several worker processes, each one with its own joined websocket-based endpoint, and
+feeds them from a shared multiprocessing queue.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import logging
+import multiprocessing
+from collections import deque
+from threading import Thread, Event, Condition
+from time import monotonic
+from ssap.core import BasicSSAPCallback, SSAPEndpoint, SSAP_MESSAGE_TYPE, SSAP_QUERY_TYPE
+from ssap.exceptions import InvalidSSAPOperation, SSAPConnectionError
+from ssap.utils.logs import LogFactory
+
+# Layout of the per-worker statistics stored in the shared array
+_STATS_SUBMITTED = 0
+_STATS_OK = 1
+_STATS_FAILED = 2
+_STATS_LOST = 3
+_STATS_FIELDS = 4
+
+# The endpoint operations that can be submitted, and whether they return the number of requests
+# that they send. The other operations send a single request.
+_FLEET_OPERATIONS = {"insert" : False, "query" : False, "update" : False, "delete" : False, "subscribe" : False,
+                     "unsubscribe" : False, "config" : False, "bulk" : False, "insertColumns" : True}
+
+class SSAPFleet(object):
+    '''
+    Runs a fleet of worker processes. Each worker process has its own websocket-based SSAP endpoint,
+    so the endpoints are never carried across fork().
+    '''
+
+    def __init__(self, serverUrl, token, instance, workers=None, maxPendingRequests=100,
+                 joinTimeout=30, debugMode=False, startMethod="spawn", maxRestarts=5, restartDelay=1,
+                 maxRestartDelay=60, transport="ws4py"):
+        '''
+        Initializes the state of the fleet. No worker will be started until start() is called.
+
+        Keyword arguments:
+        serverUrl            -- the URL of the websocket server.
+        token                -- the token that the workers will use to JOIN.
+        instance             -- the KP instance ID to use. If it contains "{0}", it will be replaced by the worker number.
+        workers              -- the number of worker processes. By default, one per CPU.
+        maxPendingRequests   -- the maximum number of unanswered operations per worker.
+        joinTimeout          -- the number of seconds that a worker will wait for its JOIN response.
+        debugMode            -- enables debug log messages.
+        startMethod          -- the multiprocessing start method that will be used to create the workers.
+        maxRestarts          -- the maximum number of times that a worker process will be restarted after crashing.
+        restartDelay         -- the number of seconds to wait before restarting a crashed worker for the first time.
+                                The delay is doubled after each restart.
+        maxRestartDelay      -- the maximum number of seconds to wait before restarting a crashed worker.
+        transport            -- the name of the registered transport that the workers will use.
+        '''
+        if (workers is None):
+            workers = multiprocessing.cpu_count()
+        if (debugMode) :
+            logLevel = logging.DEBUG
+        else:
+            logLevel = logging.INFO
+        self.__logger = LogFactory.configureLogger(self, logLevel, LogFactory.DEFAULT_LOG_FILE)
+        self.__context = multiprocessing.get_context(startMethod)
+        self.__workerArgs = (serverUrl, token, instance, maxPendingRequests, joinTimeout, debugMode, transport)
+        self.__workerCount = workers
+        self.__tasks = self.__context.Queue()
+        self.__stats = self.__context.Array('q', workers * _STATS_FIELDS)
+        self.__maxRestarts = maxRestarts
+        self.__restartDelay = restartDelay
+        self.__maxRestartDelay = maxRestartDelay
+        self.__restarts = [0] * workers
+        # When the crashed workers will be restarted. None means that the worker is not waiting.
+        self.__restartTimes = [None] * workers
+        self.__abandoned = [False] * workers
+        self.__processes = [None] * workers
+        self.__stopping = Event()
+        self.__monitor = None
+
+    def start(self):
+        '''
+        Starts the worker processes and the thread that restarts them when they crash.
+        '''
+        if (not self.__monitor is None):
+            raise InvalidSSAPOperation("The fleet has already been started")
+        for workerId in range(self.__workerCount):
+            self.__startWorker(workerId)
+        self.__monitor = Thread(target=self.__monitorWorkers, name="SSAPFleetMonitor")
+        self.__monitor.daemon = True
+        self.__monitor.start()
+
+    def submit(self, operation, *args):
+        '''
+        Queues an endpoint operation. It will be performed by the first idle worker.
+
+        Keyword arguments:
+        operation    -- the name of the endpoint method to invoke (i.e. "insert", "update", "insertColumns",...).
+        args         -- the arguments of the endpoint method. They must be picklable.
+        '''
+        if (not operation in _FLEET_OPERATIONS):
+            raise InvalidSSAPOperation("The fleet workers cannot perform {0} operations".format(operation))
+        if (self.__monitor is None or self.__stopping.is_set()):
+            raise InvalidSSAPOperation("The fleet is not running")
+        if (all(self.__abandoned)):
+            raise SSAPConnectionError("All the fleet workers have crashed too many times")
+        self.__tasks.put((operation, args))
+
+    def insert(self, ontology, data, queryType=SSAP_QUERY_TYPE.NATIVE):
+        '''
+        Queues an INSERT operation.
+
+        Keyword arguments:
+        ontology         -- the target ontology of the INSERT operation.
+        data             -- the data to insert in the RTDB.
+        queryType        -- defines the format of the data (NATIVE or SQL-LIKE).
+        '''
+        self.submit("insert", ontology, data, queryType)
+
+    def stop(self, timeout=None):
+        '''
+        Stops the fleet. The workers will process all the queued operations, LEAVE and exit.
+
+        Keyword arguments:
+        timeout    -- the number of seconds to wait for each worker process.
+        '''
+        if (self.__monitor is None):
+            raise InvalidSSAPOperation("The fleet has not been started")
+        self.__stopping.set()
+        for _workerId in range(self.__workerCount):
+            self.__tasks.put(None)
+        self.__monitor.join()
+        for process in self.__processes:
+            process.join(timeout)
+
+    def getStats(self):
+        '''
+        Returns a dictionary with the aggregated statistics of the fleet. The per-worker statistics
+        are stored in the "workers" list. An operation that sends several requests is counted once:
+        it fails if any of its requests fails. The "lost" operations were taken by a worker that crashed
+        before receiving their responses, so they might or might not have been performed.
+        '''
+        with self.__stats.get_lock():
+            values = self.__stats[:]
+        workers = []
+        for workerId in range(self.__workerCount):
+            base = workerId * _STATS_FIELDS
+            workers.append({"submitted" : values[base + _STATS_SUBMITTED],
+                            "ok" : values[base + _STATS_OK],
+                            "failed" : values[base + _STATS_FAILED],
+                            "lost" : values[base + _STATS_LOST],
+                            "restarts" : self.__restarts[workerId],
+                            "abandoned" : self.__abandoned[workerId],
+                            "alive" : not self.__processes[workerId] is None and self.__processes[workerId].is_alive()})
+        totals = {"workers" : workers}
+        for field in ("submitted", "ok", "failed", "lost", "restarts"):
+            totals[field] = sum(worker[field] for worker in workers)
+        return totals
+
+    def __startWorker(self, workerId):
+        '''
+        Starts a worker process.
+
+        Keyword arguments:
+        workerId    -- the number of the worker.
+        '''
+        process = self.__context.Process(target=_runFleetWorker, name="SSAPFleetWorker-{0}".format(workerId),
+                                         args=(workerId, self.__tasks, self.__stats) + self.__workerArgs)
+        process.daemon = True
+        process.start()
+        self.__processes[workerId] = process
+
+    def __monitorWorkers(self):
+        '''
+        Restarts the worker processes that exit abnormally, with an exponential backoff. The workers
+        that crash too many times are abandoned.
+        '''
+        while not self.__stopping.wait(0.5):
+            now = monotonic()
+            for workerId in range(self.__workerCount):
+                process = self.__processes[workerId]
+                if (self.__abandoned[workerId] or process.is_alive() or process.exitcode == 0):
+                    continue
+                restartTime = self.__restartTimes[workerId]
+                if (restartTime is None):
+                    self.__onWorkerCrashed(workerId, process.exitcode, now)
+                elif (now >= restartTime):
+                    self.__restartTimes[workerId] = None
+                    self.__restarts[workerId] = self.__restarts[workerId] + 1
+                    self.__startWorker(workerId)
+
+    def __onWorkerCrashed(self, workerId, exitCode, now):
+        '''
+        Reports the operations that a crashed worker had taken and schedules its restart.
+
+        Keyword arguments:
+        workerId    -- the number of the worker.
+        exitCode    -- the exit code of the worker process.
+        now         -- the current monotonic time.
+        '''
+        base = workerId * _STATS_FIELDS
+        with self.__stats.get_lock():
+            lost = self.__stats[base + _STATS_SUBMITTED] - self.__stats[base + _STATS_OK] - \
+                self.__stats[base + _STATS_FAILED] - self.__stats[base + _STATS_LOST]
+            self.__stats[base + _STATS_LOST] += lost
+        if (lost > 0):
+            self.__logger.error("Fleet worker {0} crashed before receiving the responses of {1} operations".format(workerId, lost))
+        if (self.__restarts[workerId] >= self.__maxRestarts):
+            self.__abandoned[workerId] = True
+            self.__logger.error("Fleet worker {0} exited with code {1}. It has crashed too many times, so it won't be restarted".format(
+                workerId, exitCode))
+            return
+        delay = min(self.__maxRestartDelay, self.__restartDelay * 2 ** self.__restarts[workerId])
+        self.__logger.warning("Fleet worker {0} exited with code {1}. Restarting it in {2} seconds".format(workerId, exitCode, delay))
+        self.__restartTimes[workerId] = now + delay
+
+class _FleetWorkerCallback(BasicSSAPCallback):
+    '''
+    The SSAP callback used by the fleet workers. It updates the shared statistics and limits the
+    number of unanswered operations of the worker. The responses arrive in the order in which the
+    requests were sent, so they are matched with the oldest unfinished operation.
+    '''
+
+    def __init__(self, workerId, stats, maxPendingRequests):
+        '''
+        Initializes the state of the callback.
+
+        Keyword arguments:
+        workerId            -- the number of the worker.
+        stats               -- the shared statistics array.
+        maxPendingRequests  -- the maximum number of unanswered operations.
+        '''
+        BasicSSAPCallback.__init__(self)
+        self.__base = workerId * _STATS_FIELDS
+        self.__stats = stats
+        self.__maxPendingRequests = maxPendingRequests
+        self.__condition = Condition()
+        # The unfinished operations: [expected responses (None if unknown), received responses, ok]
+        self.__pending = deque()
+        self.__joined = Event()
+        self.__left = Event()
+        self.__joinOk = False
+
+    def onSSAPMessageReceived(self, message):
+        messageType = message["messageType"]
+        if (messageType == SSAP_MESSAGE_TYPE.INDICATION):
+            return
+        isOk = SSAPEndpoint.hasOkField(message) and message["body"]["ok"]
+        if (messageType == SSAP_MESSAGE_TYPE.JOIN):
+            self.__joinOk = isOk
+            self.__joined.set()
+        elif (messageType == SSAP_MESSAGE_TYPE.LEAVE):
+            self.__left.set()
+        else:
+            with self.__condition:
+                if (len(self.__pending) == 0):
+                    return
+                operation = self.__pending[0]
+                operation[1] = operation[1] + 1
+                operation[2] = operation[2] and isOk
+                self.__finishOperations()
+
+    def waitForJoin(self, timeout):
+        '''
+        Waits for the JOIN response. Returns True if the JOIN operation succeeded.
+        '''
+        return self.__joined.wait(timeout) and self.__joinOk
+
+    def waitForLeave(self, timeout):
+        '''
+        Waits for the LEAVE response.
+        '''
+        return self.__left.wait(timeout)
+
+    def onTaskTaken(self):
+        '''
+        Counts an operation that has been taken from the shared queue. If the worker crashes before
+        receiving its response, the fleet will report it as lost.
+        '''
+        self.__increment(_STATS_SUBMITTED)
+
+    def acquireSlot(self):
+        '''
+        Blocks until the number of unanswered operations is below the limit, and registers a new one.
+        '''
+        with self.__condition:
+            while (len(self.__pending) >= self.__maxPendingRequests):
+                self.__condition.wait()
+            self.__pending.append([None, 0, True])
+
+    def onOperationSent(self, requestCount):
+        '''
+        Sets the number of responses that the last registered operation will receive.
+
+        Keyword arguments:
+        requestCount    -- the number of requests that the operation has sent.
+        '''
+        with self.__condition:
+            self.__pending[-1][0] = requestCount
+            self.__finishOperations()
+
+    def waitUntilIdle(self):
+        '''
+        Waits until all the operations have been answered.
+        '''
+        with self.__condition:
+            while (len(self.__pending) != 0):
+                self.__condition.wait()
+
+    def __finishOperations(self):
+        '''
+        Counts the operations that have received all their responses. The condition must be held.
+        '''
+        while (len(self.__pending) != 0 and not self.__pending[0][0] is None and self.__pending[0][1] >= self.__pending[0][0]):
+            (_expected, _received, ok) = self.__pending.popleft()
+            if (ok):
+                self.__increment(_STATS_OK)
+            else:
+                self.__increment(_STATS_FAILED)
+            self.__condition.notify_all()
+
+    def __increment(self, field):
+        with self.__stats.get_lock():
+            self.__stats[self.__base + field] += 1
+
+def _runFleetWorker(workerId, tasks, stats, serverUrl, token, instance, maxPendingRequests, joinTimeout, debugMode, transport):
+    '''
+    The body of the fleet worker processes. The endpoint is created here, after the process has
+    been started, so it never crosses a fork() boundary.
+    '''
+    # The websocket implementation is imported here to keep it out of the parent process
+    from ssap.factories import SSAPEndpointFactory
+    callback = _FleetWorkerCallback(workerId, stats, maxPendingRequests)
+    endpoint = SSAPEndpointFactory.buildEndpoint(serverUrl, callback, transport, debugMode=debugMode)
+    endpoint.joinWithToken(token, instance.format(workerId))
+    if (not callback.waitForJoin(joinTimeout)):
+        raise SSAPConnectionError("Fleet worker {0} couldn't join the SIB".format(workerId))
+    while True:
+        task = tasks.get()
+        if (task is None):
+            break
+        (operation, args) = task
+        callback.onTaskTaken()
+        callback.acquireSlot()
+        result = getattr(endpoint, operation)(*args)
+        if (_FLEET_OPERATIONS[operation]):
+            callback.onOperationSent(result)
+        else:
+            callback.onOperationSent(1)
+    callback.waitUntilIdle()
+    endpoint.leave()
+    callback.waitForLeave(joinTimeout)
@@ -0,0 +1,281 @@
+# -*- coding: utf8 -*-
+'''
+Record-and-replay websocket transports.
+
+The recording transport stores every raw frame that the endpoint sends and receives in a
+capture file. The replay transport feeds a captured session back into an endpoint without
+connecting to the SIB.
+
+Capture files start with a magic string. Each frame is stored as a fixed-size header (the
+direction, the number of seconds since the connection was established and the payload length)
+followed by the payload. The frames are flushed as soon as they are written, so the capture
+file can be read while the session is still running and it survives a crash of the process.
+
+Each connection is recorded in its own capture file. The first one is stored in the given path,
+and the connections that follow it (i.e. after a reconnection or a failover) are stored in
+"<path>.1", "<path>.2" and so on. They are replayed in the same order.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import os
+import struct
+from threading import Lock, Thread, Condition, Event
+from time import monotonic, sleep
+from ssap.exceptions import SSAPConnectionError
+
+_CAPTURE_MAGIC = b"SSAPCAP1"
+_FRAME_HEADER = struct.Struct("<BdI")
+
+FRAME_SENT = 0
+FRAME_RECEIVED = 1
+
+def getConnectionCapturePath(capturePath, connectionNumber):
+    '''
+    Returns the path of the capture file of a connection.
+
+    Keyword arguments:
+    capturePath         -- the path of the capture file of the first connection.
+    connectionNumber    -- the number of the connection. The first one is 0.
+    '''
+    if (connectionNumber == 0):
+        return capturePath
+    return "{0}.{1}".format(capturePath, connectionNumber)
+
+class SSAPCaptureWriter(object):
+    '''
+    Writes frames to a capture file.
+    '''
+
+    def __init__(self, path):
+        '''
+        Creates the capture file. If it already exists, it will be overwritten.
+
+        Keyword arguments:
+        path    -- the path of the capture file.
+        '''
+        self.__lock = Lock()
+        self.__file = open(path, "wb")
+        self.__file.write(_CAPTURE_MAGIC)
+        self.__file.flush()
+        self.__start = monotonic()
+
+    def write(self, direction, payload):
+        '''
+        Appends a frame to the capture file.
+
+        Keyword arguments:
+        direction    -- FRAME_SENT or FRAME_RECEIVED.
+        payload      -- the raw frame data.
+        '''
+        if (not isinstance(payload, bytes)):
+            payload = payload.encode("utf-8")
+        with self.__lock:
+            if (self.__file.closed):
+                return
+            self.__file.write(_FRAME_HEADER.pack(direction, monotonic() - self.__start, len(payload)) + payload)
+            self.__file.flush()
+
+    def close(self):
+        '''
+        Flushes and closes the capture file.
+        '''
+        with self.__lock:
+            self.__file.close()
+
+class SSAPCaptureReader(object):
+    '''
+    Reads the frames stored in a capture file.
+    '''
+
+    def __init__(self, path):
+        '''
+        Initializes the state of the reader.
+
+        Keyword arguments:
+        path    -- the path of the capture file.
+        '''
+        self.__path = path
+
+    def __iter__(self):
+        '''
+        Returns an iterator over the (direction, timestamp, payload) tuples stored in the capture file.
+        '''
+        with open(self.__path, "rb") as captureFile:
+            if (captureFile.read(len(_CAPTURE_MAGIC)) != _CAPTURE_MAGIC):
+                raise ValueError("{0} is not a SSAP capture file".format(self.__path))
+            while True:
+                header = captureFile.read(_FRAME_HEADER.size)
+                if (len(header) < _FRAME_HEADER.size):
+                    return
+                (direction, timestamp, length) = _FRAME_HEADER.unpack(header)
+                payload = captureFile.read(length)
+                if (len(payload) < length):
+                    return # The process crashed while it was writing the frame
+                yield (direction, timestamp, payload)
+
+class RecordingTransportFactory(object):
+    '''
+    Builds transports that record all the frames of another transport. Each connection is
+    recorded in its own capture file.
+    '''
+
+    def __init__(self, capturePath, transportFactory=None):
+        '''
+        Initializes the state of the factory.
+
+        Keyword arguments:
+        capturePath        -- the path of the capture file of the first connection.
+        transportFactory   -- the factory of the transport that will be recorded. By default, the ws4py-based one.
+        '''
+        self.__capturePath = capturePath
+        self.__transportFactory = transportFactory
+        self.__lock = Lock()
+        self.__connections = 0
+
+    def getCapturePaths(self):
+        '''
+        Returns the paths of the capture files that have been created, in connection order.
+        '''
+        with self.__lock:
+            return [getConnectionCapturePath(self.__capturePath, number) for number in range(self.__connections)]
+
+    def __call__(self, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+        transportFactory = self.__transportFactory
+        if (transportFactory is None):
+            from ssap.implementations.ws4pyclient import _SSAPWebsocketClient
+            transportFactory = _SSAPWebsocketClient
+        with self.__lock:
+            capturePath = getConnectionCapturePath(self.__capturePath, self.__connections)
+            self.__connections = self.__connections + 1
+        return _RecordingTransport(SSAPCaptureWriter(capturePath), transportFactory, serverUrl, protocols,
+                                   connectionEstablishedHandler, dataReceivedEventHandler)
+
+class _RecordingTransport(object):
+    '''
+    A transport that records the frames of another transport.
+    '''
+
+    def __init__(self, writer, transportFactory, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+        self.__writer = writer
+        self.__dataReceivedEventHandler = dataReceivedEventHandler
+        self.__transport = transportFactory(serverUrl, protocols, connectionEstablishedHandler, self.__onDataReceived)
+        if (hasattr(self.__transport, "ping")):
+            # The control frames are not recorded
+            self.ping = self.__transport.ping
+            self.setPongHandler = self.__transport.setPongHandler
+
+    def connect(self):
+        self.__transport.connect()
+
+    def send(self, payload, binary=False):
+        self.__writer.write(FRAME_SENT, payload)
+        self.__transport.send(payload, binary)
+
+    def close(self):
+        self.__transport.close()
+        self.__writer.close()
+
+    def run_forever(self):
+        self.__transport.run_forever()
+
+    def __onDataReceived(self, data):
+        self.__writer.write(FRAME_RECEIVED, data)
+        self.__dataReceivedEventHandler(data)
+
+class ReplayTransportFactory(object):
+    '''
+    Builds transports that replay the capture files of a recorded session instead of connecting to
+    the SIB. Each new connection replays the next capture file.
+    '''
+
+    def __init__(self, capturePath, realTime=True, synchronizeWithRequests=True):
+        '''
+        Initializes the state of the factory.
+
+        Keyword arguments:
+        capturePath              -- the path of the capture file of the first connection.
+        realTime                 -- if True, the received frames will be replayed with their original timing.
+                                    Otherwise, they will be replayed as fast as possible.
+        synchronizeWithRequests  -- if True, a received frame will not be replayed until the endpoint has sent
+                                    as many frames as were sent before it in the captured session.
+        '''
+        self.__capturePath = capturePath
+        self.__realTime = realTime
+        self.__synchronizeWithRequests = synchronizeWithRequests
+        self.__lock = Lock()
+        self.__connections = 0
+
+    def __call__(self, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+        with self.__lock:
+            capturePath = getConnectionCapturePath(self.__capturePath, self.__connections)
+            self.__connections = self.__connections + 1
+        if (not os.path.exists(capturePath)):
+            raise SSAPConnectionError("The captured session has no more connections: {0} does not exist".format(capturePath))
+        return _ReplayTransport(SSAPCaptureReader(capturePath), self.__realTime, self.__synchronizeWithRequests,
+                                connectionEstablishedHandler, dataReceivedEventHandler)
+
+class _ReplayTransport(object):
+    '''
+    A transport that replays the received frames stored in a capture file. The sent frames are discarded.
+    '''
+
+    def __init__(self, reader, realTime, synchronizeWithRequests, connectionEstablishedHandler, dataReceivedEventHandler):
+        self.__reader = reader
+        self.__realTime = realTime
+        self.__synchronizeWithRequests = synchronizeWithRequests
+        self.__connectionEstablishedHandler = connectionEstablishedHandler
+        self.__dataReceivedEventHandler = dataReceivedEventHandler
+        self.__sentFrames = 0
+        self.__sentFramesCondition = Condition()
+        self.__closed = Event()
+        self.__thread = None
+
+    def connect(self):
+        if (not self.__thread is None):
+            raise SSAPConnectionError("The captured session is already being replayed")
+        self.__thread = Thread(target=self.__replay, name="SSAPReplayTransport")
+        self.__thread.daemon = True
+        self.__connectionEstablishedHandler()
+        self.__thread.start()
+
+    def send(self, payload, binary=False):
+        with self.__sentFramesCondition:
+            self.__sentFrames = self.__sentFrames + 1
+            self.__sentFramesCondition.notify_all()
+
+    def close(self):
+        self.__closed.set()
+        with self.__sentFramesCondition:
+            self.__sentFramesCondition.notify_all()
+
+    def run_forever(self):
+        self.__thread.join()
+
+    def __replay(self):
+        '''
+        Feeds the received frames of the capture file to the endpoint.
+        '''
+        start = monotonic()
+        capturedSentFrames = 0
+        for (direction, timestamp, payload) in self.__reader:
+            if (self.__closed.is_set()):
+                return
+            if (direction == FRAME_SENT):
+                capturedSentFrames = capturedSentFrames + 1
+                continue
+            if (self.__synchronizeWithRequests):
+                with self.__sentFramesCondition:
+                    while (self.__sentFrames < capturedSentFrames and not self.__closed.is_set()):
+                        self.__sentFramesCondition.wait()
+            if (self.__realTime):
+                delay = timestamp - (monotonic() - start)
+                if (delay > 0):
+                    sleep(delay)
+            if (not self.__closed.is_set()):
+                self.__dataReceivedEventHandler(payload)
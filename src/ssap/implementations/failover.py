@@ -0,0 +1,224 @@
+# -*- coding: utf8 -*-
+'''
+Server selection and hot standby connections for the websocket-based SSAP endpoints.
+
+When an endpoint can use several SIB front ends, they are probed before connecting: the
+healthy ones are tried first, fastest first. A hot standby is an additional connection to
+another front end that is established and joined in advance, so that a dead connection can be
+replaced without waiting for the websocket handshake and the JOIN request.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import logging
+import socket
+from threading import Thread, Event, Lock
+from time import monotonic
+from urllib.parse import urlsplit
+from ssap.core import SSAP_MESSAGE_TYPE
+from ssap.messages.messages import _SSAPMessageFactory, _SSAPMessageParser
+
+# The default ports of the URL schemes whose servers can be probed
+_DEFAULT_PORTS = {"ws" : 80, "http" : 80, "wss" : 443, "https" : 443}
+
+def probeServerUrl(url, timeout):
+    '''
+    Measures the time that it takes to open a TCP connection with the server of a websocket URL.
+    Returns the latency (in seconds), or None if the server is unreachable. The URLs that do not
+    use a TCP-based scheme (i.e. loopback://) cannot be probed, and their latency is always 0.
+
+    Keyword arguments:
+    url        -- the URL of the websocket server.
+    timeout    -- the maximum number of seconds to wait for the TCP connection.
+    '''
+    parts = urlsplit(url)
+    defaultPort = _DEFAULT_PORTS.get(parts.scheme.lower())
+    if (defaultPort is None):
+        return 0.0
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    if (port is None):
+        port = defaultPort
+    start = monotonic()
+    try:
+        connection = socket.create_connection((parts.hostname, port), timeout)
+    except (OSError, ValueError):
+        return None
+    latency = monotonic() - start
+    connection.close()
+    return latency
+
+def rankServerUrls(urls, timeout, healthCheck=probeServerUrl):
+    '''
+    Probes several websocket URLs in parallel. Returns a list with the healthy URLs sorted by
+    latency and a list with the unhealthy ones.
+
+    Keyword arguments:
+    urls           -- the URLs to probe.
+    timeout        -- the maximum number of seconds to wait for each probe.
+    healthCheck    -- the function that probes a URL. It receives the URL and the timeout, and returns
+                      its latency (in seconds) or None if it is not healthy.
+    '''
+    latencies = [None] * len(urls)
+    def probe(index):
+        try:
+            latencies[index] = healthCheck(urls[index], timeout)
+        except Exception:
+            latencies[index] = None
+    threads = [Thread(target=probe, args=(index,), name="SSAPProbe") for index in range(len(urls))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    deadline = monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - monotonic()))
+    healthyUrls = sorted([index for index in range(len(urls)) if not latencies[index] is None],
+                         key=lambda index: latencies[index])
+    unhealthyUrls = [urls[index] for index in range(len(urls)) if latencies[index] is None]
+    return ([urls[index] for index in healthyUrls], unhealthyUrls)
+
+class _SSAPStandbyConnection(object):
+    '''
+    A connection with a SIB front end that has been joined with a token, but sends no other requests
+    until it replaces the connection of an endpoint. Its session is renewed periodically.
+    '''
+
+    def __init__(self, serverUrl, connectionData, token, instance, renewalIntervalInSeconds, logger):
+        '''
+        Initializes the state of the connection. It will be established when open() is invoked.
+
+        Keyword arguments:
+        serverUrl                 -- the URL of the websocket server.
+        connectionData            -- the configuration of the websocket connections of the endpoint.
+        token                     -- the token of the JOIN requests.
+        instance                  -- the KP instance of the JOIN requests.
+        renewalIntervalInSeconds  -- the number of seconds between two consecutive session renewals.
+        logger                    -- the logger of the endpoint.
+        '''
+        self.__serverUrl = serverUrl
+        self.__connectionData = connectionData
+        self.__token = token
+        self.__instance = instance
+        self.__renewalInterval = renewalIntervalInSeconds
+        self.__logger = logger
+        self.__lock = Lock()
+        self.__websocket = None
+        self.__connectionEstablished = Event()
+        self.__joined = Event()
+        self.__stopEvent = Event()
+        self.__sessionKey = None
+        self.__joinResponse = None
+        self.__dataHandler = None
+        self.__connectionHandler = None
+
+    def getServerUrl(self):
+        return self.__serverUrl
+
+    def open(self):
+        '''
+        Connects to the SIB and joins it. Returns True if the connection is ready to be used.
+        '''
+        timeout = self.__connectionData.getConnectTimeout()
+        try:
+            transportFactory = self.__connectionData.getTransportFactory()
+            self.__websocket = transportFactory(self.__serverUrl, self.__connectionData.getProtocols(),
+                                                self.__onConnectionEvent, self.__onDataReceived)
+            self.__websocket.connect()
+            if (not self.__connectionEstablished.wait(timeout)):
+                raise Exception("Connection timed out")
+            self.__websocket.send(_SSAPMessageFactory.buildTokenBasedJoinMessage(self.__token, self.__instance), False)
+            if (not self.__joined.wait(timeout) or self.__sessionKey is None):
+                raise Exception("The SIB did not accept the JOIN request")
+        except Exception as e:
+            self.__logger.warning("Couldn't open a standby connection with {0}: {1}".format(self.__serverUrl, str(e)))
+            self.close()
+            return False
+        renewalThread = Thread(target=self.__renewSession, name="SSAPStandbyKeeper")
+        renewalThread.daemon = True
+        renewalThread.start()
+        return True
+
+    def isReady(self):
+        '''
+        Checks if the connection can replace the connection of an endpoint.
+        '''
+        with self.__lock:
+            return not self.__websocket is None and not self.__sessionKey is None
+
+    def promote(self, dataHandler, connectionHandler):
+        '''
+        Hands the connection to an endpoint. Returns the websocket client, the session key and the
+        serialized JOIN response.
+
+        Keyword arguments:
+        dataHandler          -- the function that will process the data received from now on.
+        connectionHandler    -- the function that will be invoked if the websocket client reports a new connection.
+        '''
+        self.__stopEvent.set()
+        with self.__lock:
+            self.__dataHandler = dataHandler
+            self.__connectionHandler = connectionHandler
+            return (self.__websocket, self.__sessionKey, self.__joinResponse)
+
+    def close(self):
+        '''
+        Closes the connection.
+        '''
+        self.__stopEvent.set()
+        with self.__lock:
+            websocket = self.__websocket
+            self.__websocket = None
+            self.__sessionKey = None
+        if (not websocket is None):
+            try:
+                websocket.close()
+            except Exception as e:
+                self.__logger.debug("Couldn't close the standby connection: " + str(e))
+
+    def __renewSession(self):
+        while (not self.__stopEvent.wait(self.__renewalInterval)):
+            with self.__lock:
+                websocket = self.__websocket
+                sessionKey = self.__sessionKey
+            if (websocket is None or sessionKey is None):
+                return
+            try:
+                websocket.send(_SSAPMessageFactory.buildRenewSessionKeyJoinMessage(self.__token, self.__instance, sessionKey), False)
+            except Exception as e:
+                self.__logger.warning("Couldn't renew the session of the standby connection: " + str(e))
+                self.close()
+
+    def __onConnectionEvent(self):
+        with self.__lock:
+            connectionHandler = self.__connectionHandler
+        if (connectionHandler is None):
+            self.__connectionEstablished.set()
+        else:
+            connectionHandler()
+
+    def __onDataReceived(self, data):
+        with self.__lock:
+            dataHandler = self.__dataHandler
+        if (not dataHandler is None):
+            dataHandler(data)
+            return
+        if (len(data) == 1):
+            return
+        message = _SSAPMessageParser.parse(data)
+        if (message["messageType"] != SSAP_MESSAGE_TYPE.JOIN):
+            return
+        with self.__lock:
+            if (message["body"]["ok"]):
+                self.__sessionKey = message["sessionKey"]
+                self.__joinResponse = data
+            else:
+                self.__logger.warning("The standby connection could not join the SIB: " + str(message["body"].get("error")))
+                self.__sessionKey = None
+        self.__joined.set()
@@ -0,0 +1,217 @@
+# -*- coding: utf8 -*-
+'''
+An in-process SIB stand-in.
+
+The loopback transport does not open any network connection: the requests are answered by an
+in-memory SIB that behaves like a real one (sessions, inserted instances, queries and
+subscriptions with INDICATION messages). It is useful to measure the client-side overhead of
+the SSAP API and to test applications without a SIB.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import json
+from collections import deque
+from itertools import count
+from threading import Lock, Thread
+from ssap.exceptions import SSAPConnectionError
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+class LoopbackSIB(object):
+    '''
+    An in-memory SIB. It stores the last instances inserted in each ontology.
+    '''
+
+    def __init__(self, storedInstances=1000, queryLimit=10):
+        '''
+        Initializes the state of the SIB.
+
+        Keyword arguments:
+        storedInstances    -- the maximum number of instances that will be stored for each ontology.
+        queryLimit         -- the maximum number of instances that the QUERY responses will contain.
+        '''
+        self.__lock = Lock()
+        self.__storedInstances = storedInstances
+        self.__queryLimit = queryLimit
+        self.__instances = {}
+        self.__subscriptions = {}
+        self.__ids = count(1)
+        self.__responsive = True
+
+    def setResponsive(self, responsive):
+        '''
+        Enables or disables the responses. While the SIB is unresponsive, the requests and the pings
+        are silently discarded, like in a half-open connection.
+
+        Keyword arguments:
+        responsive    -- False to stop answering.
+        '''
+        self.__responsive = responsive
+
+    def isResponsive(self):
+        return self.__responsive
+
+    def process(self, transport, request):
+        '''
+        Processes a SSAP request and delivers the response (and the INDICATION messages that it
+        generates) to the transports.
+
+        Keyword arguments:
+        transport    -- the transport that sent the request.
+        request      -- the deserialized request.
+        '''
+        if (not self.__responsive):
+            return
+        messageType = request["messageType"]
+        ontology = request.get("ontology")
+        sessionKey = request.get("sessionKey")
+        body = request.get("body")
+        data = None
+        indications = []
+        with self.__lock:
+            if (messageType == "JOIN"):
+                sessionKey = "loopback-session-{0}".format(next(self.__ids))
+            elif (messageType == "INSERT" or messageType == "UPDATE"):
+                data = '{{"_id": ObjectId("{0:024x}")}}'.format(next(self.__ids))
+                self.__store(ontology, body.get("data"), indications)
+            elif (messageType == "BULK"):
+                for item in body:
+                    if (item.get("type") == "INSERT"):
+                        self.__store(item.get("ontology"), item["body"].get("data"), indications)
+            elif (messageType == "QUERY"):
+                instances = list(self.__instances.get(ontology, ()))[-self.__queryLimit:]
+                data = json.dumps(instances)
+            elif (messageType == "SUBSCRIBE"):
+                data = "loopback-subscription-{0}".format(next(self.__ids))
+                self.__subscriptions[data] = (transport, ontology, sessionKey)
+            elif (messageType == "UNSUBSCRIBE"):
+                self.__subscriptions.pop(body.get("idSuscripcion", body.get("subscriptionId")), None)
+        responseBody = {"ok" : True, "data" : data, "error" : None, "errorCode" : None}
+        if (messageType == "CONFIG"):
+            responseBody = {}
+        transport._deliver(self.__buildMessage(messageType, sessionKey, ontology, responseBody))
+        for (subscriber, indication) in indications:
+            subscriber._deliver(indication)
+
+    def __store(self, ontology, instance, indications):
+        '''
+        Stores an inserted instance and builds the INDICATION messages that it generates.
+        '''
+        if (isinstance(instance, str)):
+            try:
+                instance = json.loads(instance)
+            except ValueError:
+                return # SQL-like statements are not interpreted
+        if (instance is None):
+            return
+        self.__instances.setdefault(ontology, deque(maxlen=self.__storedInstances)).append(instance)
+        for (subscriptionId, (subscriber, subscribedOntology, subscriberKey)) in self.__subscriptions.items():
+            if (subscribedOntology == ontology):
+                indications.append((subscriber, self.__buildMessage("INDICATION", subscriberKey, ontology,
+                                    {"subscriptionId" : subscriptionId, "data" : [instance]})))
+
+    def disconnect(self, transport):
+        '''
+        Removes the subscriptions of a closed transport.
+        '''
+        with self.__lock:
+            for subscriptionId in [s for (s, value) in self.__subscriptions.items() if value[0] is transport]:
+                del self.__subscriptions[subscriptionId]
+
+    @staticmethod
+    def __buildMessage(messageType, sessionKey, ontology, body):
+        return json.dumps({"messageType" : messageType, "direction" : "RESPONSE", "sessionKey" : sessionKey,
+                           "ontology" : ontology, "body" : body}).encode("utf-8")
+
+class LoopbackTransportFactory(object):
+    '''
+    Builds transports that send the requests to a LoopbackSIB.
+    '''
+
+    def __init__(self, sib=None):
+        '''
+        Initializes the state of the factory.
+
+        Keyword arguments:
+        sib    -- the LoopbackSIB that will answer the requests. By default, a new one. Share it between
+                  several factories to connect several endpoints to the same SIB.
+        '''
+        if (sib is None):
+            sib = LoopbackSIB()
+        self.__sib = sib
+
+    def getSIB(self):
+        '''
+        Returns the LoopbackSIB that answers the requests.
+        '''
+        return self.__sib
+
+    def __call__(self, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+        return _LoopbackTransport(self.__sib, connectionEstablishedHandler, dataReceivedEventHandler)
+
+class _LoopbackTransport(object):
+    '''
+    A transport connected to a LoopbackSIB. The requests are processed by a background thread, so
+    the responses are delivered asynchronously, like in a real connection.
+    '''
+
+    def __init__(self, sib, connectionEstablishedHandler, dataReceivedEventHandler):
+        self.__sib = sib
+        self.__connectionEstablishedHandler = connectionEstablishedHandler
+        self.__dataReceivedEventHandler = dataReceivedEventHandler
+        self.__requests = Queue()
+        self.__thread = None
+        self.__pongHandler = None
+
+    def connect(self):
+        if (not self.__thread is None):
+            raise SSAPConnectionError("The loopback transport is already connected")
+        self.__thread = Thread(target=self.__run, name="SSAPLoopbackTransport")
+        self.__thread.daemon = True
+        self.__thread.start()
+        self.__connectionEstablishedHandler()
+
+    def send(self, payload, binary=False):
+        self.__requests.put(("request", payload))
+
+    def ping(self, payload=b""):
+        if (self.__sib.isResponsive()):
+            self.__requests.put(("pong", payload))
+
+    def setPongHandler(self, pongHandler):
+        self.__pongHandler = pongHandler
+
+    def close(self):
+        self.__requests.put(("close", None))
+
+    def run_forever(self):
+        self.__thread.join()
+
+    def _deliver(self, data):
+        '''
+        Queues a message that the SIB sends to this transport.
+        '''
+        self.__requests.put(("response", data))
+
+    def __run(self):
+        while True:
+            (kind, payload) = self.__requests.get()
+            if (kind == "close"):
+                self.__sib.disconnect(self)
+                return
+            if (kind == "response"):
+                self.__dataReceivedEventHandler(payload)
+            elif (kind == "pong"):
+                if (not self.__pongHandler is None):
+                    self.__pongHandler(payload)
+            else:
+                self.__sib.process(self, json.loads(payload))
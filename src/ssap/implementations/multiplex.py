@@ -0,0 +1,66 @@
+# -*- coding: utf8 -*-
+'''
+Several SSAP sessions over a single websocket connection.
+
+SSAP messages carry their session key, so many JOINed KP instances can share one websocket
+connection, one writer and one reader. The responses are routed to the session that sent the
+request, and the INDICATION messages are routed using their session key.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import logging
+from ssap.implementations.websockets import WebsocketBasedSSAPEndpoint, _SSAPConnection
+from ssap.utils.logs import LogFactory
+from ssap import profiling
+
+class MultiplexedWebsocketConnection(_SSAPConnection):
+    '''
+    A websocket connection shared by several SSAP sessions. The sessions are websocket-based
+    endpoints: each one has its own output message queue, session keepalive and connection
+    listeners, and they share the connection, its flow controller and its heartbeat. If the
+    connection fails over to another server, the sessions that were joined with a token join
+    the SIB again.
+    '''
+
+    def __init__(self, connectionData, debugMode=False, flowController=None, compactMessages=False):
+        '''
+        Initializes the state of the connection. It will be established when the first request is sent.
+
+        Keyword arguments:
+        connectionData    -- the object that stores the configuration of the websocket connection.
+        debugMode         -- a flag that enables additional debug messages.
+        flowController    -- an object that limits the outbound requests of all the sessions (i.e. an
+                             AIMDFlowController). By default, every session sends its requests one at a time.
+        compactMessages   -- if True, the sessions will receive read-only SSAPMessage objects instead of dictionaries.
+        '''
+        if (debugMode) :
+            logLevel = logging.DEBUG
+        else:
+            logLevel = logging.INFO
+        self.__logger = LogFactory.configureLogger(self, logLevel, LogFactory.DEFAULT_LOG_FILE)
+        profiling.configureFromEnvironment()
+        _SSAPConnection.__init__(self, connectionData, self.__logger, flowController, compactMessages, False)
+        self.__debugMode = debugMode
+
+    def createSession(self, callback):
+        '''
+        Creates a new SSAP session. It will not be JOINed.
+
+        Keyword arguments:
+        callback     -- the callback that will process the incoming SSAP messages of the session.
+        '''
+        return WebsocketBasedSSAPEndpoint(callback, self.getConnectionData(), self.__debugMode, connection=self)
+
+    def close(self):
+        '''
+        Closes the connection. The sessions should be LEFT before doing this.
+        '''
+        if (self.getSessionCount() != 0):
+            self.__logger.warning("There are active sessions. You should close them before disconnecting from the SIB")
+        _SSAPConnection.close(self)
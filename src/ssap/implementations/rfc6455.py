@@ -0,0 +1,615 @@
+# -*- coding: utf8 -*-
+'''
+A lightweight RFC 6455 websocket client transport.
+
+All the connections of a process share a single selector-based reader thread, so no thread
+is created per connection. The reader thread never blocks: the received messages are delivered
+as bytes objects, in order, by a small pool of dispatcher threads, which also answer the control
+frames. When processing the data of a connection fails, only that connection is closed.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import base64
+import hashlib
+import os
+import selectors
+import socket
+import ssl
+import struct
+import logging
+from collections import deque
+from queue import Queue
+from select import select
+from threading import Lock, Thread, Event
+from time import monotonic
+from ssap.exceptions import SSAPConnectionError
+from ssap.utils.logs import LogFactory
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+_WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_OPCODE_CONTINUATION = 0x0
+_OPCODE_TEXT = 0x1
+_OPCODE_BINARY = 0x2
+_OPCODE_CLOSE = 0x8
+_OPCODE_PING = 0x9
+_OPCODE_PONG = 0xA
+
+_MAX_HANDSHAKE_SIZE = 65536
+_READ_SIZE = 65536
+
+# The maximum number of seconds that a dispatcher thread will wait to send a pong or a close frame.
+# The dispatcher threads are shared by all the connections, so a peer that does not read must not hold them.
+_CONTROL_REPLY_TIMEOUT = 1.0
+
+# The maximum number of dispatcher threads. They are started when all the existing ones are busy.
+_MAX_DISPATCHER_THREADS = 16
+
+def _mask(maskKey, data):
+    '''
+    Applies a websocket masking key to the given data. The whole payload is XORed at once
+    using Python integers, which is much faster than a byte-by-byte loop.
+
+    Keyword arguments:
+    maskKey    -- a 4-byte masking key.
+    data       -- the data to mask (or unmask).
+    '''
+    length = len(data)
+    if (length == 0):
+        return b""
+    repeatedKey = (maskKey * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(repeatedKey, "big")).to_bytes(length, "big")
+
+def _encodeFrame(opcode, payload):
+    '''
+    Builds a masked websocket frame (all the client frames must be masked).
+
+    Keyword arguments:
+    opcode     -- the frame opcode.
+    payload    -- the frame payload (bytes).
+    '''
+    length = len(payload)
+    if (length < 126):
+        header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+    elif (length < 65536):
+        header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+    maskKey = os.urandom(4)
+    return header + maskKey + _mask(maskKey, payload)
+
+class NativeWebsocketTransportFactory(object):
+    '''
+    Builds lightweight RFC 6455 websocket clients.
+    '''
+
+    def __init__(self, connectTimeout=10, tcpNoDelay=True, sendBufferSize=None, receiveBufferSize=None, sslContext=None,
+                 sendTimeout=30):
+        '''
+        Initializes the state of the factory.
+
+        Keyword arguments:
+        connectTimeout      -- the maximum number of seconds to wait for the TCP connection and the websocket handshake.
+        tcpNoDelay          -- if True, Nagle's algorithm will be disabled.
+        sendBufferSize      -- the size of the socket send buffer (SO_SNDBUF). None keeps the system default.
+        receiveBufferSize   -- the size of the socket receive buffer (SO_RCVBUF). None keeps the system default.
+        sslContext          -- the SSL context for wss:// URLs. By default, the system default context.
+        sendTimeout         -- the maximum number of seconds to wait for the peer to accept the data of a frame.
+                               When it expires, the connection is closed.
+        '''
+        self.__connectTimeout = connectTimeout
+        self.__tcpNoDelay = tcpNoDelay
+        self.__sendBufferSize = sendBufferSize
+        self.__receiveBufferSize = receiveBufferSize
+        self.__sslContext = sslContext
+        self.__sendTimeout = sendTimeout
+
+    def __call__(self, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+        return _NativeWebsocketClient(serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler,
+                                      self.__connectTimeout, self.__tcpNoDelay, self.__sendBufferSize,
+                                      self.__receiveBufferSize, self.__sslContext, self.__sendTimeout)
+
+class _SelectorLoop(object):
+    '''
+    A thread that waits for data on all the websocket connections of the process, and the dispatcher
+    threads that process it.
+    '''
+
+    __instance = None
+    __instanceLock = Lock()
+
+    @staticmethod
+    def getInstance():
+        '''
+        Returns the selector loop of the current process. It will be started if necessary.
+        '''
+        with _SelectorLoop.__instanceLock:
+            instance = _SelectorLoop.__instance
+            if (instance is None or instance.__pid != os.getpid()):
+                # A forked child must never use the loop of its parent
+                instance = _SelectorLoop()
+                _SelectorLoop.__instance = instance
+            return instance
+
+    def __init__(self):
+        self.__logger = LogFactory.configureLogger(self, logging.INFO, LogFactory.DEFAULT_LOG_FILE)
+        self.__pid = os.getpid()
+        self.__selector = selectors.DefaultSelector()
+        self.__lock = Lock()
+        self.__changes = []
+        (self.__wakeupReader, self.__wakeupWriter) = socket.socketpair()
+        self.__wakeupReader.setblocking(False)
+        self.__selector.register(self.__wakeupReader, selectors.EVENT_READ, None)
+        self.__tasks = Queue()
+        self.__dispatcherCount = 0
+        self.__idleDispatchers = 0
+        self.__thread = Thread(target=self.__run, name="SSAPSelectorLoop")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def register(self, sock, client):
+        '''
+        Starts waiting for data on a socket.
+
+        Keyword arguments:
+        sock      -- the socket.
+        client    -- the websocket client that will process the received data.
+        '''
+        self.__change(sock, client)
+
+    def unregister(self, sock):
+        '''
+        Stops waiting for data on a socket.
+
+        Keyword arguments:
+        sock      -- the socket.
+        '''
+        self.__change(sock, None)
+
+    def dispatch(self, function):
+        '''
+        Runs a function on a dispatcher thread. A new dispatcher thread is started if all the existing
+        ones are busy, so a slow function only delays the functions queued behind it.
+
+        Keyword arguments:
+        function    -- the function to run.
+        '''
+        with self.__lock:
+            startDispatcher = (self.__idleDispatchers <= self.__tasks.qsize() and
+                               self.__dispatcherCount < _MAX_DISPATCHER_THREADS)
+            if (startDispatcher):
+                self.__dispatcherCount = self.__dispatcherCount + 1
+                self.__idleDispatchers = self.__idleDispatchers + 1
+        if (startDispatcher):
+            thread = Thread(target=self.__runDispatcher, name="SSAPDispatcher")
+            thread.daemon = True
+            thread.start()
+        self.__tasks.put(function)
+
+    def __runDispatcher(self):
+        while True:
+            function = self.__tasks.get()
+            with self.__lock:
+                self.__idleDispatchers = self.__idleDispatchers - 1
+            try:
+                function()
+            except Exception as e:
+                self.__logger.error("A websocket dispatcher task failed: " + str(e))
+            with self.__lock:
+                self.__idleDispatchers = self.__idleDispatchers + 1
+
+    def __change(self, sock, client):
+        # The selector is only modified from the loop thread
+        with self.__lock:
+            self.__changes.append((sock, client))
+        self.__wakeupWriter.send(b"\0")
+
+    def __applyChanges(self):
+        with self.__lock:
+            changes = self.__changes
+            self.__changes = []
+        for (sock, client) in changes:
+            if (client is None):
+                try:
+                    self.__selector.unregister(sock)
+                except (KeyError, ValueError):
+                    pass
+            else:
+                self.__selector.register(sock, selectors.EVENT_READ, client)
+                # The frames received with the handshake response are decoded here, like the other ones
+                self.__process(sock, client, client._onRegistered)
+
+    def __run(self):
+        while True:
+            for (key, _events) in self.__selector.select():
+                if (key.data is None):
+                    try:
+                        self.__wakeupReader.recv(4096)
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    self.__applyChanges()
+                else:
+                    self.__process(key.fileobj, key.data, key.data._onReadable)
+
+    def __process(self, sock, client, method):
+        '''
+        Invokes a method of a websocket client. If it fails, the client is closed.
+        '''
+        try:
+            method()
+        except Exception as e:
+            # The other connections must keep receiving data
+            self.__logger.error("Couldn't process the data received from a websocket connection: " + str(e))
+            try:
+                self.__selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            client._abort(str(e))
+
+class _NativeWebsocketClient(object):
+    '''
+    A minimal RFC 6455 websocket client.
+    '''
+
+    def __init__(self, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler, connectTimeout,
+                 tcpNoDelay, sendBufferSize, receiveBufferSize, sslContext, sendTimeout=30):
+        '''
+        Initializes the state of the client.
+
+        Keyword arguments:
+        serverURL                        -- the URL of the websocket server.
+        protocols                        -- a list containing the websocket protocols supported by the websockets client.
+        connectionEstablishedHandler     -- a function that will be invoked after establishing the websocket connection.
+        dataReceivedHandler              -- a function that will be invoked with the bytes of every received message.
+        sendTimeout                      -- the maximum number of seconds to wait for the peer to accept a frame.
+        '''
+        self.__logger = LogFactory.configureLogger(self, logging.INFO, LogFactory.DEFAULT_LOG_FILE)
+        self.__url = urlparse(serverUrl)
+        self.__protocols = protocols
+        self.__connectionEstablishedHandler = connectionEstablishedHandler
+        self.__dataReceivedEventHandler = dataReceivedEventHandler
+        self.__connectTimeout = connectTimeout
+        self.__tcpNoDelay = tcpNoDelay
+        self.__sendBufferSize = sendBufferSize
+        self.__receiveBufferSize = receiveBufferSize
+        self.__sslContext = sslContext
+        self.__sendTimeout = sendTimeout
+        self.__socket = None
+        self.__sendLock = Lock()
+        self.__buffer = bytearray()
+        self.__fragments = []
+        self.__closeReceived = False
+        self.__closed = Event()
+        self.__closeLock = Lock()
+        self.__pongHandler = None
+        # The functions that will run on the dispatcher threads, in order
+        self.__deliveries = deque()
+        self.__deliveryScheduled = False
+        self.__deliveryLock = Lock()
+
+    def connect(self):
+        '''
+        Establishes the TCP connection and performs the websocket handshake.
+        '''
+        secure = self.__url.scheme == "wss"
+        port = self.__url.port
+        if (port is None):
+            if (secure):
+                port = 443
+            else:
+                port = 80
+        sock = socket.create_connection((self.__url.hostname, port), self.__connectTimeout)
+        try:
+            if (self.__tcpNoDelay):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if (not self.__sendBufferSize is None):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.__sendBufferSize)
+            if (not self.__receiveBufferSize is None):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.__receiveBufferSize)
+            if (secure):
+                context = self.__sslContext
+                if (context is None):
+                    context = ssl.create_default_context()
+                sock = context.wrap_socket(sock, server_hostname=self.__url.hostname)
+            self.__handshake(sock)
+        except Exception:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self.__socket = sock
+        self.__logger.info("Websocket connection established")
+        self.__connectionEstablishedHandler()
+        _SelectorLoop.getInstance().register(sock, self)
+
+    def send(self, payload, binary=False):
+        '''
+        Sends a websocket message.
+
+        Keyword arguments:
+        payload    -- the message to send (str or bytes).
+        binary     -- if True, a binary frame will be sent. Otherwise, a text frame will be sent.
+        '''
+        if (not isinstance(payload, bytes)):
+            payload = payload.encode("utf-8")
+        if (binary):
+            opcode = _OPCODE_BINARY
+        else:
+            opcode = _OPCODE_TEXT
+        self.__sendFrame(opcode, payload)
+
+    def ping(self, payload=b""):
+        '''
+        Sends a ping frame. The server will answer it with a pong frame that contains the same payload.
+
+        Keyword arguments:
+        payload    -- the payload of the ping frame (str or bytes).
+        '''
+        if (not isinstance(payload, bytes)):
+            payload = payload.encode("utf-8")
+        self.__sendFrame(_OPCODE_PING, payload)
+
+    def setPongHandler(self, pongHandler):
+        '''
+        Sets the function that will be invoked with the payload of every received pong frame.
+        '''
+        self.__pongHandler = pongHandler
+
+    def close(self, code=1000, reason=b""):
+        '''
+        Closes the websocket connection.
+
+        Keyword arguments:
+        code      -- the websocket close status code.
+        reason    -- the close reason.
+        '''
+        if (self.__socket is None or self.__closed.is_set()):
+            return
+        try:
+            self.__sendFrame(_OPCODE_CLOSE, struct.pack("!H", code) + reason)
+        except (socket.error, SSAPConnectionError):
+            pass
+        self.__shutdown(code, reason)
+
+    def run_forever(self):
+        '''
+        Waits until the websocket connection is closed.
+        '''
+        self.__closed.wait()
+
+    def __handshake(self, sock):
+        '''
+        Performs the websocket opening handshake.
+        '''
+        key = base64.b64encode(os.urandom(16))
+        resource = self.__url.path or "/"
+        if (self.__url.query):
+            resource = resource + "?" + self.__url.query
+        lines = ["GET {0} HTTP/1.1".format(resource),
+                 "Host: {0}".format(self.__url.netloc),
+                 "Upgrade: websocket",
+                 "Connection: Upgrade",
+                 "Sec-WebSocket-Key: {0}".format(key.decode("ascii")),
+                 "Sec-WebSocket-Version: 13"]
+        if (self.__protocols):
+            lines.append("Sec-WebSocket-Protocol: {0}".format(", ".join(self.__protocols)))
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("ascii"))
+
+        response = bytearray()
+        while not b"\r\n\r\n" in response:
+            chunk = sock.recv(4096)
+            if (not chunk or len(response) > _MAX_HANDSHAKE_SIZE):
+                raise SSAPConnectionError("Invalid websocket handshake response")
+            response.extend(chunk)
+        headerEnd = response.index(b"\r\n\r\n") + 4
+        # The server might have sent some frames right after the handshake
+        self.__buffer.extend(response[headerEnd:])
+        headerLines = bytes(response[:headerEnd]).decode("latin-1").split("\r\n")
+        statusLine = headerLines[0].split(" ")
+        if (len(statusLine) < 2 or statusLine[1] != "101"):
+            raise SSAPConnectionError("The websocket handshake was rejected: " + headerLines[0])
+        headers = {}
+        for line in headerLines[1:]:
+            if (":" in line):
+                (name, value) = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        expectedAccept = base64.b64encode(hashlib.sha1(key + _WEBSOCKET_GUID).digest()).decode("ascii")
+        if (headers.get("sec-websocket-accept") != expectedAccept):
+            raise SSAPConnectionError("Invalid Sec-WebSocket-Accept header in the websocket handshake response")
+
+    def __sendFrame(self, opcode, payload, timeout=None):
+        '''
+        Sends a frame. The socket is non-blocking, so we wait until it is writable when its buffer is full.
+        If the peer does not accept the data before the send timeout expires, the connection is closed.
+        '''
+        if (self.__socket is None or self.__closed.is_set()):
+            raise SSAPConnectionError("The websocket connection is closed")
+        if (timeout is None):
+            timeout = self.__sendTimeout
+        data = memoryview(_encodeFrame(opcode, payload))
+        with self.__sendLock:
+            if (self.__closed.is_set()):
+                raise SSAPConnectionError("The websocket connection is closed")
+            deadline = monotonic() + timeout
+            while (len(data) != 0):
+                try:
+                    sent = self.__socket.send(data)
+                except (BlockingIOError, ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                    remaining = deadline - monotonic()
+                    if (remaining <= 0 or not select([], [self.__socket], [], remaining)[1]):
+                        self.__shutdown(1006, b"Send timeout")
+                        raise SSAPConnectionError("The websocket peer did not accept the data in {0} seconds".format(timeout))
+                    continue
+                data = data[sent:]
+
+    def _onRegistered(self):
+        '''
+        This method is invoked from the selector loop when it starts waiting for data on the socket.
+        '''
+        if (len(self.__buffer) != 0):
+            self.__processBuffer()
+
+    def _onReadable(self):
+        '''
+        This method is invoked from the selector loop when data can be read from the socket.
+        '''
+        try:
+            while True:
+                chunk = self.__socket.recv(_READ_SIZE)
+                if (not chunk):
+                    self.__shutdown(1006, b"Connection closed by the server")
+                    return
+                self.__buffer.extend(chunk)
+                if (not isinstance(self.__socket, ssl.SSLSocket) or self.__socket.pending() == 0):
+                    break
+        except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            pass
+        except socket.error as e:
+            self.__shutdown(1006, str(e).encode("utf-8"))
+            return
+        self.__processBuffer()
+
+    def _abort(self, reason):
+        '''
+        This method is invoked from the selector loop when the received data could not be processed.
+        The connection is closed without sending a close frame.
+        '''
+        self.__shutdown(1011, reason.encode("utf-8"))
+
+    def __processBuffer(self):
+        '''
+        Decodes all the complete frames stored in the receive buffer. This method is invoked from the
+        selector loop.
+        '''
+        buf = self.__buffer
+        offset = 0
+        while (not self.__closed.is_set() and not self.__closeReceived):
+            if (len(buf) - offset < 2):
+                break
+            (first, second) = (buf[offset], buf[offset + 1])
+            length = second & 0x7F
+            headerSize = 2
+            if (length == 126):
+                if (len(buf) - offset < 4):
+                    break
+                length = struct.unpack_from("!H", buf, offset + 2)[0]
+                headerSize = 4
+            elif (length == 127):
+                if (len(buf) - offset < 10):
+                    break
+                length = struct.unpack_from("!Q", buf, offset + 2)[0]
+                headerSize = 10
+            masked = second & 0x80
+            if (masked):
+                headerSize = headerSize + 4
+            if (len(buf) - offset < headerSize + length):
+                break
+            payload = bytes(buf[offset + headerSize:offset + headerSize + length])
+            if (masked):
+                payload = _mask(bytes(buf[offset + headerSize - 4:offset + headerSize]), payload)
+            offset = offset + headerSize + length
+            self.__onFrame(first & 0x80, first & 0x0F, payload)
+        del buf[:offset]
+
+    def __onFrame(self, fin, opcode, payload):
+        '''
+        Processes a decoded frame. The frames that must be answered or delivered are handed to the
+        dispatcher threads, so that the selector loop never blocks.
+        '''
+        if (opcode == _OPCODE_PING):
+            self.__dispatch(self.__onPingFrame, payload)
+        elif (opcode == _OPCODE_PONG):
+            if (not self.__pongHandler is None):
+                self.__dispatch(self.__pongHandler, payload)
+        elif (opcode == _OPCODE_CLOSE):
+            # The frames received after the close frame are ignored
+            self.__closeReceived = True
+            self.__dispatch(self.__onCloseFrame, payload)
+        elif (opcode == _OPCODE_CONTINUATION):
+            self.__fragments.append(payload)
+            if (fin):
+                message = b"".join(self.__fragments)
+                self.__fragments = []
+                self.__dispatch(self.__dataReceivedEventHandler, message)
+        elif (fin):
+            self.__dispatch(self.__dataReceivedEventHandler, payload)
+        else:
+            self.__fragments = [payload]
+
+    def __onPingFrame(self, payload):
+        '''
+        Answers a ping frame.
+        '''
+        try:
+            self.__sendFrame(_OPCODE_PONG, payload, _CONTROL_REPLY_TIMEOUT)
+        except (socket.error, SSAPConnectionError):
+            pass
+
+    def __onCloseFrame(self, payload):
+        '''
+        Answers a close frame and releases the socket.
+        '''
+        code = 1005
+        if (len(payload) >= 2):
+            code = struct.unpack("!H", payload[:2])[0]
+        try:
+            self.__sendFrame(_OPCODE_CLOSE, payload[:2], _CONTROL_REPLY_TIMEOUT)
+        except (socket.error, SSAPConnectionError):
+            pass
+        self.__shutdown(code, payload[2:])
+
+    def __dispatch(self, function, *args):
+        '''
+        Queues a function that will run on a dispatcher thread. The functions of a connection run
+        one at a time and in order.
+        '''
+        with self.__deliveryLock:
+            self.__deliveries.append((function, args))
+            if (self.__deliveryScheduled):
+                return
+            self.__deliveryScheduled = True
+        _SelectorLoop.getInstance().dispatch(self.__deliver)
+
+    def __deliver(self):
+        '''
+        Runs the queued functions. This method is invoked from a dispatcher thread. If a function
+        fails, the connection is closed and the other queued functions are discarded.
+        '''
+        while True:
+            with self.__deliveryLock:
+                if (len(self.__deliveries) == 0):
+                    self.__deliveryScheduled = False
+                    return
+                (function, args) = self.__deliveries.popleft()
+            try:
+                function(*args)
+            except Exception as e:
+                self.__logger.error("Couldn't process the data received from a websocket connection: " + str(e))
+                with self.__deliveryLock:
+                    self.__deliveries.clear()
+                self._abort(str(e))
+
+    def __shutdown(self, code, reason):
+        '''
+        Releases the socket.
+        '''
+        with self.__closeLock:
+            if (self.__closed.is_set()):
+                return
+            self.__closed.set()
+        _SelectorLoop.getInstance().unregister(self.__socket)
+        try:
+            self.__socket.close()
+        except socket.error:
+            pass
+        message = "Websocket connection closed. Code: {0}, Message: {1}".format(code, bytes(reason).decode("utf-8", "replace"))
+        self.__logger.info(message)
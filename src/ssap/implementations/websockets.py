@@ -11,16 +11,21 @@ This module is part of the Python SSAP API, version 1.5
 '''
 
 from __future__ import print_function
-from ssap.core import SSAPEndpoint, SSAP_MESSAGE_TYPE, SSAP_QUERY_TYPE
-from ssap.messages.messages import _SSAPMessageFactory, _SSAPMessageParser
-from ws4py.client.threadedclient import WebSocketClient
+from ssap.core import SSAPEndpoint, SSAPPreparedQuery, SSAP_MESSAGE_TYPE, SSAP_QUERY_TYPE, SSAP_ERROR_CODE, \
+    SSAP_REQUEST_PRIORITY, SSAP_MESSAGE_DIRECTION
+from ssap.messages.messages import _SSAPMessageFactory, _SSAPMessageParser, SSAPMessage
 from ssap.utils.logs import LogFactory
+from ssap import profiling
 from ssap.utils.datastructures import GenericThreadSafeList
 from ssap.exceptions import InvalidSSAPOperation, SSAPConnectionError
 from ssap.utils.enums import enum
 from ssap.utils.strings import bytes2String
+from ssap.implementations.failover import probeServerUrl, rankServerUrls, _SSAPStandbyConnection
 import logging
-from time import sleep
+import os
+from threading import Lock, RLock, Timer, Thread, Event
+from collections import deque
+from time import monotonic
 
 _CONNECTION_STATUS = enum("OPENED", "CLOSED")
 
@@ -28,17 +33,89 @@ class WebsocketConnectionData(object):
     '''
     These objects store the configuration data of a websocket-based connection.
     '''
-    def __init__(self, server_url):
+    def __init__(self, server_url, transportFactory=None, connectTimeout=30, probeTimeout=2, failoverTimeout=60,
+                 healthCheck=None):
         '''
         Stores the websocket server URL in the configuration object.
+        
+        Keyword arguments:
+        server_url        -- the URL of the websocket server, or a list with the URLs of several servers of the
+                             same SIB. The servers will be probed before connecting, and the fastest healthy
+                             one will be used.
+        transportFactory  -- a callable that builds the websocket client. It will receive the server URL, the
+                             protocols, the connection established handler and the data received handler.
+                             By default, the ws4py-based client will be used. The heartbeats require clients
+                             with ping(payload) and setPongHandler(handler) methods.
+        connectTimeout    -- the maximum number of seconds to wait for the websocket connection to be established.
+        probeTimeout      -- the maximum number of seconds to wait for the server probes.
+        failoverTimeout   -- the maximum number of seconds to spend trying to connect to the servers.
+        healthCheck       -- the function that probes the servers. It receives a URL and the probe timeout, and
+                             returns the latency of the server (in seconds) or None if it is not healthy. By
+                             default, the time to open a TCP connection is measured.
         '''
-        self.__server_url = server_url
+        if (isinstance(server_url, str)):
+            server_url = [server_url]
+        if (len(server_url) == 0):
+            raise InvalidSSAPOperation("At least one server URL is required")
+        self.__server_urls = list(server_url)
+        self.__connectTimeout = connectTimeout
+        self.__probeTimeout = probeTimeout
+        self.__failoverTimeout = failoverTimeout
+        if (healthCheck is None):
+            healthCheck = probeServerUrl
+        self.__healthCheck = healthCheck
+        self.__transportFactory = transportFactory
     
     def getServerUrl(self):
         '''
-        Returns the websocket server URL.
+        Returns the websocket server URL (the first one if there are several).
+        '''
+        return self.__server_urls[0]
+    
+    def getServerUrls(self):
+        '''
+        Returns a list with all the websocket server URLs.
+        '''
+        return list(self.__server_urls)
+    
+    def getCandidateServerUrls(self, failedUrl=None):
+        '''
+        Returns the websocket server URLs in the order in which they should be tried: the healthy
+        ones sorted by latency, then the unhealthy ones and finally the one that has just failed.
+        
+        Keyword arguments:
+        failedUrl    -- the URL of the server whose connection has just been lost.
+        '''
+        if (len(self.__server_urls) == 1):
+            return list(self.__server_urls)
+        urls = [url for url in self.__server_urls if url != failedUrl]
+        (healthyUrls, unhealthyUrls) = rankServerUrls(urls, self.__probeTimeout, self.__healthCheck)
+        candidates = healthyUrls + unhealthyUrls
+        if (failedUrl in self.__server_urls):
+            candidates.append(failedUrl)
+        return candidates
+    
+    def getFailoverTimeout(self):
+        '''
+        Returns the maximum number of seconds to spend trying to connect to the servers.
         '''
-        return self.__server_url
+        return self.__failoverTimeout
+    
+    def getConnectTimeout(self):
+        '''
+        Returns the maximum number of seconds to wait for the websocket connection to be established.
+        '''
+        return self.__connectTimeout
+    
+    def getTransportFactory(self):
+        '''
+        Returns the callable that builds the websocket client.
+        '''
+        if (self.__transportFactory is None):
+            # ws4py is only imported when it is going to be used
+            from ssap.implementations.ws4pyclient import _SSAPWebsocketClient
+            self.__transportFactory = _SSAPWebsocketClient
+        return self.__transportFactory
     
     def getProtocols(self):
         '''
@@ -48,7 +125,8 @@ class WebsocketConnectionData(object):
 
 class WebsocketBasedSSAPEndpoint(SSAPEndpoint):    
     '''A websocket-based SSAP endpoint'''
-    def __init__(self, callback, connectionData, debugMode=False):
+    def __init__(self, callback, connectionData, debugMode=False, flowController=None, compactMessages=False,
+                 connection=None):
         '''
         Initializes the state of the endpoint.
         
@@ -56,19 +134,43 @@ class WebsocketBasedSSAPEndpoint(SSAPEndpoint):
         callback          -- the object that will process the incoming SSAP messages.
         connectionData    -- the object that stores the configuration of the websocket connection.
         debugMode         -- a flag that enables additional debug messages.
+        flowController    -- an object that limits the outbound requests (i.e. an AIMDFlowController).
+                             By default, requests are sent one at a time and without rate limits.
+        compactMessages   -- if True, the callback will receive read-only SSAPMessage objects instead of
+                             dictionaries. They use less memory and can be shared by several handlers.
+        connection        -- the _SSAPConnection that the endpoint will share with other endpoints. By default,
+                             the endpoint opens its own connection. The flow controller, the compactMessages
+                             flag and the logger of a shared connection replace the given ones.
         '''
         SSAPEndpoint.__init__(self, callback)
-        if (debugMode) :
-            logLevel = logging.DEBUG
+        if (connection is None):
+            if (debugMode) :
+                logLevel = logging.DEBUG
+            else:
+                logLevel = logging.INFO
+            self.__logger = LogFactory.configureLogger(self, logLevel, LogFactory.DEFAULT_LOG_FILE)
+            profiling.configureFromEnvironment()
+            connection = _SSAPConnection(connectionData, self.__logger, flowController, compactMessages)
         else:
-            logLevel = logging.INFO
-        self.__logger = LogFactory.configureLogger(self, logLevel, LogFactory.DEFAULT_LOG_FILE)      
-        self.__queue = GenericThreadSafeList()
-        self.__websocket = None
-        self.__connectionData = connectionData
+            # The sessions of a shared connection must not add a logging handler each
+            self.__logger = connection.getLogger()
+        self.__connection = connection
+        self.__connectionData = connection.getConnectionData()
+        self.__compactMessages = connection.hasCompactMessages()
+        self.__queue = _SSAPOutboundQueue()
+        self.__priorities = dict(_DEFAULT_REQUEST_PRIORITIES)
         self.__activeSubscriptions = 0
+        self.__sessionKeeper = None
+        self.__expiredRequests = []
+        self.__reJoinPending = False
+        self.__connectionListeners = []
+        self.__failingOver = False
+        self.__standby = None
+        self.__standbyPending = False
+        self.__standbyRenewalInterval = None
+        connection.attach(self)
         
-    def __sendSSAPRequest(self, messageType, ssapRequest, checkWebsocket=True):
+    def __sendSSAPRequest(self, messageType, ssapRequest, checkWebsocket=True, rowHandler=None):
         '''
         Prepares a SSAP message to be sent to the SIB.
         
@@ -76,18 +178,28 @@ class WebsocketBasedSSAPEndpoint(SSAPEndpoint):
         messageType        -- the type of the SSAP message to send.
         ssapRequest        -- the serialized SSAP message to send.
         checkWebsocket     -- indicates if we must check wether the connection is ready or not.
+        rowHandler         -- the SSAPRowHandler that will process the rows of the response.
         '''
+        self.__connection.checkOwnerProcess()
         if checkWebsocket :
             self.__checkIfWebsocketIsInstantiated()
-        self.__appendRequest(_SSAPRequest(messageType, ssapRequest))
+        request = _SSAPRequest(messageType, ssapRequest, self.__priorities[messageType], self._sessionKey)
+        request.setRowHandler(rowHandler)
+        self.__appendRequest(request)
         
     def joinWithToken(self, token, instance):
         self._token = token
         self._instance = instance        
+        # The shared connections forget the endpoints that have left the SIB
+        self.__connection.attach(self)
         self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.JOIN,
                                _SSAPMessageFactory.buildTokenBasedJoinMessage(token, instance), False)
         
     def leave(self):
+        self.stopSessionKeepAlive()
+        if (self.__connection.isExclusive()):
+            self.stopHeartbeat()
+        self.__closeStandby()
         if (self.__activeSubscriptions != 0):
             self.__logger.warning("There are active subscriptions. You should cancel them before disconnecting from the SIB")
         self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.LEAVE,
@@ -101,9 +213,14 @@ class WebsocketBasedSSAPEndpoint(SSAPEndpoint):
         self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.INSERT,
                                _SSAPMessageFactory.buildInsertMessage(ontology, data, queryType, self._sessionKey))
         
-    def query(self, ontology, query, queryType=SSAP_QUERY_TYPE.NATIVE, queryParams = None):
+    def query(self, ontology, query, queryType=SSAP_QUERY_TYPE.NATIVE, queryParams = None, rowHandler = None):
         self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.QUERY,
-            _SSAPMessageFactory.buildQueryMessage(ontology, query, queryType, queryParams, self._sessionKey))
+            _SSAPMessageFactory.buildQueryMessage(ontology, query, queryType, queryParams, self._sessionKey), True, rowHandler)
+        
+    def prepare(self, ontology, query, queryType=SSAP_QUERY_TYPE.NATIVE):
+        template = _SSAPMessageFactory.buildQueryMessageTemplate(ontology, query, queryType)
+        return SSAPPreparedQuery(template, lambda message, rowHandler:
+                                 self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.QUERY, message, True, rowHandler))
     
 
     def update(self, ontology, query, data, queryType=SSAP_QUERY_TYPE.NATIVE):
@@ -125,14 +242,165 @@ class WebsocketBasedSSAPEndpoint(SSAPEndpoint):
     def config(self, kpName, kpInstance, token, assetService, assetServiceParam):
         self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.CONFIG, _SSAPMessageFactory.buildConfigMessage(kpName, kpInstance, token, assetService, assetServiceParam), False)
 
-#     def bulk(self, ontology, ssapBulkRequest):
-#         self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.BULK,
-#                                _SSAPMessageFactory.buildBulkMessage(ssapBulkRequest, ontology, self._sessionKey))
+    def bulk(self, ontology, ssapBulkRequest):
+        self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.BULK,
+                               _SSAPMessageFactory.buildBulkMessage(ssapBulkRequest, ontology, self._sessionKey))
+        
+    def insertColumns(self, ontology, template, columns, rowsPerMessage=1000):
+        # NumPy is only imported when it is going to be used
+        from ssap.messages.columnar import ColumnarBulkEncoder
+        encoder = ColumnarBulkEncoder(ontology, template, columns)
+        messageCount = 0
+        for message in encoder.encode(rowsPerMessage):
+            self.__sendSSAPRequest(SSAP_MESSAGE_TYPE.BULK, message)
+            messageCount = messageCount + 1
+        return messageCount
+
+    def startSessionKeepAlive(self, renewalIntervalInSeconds):
+        '''
+        Starts renewing the session periodically in background. While the session keepalive is enabled,
+        the requests that fail because the session has expired will be sent again after joining the SIB
+        with the token.
+        
+        Keyword arguments:
+        renewalIntervalInSeconds    -- the number of seconds between two consecutive session renewals. It
+                                       must be lower than the session expiration time.
+        '''
+        if (not self.__sessionKeeper is None):
+            raise InvalidSSAPOperation("The session keepalive has already been started")
+        self.__sessionKeeper = _SSAPSessionKeeper(self.__renewSessionInBackground, renewalIntervalInSeconds)
+        self.__sessionKeeper.start()
+        
+    def stopSessionKeepAlive(self):
+        '''
+        Stops renewing the session in background.
+        '''
+        if (not self.__sessionKeeper is None):
+            self.__sessionKeeper.stop()
+            self.__sessionKeeper = None
+        
+    def startHeartbeat(self, intervalInSeconds=5, timeoutInSeconds=None, maxMissedPongs=2):
+        '''
+        Starts sending websocket pings periodically in background. If several consecutive pongs are
+        missed, the connection will be declared dead: it will be closed, the unanswered and the queued
+        requests will fail and the connection listeners will be notified. The heartbeat belongs to the
+        connection, so it also watches the endpoints that share it.
+        
+        Keyword arguments:
+        intervalInSeconds    -- the number of seconds between two consecutive pings.
+        timeoutInSeconds     -- the number of seconds to wait for each pong. By default, the ping interval.
+        maxMissedPongs       -- the number of consecutive missed pongs that make a connection dead.
+        '''
+        self.__connection.startHeartbeat(intervalInSeconds, timeoutInSeconds, maxMissedPongs)
+        
+    def stopHeartbeat(self):
+        '''
+        Stops sending websocket pings.
+        '''
+        self.__connection.stopHeartbeat()
+            
+    def getRoundTripTime(self):
+        '''
+        Returns the smoothed round-trip time of the heartbeats (in seconds), or None if no pong has
+        been received yet.
+        '''
+        return self.__connection.getRoundTripTime()
+    
+    def getLastRoundTripTime(self):
+        '''
+        Returns the round-trip time of the last heartbeat (in seconds), or None if no pong has been
+        received yet.
+        '''
+        return self.__connection.getLastRoundTripTime()
+    
+    def enableHotStandby(self, renewalIntervalInSeconds=60):
+        '''
+        Keeps a connection with another server established and joined, so that the endpoint can fail
+        over to it without waiting for the connection and the JOIN request. The standby connection is
+        opened after joining the SIB with a token. The endpoints that share their connection cannot
+        use a hot standby.
+        
+        Keyword arguments:
+        renewalIntervalInSeconds    -- the number of seconds between two consecutive renewals of the session of
+                                       the standby connection. It must be lower than the session expiration time.
+        '''
+        if (not self.__connection.isExclusive()):
+            raise InvalidSSAPOperation("The endpoints that share their connection cannot use a hot standby")
+        if (len(self.__connectionData.getServerUrls()) < 2):
+            raise InvalidSSAPOperation("A hot standby requires several server URLs")
+        with self.__connection.getSendLock():
+            self.__standbyRenewalInterval = renewalIntervalInSeconds
+            if (self.__connection.isConnected() and not self._sessionKey is None):
+                self.__startStandby()
+            
+    def disableHotStandby(self):
+        '''
+        Closes the standby connection.
+        '''
+        self.__standbyRenewalInterval = None
+        self.__closeStandby()
+        
+    def getConnectedServerUrl(self):
+        '''
+        Returns the URL of the server that the endpoint is connected to (or None).
+        '''
+        return self.__connection.getServerUrl()
+    
+    def addConnectionListener(self, listener):
+        '''
+        Registers an object that will be notified when the connection with the SIB is lost and
+        when the endpoint fails over to another server.
+        
+        Keyword arguments:
+        listener    -- a SSAPConnectionListener.
+        '''
+        self.__connectionListeners.append(listener)
+        
+    def removeConnectionListener(self, listener):
+        '''
+        Unregisters a connection listener.
+        
+        Keyword arguments:
+        listener    -- the listener to unregister.
+        '''
+        self.__connectionListeners.remove(listener)
+        
+    def setRequestPriority(self, messageType, priority):
+        '''
+        Changes the priority class of a SSAP message type. Requests with higher priority are sent first,
+        but the lower priority classes are never starved.
+        
+        Keyword arguments:
+        messageType    -- the SSAP message type.
+        priority       -- the new priority class (a SSAP_REQUEST_PRIORITY value).
+        '''
+        self.__priorities[messageType] = priority
+        
+    def getFlowController(self):
+        '''
+        Returns the flow controller of the endpoint (or None if it has no flow controller).
+        '''
+        return self.__connection.getFlowController()
 
     def waitForever(self):
-        if (self.__websocket is None) :
-            raise InvalidSSAPOperation("The connection with the SIB is not established")
-        self.__websocket.run_forever()
+        self.__connection.waitForever()
+        
+    def _peekRequest(self):
+        '''
+        Returns the next request that will be sent (or None if there are no queued requests). This
+        method is invoked from the connection.
+        '''
+        return self.__queue.peek()
+    
+    def _popRequest(self):
+        '''
+        Removes the next request from the output message queue and returns it with the current session
+        key. This method is invoked from the connection.
+        '''
+        request = self.__queue.pop()
+        if (not self._sessionKey is None):
+            request.setSessionKey(self._sessionKey)
+        return request
         
     def __appendRequest(self, request):
         '''
@@ -143,127 +411,816 @@ class WebsocketBasedSSAPEndpoint(SSAPEndpoint):
         '''
         
         self.__queue.append(request)
-        if (self.__queue.getSize() == 1):
-            self.__sendNextRequestToSib()
+        self.__connection.sendPendingRequests()
             
     def __checkIfWebsocketIsInstantiated(self):
         '''
         Checks if the websocket has been instantiated. This allows us to detect invalid API invocations.
         '''
-        if (self.__websocket is None):
+        if (self.__failingOver):
+            return
+        if (not self.__connection.isConnected()):
             raise InvalidSSAPOperation("The connection with the SIB has not been established yet")
+        if (not self.__connection.isExclusive() and self._sessionKey is None):
+            raise InvalidSSAPOperation("The session has not been joined yet")
+        
+    def _onMessageReceived(self, message, request):
+        '''
+        Processes a SSAP message. This method is invoked from the connection.
+        
+        Keyword arguments:
+        message    -- the parsed SSAP message.
+        request    -- the request that the message answers (None for INDICATION messages).
+        '''
+        # The message content can be modified within the callback. We must copy
+        # everything we need before invoking it.
+        messageType = message["messageType"]
+        noErrors = SSAPEndpoint.hasOkField(message) and message["body"]["ok"]
+        errorCode = _getErrorCode(message)
+                
+        restored = False
+        abandonedRequests = []
+        if (messageType == SSAP_MESSAGE_TYPE.JOIN):
+            self.__reJoinPending = False
+            failingOver = self.__failingOver
+            restored = failingOver and noErrors
+            self.__failingOver = False
+            if (noErrors):
+                self._sessionKey = message["sessionKey"]
+                self.__resendExpiredRequests()
+                if (not self.__standbyRenewalInterval is None):
+                    self.__startStandby()
+            else:
+                # The requests that were waiting for a new session will never be sent again
+                with self.__connection.getSendLock():
+                    abandonedRequests = self.__expiredRequests
+                    self.__expiredRequests = []
+                    if (failingOver):
+                        while (not self.__queue.isEmpty()):
+                            abandonedRequests.append(self.__queue.pop())
+        if (errorCode == SSAP_ERROR_CODE.AUTHENTICATION and self.__retryExpiredRequest(request)):
+            self.__logger.debug("The session has expired. The request will be sent again after joining the SIB")
+        else:
+            if (not request is None and not request.getRowHandler() is None):
+                request.getRowHandler().onQueryCompleted(message)
+            self._callback.onSSAPMessageReceived(message)
+        for abandonedRequest in abandonedRequests:
+            self.__failRequest(abandonedRequest, "The SIB could not be joined again: " + str(message["body"].get("error")))
+            
+        if (noErrors) :             
+        
+            if (messageType == SSAP_MESSAGE_TYPE.LEAVE):
+                self._clearStateData()
+                self.__connection.release(self)
+            elif (messageType == SSAP_MESSAGE_TYPE.SUBSCRIBE):
+                self.__activeSubscriptions = self.__activeSubscriptions + 1
+            elif (messageType == SSAP_MESSAGE_TYPE.UNSUBSCRIBE):
+                self.__activeSubscriptions = self.__activeSubscriptions - 1
+                
+        if (restored):
+            serverUrl = self.__connection.getServerUrl()
+            self.__logger.info("The connection with the SIB has been restored through " + str(serverUrl))
+            for listener in list(self.__connectionListeners):
+                listener.onConnectionRestored(serverUrl)
+            
+    def _abandonRequests(self, inFlightRequests):
+        '''
+        Forgets the session of a dead connection. Returns the requests that will never be answered
+        and the ones that will be sent again after failing over to another server (None if the
+        endpoint will not fail over). This method is invoked from the connection while it holds
+        its send lock.
+        
+        If there are several servers and the endpoint has joined the SIB with a token, the endpoint
+        fails over to another server: the requests that do not depend on the lost session are sent
+        again after joining the SIB. They might be processed twice.
+        
+        Keyword arguments:
+        inFlightRequests    -- the unanswered requests of the endpoint.
+        '''
+        failedRequests = list(inFlightRequests)
+        failedRequests.extend(self.__expiredRequests)
+        self.__expiredRequests = []
+        while (not self.__queue.isEmpty()):
+            failedRequests.append(self.__queue.pop())
+        self.__reJoinPending = False
+        self.__activeSubscriptions = 0
+        failOver = (len(self.__connectionData.getServerUrls()) > 1 and not self._token is None and
+                    not SSAP_MESSAGE_TYPE.LEAVE in [request.getType() for request in failedRequests])
+        (token, instance) = (self._token, self._instance)
+        self._clearStateData()
+        if (not failOver):
+            return (failedRequests, None)
+        # The token will be used to join the SIB again
+        (self._token, self._instance) = (token, instance)
+        retriedRequests = [request for request in failedRequests if not request.getType() in _SESSION_BOUND_REQUESTS]
+        failedRequests = [request for request in failedRequests if request.getType() in _SESSION_BOUND_REQUESTS]
+        self.__failingOver = True
+        return (failedRequests, retriedRequests)
+    
+    def _onConnectionLost(self, failedRequests, retriedRequests, reason):
+        '''
+        Fails the requests that will never be answered, notifies the connection listeners and fails
+        over to another server. This method is invoked from the thread that detected the dead connection.
+        
+        Keyword arguments:
+        failedRequests     -- the requests that will never be answered.
+        retriedRequests    -- the requests that will be sent again, or None if the endpoint will not fail over.
+        reason             -- a string that describes why the connection is dead.
+        '''
+        for request in failedRequests:
+            self.__failRequest(request, reason)
+        for listener in list(self.__connectionListeners):
+            listener.onConnectionLost(reason)
+        if (not retriedRequests is None):
+            self.__failOver(retriedRequests)
+            
+    def __failOver(self, requests):
+        '''
+        Connects to another server and joins the SIB. The given requests will be sent after the JOIN
+        request. This method is invoked from the thread that detected the dead connection.
+        
+        Keyword arguments:
+        requests    -- the requests that will be sent again.
+        '''
+        standby = self.__takeStandby()
+        with self.__connection.getSendLock():
+            self.__queue.startNewRound()
+            for request in reversed(requests):
+                self.__queue.appendLeft(request)
+            if (standby is None):
+                self.__queueReJoin()
+            else:
+                (self._sessionKey, joinResponse) = self.__connection.adoptStandby(standby)
+                self.__logger.info("The standby connection with {0} will be used".format(standby.getServerUrl()))
+        try:
+            if (standby is None):
+                self.__connection.sendPendingRequests()
+            else:
+                # The JOIN response of the standby connection is processed as if it had just been received
+                self.__connection.onDataReceived(joinResponse)
+        except Exception as e:
+            reason = "Couldn't fail over to another server: " + str(e)
+            self.__logger.error(reason)
+            failedRequests = []
+            with self.__connection.getSendLock():
+                self.__failingOver = False
+                self.__reJoinPending = False
+                while (not self.__queue.isEmpty()):
+                    failedRequests.append(self.__queue.pop())
+            for request in failedRequests:
+                self.__failRequest(request, reason)
+                
+    def __startStandby(self):
+        '''
+        Opens a standby connection in background (if there is none).
+        '''
+        with self.__connection.getSendLock():
+            if (not self.__standby is None or self.__standbyPending or self._token is None):
+                return
+            self.__standbyPending = True
+        thread = Thread(target=self.__openStandby, name="SSAPStandbyConnector")
+        thread.daemon = True
+        thread.start()
+        
+    def __openStandby(self):
+        '''
+        Opens a standby connection with the fastest server that is not being used. This method
+        is invoked from a background thread.
+        '''
+        try:
+            activeUrl = self.__connection.getServerUrl()
+            for serverUrl in self.__connectionData.getCandidateServerUrls(activeUrl):
+                if (serverUrl == activeUrl):
+                    continue
+                standby = _SSAPStandbyConnection(serverUrl, self.__connectionData, self._token, self._instance,
+                                                 self.__standbyRenewalInterval, self.__logger)
+                if (not standby.open()):
+                    continue
+                with self.__connection.getSendLock():
+                    keep = (not self.__standbyRenewalInterval is None and self.__standby is None and
+                            self.__connection.isConnected() and self.__connection.getServerUrl() == activeUrl)
+                    if (keep):
+                        self.__standby = standby
+                if (keep):
+                    self.__logger.info("A standby connection with {0} has been established".format(serverUrl))
+                else:
+                    standby.close()
+                return
+        except Exception as e:
+            self.__logger.warning("Couldn't open a standby connection: " + str(e))
+        finally:
+            self.__standbyPending = False
+            
+    def __takeStandby(self):
+        '''
+        Returns the standby connection if it can be used, and forgets it.
+        '''
+        with self.__connection.getSendLock():
+            standby = self.__standby
+            self.__standby = None
+        if (standby is None or standby.isReady()):
+            return standby
+        standby.close()
+        return None
+    
+    def __closeStandby(self):
+        '''
+        Closes the standby connection (if any).
+        '''
+        standby = self.__takeStandby()
+        if (not standby is None):
+            standby.close()
+            
+    def __failRequest(self, request, reason):
+        '''
+        Passes an error response to the callback of a request that will never be answered.
+        '''
+        message = _buildErrorResponse(request, reason, self.__compactMessages)
+        if (not request.getRowHandler() is None):
+            request.getRowHandler().onQueryCompleted(message)
+        self._callback.onSSAPMessageReceived(message)
+    
+    def __renewSessionInBackground(self):
+        '''
+        Renews the session. This method is invoked from the session keepalive thread.
+        '''
+        if (not self.__connection.isConnected() or self._sessionKey is None or self.__reJoinPending):
+            return
+        try:
+            self.renovateSessionKey()
+        except Exception as e:
+            self.__logger.warning("Couldn't renew the session: " + str(e))
+    
+    def __retryExpiredRequest(self, request):
+        '''
+        Schedules a request that failed because the session had expired to be sent again after
+        joining the SIB. Returns False if the request will not be sent again.
+        
+        Keyword arguments:
+        request    -- the failed request.
+        '''
+        if (self.__sessionKeeper is None or self._token is None or request is None or request.getRetries() != 0):
+            return False
+        if (request.getType() == SSAP_MESSAGE_TYPE.JOIN):
+            # The session could not be renewed. We'll open a new one.
+            if (not request.getSessionKey() is None):
+                self.__queueReJoin()
+            return False
+        request.setRetries(request.getRetries() + 1)
+        self.__expiredRequests.append(request)
+        self.__queueReJoin()
+        return True
+    
+    def __queueReJoin(self):
+        '''
+        Queues a token-based JOIN request at the head of the output message queue.
+        '''
+        if (self.__reJoinPending):
+            return
+        self.__reJoinPending = True
+        request = _SSAPRequest(SSAP_MESSAGE_TYPE.JOIN, _SSAPMessageFactory.buildTokenBasedJoinMessage(self._token, self._instance),
+                               SSAP_REQUEST_PRIORITY.CONTROL)
+        request.setRetries(1)
+        self.__queue.appendLeft(request)
+        
+    def __resendExpiredRequests(self):
+        '''
+        Queues the requests that failed because the session had expired. They will keep their
+        original order.
+        '''
+        for request in reversed(self.__expiredRequests):
+            self.__queue.appendLeft(request)
+        self.__expiredRequests = []
+        
+def _buildErrorResponse(request, reason, compact):
+    '''
+    Builds the error response of a request that was not answered, or whose response could not be processed.
     
-    def __sendNextRequestToSib(self):
+    Keyword arguments:
+    request    -- the failed request.
+    reason     -- a string that describes the error.
+    compact    -- if True, the response will be a read-only SSAPMessage instead of a dictionary.
+    '''
+    message = {"messageId" : None, "sessionKey" : request.getSessionKey(), "ontology" : None,
+               "messageType" : request.getType(), "direction" : SSAP_MESSAGE_DIRECTION.ERROR,
+               "body" : {"ok" : False, "data" : None, "error" : reason, "errorCode" : SSAP_ERROR_CODE.OTHER}}
+    if (compact):
+        return SSAPMessage.fromDict(message)
+    return message
+
+def _getErrorCode(message):
+    '''
+    Returns the error code of a SSAP response, or None if the request was successful.
+    
+    Keyword arguments:
+    message    -- the parsed SSAP response.
+    '''
+    if (not SSAPEndpoint.hasOkField(message) or message["body"]["ok"]):
+        return None
+    errorCode = message["body"].get("errorCode")
+    if (errorCode is None):
+        errorCode = SSAP_ERROR_CODE.OTHER
+    return errorCode
+
+class _SSAPConnection(object):
+    '''
+    The websocket connection of one or more websocket-based endpoints. It sends the requests queued
+    by the endpoints, matches the responses with them and routes the INDICATION messages using their
+    session key. The endpoints with queued requests take turns to send them, and the SIB must answer
+    the requests sent through a connection in order.
+    '''
+    
+    def __init__(self, connectionData, logger, flowController=None, compactMessages=False, exclusive=True):
+        '''
+        Initializes the state of the connection. It will be established when the first request is sent.
+        
+        Keyword arguments:
+        connectionData    -- the object that stores the configuration of the websocket connection.
+        logger            -- the logger that the connection will use.
+        flowController    -- an object that limits the outbound requests of all the endpoints (i.e. an
+                             AIMDFlowController). By default, every endpoint sends its requests one at a time
+                             and without rate limits.
+        compactMessages   -- if True, the endpoints will receive read-only SSAPMessage objects instead of dictionaries.
+        exclusive         -- if True, the connection belongs to a single endpoint, and it will be closed when
+                             the endpoint leaves the SIB.
+        '''
+        self.__connectionData = connectionData
+        self.__logger = logger
+        self.__flowController = flowController
+        self.__compactMessages = compactMessages
+        self.__exclusive = exclusive
+        self.__ownerPid = os.getpid()
+        self.__sendLock = RLock()
+        self.__sendTimer = None
+        self.__websocket = None
+        self.__connectionEstablished = Event()
+        self.__serverUrl = None
+        self.__lastFailedUrl = None
+        self.__heartbeat = None
+        self.__inFlight = GenericThreadSafeList()
+        self.__inFlightCounts = {}
+        self.__lastSentRequests = {}
+        self.__endpoints = []
+        self.__nextEndpoint = 0
+        self.__endpointsBySessionKey = {}
+        self.__sessionKeys = {}
+        
+    def attach(self, endpoint):
+        '''
+        Registers an endpoint that will send its requests through the connection.
+        
+        Keyword arguments:
+        endpoint    -- the WebsocketBasedSSAPEndpoint.
+        '''
+        with self.__sendLock:
+            if (endpoint in self.__endpoints):
+                return
+            if (self.__exclusive and len(self.__endpoints) != 0):
+                raise InvalidSSAPOperation("The connection belongs to another endpoint")
+            self.__endpoints.append(endpoint)
+            
+    def isExclusive(self):
+        '''
+        Checks if the connection belongs to a single endpoint.
+        '''
+        return self.__exclusive
+    
+    def isConnected(self):
+        '''
+        Checks if the websocket connection has been opened.
+        '''
+        return not self.__websocket is None
+    
+    def getConnectionData(self):
+        '''
+        Returns the object that stores the configuration of the websocket connection.
+        '''
+        return self.__connectionData
+    
+    def getFlowController(self):
+        '''
+        Returns the flow controller of the connection (or None if it has no flow controller).
+        '''
+        return self.__flowController
+    
+    def getLogger(self):
+        '''
+        Returns the logger of the connection.
+        '''
+        return self.__logger
+    
+    def hasCompactMessages(self):
+        '''
+        Checks if the received messages are parsed into read-only SSAPMessage objects.
+        '''
+        return self.__compactMessages
+    
+    def getSendLock(self):
+        '''
+        Returns the lock that serializes the sends and the changes of the connection state.
+        '''
+        return self.__sendLock
+    
+    def getServerUrl(self):
         '''
-        Pops a SSAP message request from the output queue and sends it to the SIB.
+        Returns the URL of the server that the connection is established with (or None).
         '''
         if (self.__websocket is None):
-            self.__openConnection()
-        request = self.__queue[0]
-        self.__websocket.send(request.getQuery(), False)            
+            return None
+        return self.__serverUrl
+    
+    def getSessionCount(self):
+        '''
+        Returns the number of JOINed endpoints.
+        '''
+        return len(self.__endpointsBySessionKey)
+    
+    def checkOwnerProcess(self):
+        '''
+        Checks that the connection is being used by the process that created it. The ws4py threads
+        and the socket are not usable after a fork(), so every process must build its own endpoints.
+        '''
+        if (os.getpid() != self.__ownerPid):
+            raise InvalidSSAPOperation("This endpoint was created by another process. Build a new endpoint after calling fork()")
+        
+    def waitForever(self):
+        '''
+        Waits until the connection is closed.
+        '''
+        if (self.__websocket is None) :
+            raise InvalidSSAPOperation("The connection with the SIB is not established")
+        self.__websocket.run_forever()
+        
+    def close(self):
+        '''
+        Closes the connection.
+        '''
+        with self.__sendLock:
+            websocket = self.__websocket
+            if (websocket is None) :
+                raise InvalidSSAPOperation("The connection with the SIB is not established")
+            self.__websocket = None
+            self.__connectionEstablished = Event()
+        websocket.close()
+        
+    def release(self, endpoint):
+        '''
+        Closes the connection after an endpoint has left the SIB, unless other endpoints share it.
+        In that case, the endpoint is forgotten until it joins the SIB again.
+        
+        Keyword arguments:
+        endpoint    -- the endpoint that has left the SIB.
+        '''
+        if (self.__exclusive):
+            if (not self.__websocket is None):
+                self.close()
+            return
+        with self.__sendLock:
+            # The requests queued after the LEAVE request must still be sent
+            if (not endpoint in self.__endpoints or not endpoint._peekRequest() is None or
+                self.__inFlightCounts.get(endpoint, 0) != 0):
+                return
+            index = self.__endpoints.index(endpoint)
+            del self.__endpoints[index]
+            if (index < self.__nextEndpoint):
+                self.__nextEndpoint = self.__nextEndpoint - 1
+            if (self.__nextEndpoint >= len(self.__endpoints)):
+                self.__nextEndpoint = 0
+            self.__inFlightCounts.pop(endpoint, None)
+            self.__lastSentRequests.pop(endpoint, None)
+            self.__registerSessionKey(endpoint)
+        
+    def startHeartbeat(self, intervalInSeconds, timeoutInSeconds, maxMissedPongs):
+        '''
+        Starts sending websocket pings periodically in background. If several consecutive pongs are
+        missed, the connection will be declared dead.
+        
+        Keyword arguments:
+        intervalInSeconds    -- the number of seconds between two consecutive pings.
+        timeoutInSeconds     -- the number of seconds to wait for each pong. None means the ping interval.
+        maxMissedPongs       -- the number of consecutive missed pongs that make a connection dead.
+        '''
+        if (not self.__heartbeat is None):
+            raise InvalidSSAPOperation("The heartbeat has already been started")
+        if (timeoutInSeconds is None):
+            timeoutInSeconds = intervalInSeconds
+        self.__heartbeat = _SSAPHeartbeat(self.__sendPing, self.__onConnectionDead, intervalInSeconds, timeoutInSeconds,
+                                          maxMissedPongs, self.__logger)
+        self.__heartbeat.start()
+        
+    def stopHeartbeat(self):
+        '''
+        Stops sending websocket pings.
+        '''
+        if (not self.__heartbeat is None):
+            self.__heartbeat.stop()
+            self.__heartbeat = None
+            
+    def getRoundTripTime(self):
+        '''
+        Returns the smoothed round-trip time of the heartbeats (or None).
+        '''
+        if (self.__heartbeat is None):
+            return None
+        return self.__heartbeat.getRoundTripTime()
+    
+    def getLastRoundTripTime(self):
+        '''
+        Returns the round-trip time of the last heartbeat (or None).
+        '''
+        if (self.__heartbeat is None):
+            return None
+        return self.__heartbeat.getLastRoundTripTime()
+    
+    def adoptStandby(self, standby):
+        '''
+        Replaces the dead websocket connection with a standby connection. Returns the session key
+        and the serialized JOIN response of the standby connection.
+        
+        Keyword arguments:
+        standby    -- the _SSAPStandbyConnection.
+        '''
+        (websocket, sessionKey, joinResponse) = standby.promote(self.onDataReceived, self.__onConnectionEvent)
+        with self.__sendLock:
+            self.__websocket = websocket
+            self.__serverUrl = standby.getServerUrl()
+            self.__lastFailedUrl = None
+            self.__connectionEstablished.set()
+        if (hasattr(websocket, "setPongHandler")):
+            websocket.setPongHandler(self.__onPong)
+        return (sessionKey, joinResponse)
+        
+    def sendPendingRequests(self):
+        '''
+        Pops SSAP message requests from the output queues of the endpoints and sends them to the SIB
+        while the flow controller allows it.
+        '''
+        with self.__sendLock:
+            if (not self.__sendTimer is None):
+                return # The queues will be flushed when the timer expires
+            while (True):
+                endpoint = self.__nextSender()
+                if (endpoint is None):
+                    return
+                if (not self.__flowController is None):
+                    delay = self.__flowController.tryAcquire()
+                    if (delay > 0):
+                        self.__sendTimer = Timer(delay, self.__onSendTimerExpired)
+                        self.__sendTimer.daemon = True
+                        self.__sendTimer.start()
+                        return
+                if (self.__websocket is None):
+                    self.__openConnection()
+                request = endpoint._popRequest()
+                request.setOwner(endpoint)
+                request.setSendTime(monotonic())
+                self.__inFlight.append(request)
+                self.__inFlightCounts[endpoint] = self.__inFlightCounts.get(endpoint, 0) + 1
+                self.__lastSentRequests[endpoint] = request
+                self.__websocket.send(request.getQuery(), False)
+                
+    def __nextSender(self):
+        '''
+        Returns the next endpoint whose queued request can be sent (or None). The endpoints take turns.
+        '''
+        endpointCount = len(self.__endpoints)
+        for offset in range(endpointCount):
+            index = (self.__nextEndpoint + offset) % endpointCount
+            endpoint = self.__endpoints[index]
+            if (self.__canSendNextRequest(endpoint)):
+                self.__nextEndpoint = (index + 1) % endpointCount
+                return endpoint
+        return None
+    
+    def __canSendNextRequest(self, endpoint):
+        '''
+        Checks if the next queued request of an endpoint can be sent without waiting for the unanswered ones.
+        '''
+        request = endpoint._peekRequest()
+        if (request is None):
+            return False
+        if (self.__inFlightCounts.get(endpoint, 0) != 0):
+            if (self.__flowController is None):
+                return False
+            # JOIN, LEAVE and CONFIG requests change the session state, so they are never pipelined
+            if (request.isBarrier() or self.__lastSentRequests[endpoint].isBarrier()):
+                return False
+        if (self.__flowController is None or self.__inFlight.isEmpty()):
+            return True
+        return self.__inFlight.getSize() < self.__flowController.getInFlightLimit()
+        
+    def __onSendTimerExpired(self):
+        '''
+        Sends the queued requests after waiting for the rate limiter.
+        '''
+        with self.__sendLock:
+            self.__sendTimer = None
+        self.sendPendingRequests()
         
     def __openConnection(self):
         '''
-        Establishes a websocket-based connection with the SIB
+        Establishes a websocket-based connection with the SIB. If there are several servers, they
+        will be tried in order until one of them accepts the connection.
         '''
         if (not self.__websocket is None) :
             raise InvalidSSAPOperation("The connection with the SIB has already been established")
-        try :
-            self.__websocket = _SSAPWebsocketClient(self.__connectionData.getServerUrl(),
+        serverUrls = self.__connectionData.getCandidateServerUrls(self.__lastFailedUrl)
+        deadline = monotonic() + self.__connectionData.getFailoverTimeout()
+        for (index, serverUrl) in enumerate(serverUrls):
+            timeout = self.__connectionData.getConnectTimeout()
+            if (index != 0):
+                timeout = min(timeout, deadline - monotonic())
+                if (timeout <= 0):
+                    break
+            try :
+                self.__connectionEstablished = Event()
+                transportFactory = self.__connectionData.getTransportFactory()
+                self.__websocket = transportFactory(serverUrl,
                                                     self.__connectionData.getProtocols(),
                                                     self.__onConnectionEvent,
-                                                    self.__onDataReceived)
-            self.__websocket.connect()
-            self.__waitUntilConnectionEstablished()        
-        except Exception as ws4pyException:
-            self._clearStateData()
-            raise SSAPConnectionError("Couldn't connect to the SIB: " + str(ws4pyException))        
+                                                    self.onDataReceived)
+                if (hasattr(self.__websocket, "setPongHandler")):
+                    self.__websocket.setPongHandler(self.__onPong)
+                self.__websocket.connect()
+                self.__waitUntilConnectionEstablished(timeout)
+                self.__serverUrl = serverUrl
+                self.__lastFailedUrl = None
+                return
+            except Exception as ws4pyException:
+                self.__websocket = None
+                error = ws4pyException
+                if (len(serverUrls) > 1):
+                    self.__logger.warning("Couldn't connect to {0}: {1}".format(serverUrl, str(ws4pyException)))
+        raise SSAPConnectionError("Couldn't connect to the SIB: " + str(error))
         
-    def __waitUntilConnectionEstablished(self):
+    def __waitUntilConnectionEstablished(self, timeout):
         '''
         Waits for the websocket connection to the SIB to be established.
+        
+        Keyword arguments:
+        timeout    -- the maximum number of seconds to wait.
         '''
         self.__logger.info("Waiting for the websocket connection to be established")
-        while not self.__connection_established :            
-            sleep(1)
+        if (not self.__connectionEstablished.wait(timeout)):
+            raise SSAPConnectionError("Connection timed out")
             
     def __onConnectionEvent(self):
         '''
-        This method is invoked from the ws4py library when a websocket connection is established or closed.
+        This method is invoked from the websocket client when a websocket connection is established.
         '''
-        self.__connection_established = True
+        self.__connectionEstablished.set()
         
-    def __onDataReceived(self, data):
+    def onDataReceived(self, data):
         '''
-        This method is invokef from the ws4py library when data is received from the websocket.
+        Passes a received SSAP message to its endpoint. This method is invoked from the websocket client
+        when data is received from the websocket.
         
         Keyword arguments:
-        data    -- the received data.
+        data    -- the received data (a bytes object).
         '''
-        if (len(data.data) == 1):
+        if (len(data) == 1):
             return # We might receive some shit after closing the connection. We won't process it.
-        self.__logger.debug("Data received: " + bytes2String(data.data))
-        parsed_message = _SSAPMessageParser.parse(data.data)
+        if (self.__logger.isEnabledFor(logging.DEBUG)):
+            self.__logger.debug("Data received: " + bytes2String(data))
+        # The request is popped before parsing the response: the row handler runs while the response
+        # is being parsed, and the connection must not depend on it
+        request = None
+        if (not self.__inFlight.isEmpty() and not _SSAPMessageParser.isIndication(data)):
+            with self.__sendLock:
+                if (not self.__inFlight.isEmpty()):
+                    request = self.__inFlight.pop()
+                    self.__inFlightCounts[request.getOwner()] = self.__inFlightCounts[request.getOwner()] - 1
+        try:
+            message = _SSAPMessageParser.parse(data, None if request is None else request.getRowHandler(),
+                                               self.__compactMessages)
+        except Exception as e:
+            if (request is None):
+                self.__logger.error("Couldn't parse a SSAP message: " + str(e))
+                self.sendPendingRequests()
+                return
+            message = _buildErrorResponse(request, "Couldn't parse the response: " + str(e), self.__compactMessages)
         
-        # The message content can be modified within the callback. We must copy
-        # everything we need before invoking it.
-        messageType = parsed_message["messageType"]
-        noErrors = parsed_message["messageType"] != SSAP_MESSAGE_TYPE.INDICATION and parsed_message["body"]["ok"]
-                
-        if (noErrors and messageType == SSAP_MESSAGE_TYPE.JOIN):
-            self._sessionKey = parsed_message["sessionKey"]
-        self._callback.onSSAPMessageReceived(parsed_message)  
-              
-        if (messageType != SSAP_MESSAGE_TYPE.INDICATION) :
-            self.__queue.pop()       
-            
-        if (noErrors) :             
+        if (not request is None):
+            endpoint = request.getOwner()
+            if (not self.__flowController is None):
+                self.__flowController.onResponse(monotonic() - request.getSendTime(), _getErrorCode(message))
+        elif (message["messageType"] == SSAP_MESSAGE_TYPE.INDICATION):
+            endpoint = self.__endpointsBySessionKey.get(message["sessionKey"])
+        else:
+            # This happens when a captured session is replayed
+            self.__logger.debug("A response was received, but there are no unanswered requests")
+            endpoint = None
+        if (endpoint is None and self.__exclusive and len(self.__endpoints) != 0):
+            endpoint = self.__endpoints[0]
+        if (endpoint is None):
+            self.__logger.warning("A message for an unknown session was received")
+        else:
+            endpoint._onMessageReceived(message, request)
+            self.__registerSessionKey(endpoint)
+        self.sendPendingRequests()
         
-            if (messageType == SSAP_MESSAGE_TYPE.LEAVE):
-                self.__closeConnection()
-                self._clearStateData()
-                self.__websocket = None
-            elif (messageType == SSAP_MESSAGE_TYPE.SUBSCRIBE):
-                self.__activeSubscriptions = self.__activeSubscriptions + 1
-            elif (messageType == SSAP_MESSAGE_TYPE.UNSUBSCRIBE):
-                self.__activeSubscriptions = self.__activeSubscriptions - 1
-            
-        if (self.__queue.getSize() != 0) :
-            self.__sendNextRequestToSib()
+    def __registerSessionKey(self, endpoint):
+        '''
+        Updates the session key that routes the INDICATION messages to an endpoint.
+        '''
+        with self.__sendLock:
+            sessionKey = endpoint._sessionKey
+            previousKey = self.__sessionKeys.get(endpoint)
+            if (sessionKey == previousKey):
+                return
+            if (self.__endpointsBySessionKey.get(previousKey) is endpoint):
+                del self.__endpointsBySessionKey[previousKey]
+            if (sessionKey is None):
+                del self.__sessionKeys[endpoint]
+            else:
+                self.__sessionKeys[endpoint] = sessionKey
+                self.__endpointsBySessionKey[sessionKey] = endpoint
     
-    def __closeConnection(self):
+    def __sendPing(self, payload):
         '''
-        Closes the connection.
+        Sends a websocket ping. Returns the websocket client, or None if there is no established
+        connection or the client cannot send pings. This method is invoked from the heartbeat thread.
         '''
-        if (self.__websocket is None) :
-            raise InvalidSSAPOperation("The connection with the SIB is not established")
-        self._clearStateData()
-        self.__websocket.close()
-        self.__websocket = None
-        
-    def _clearStateData(self):
+        websocket = self.__websocket
+        if (websocket is None or not self.__connectionEstablished.is_set() or not hasattr(websocket, "ping")):
+            return None
+        try:
+            websocket.ping(payload)
+        except Exception as e:
+            self.__onConnectionDead(websocket, "Couldn't send a ping: " + str(e))
+            return None
+        return websocket
+    
+    def __onPong(self, payload):
         '''
-        Deletes all the state data stored in the endpoint (i.e. session keys, ...).
+        This method is invoked from the websocket client when a pong is received.
         '''
-        SSAPEndpoint._clearStateData(self)
-        self.__connection_established = False
-        
+        heartbeat = self.__heartbeat
+        if (not heartbeat is None):
+            heartbeat.onPong(payload)
+            
+    def __onConnectionDead(self, websocket, reason):
+        '''
+        Closes a dead connection and passes the unanswered requests to their endpoints, which will
+        fail them or fail over to another server. This method is invoked from the heartbeat thread.
         
+        Keyword arguments:
+        websocket    -- the websocket client of the dead connection.
+        reason       -- a string that describes why the connection is dead.
+        '''
+        with self.__sendLock:
+            if (not websocket is self.__websocket):
+                return # The connection has already been closed
+            self.__logger.warning("The connection with the SIB is dead: " + reason)
+            self.__websocket = None
+            self.__connectionEstablished = Event()
+            self.__lastFailedUrl = self.__serverUrl
+            lostRequests = {}
+            while (not self.__inFlight.isEmpty()):
+                request = self.__inFlight.pop()
+                lostRequests.setdefault(request.getOwner(), []).append(request)
+            self.__inFlightCounts = {}
+            self.__lastSentRequests = {}
+            abandonedRequests = []
+            for endpoint in self.__endpoints:
+                abandonedRequests.append((endpoint, endpoint._abandonRequests(lostRequests.get(endpoint, []))))
+                self.__registerSessionKey(endpoint)
+        try:
+            websocket.close()
+        except Exception as e:
+            self.__logger.debug("Couldn't close the dead connection: " + str(e))
+        for (endpoint, (failedRequests, retriedRequests)) in abandonedRequests:
+            endpoint._onConnectionLost(failedRequests, retriedRequests, reason)
+    
 class _SSAPRequest(object):
     '''
     These objects store the data of an outgoing SSAP request (i.e. one that will be sent to the SIB).
     '''
     
-    def __init__(self, requestType, query):
+    def __init__(self, requestType, query, priority=SSAP_REQUEST_PRIORITY.BULK, sessionKey=None):
         '''
         Initializes the state of the request.
         
         Keyword arguments:
         requestType    --    the SSAP message type of the request.
-        query          --    the serialized SSAP message to be sent.
+        query          --    the serialized SSAP message to be sent, or a bound message template. Templates
+                             are rendered with the current session key when the request is sent.
+        priority       --    the priority class of the request.
+        sessionKey     --    the session key included in the serialized SSAP message.
         '''
         self.__type = requestType
-        self.__query = query
+        if (isinstance(query, str)):
+            self.__query = query
+            self.__template = None
+        else:
+            self.__query = None
+            self.__template = query
+        self.__priority = priority
+        self.__sessionKey = sessionKey
+        self.__retries = 0
+        self.__rowHandler = None
+        self.__owner = None
+        self.__sendTime = None
         
     def getType(self):
         '''
@@ -275,56 +1232,408 @@ class _SSAPRequest(object):
         '''
         Returns the serialized SSAP message of the request.
         '''
+        if (self.__query is None):
+            self.__query = self.__template.render(self.__sessionKey)
         return self.__query
     
-class _SSAPWebsocketClient(WebSocketClient):
+    def getOwner(self):
+        '''
+        Returns the endpoint that sent the request (or None).
+        '''
+        return self.__owner
+    
+    def setOwner(self, owner):
+        '''
+        Stores the endpoint that sent the request. Several endpoints can share the same connection.
+        
+        Keyword arguments:
+        owner    --    the endpoint.
+        '''
+        self.__owner = owner
+    
+    def getRowHandler(self):
+        '''
+        Returns the SSAPRowHandler that will process the rows of the response (or None).
+        '''
+        return self.__rowHandler
+    
+    def setRowHandler(self, rowHandler):
+        '''
+        Sets the SSAPRowHandler that will process the rows of the response.
+        
+        Keyword arguments:
+        rowHandler    --    the row handler. None disables the incremental decoding of the response.
+        '''
+        self.__rowHandler = rowHandler
+    
+    def getSessionKey(self):
+        '''
+        Returns the session key included in the serialized SSAP message.
+        '''
+        return self.__sessionKey
+    
+    def setSessionKey(self, sessionKey):
+        '''
+        Replaces the session key included in the serialized SSAP message. JOIN and CONFIG
+        requests are never modified.
+        
+        Keyword arguments:
+        sessionKey    --    the new session key.
+        '''
+        if (sessionKey == self.__sessionKey or self.__type in (SSAP_MESSAGE_TYPE.JOIN, SSAP_MESSAGE_TYPE.CONFIG)):
+            return
+        if (self.__template is None):
+            self.__query = _SSAPMessageFactory.replaceSessionKey(self.__query, sessionKey)
+        else:
+            self.__query = None # The template will be rendered again
+        self.__sessionKey = sessionKey
+        
+    def getRetries(self):
+        '''
+        Returns the number of times that the request has been sent again.
+        '''
+        return self.__retries
+    
+    def setRetries(self, retries):
+        '''
+        Stores the number of times that the request has been sent again.
+        
+        Keyword arguments:
+        retries    --    the number of retries.
+        '''
+        self.__retries = retries
+    
+    def getPriority(self):
+        '''
+        Returns the priority class of the request.
+        '''
+        return self.__priority
+    
+    def isBarrier(self):
+        '''
+        Checks if the request changes the session state. Other requests cannot be sent until these
+        requests are answered.
+        '''
+        return self.__type in (SSAP_MESSAGE_TYPE.JOIN, SSAP_MESSAGE_TYPE.LEAVE, SSAP_MESSAGE_TYPE.CONFIG)
+    
+    def drainsQueue(self):
+        '''
+        Checks if the request ends the session. These requests are sent after all the requests that
+        were queued before them, whatever their priority class.
+        '''
+        return self.__type == SSAP_MESSAGE_TYPE.LEAVE
+    
+    def getSendTime(self):
+        '''
+        Returns the instant when the request was sent to the SIB.
+        '''
+        return self.__sendTime
+    
+    def setSendTime(self, sendTime):
+        '''
+        Stores the instant when the request was sent to the SIB.
+        
+        Keyword arguments:
+        sendTime    -- the send instant.
+        '''
+        self.__sendTime = sendTime
+    
+# The requests that are not sent again when the endpoint fails over to another server
+_SESSION_BOUND_REQUESTS = (SSAP_MESSAGE_TYPE.JOIN, SSAP_MESSAGE_TYPE.LEAVE, SSAP_MESSAGE_TYPE.SUBSCRIBE,
+                           SSAP_MESSAGE_TYPE.UNSUBSCRIBE)
+
+# The default priority classes of the SSAP requests
+_DEFAULT_REQUEST_PRIORITIES = {SSAP_MESSAGE_TYPE.JOIN : SSAP_REQUEST_PRIORITY.CONTROL,
+                               SSAP_MESSAGE_TYPE.LEAVE : SSAP_REQUEST_PRIORITY.CONTROL,
+                               SSAP_MESSAGE_TYPE.CONFIG : SSAP_REQUEST_PRIORITY.CONTROL,
+                               SSAP_MESSAGE_TYPE.SUBSCRIBE : SSAP_REQUEST_PRIORITY.CONTROL,
+                               SSAP_MESSAGE_TYPE.UNSUBSCRIBE : SSAP_REQUEST_PRIORITY.CONTROL,
+                               SSAP_MESSAGE_TYPE.QUERY : SSAP_REQUEST_PRIORITY.INTERACTIVE,
+                               SSAP_MESSAGE_TYPE.INSERT : SSAP_REQUEST_PRIORITY.BULK,
+                               SSAP_MESSAGE_TYPE.UPDATE : SSAP_REQUEST_PRIORITY.BULK,
+                               SSAP_MESSAGE_TYPE.DELETE : SSAP_REQUEST_PRIORITY.BULK,
+                               SSAP_MESSAGE_TYPE.BULK : SSAP_REQUEST_PRIORITY.BULK}
+
+class _SSAPOutboundQueue(object):
     '''
-    The ws4py websocket client that is used by the SSAP API.
+    The output message queue. It has one FIFO lane per priority class, and serves them using
+    weighted round robin: higher priority requests jump ahead, but every lane is guaranteed a
+    share of the sends while it has queued requests.
+    
+    The requests that end the session (LEAVE) are barriers: they are held until all the lanes are
+    empty, and the requests queued after them wait until they have been popped.
     '''
     
-    def __init__(self, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+    # The number of requests of each priority class that can be sent in every round
+    WEIGHTS = {SSAP_REQUEST_PRIORITY.CONTROL : 16,
+               SSAP_REQUEST_PRIORITY.INTERACTIVE : 4,
+               SSAP_REQUEST_PRIORITY.BULK : 1}
+    
+    def __init__(self):
         '''
-        Initializes the state of the client.
+        Initializes the state of the queue. It will be empty.
+        '''
+        self.__lock = Lock()
+        self.__lanes = {}
+        self.__served = {}
+        for priority in _SSAPOutboundQueue.WEIGHTS:
+            self.__lanes[priority] = deque()
+            self.__served[priority] = 0
+        self.__priorities = sorted(_SSAPOutboundQueue.WEIGHTS.keys())
+        self.__size = 0
+        self.__laneSize = 0
+        self.__barrier = None
+        self.__deferred = deque()
+        
+    def append(self, request):
+        '''
+        Queues a request at the end of its lane.
         
         Keyword arguments:
-        serverURL                        -- the URL of the websocket server.
-        protocols                        -- a list containing the websocket protocols supported by the websockets client.
-        connectionEstablishedHandler     -- a function that will be invoked after establishing the websocket connection.
-        dataReceivedHandler              -- a function that will be invoked after receiving data from the websocket.
+        request    -- the request to queue.
         '''
-        WebSocketClient.__init__(self, serverUrl, protocols)
-        self.__logger = LogFactory.configureLogger(self, logging.INFO, LogFactory.DEFAULT_LOG_FILE)
-        self.__connectionEstablishedHandler = connectionEstablishedHandler
-        self.__dataReceivedEventHandler = dataReceivedEventHandler
+        with self.__lock:
+            self.__enqueue(request)
+            self.__size = self.__size + 1
+            
+    def appendLeft(self, request):
+        '''
+        Queues a request at the beginning of its lane.
+        
+        Keyword arguments:
+        request    -- the request to queue.
+        '''
+        with self.__lock:
+            if (request.drainsQueue() and self.__barrier is None):
+                self.__barrier = request
+            else:
+                self.__lanes[request.getPriority()].appendleft(request)
+                self.__laneSize = self.__laneSize + 1
+            self.__size = self.__size + 1
+    
+    def peek(self):
+        '''
+        Returns the next request that will be popped (or None if the queue is empty).
+        '''
+        with self.__lock:
+            priority = self.__nextLane()
+            if (priority is None):
+                return self.__barrier
+            return self.__lanes[priority][0]
+    
+    def pop(self):
+        '''
+        Removes the next request from the queue and returns it.
+        '''
+        with self.__lock:
+            priority = self.__nextLane()
+            if (priority is None):
+                if (self.__barrier is None):
+                    raise IndexError("pop from an empty queue")
+                request = self.__barrier
+                self.__barrier = None
+                self.__size = self.__size - 1
+                deferred = self.__deferred
+                self.__deferred = deque()
+                for deferredRequest in deferred:
+                    self.__enqueue(deferredRequest)
+                return request
+            self.__served[priority] = self.__served[priority] + 1
+            self.__size = self.__size - 1
+            self.__laneSize = self.__laneSize - 1
+            return self.__lanes[priority].popleft()
+    
+    def startNewRound(self):
+        '''
+        Forgets the requests served in the current round, so that the highest priority lane is
+        served first.
+        '''
+        with self.__lock:
+            for priority in self.__priorities:
+                self.__served[priority] = 0
+    
+    def isEmpty(self):
+        '''
+        Checks if the queue is empty.
+        '''
+        return self.__size == 0
+    
+    def getSize(self):
+        '''
+        Returns the number of queued requests.
+        '''
+        return self.__size
+    
+    def __enqueue(self, request):
+        '''
+        Puts a request at the end of its lane, or behind the pending barrier.
+        '''
+        if (not self.__barrier is None):
+            self.__deferred.append(request)
+        elif (request.drainsQueue()):
+            self.__barrier = request
+        else:
+            self.__lanes[request.getPriority()].append(request)
+            self.__laneSize = self.__laneSize + 1
+    
+    def __nextLane(self):
+        '''
+        Returns the priority class of the lane that will be served next.
+        '''
+        if (self.__laneSize == 0):
+            return None
+        for _round in range(2):
+            for priority in self.__priorities:
+                if (len(self.__lanes[priority]) != 0 and self.__served[priority] < _SSAPOutboundQueue.WEIGHTS[priority]):
+                    return priority
+            # All the non-empty lanes have used their share. A new round begins.
+            for priority in self.__priorities:
+                self.__served[priority] = 0
+        return None
 
-    def opened(self):
+class _SSAPSessionKeeper(Thread):
+    '''
+    A background thread that renews the session of an endpoint periodically.
+    '''
+    
+    def __init__(self, renewalFunction, renewalIntervalInSeconds):
+        '''
+        Initializes the state of the thread.
+        
+        Keyword arguments:
+        renewalFunction             -- the function that renews the session.
+        renewalIntervalInSeconds    -- the number of seconds between two consecutive session renewals.
         '''
-        This function will be invoked from the ws4py library after establishing the websocket connection.
+        Thread.__init__(self, name="SSAPSessionKeeper")
+        self.daemon = True
+        self.__renewalFunction = renewalFunction
+        self.__renewalInterval = renewalIntervalInSeconds
+        self.__stopEvent = Event()
+        
+    def run(self):
+        while not self.__stopEvent.wait(self.__renewalInterval):
+            self.__renewalFunction()
+            
+    def stop(self):
+        '''
+        Stops the thread. The current session renewal (if any) will not be cancelled.
         '''
-        self.__logger.info("Websocket connection established")
-        self.__connectionEstablishedHandler()
+        self.__stopEvent.set()
+
+class _SSAPHeartbeat(Thread):
+    '''
+    A background thread that sends websocket pings periodically and measures the round-trip time
+    of their pongs.
+    '''
     
-    def closed(self, code, reason):
+    # The weight of the last round-trip time in the smoothed one (the value used by TCP)
+    RTT_GAIN = 0.125
+    
+    def __init__(self, pingFunction, deadConnectionFunction, intervalInSeconds, timeoutInSeconds, maxMissedPongs, logger):
         '''
-        This function will be invoked from the ws4py library after closing the websocket connection.
+        Initializes the state of the thread.
         
         Keyword arguments:
-        code     -- a status code.
-        reason   -- a string containing the disconnection reason.
+        pingFunction              -- the function that sends a ping. It receives the ping payload, and returns
+                                     the websocket client that sent it (or None if there is no connection).
+        deadConnectionFunction    -- the function that will be invoked with the websocket client and a reason
+                                     when the connection is declared dead.
+        intervalInSeconds         -- the number of seconds between two consecutive pings.
+        timeoutInSeconds          -- the number of seconds to wait for each pong.
+        maxMissedPongs            -- the number of consecutive missed pongs that make a connection dead.
+        logger                    -- the logger of the endpoint.
+        '''
+        Thread.__init__(self, name="SSAPHeartbeat")
+        self.daemon = True
+        self.__pingFunction = pingFunction
+        self.__deadConnectionFunction = deadConnectionFunction
+        self.__interval = intervalInSeconds
+        self.__timeout = timeoutInSeconds
+        self.__maxMissedPongs = maxMissedPongs
+        self.__logger = logger
+        self.__lock = Lock()
+        self.__stopEvent = Event()
+        self.__sequence = 0
+        self.__websocket = None
+        self.__pendingPing = None
+        self.__missedPongs = 0
+        self.__roundTripTime = None
+        self.__lastRoundTripTime = None
+        
+    def run(self):
+        while not self.__stopEvent.wait(min(self.__interval, self.__timeout)):
+            try:
+                self.__beat()
+            except Exception as e:
+                self.__logger.warning("Heartbeat error: " + str(e))
+            
+    def stop(self):
+        '''
+        Stops the thread.
         '''
-        message = "Websocket connection closed. Code: {0}, Message: {1}".format(code, reason)
-        self.__logger.info(message)
+        self.__stopEvent.set()
         
-    def received_message(self, message):
+    def getRoundTripTime(self):
+        return self.__roundTripTime
+    
+    def getLastRoundTripTime(self):
+        return self.__lastRoundTripTime
+        
+    def onPong(self, payload):
         '''
-        This function will be invoked from the ws4py library after receiving data from the websocket.
+        Processes a received pong.
         
         Keyword arguments:
-        message     -- An object containing the received data.
+        payload    -- the payload of the pong.
         '''
-        self.__logger.debug("Data received: {0}".format(message))
-        self.__dataReceivedEventHandler(message)
+        if (isinstance(payload, (bytes, bytearray))):
+            payload = bytes2String(bytes(payload))
+        now = monotonic()
+        with self.__lock:
+            # Any pong proves that the connection is alive
+            self.__missedPongs = 0
+            if (self.__pendingPing is None or self.__pendingPing[0] != payload):
+                return
+            roundTripTime = now - self.__pendingPing[1]
+            self.__pendingPing = None
+            self.__lastRoundTripTime = roundTripTime
+            if (self.__roundTripTime is None):
+                self.__roundTripTime = roundTripTime
+            else:
+                self.__roundTripTime += _SSAPHeartbeat.RTT_GAIN * (roundTripTime - self.__roundTripTime)
         
+    def __beat(self):
+        '''
+        Checks the last ping and sends a new one.
+        '''
+        now = monotonic()
+        with self.__lock:
+            if (not self.__pendingPing is None):
+                if (now - self.__pendingPing[1] < self.__timeout):
+                    return # We are still waiting for the pong
+                self.__pendingPing = None
+                self.__missedPongs = self.__missedPongs + 1
+                self.__logger.debug("Missed pong ({0} in a row)".format(self.__missedPongs))
+            deadWebsocket = None
+            if (self.__missedPongs >= self.__maxMissedPongs):
+                deadWebsocket = self.__websocket
+                self.__missedPongs = 0
+                self.__websocket = None
+            else:
+                self.__sequence = self.__sequence + 1
+                payload = str(self.__sequence)
+                self.__pendingPing = (payload, now)
+        if (not deadWebsocket is None):
+            self.__deadConnectionFunction(deadWebsocket, "{0} consecutive pongs were missed".format(self.__maxMissedPongs))
+            return
+        websocket = self.__pingFunction(payload)
+        with self.__lock:
+            if (websocket is None):
+                self.__pendingPing = None # There is no connection
+            if (not websocket is self.__websocket):
+                self.__missedPongs = 0
+            self.__websocket = websocket
+
 class _ConnectionStatus(object):
     '''
     These objects hold the status of a websocket connection.
@@ -0,0 +1,90 @@
+# -*- coding: utf8 -*-
+'''
+The ws4py-based websocket transport. It is the default transport of the websocket-based endpoints,
+but it is only imported when an endpoint opens its first connection.
+
+This module is part of the Python SSAP API, version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+
+import logging
+from ws4py.client.threadedclient import WebSocketClient
+from ssap.utils.logs import LogFactory
+
+class _SSAPWebsocketClient(WebSocketClient):
+    '''
+    The ws4py websocket client that is used by the SSAP API.
+    '''
+    
+    def __init__(self, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+        '''
+        Initializes the state of the client.
+        
+        Keyword arguments:
+        serverURL                        -- the URL of the websocket server.
+        protocols                        -- a list containing the websocket protocols supported by the websockets client.
+        connectionEstablishedHandler     -- a function that will be invoked after establishing the websocket connection.
+        dataReceivedHandler              -- a function that will be invoked after receiving data from the websocket.
+        '''
+        WebSocketClient.__init__(self, serverUrl, protocols)
+        self.__logger = LogFactory.configureLogger(self, logging.INFO, LogFactory.DEFAULT_LOG_FILE)
+        self.__connectionEstablishedHandler = connectionEstablishedHandler
+        self.__dataReceivedEventHandler = dataReceivedEventHandler
+        self.__pongHandler = None
+
+    def setPongHandler(self, pongHandler):
+        '''
+        Sets the function that will be invoked with the payload of every received pong message.
+        '''
+        self.__pongHandler = pongHandler
+
+    def opened(self):
+        '''
+        This function will be invoked from the ws4py library after establishing the websocket connection.
+        '''
+        self.__logger.info("Websocket connection established")
+        self.__connectionEstablishedHandler()
+    
+    def closed(self, code, reason):
+        '''
+        This function will be invoked from the ws4py library after closing the websocket connection.
+        
+        Keyword arguments:
+        code     -- a status code.
+        reason   -- a string containing the disconnection reason.
+        '''
+        message = "Websocket connection closed. Code: {0}, Message: {1}".format(code, reason)
+        self.__logger.info(message)
+        
+    def ponged(self, pong):
+        '''
+        This function will be invoked from the ws4py library after receiving a pong message.
+        
+        Keyword arguments:
+        pong     -- the pong message.
+        '''
+        if (not self.__pongHandler is None):
+            self.__pongHandler(pong.data)
+        
+    def received_message(self, message):
+        '''
+        This function will be invoked from the ws4py library after receiving data from the websocket.
+        
+        Keyword arguments:
+        message     -- An object containing the received data.
+        '''
+        self.__logger.debug("Data received: {0}".format(message))
+        self.__dataReceivedEventHandler(message.data)
+
+class Ws4pyTransportFactory(object):
+    '''
+    Builds ws4py-based transports. This class allows the ws4py transport to be selected by name in
+    the SSAPEndpointFactory transport registry.
+    '''
+    
+    def __call__(self, serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+        return _SSAPWebsocketClient(serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler)
@@ -0,0 +1,589 @@
+# -*- coding: utf8 -*-
+'''
+A resumable loader for JSONL and CSV files.
+
+The file is read sequentially, its records are converted into ontology instances through a
+field mapping and they are inserted with BULK requests, sent through several connections in
+parallel. A checkpoint file stores the byte offset of the last record that precedes the first
+unacknowledged batch, so an interrupted load can be resumed from there. Some records of the
+batches that were sent after it might be inserted twice.
+
+The field mapping is an ontology instance whose string values reference the fields of the
+records as "$<field>[:<type>]". The JSONL fields are dotted paths, the CSV fields are column
+names and "$*" references the whole record. The types are str, int, float, bool, json and date
+(a MongoDB extended JSON date built from an ISO 8601 string or from seconds since the epoch).
+For example,
+
+    {"Sensor" : {"assetId" : "$id", "measure" : "$value:float", "timestamp" : "$time:date"}}
+
+Usage: python -m ssap.load readings.csv --url ws://sofia2.com/sib/api_websocket --token TOKEN
+       --instance KP:INSTANCE --ontology TestSensorTemperatura --mapping @mapping.json
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from collections import OrderedDict, deque
+from threading import Event, Lock, Semaphore
+from time import monotonic, sleep
+from ssap.core import BasicSSAPCallback, SSAP_MESSAGE_TYPE
+from ssap.factories import SSAPEndpointFactory
+from ssap.utils.filters import compileFieldGetter
+from ssap.utils.flowcontrol import AIMDFlowController
+from ssap.utils.timestamps import toEpochSeconds, toExtendedJsonDate
+
+# The reference to the whole record
+WHOLE_RECORD = "*"
+
+def _toBoolean(value):
+    if (isinstance(value, bool)):
+        return value
+    text = str(value).strip().lower()
+    if (text in ("true", "1", "yes", "y", "t")):
+        return True
+    if (text in ("false", "0", "no", "n", "f")):
+        return False
+    raise ValueError("Invalid boolean value: {0}".format(value))
+
+def _toDate(value):
+    if (isinstance(value, str)):
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    epochSeconds = toEpochSeconds(value)
+    if (epochSeconds is None):
+        raise ValueError("Invalid date: {0}".format(value))
+    return toExtendedJsonDate(epochSeconds)
+
+def _toJson(value):
+    if (isinstance(value, str)):
+        return json.loads(value)
+    return value
+
+class FieldMapping(object):
+    '''
+    Converts the records of a file into the columns of a ColumnarBulkEncoder.
+    '''
+
+    CONVERTERS = {"str" : str, "int" : int, "float" : float, "bool" : _toBoolean, "json" : _toJson, "date" : _toDate}
+
+    def __init__(self, template, flatRecords=False):
+        '''
+        Compiles a field mapping.
+
+        Keyword arguments:
+        template       -- the ontology instance that references the fields of the records.
+        flatRecords    -- if True, the field names are not dotted paths (i.e. they are CSV column names).
+        '''
+        self.__template = template
+        self.__extractors = {}
+        self.__collectReferences(template, flatRecords)
+        if (len(self.__extractors) == 0):
+            raise ValueError("The field mapping does not reference any field")
+
+    def getTemplate(self):
+        '''
+        Returns the template of the ontology instances.
+        '''
+        return self.__template
+
+    def buildColumns(self, records):
+        '''
+        Returns a dictionary that maps the references of the template to the converted values of
+        the records. A ValueError is raised if a value cannot be converted.
+        '''
+        return dict((reference, [extractor(record) for record in records])
+                    for (reference, extractor) in self.__extractors.items())
+
+    def __collectReferences(self, value, flatRecords):
+        if (isinstance(value, dict)):
+            for item in value.values():
+                self.__collectReferences(item, flatRecords)
+        elif (isinstance(value, list)):
+            for item in value:
+                self.__collectReferences(item, flatRecords)
+        elif (isinstance(value, str) and value.startswith("$") and not value[1:] in self.__extractors):
+            self.__extractors[value[1:]] = self.__compileReference(value[1:], flatRecords)
+
+    @staticmethod
+    def __compileReference(reference, flatRecords):
+        (field, _separator, typeName) = reference.partition(":")
+        if (typeName):
+            convert = FieldMapping.CONVERTERS.get(typeName)
+            if (convert is None):
+                raise ValueError("Unknown type in the field mapping: {0}".format(typeName))
+        else:
+            convert = None
+        if (field == WHOLE_RECORD):
+            getValue = lambda record: record
+        elif (flatRecords):
+            getValue = lambda record: record.get(field)
+        else:
+            getValue = compileFieldGetter(field)
+        if (convert is None):
+            return getValue
+        def extract(record):
+            value = getValue(record)
+            if (value is None or value == ""):
+                return None
+            return convert(value)
+        return extract
+
+class _OffsetLineReader(object):
+    '''
+    Reads the lines of a file, keeping track of the byte offset of the next line.
+    '''
+
+    def __init__(self, stream, offset):
+        self.offset = offset
+        self.__stream = stream
+
+    def __iter__(self):
+        for line in self.__stream:
+            self.offset += len(line)
+            yield line.decode("utf-8")
+
+def readRecords(path, fileFormat, offset=0, chunkSize=4 * 1024 * 1024, delimiter=","):
+    '''
+    Returns a generator that yields the records of a file and the byte offset of the next record.
+    The records that cannot be parsed are yielded as None.
+
+    Keyword arguments:
+    path          -- the path of the file.
+    fileFormat    -- the format of the file (jsonl or csv).
+    offset        -- the byte offset of the first record. The CSV header is always read.
+    chunkSize     -- the size of the read buffer.
+    delimiter     -- the delimiter of the CSV fields.
+    '''
+    with open(path, "rb", buffering=chunkSize) as stream:
+        if (fileFormat == "csv"):
+            lines = _OffsetLineReader(stream, 0)
+            reader = csv.reader(lines, delimiter=delimiter)
+            header = next(reader, None)
+            if (header is None):
+                return
+            if (header):
+                header[0] = header[0].lstrip("\ufeff")
+            if (offset > lines.offset):
+                stream.seek(offset)
+                lines.offset = offset
+            for row in reader:
+                if (not row):
+                    continue
+                if (len(row) != len(header)):
+                    yield (None, lines.offset)
+                else:
+                    yield (dict(zip(header, row)), lines.offset)
+        else:
+            stream.seek(offset)
+            lines = _OffsetLineReader(stream, offset)
+            for line in lines:
+                if (not line.strip()):
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield (record, lines.offset)
+
+class _Batch(object):
+    '''
+    A set of consecutive records that is inserted with a single BULK request.
+    '''
+
+    def __init__(self, sequence, columns, recordCount, endOffset):
+        self.sequence = sequence
+        self.columns = columns
+        self.recordCount = recordCount
+        self.endOffset = endOffset
+        self.attempts = 0
+
+class _Checkpoint(object):
+    '''
+    Stores the progress of a load in a JSON file. The file is replaced atomically.
+    '''
+
+    def __init__(self, path, fingerprint):
+        self.__path = path
+        self.__fingerprint = fingerprint
+
+    def load(self):
+        '''
+        Returns the byte offset and the number of records of the last checkpoint, or (0, 0) if
+        there is no checkpoint. A ValueError is raised if the checkpoint belongs to another load.
+        '''
+        if (not os.path.exists(self.__path)):
+            return (0, 0)
+        with open(self.__path, "r") as checkpointFile:
+            checkpoint = json.load(checkpointFile)
+        if (checkpoint.get("load") != self.__fingerprint):
+            raise ValueError("The checkpoint {0} belongs to another load. Use --restart to ignore it".format(self.__path))
+        return (checkpoint["offset"], checkpoint["records"])
+
+    def save(self, offset, records, completed=False):
+        temporaryPath = self.__path + ".tmp"
+        with open(temporaryPath, "w") as checkpointFile:
+            json.dump({"load" : self.__fingerprint, "offset" : offset, "records" : records, "completed" : completed},
+                      checkpointFile, sort_keys=True)
+        os.replace(temporaryPath, self.__path)
+
+class _LoaderConnection(BasicSSAPCallback):
+    '''
+    A SSAP connection that sends BULK requests.
+    '''
+
+    def __init__(self, options, loader, transportFactory):
+        self.__options = options
+        self.__loader = loader
+        self.__permits = Semaphore(options.pipeline)
+        self.__pending = deque()
+        self.__pendingLock = Lock()
+        self.__joined = Event()
+        self.__joinOk = False
+        flowController = None
+        if (options.pipeline > 1):
+            flowController = AIMDFlowController(maxInFlight=options.pipeline)
+        if (transportFactory is None):
+            self.__endpoint = SSAPEndpointFactory.buildEndpoint(options.url, self, options.transport,
+                                                                flowController=flowController)
+        else:
+            self.__endpoint = SSAPEndpointFactory.buildWebsocketBasedSSAPEndpoint(options.url, self, False, flowController,
+                                                                                   transportFactory)
+
+    def join(self, timeout):
+        '''
+        Joins the SIB. Returns True if the JOIN request succeeded.
+        '''
+        self.__endpoint.joinWithToken(self.__options.token, self.__options.instance)
+        self.__joined.wait(timeout)
+        return self.__joinOk
+
+    def trySend(self, batch, template, timeout):
+        '''
+        Sends a batch if the connection has room for another unanswered request. Returns False if
+        the timeout expired first.
+        '''
+        if (not self.__permits.acquire(timeout=timeout)):
+            return False
+        batch.attempts = batch.attempts + 1
+        with self.__pendingLock:
+            self.__pending.append(batch)
+            try:
+                self.__endpoint.insertColumns(self.__options.ontology, template, batch.columns, batch.recordCount)
+            except Exception:
+                self.__pending.pop()
+                self.__permits.release()
+                raise
+        return True
+
+    def leave(self):
+        try:
+            self.__endpoint.leave()
+        except Exception:
+            pass
+
+    def onSSAPMessageReceived(self, message):
+        # Do not call this method from client code!!!
+        if (message["messageType"] == SSAP_MESSAGE_TYPE.JOIN and not self.__joined.is_set()):
+            self.__joinOk = bool(message["body"].get("ok"))
+            self.__joined.set()
+            return
+        if (message["messageType"] != SSAP_MESSAGE_TYPE.BULK):
+            return
+        with self.__pendingLock:
+            if (not self.__pending):
+                return
+            batch = self.__pending.popleft()
+        self.__permits.release()
+        self.__loader._onBatchResponse(batch, bool(message["body"].get("ok")), message["body"].get("error"))
+
+class FileLoader(object):
+    '''
+    Loads a file into an ontology through several connections.
+    '''
+
+    def __init__(self, options, transportFactory=None):
+        '''
+        Initializes the state of the loader.
+
+        Keyword arguments:
+        options            -- the parsed command line options.
+        transportFactory   -- if it is set, it will be used instead of the transport selected in the command
+                              line (i.e. to share a loopback SIB between all the connections).
+        '''
+        self.__options = options
+        self.__transportFactory = transportFactory
+        self.__mapping = FieldMapping(options.mapping, options.format == "csv")
+        fingerprint = {"file" : os.path.abspath(options.file), "ontology" : options.ontology, "mapping" : options.mapping}
+        self.__checkpoint = _Checkpoint(options.checkpoint, fingerprint)
+        self.__lock = Lock()
+        self.__outstanding = OrderedDict()
+        self.__batchesBySequence = {}
+        self.__retries = deque()
+        self.__error = None
+        self.__offset = 0
+        self.__records = 0
+        self.__invalidRecords = 0
+        self.__batches = 0
+
+    def run(self):
+        '''
+        Loads the file. Returns a dictionary with the results. Its "error" field is None if all
+        the records were inserted.
+        '''
+        options = self.__options
+        if (options.restart):
+            (self.__offset, self.__records) = (0, 0)
+        else:
+            (self.__offset, self.__records) = self.__checkpoint.load()
+        initialRecords = self.__records
+        if (self.__offset > os.path.getsize(options.file)):
+            raise ValueError("The checkpoint offset is beyond the end of the file")
+        transportFactory = self.__transportFactory
+        if (transportFactory is None and options.transport == "loopback"):
+            transportFactory = SSAPEndpointFactory.buildTransportFactory("loopback")
+        connections = [_LoaderConnection(options, self, transportFactory) for _i in range(options.connections)]
+        start = monotonic()
+        try:
+            for connection in connections:
+                if (not connection.join(options.timeout)):
+                    raise RuntimeError("Couldn't join the SIB")
+            self.__load(connections)
+        finally:
+            for connection in connections:
+                connection.leave()
+        completed = self.__error is None
+        self.__checkpoint.save(self.__offset, self.__records, completed)
+        elapsed = monotonic() - start
+        insertedRecords = self.__records - initialRecords
+        return {"file" : options.file, "ontology" : options.ontology, "records" : insertedRecords,
+                "totalRecords" : self.__records, "invalidRecords" : self.__invalidRecords, "batches" : self.__batches,
+                "offset" : self.__offset, "duration" : round(elapsed, 3),
+                "throughput" : round(insertedRecords / elapsed, 1) if elapsed > 0 else None, "error" : self.__error}
+
+    def _onBatchResponse(self, batch, ok, error):
+        '''
+        Processes the response of a BULK request. This method is invoked from the connection threads.
+        '''
+        with self.__lock:
+            if (ok):
+                self.__outstanding[batch.sequence] = True
+                # The checkpoint advances up to the first unacknowledged batch
+                while (self.__outstanding):
+                    (sequence, acknowledged) = next(iter(self.__outstanding.items()))
+                    if (not acknowledged):
+                        break
+                    del self.__outstanding[sequence]
+                    acknowledgedBatch = self.__batchesBySequence.pop(sequence)
+                    self.__offset = acknowledgedBatch.endOffset
+                    self.__records = self.__records + acknowledgedBatch.recordCount
+            elif (batch.attempts <= self.__options.retries):
+                self.__retries.append(batch)
+            elif (self.__error is None):
+                self.__error = "A BULK request failed {0} times: {1}".format(batch.attempts, error)
+
+    def __load(self, connections):
+        options = self.__options
+        lastCheckpoint = monotonic()
+        nextConnection = 0
+        records = readRecords(options.file, options.format, self.__offset, options.chunk_size, options.delimiter)
+        for batch in self.__buildBatches(records):
+            deadline = monotonic() + options.timeout
+            while (True):
+                self.__resendFailedBatches(connections)
+                if (not self.__error is None):
+                    return
+                connection = connections[nextConnection % len(connections)]
+                nextConnection = nextConnection + 1
+                if (connection.trySend(batch, self.__mapping.getTemplate(), 0.1 / len(connections))):
+                    break
+                if (monotonic() > deadline):
+                    self.__error = "Timed out waiting for {0} BULK responses".format(len(self.__outstanding) - 1)
+                    return
+            if (monotonic() - lastCheckpoint >= options.checkpoint_interval):
+                lastCheckpoint = monotonic()
+                self.__saveProgress()
+        # Wait for the last responses
+        deadline = monotonic() + options.timeout
+        while (self.__outstanding and self.__error is None):
+            if (monotonic() > deadline):
+                self.__error = "Timed out waiting for {0} BULK responses".format(len(self.__outstanding))
+                return
+            if (not self.__resendFailedBatches(connections)):
+                sleep(0.01)
+
+    def __buildBatches(self, records):
+        '''
+        Groups the records in batches and registers them as unacknowledged.
+        '''
+        options = self.__options
+        batchRecords = []
+        batchStart = endOffset = self.__offset
+        sequence = 0
+        for (record, offset) in records:
+            if (record is None):
+                self.__onInvalidRecord("Couldn't parse the record that ends at byte {0}".format(offset))
+                if (not self.__error is None):
+                    return
+            else:
+                batchRecords.append(record)
+            endOffset = offset
+            if (len(batchRecords) >= options.batch_size):
+                batch = self.__buildBatch(sequence, batchRecords, endOffset)
+                if (not self.__error is None):
+                    return
+                if (not batch is None):
+                    yield batch
+                sequence = sequence + 1
+                batchRecords = []
+                batchStart = endOffset
+        if (batchRecords):
+            batch = self.__buildBatch(sequence, batchRecords, endOffset)
+            if (not batch is None):
+                yield batch
+        elif (endOffset != batchStart):
+            # The last records were invalid
+            self.__acknowledgeEmptyBatch(sequence, endOffset)
+
+    def __buildBatch(self, sequence, records, endOffset):
+        try:
+            columns = self.__mapping.buildColumns(records)
+        except (ValueError, TypeError) as e:
+            # A record cannot be converted. We'll look for it.
+            validRecords = []
+            for record in records:
+                try:
+                    self.__mapping.buildColumns([record])
+                    validRecords.append(record)
+                except (ValueError, TypeError) as recordError:
+                    self.__onInvalidRecord("Couldn't convert a record before byte {0}: {1}".format(endOffset, recordError))
+                    if (not self.__error is None):
+                        return None
+            if (not validRecords):
+                self.__acknowledgeEmptyBatch(sequence, endOffset)
+                return None
+            records = validRecords
+            columns = self.__mapping.buildColumns(records)
+        batch = _Batch(sequence, columns, len(records), endOffset)
+        with self.__lock:
+            self.__outstanding[sequence] = False
+            self.__batchesBySequence[sequence] = batch
+        self.__batches = self.__batches + 1
+        return batch
+
+    def __acknowledgeEmptyBatch(self, sequence, endOffset):
+        batch = _Batch(sequence, {}, 0, endOffset)
+        with self.__lock:
+            self.__outstanding[sequence] = False
+            self.__batchesBySequence[sequence] = batch
+        self._onBatchResponse(batch, True, None)
+
+    def __onInvalidRecord(self, reason):
+        self.__invalidRecords = self.__invalidRecords + 1
+        if (not self.__options.skip_invalid):
+            self.__error = reason + ". Use --skip-invalid to skip it"
+        elif (not self.__options.quiet):
+            sys.stderr.write("Skipped: {0}\n".format(reason))
+
+    def __resendFailedBatches(self, connections):
+        '''
+        Sends the failed batches again. Returns False if there were no failed batches.
+        '''
+        if (not self.__retries):
+            return False
+        deadline = monotonic() + self.__options.timeout
+        while (self.__retries and self.__error is None):
+            batch = self.__retries[0]
+            for connection in connections:
+                if (connection.trySend(batch, self.__mapping.getTemplate(), 0.01)):
+                    self.__retries.popleft()
+                    break
+            if (monotonic() > deadline):
+                self.__error = "Timed out waiting for {0} BULK responses".format(len(self.__outstanding))
+        return True
+
+    def __saveProgress(self):
+        with self.__lock:
+            (offset, records) = (self.__offset, self.__records)
+        self.__checkpoint.save(offset, records)
+        if (not self.__options.quiet):
+            sys.stderr.write("{0} records inserted ({1} bytes)\n".format(records, offset))
+
+def parseMapping(value):
+    '''
+    Parses the --mapping option: a JSON object or "@" followed by the path of a JSON file.
+    '''
+    if (value.startswith("@")):
+        with io.open(value[1:], "r", encoding="utf-8") as mappingFile:
+            return json.load(mappingFile)
+    return json.loads(value)
+
+def buildArgumentParser():
+    parser = argparse.ArgumentParser(prog="python -m ssap.load", description="Loads a JSONL or CSV file into an ontology")
+    parser.add_argument("file", help="the JSONL or CSV file")
+    parser.add_argument("--url", required=True, help="the SIB websocket URL. loopback:// uses an in-process SIB stand-in")
+    parser.add_argument("--transport", default=None, help="the transport name (ws4py, native...). By default, ws4py "
+                        "or loopback, depending on the URL")
+    parser.add_argument("--token", required=True, help="the token used to join the SIB")
+    parser.add_argument("--instance", required=True, help="the KP instance")
+    parser.add_argument("--ontology", required=True, help="the target ontology")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default=None, help="the file format. By default, it "
+                        "depends on the file extension")
+    parser.add_argument("--mapping", default=None, help="the field mapping: a JSON object or @<path of a JSON file>. "
+                        "By default, the records are inserted as they are")
+    parser.add_argument("--delimiter", default=",", help="the delimiter of the CSV fields")
+    parser.add_argument("--batch-size", type=int, default=500, help="the records of each BULK request")
+    parser.add_argument("--connections", type=int, default=4, help="the number of parallel connections")
+    parser.add_argument("--pipeline", type=int, default=2, help="the unanswered BULK requests per connection")
+    parser.add_argument("--retries", type=int, default=3, help="the number of times that a failed BULK request is sent again")
+    parser.add_argument("--checkpoint", default=None, help="the checkpoint file (default: <file>.checkpoint)")
+    parser.add_argument("--checkpoint-interval", type=float, default=5.0, help="the seconds between two checkpoints")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and load the whole file")
+    parser.add_argument("--skip-invalid", action="store_true", help="skip the records that cannot be parsed or converted")
+    parser.add_argument("--chunk-size", type=int, default=4 * 1024 * 1024, help="the size of the read buffer in bytes")
+    parser.add_argument("--timeout", type=float, default=60.0, help="the JOIN and BULK response timeout in seconds")
+    parser.add_argument("--quiet", action="store_true", help="do not report the progress")
+    return parser
+
+def main(argv=None):
+    parser = buildArgumentParser()
+    options = parser.parse_args(argv)
+    if (options.format is None):
+        options.format = "csv" if options.file.lower().endswith((".csv", ".tsv")) else "jsonl"
+    if (options.transport is None):
+        options.transport = "loopback" if options.url.startswith("loopback:") else "ws4py"
+    if (options.checkpoint is None):
+        options.checkpoint = options.file + ".checkpoint"
+    options.batch_size = max(1, options.batch_size)
+    options.connections = max(1, options.connections)
+    options.pipeline = max(1, options.pipeline)
+    try:
+        options.mapping = "$" + WHOLE_RECORD if options.mapping is None else parseMapping(options.mapping)
+        loader = FileLoader(options)
+    except (IOError, ValueError) as e:
+        parser.error(str(e))
+    try:
+        results = loader.run()
+    except (IOError, ValueError, RuntimeError) as e:
+        sys.stderr.write("Error: {0}\n".format(e))
+        return 1
+    print("{0} records inserted into {1} in {2} s ({3} records/s), {4} invalid records".format(
+        results["records"], results["ontology"], results["duration"], results["throughput"], results["invalidRecords"]))
+    if (not results["error"] is None):
+        sys.stderr.write("Error: {0}. The load can be resumed from byte {1}\n".format(results["error"], results["offset"]))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
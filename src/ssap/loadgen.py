@@ -0,0 +1,451 @@
+# -*- coding: utf8 -*-
+'''
+A load generator for end-to-end throughput and latency tests.
+
+It opens several SSAP connections, sends a weighted mix of JOIN, INSERT, UPDATE, QUERY and
+SUBSCRIBE requests during a fixed time, and reports the throughput and the latency percentiles
+of each operation, along with the latency between an INSERT and the INDICATION that it
+generates.
+
+Usage: python -m ssap.loadgen --url ws://sofia2.com/sib/api_websocket --token TOKEN --instance KP:INSTANCE
+       python -m ssap.loadgen --url loopback:// (the in-process SIB stand-in)
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import argparse
+import json
+import random
+import sys
+from array import array
+from collections import deque
+from threading import Event, Lock, Semaphore, Thread
+from time import monotonic, sleep, time
+from ssap.core import BasicSSAPCallback, SSAP_MESSAGE_TYPE, SSAP_QUERY_TYPE
+from ssap.factories import SSAPEndpointFactory
+from ssap.utils.timestamps import toEpochSeconds, toExtendedJsonDate
+from ssap.utils.flowcontrol import AIMDFlowController
+
+OPERATIONS = ("join", "insert", "update", "query", "subscribe")
+
+DEFAULT_MIX = "insert=60,query=20,update=10,subscribe=5,join=5"
+
+_RESPONSE_OPERATIONS = {SSAP_MESSAGE_TYPE.JOIN : "join", SSAP_MESSAGE_TYPE.INSERT : "insert",
+                        SSAP_MESSAGE_TYPE.UPDATE : "update", SSAP_MESSAGE_TYPE.QUERY : "query",
+                        SSAP_MESSAGE_TYPE.SUBSCRIBE : "subscribe", SSAP_MESSAGE_TYPE.UNSUBSCRIBE : "unsubscribe"}
+
+def parseMix(mix):
+    '''
+    Parses a traffic mix (e.g. "insert=60,query=40"). Returns a list of (operation, weight) tuples.
+
+    Keyword arguments:
+    mix    -- the traffic mix.
+    '''
+    weights = []
+    for item in mix.split(","):
+        (operation, _separator, weight) = item.strip().partition("=")
+        operation = operation.strip().lower()
+        if (not operation in OPERATIONS):
+            raise ValueError("Unknown operation in the traffic mix: {0}".format(operation))
+        weight = float(weight or 1)
+        if (weight > 0):
+            weights.append((operation, weight))
+    if (not weights):
+        raise ValueError("The traffic mix is empty")
+    return weights
+
+def percentile(sortedValues, fraction):
+    '''
+    Returns a percentile of a sorted sequence (nearest-rank method), or None if it is empty.
+    '''
+    if (not sortedValues):
+        return None
+    index = min(len(sortedValues) - 1, max(0, int(round(fraction * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[index]
+
+class LatencyRecorder(object):
+    '''
+    Stores the latencies and the errors of each operation.
+    '''
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__latencies = {}
+        self.__errors = {}
+
+    def record(self, operation, latency, ok=True):
+        '''
+        Records a completed operation.
+
+        Keyword arguments:
+        operation    -- the name of the operation.
+        latency      -- its latency (in seconds).
+        ok           -- False if the SIB reported an error.
+        '''
+        with self.__lock:
+            latencies = self.__latencies.get(operation)
+            if (latencies is None):
+                latencies = self.__latencies[operation] = array("d")
+                self.__errors[operation] = 0
+            latencies.append(latency)
+            if (not ok):
+                self.__errors[operation] = self.__errors[operation] + 1
+
+    def summarize(self, elapsed):
+        '''
+        Returns a dictionary with the statistics of each operation.
+
+        Keyword arguments:
+        elapsed    -- the duration of the test (in seconds).
+        '''
+        with self.__lock:
+            operations = dict((operation, sorted(latencies)) for (operation, latencies) in self.__latencies.items())
+            errors = dict(self.__errors)
+        summary = {}
+        for (operation, latencies) in operations.items():
+            summary[operation] = LatencyRecorder.__summarize(latencies, errors[operation], elapsed)
+        allLatencies = sorted(latency for latencies in operations.values() for latency in latencies)
+        summary["total"] = LatencyRecorder.__summarize(allLatencies, sum(errors.values()), elapsed)
+        return summary
+
+    @staticmethod
+    def __summarize(sortedLatencies, errors, elapsed):
+        def toMilliseconds(value):
+            if (value is None):
+                return None
+            return round(value * 1000, 3)
+        return {"count" : len(sortedLatencies), "errors" : errors,
+                "throughput" : round(len(sortedLatencies) / elapsed, 1) if elapsed > 0 else None,
+                "p50" : toMilliseconds(percentile(sortedLatencies, 0.50)),
+                "p95" : toMilliseconds(percentile(sortedLatencies, 0.95)),
+                "p99" : toMilliseconds(percentile(sortedLatencies, 0.99)),
+                "max" : toMilliseconds(sortedLatencies[-1] if sortedLatencies else None)}
+
+def _buildEndpoint(options, callback, transportFactory, flowController=None):
+    '''
+    Builds an endpoint. If transportFactory is not None, it will be used instead of the transport
+    selected in the command line (i.e. to share a loopback SIB between all the connections).
+    '''
+    if (transportFactory is None):
+        return SSAPEndpointFactory.buildEndpoint(options.url, callback, options.transport, flowController=flowController)
+    return SSAPEndpointFactory.buildWebsocketBasedSSAPEndpoint(options.url, callback, False, flowController, transportFactory)
+
+class _LoadGeneratorConnection(BasicSSAPCallback):
+    '''
+    A SSAP connection that sends requests in a closed loop: a new request is sent as soon as one
+    of the unanswered requests is answered.
+    '''
+
+    def __init__(self, options, connectionId, recorder, transportFactory):
+        self.__options = options
+        self.__connectionId = connectionId
+        self.__recorder = recorder
+        self.__random = random.Random(connectionId)
+        self.__operations = [operation for (operation, _weight) in options.mix]
+        self.__weights = [weight for (_operation, weight) in options.mix]
+        self.__permits = Semaphore(options.pipeline)
+        self.__pending = dict((operation, deque()) for operation in _RESPONSE_OPERATIONS.values())
+        self.__unanswered = 0
+        self.__pendingLock = Lock()
+        self.__subscriptionsToCancel = deque()
+        self.__joined = Event()
+        self.__joinOk = False
+        self.__sequence = 0
+        self.__padding = "x" * options.payload_size
+        flowController = None
+        if (options.pipeline > 1):
+            flowController = AIMDFlowController(maxInFlight=options.pipeline)
+        self.__endpoint = _buildEndpoint(options, self, transportFactory, flowController)
+
+    def join(self, timeout):
+        '''
+        Joins the SIB. Returns True if the JOIN request succeeded.
+        '''
+        self.__permits.acquire()
+        self.__send("join", lambda: self.__endpoint.joinWithToken(self.__options.token, self.__options.instance))
+        self.__joined.wait(timeout)
+        return self.__joinOk
+
+    def run(self, deadline):
+        '''
+        Sends requests until the deadline.
+        '''
+        while (monotonic() < deadline):
+            if (not self.__permits.acquire(timeout=0.1)):
+                continue
+            if (self.__subscriptionsToCancel):
+                subscriptionId = self.__subscriptionsToCancel.popleft()
+                self.__send("unsubscribe", lambda: self.__endpoint.unsubscribe(subscriptionId))
+                continue
+            operation = self.__random.choices(self.__operations, self.__weights)[0]
+            self.__sendOperation(operation)
+
+    def drain(self, timeout):
+        '''
+        Cancels the remaining subscriptions and waits for the unanswered requests.
+        '''
+        deadline = monotonic() + timeout
+        while (monotonic() < deadline and (self.__unanswered > 0 or self.__subscriptionsToCancel)):
+            if (self.__subscriptionsToCancel and self.__permits.acquire(timeout=0.1)):
+                subscriptionId = self.__subscriptionsToCancel.popleft()
+                self.__send("unsubscribe", lambda: self.__endpoint.unsubscribe(subscriptionId))
+            else:
+                sleep(0.01)
+
+    def leave(self):
+        try:
+            self.__endpoint.leave()
+        except Exception:
+            pass
+
+    def buildInstance(self):
+        '''
+        Builds an instance with the shape of the Sensor fixture of the tests. The timestamp is the
+        send time, so that the INDICATION latency can be computed.
+        '''
+        self.__sequence = self.__sequence + 1
+        sensor = {"geometry" : {"coordinates" : [40.512967 + self.__random.uniform(-0.05, 0.05),
+                                                 -3.67495 + self.__random.uniform(-0.05, 0.05)], "type" : "Point"},
+                  "assetId" : "{0}{1}-{2}".format(self.__options.asset_prefix, self.__connectionId, self.__sequence % 100),
+                  "measure" : self.__random.randint(0, 40),
+                  "timestamp" : toExtendedJsonDate(time())}
+        if (self.__padding):
+            sensor["payload"] = self.__padding
+        return {"Sensor" : sensor}
+
+    def __sendOperation(self, operation):
+        options = self.__options
+        endpoint = self.__endpoint
+        if (operation == "join"):
+            self.__send(operation, endpoint.renovateSessionKey)
+        elif (operation == "insert"):
+            instance = self.buildInstance()
+            self.__send(operation, lambda: endpoint.insert(options.ontology, instance))
+        elif (operation == "update"):
+            data = json.dumps(self.buildInstance())
+            self.__send(operation, lambda: endpoint.update(options.ontology, "", data))
+        elif (operation == "query"):
+            self.__send(operation, lambda: endpoint.query(options.ontology, options.query, SSAP_QUERY_TYPE.NATIVE))
+        elif (operation == "subscribe"):
+            self.__send(operation, lambda: endpoint.subscribe(options.ontology, options.subscription_query,
+                                                             SSAP_QUERY_TYPE.NATIVE, options.refresh))
+
+    def __send(self, operation, function):
+        # The responses of each message type arrive in the same order as their requests
+        with self.__pendingLock:
+            self.__pending[operation].append(monotonic())
+            self.__unanswered = self.__unanswered + 1
+            try:
+                function()
+            except Exception:
+                self.__pending[operation].pop()
+                self.__unanswered = self.__unanswered - 1
+                self.__permits.release()
+                raise
+
+    def onSSAPMessageReceived(self, message):
+        # Do not call this method from client code!!!
+        operation = _RESPONSE_OPERATIONS.get(message["messageType"])
+        if (operation is None):
+            return
+        now = monotonic()
+        with self.__pendingLock:
+            pending = self.__pending[operation]
+            if (not pending):
+                return
+            sendTime = pending.popleft()
+            self.__unanswered = self.__unanswered - 1
+        ok = bool(message["body"].get("ok"))
+        if (operation == "join" and not self.__joined.is_set()):
+            self.__joinOk = ok
+            self.__joined.set()
+        else:
+            self.__recorder.record(operation, now - sendTime, ok)
+        if (operation == "subscribe" and ok):
+            self.__subscriptionsToCancel.append(message["body"]["data"])
+        self.__permits.release()
+
+class _IndicationLatencyProbe(BasicSSAPCallback):
+    '''
+    Subscribes to the target ontology and measures the time between the INSERT and UPDATE requests
+    of the load generator and the INDICATION messages that they produce.
+    '''
+
+    def __init__(self, options, recorder, transportFactory):
+        self.__options = options
+        self.__recorder = recorder
+        self.__ready = Event()
+        self.__unsubscribed = Event()
+        self.__subscriptionId = None
+        self.__endpoint = _buildEndpoint(options, self, transportFactory)
+
+    def start(self, timeout):
+        self.__endpoint.joinWithToken(self.__options.token, self.__options.instance)
+        self.__endpoint.subscribe(self.__options.ontology, self.__options.subscription_query, SSAP_QUERY_TYPE.NATIVE,
+                                  self.__options.refresh)
+        return self.__ready.wait(timeout) and not self.__subscriptionId is None
+
+    def stop(self, timeout):
+        try:
+            if (not self.__subscriptionId is None):
+                self.__endpoint.unsubscribe(self.__subscriptionId)
+                self.__unsubscribed.wait(timeout)
+            self.__endpoint.leave()
+        except Exception:
+            pass
+
+    def onSSAPMessageReceived(self, message):
+        # Do not call this method from client code!!!
+        if (message["messageType"] == SSAP_MESSAGE_TYPE.SUBSCRIBE):
+            if (message["body"].get("ok")):
+                self.__subscriptionId = message["body"]["data"]
+            self.__ready.set()
+            return
+        if (message["messageType"] == SSAP_MESSAGE_TYPE.UNSUBSCRIBE):
+            self.__unsubscribed.set()
+            return
+        if (message["messageType"] == SSAP_MESSAGE_TYPE.JOIN and not message["body"].get("ok")):
+            self.__ready.set()
+            return
+        if (message["messageType"] != SSAP_MESSAGE_TYPE.INDICATION):
+            return
+        now = time()
+        data = message["body"].get("data")
+        if (not isinstance(data, list)):
+            data = [data]
+        for instance in data:
+            if (not isinstance(instance, dict)):
+                continue
+            sensor = instance.get("Sensor")
+            if (not isinstance(sensor, dict) or not str(sensor.get("assetId", "")).startswith(self.__options.asset_prefix)):
+                continue # The instance was not inserted by the load generator
+            sendTime = toEpochSeconds(sensor.get("timestamp"))
+            if (not sendTime is None):
+                self.__recorder.record("indication", max(0.0, now - sendTime))
+
+def runLoadTest(options):
+    '''
+    Runs a load test. Returns a dictionary with the results.
+
+    Keyword arguments:
+    options    -- the parsed command line options.
+    '''
+    recorder = LatencyRecorder()
+    indicationRecorder = LatencyRecorder()
+    transportFactory = None
+    if (options.transport == "loopback"):
+        # All the connections must share the same in-process SIB
+        transportFactory = SSAPEndpointFactory.buildTransportFactory("loopback")
+    probe = None
+    if (options.indications):
+        probe = _IndicationLatencyProbe(options, indicationRecorder, transportFactory)
+        if (not probe.start(options.timeout)):
+            sys.stderr.write("Warning: the INDICATION latency will not be measured (the subscription failed)\n")
+    connections = [_LoadGeneratorConnection(options, i, recorder, transportFactory) for i in range(options.connections)]
+    for connection in connections:
+        if (not connection.join(options.timeout)):
+            raise RuntimeError("Couldn't join the SIB")
+    start = monotonic()
+    deadline = start + options.duration
+    threads = [Thread(target=connection.run, args=(deadline,), name="SSAPLoadGenerator-{0}".format(i))
+               for (i, connection) in enumerate(connections)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for connection in connections:
+        connection.drain(options.timeout)
+    elapsed = monotonic() - start
+    sleep(min(1.0, options.refresh / 1000.0)) # The last INDICATION messages might still be on their way
+    for connection in connections:
+        connection.leave()
+    if (not probe is None):
+        probe.stop(options.timeout)
+    indications = indicationRecorder.summarize(elapsed).get("indication")
+    return {"url" : options.url, "transport" : options.transport, "connections" : options.connections,
+            "pipeline" : options.pipeline, "duration" : round(elapsed, 3), "mix" : dict(options.mix),
+            "payloadSize" : options.payload_size, "operations" : recorder.summarize(elapsed),
+            "insertToIndication" : indications}
+
+def formatReport(results):
+    '''
+    Formats the results of a load test as a text table.
+    '''
+    lines = ["SSAP load test against {0} ({1} transport)".format(results["url"], results["transport"]),
+             "{0} connections, {1} unanswered requests per connection, {2} s".format(results["connections"],
+                                                                                      results["pipeline"], results["duration"]),
+             ""]
+    header = "{0:<20}{1:>10}{2:>8}{3:>11}{4:>10}{5:>10}{6:>10}{7:>10}"
+    lines.append(header.format("operation", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    def row(name, stats):
+        def cell(value):
+            return "-" if value is None else value
+        return header.format(name, stats["count"], stats["errors"], cell(stats["throughput"]), cell(stats["p50"]),
+                             cell(stats["p95"]), cell(stats["p99"]), cell(stats["max"]))
+    operations = results["operations"]
+    for name in sorted(operation for operation in operations if operation != "total"):
+        lines.append(row(name, operations[name]))
+    lines.append(row("total", operations["total"]))
+    if (not results["insertToIndication"] is None):
+        lines.append(row("insert->INDICATION", results["insertToIndication"]))
+    return "\n".join(lines)
+
+def buildArgumentParser():
+    parser = argparse.ArgumentParser(prog="python -m ssap.loadgen", description="SSAP load generator")
+    parser.add_argument("--url", default="loopback://", help="the SIB websocket URL. loopback:// uses an in-process SIB stand-in")
+    parser.add_argument("--transport", default=None, help="the transport name (ws4py, native...). By default, ws4py "
+                        "or loopback, depending on the URL")
+    parser.add_argument("--token", default="loadgen", help="the token used to join the SIB")
+    parser.add_argument("--instance", default="KPLoadGenerator:KPLoadGenerator01", help="the KP instance")
+    parser.add_argument("--ontology", default="TestSensorTemperatura", help="the target ontology")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="the weighted traffic mix (default: %(default)s)")
+    parser.add_argument("--connections", type=int, default=4, help="the number of concurrent connections")
+    parser.add_argument("--pipeline", type=int, default=1, help="the unanswered requests per connection")
+    parser.add_argument("--duration", type=float, default=10.0, help="the test duration in seconds")
+    parser.add_argument("--payload-size", type=int, default=0, help="the size of an extra Sensor.payload string "
+                        "field. The ontology schema must accept it")
+    parser.add_argument("--query", default=None, help="the native QUERY (default: db.<ontology>.find().limit(10))")
+    parser.add_argument("--subscription-query", default=None, help="the native SUBSCRIBE query (default: db.<ontology>.find())")
+    parser.add_argument("--refresh", type=int, default=100, help="the refresh time of the subscriptions in milliseconds")
+    parser.add_argument("--no-indications", dest="indications", action="store_false",
+                        help="do not measure the insert-to-INDICATION latency")
+    parser.add_argument("--asset-prefix", default="LOADGEN-", help="the assetId prefix of the generated instances")
+    parser.add_argument("--timeout", type=float, default=30.0, help="the JOIN and drain timeout in seconds")
+    parser.add_argument("--format", choices=("text", "json"), default="text", help="the report format")
+    parser.add_argument("--output", default=None, help="writes the report to this file instead of the standard output")
+    return parser
+
+def main(argv=None):
+    parser = buildArgumentParser()
+    options = parser.parse_args(argv)
+    try:
+        options.mix = parseMix(options.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if (options.transport is None):
+        options.transport = "loopback" if options.url.startswith("loopback:") else "ws4py"
+    if (options.query is None):
+        options.query = "db.{0}.find().limit(10)".format(options.ontology)
+    if (options.subscription_query is None):
+        options.subscription_query = "db.{0}.find()".format(options.ontology)
+    options.pipeline = max(1, options.pipeline)
+    results = runLoadTest(options)
+    if (options.format == "json"):
+        report = json.dumps(results, indent=2, sort_keys=True)
+    else:
+        report = formatReport(results)
+    if (options.output is None):
+        print(report)
+    else:
+        with open(options.output, "w") as output:
+            output.write(report + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
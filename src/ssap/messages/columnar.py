@@ -0,0 +1,174 @@
+# -*- coding: utf8 -*-
+'''
+Serialization of columnar data into SSAP BULK messages.
+
+The rows are never converted into dictionaries. The document template is serialized once and
+split into constant fragments, every column is serialized in a single pass (using NumPy when the
+column is an array) and the rows are assembled by joining the fragments and the serialized
+values.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import json
+from ssap.core import SSAP_MESSAGE_TYPE, SSAP_MESSAGE_DIRECTION, SSAP_QUERY_TYPE
+from ssap.exceptions import InvalidSSAPOperation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# json.dumps() builds a new encoder whenever it receives formatting options, so we reuse this one
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+class ColumnarBulkEncoder(object):
+    '''
+    Serializes the rows of a set of columns into BULK messages with INSERT operations.
+
+    The template is an ontology instance whose string values can reference a column with the
+    "$<column name>" syntax, i.e.
+
+        {"Sensor" : {"assetId" : "$assetId", "measure" : "$measure", "timestamp" : {"$date" : "$timestamp"},
+                     "geometry" : {"type" : "Point", "coordinates" : ["$latitude", "$longitude"]}}}
+
+    The strings that do not name a column are copied as they are. The columns can be lists or
+    NumPy arrays. The datetime64 arrays are serialized as ISO 8601 strings with millisecond
+    precision, the two-dimensional arrays as JSON arrays and the NaN values as null.
+    '''
+
+    __marker = "\u0001"
+
+    def __init__(self, ontology, template, columns):
+        '''
+        Serializes the columns. The messages are built by encode().
+
+        Keyword arguments:
+        ontology    -- the target ontology of the INSERT operations.
+        template    -- the ontology instance that defines the shape of the rows.
+        columns     -- a dictionary that maps the column names to the columns.
+        '''
+        self.__ontology = ontology
+        names = []
+        markedTemplate = self.__markReferences(template, columns, names)
+        if (len(names) == 0):
+            raise InvalidSSAPOperation("The template does not reference any column")
+        lengths = set(len(columns[name]) for name in names)
+        if (len(lengths) != 1):
+            raise InvalidSSAPOperation("All the columns must have the same length")
+        self.__rowCount = lengths.pop()
+        # The BULK items are serialized like _SSAPMessageFactory.buildBulkMessage() does
+        item = {"type" : SSAP_MESSAGE_TYPE.toString(SSAP_MESSAGE_TYPE.INSERT), "ontology" : ontology,
+                "body" : {"data" : markedTemplate, "query" : None,
+                          "queryType" : SSAP_QUERY_TYPE.toString(SSAP_QUERY_TYPE.NATIVE)}}
+        serializedMarker = json.dumps(ColumnarBulkEncoder.__marker)[1:-1]
+        pieces = _encoder.encode(item).split("\"" + serializedMarker)
+        fragments = [pieces[0]]
+        references = []
+        for piece in pieces[1:]:
+            (index, fragment) = piece.split(serializedMarker + "\"", 1)
+            references.append(int(index))
+            fragments.append(fragment)
+        self.__format = "%s".join(fragment.replace("%", "%%") for fragment in fragments)
+        serializedColumns = {}
+        for name in names:
+            if (not name in serializedColumns):
+                serializedColumns[name] = _serializeColumn(columns[name])
+        self.__values = [serializedColumns[names[index]] for index in references]
+
+    def getRowCount(self):
+        '''
+        Returns the number of rows of the columns.
+        '''
+        return self.__rowCount
+
+    def encode(self, rowsPerMessage=1000):
+        '''
+        Returns a generator that yields the BULK messages. Their session key is set when they are rendered.
+
+        Keyword arguments:
+        rowsPerMessage    -- the maximum number of INSERT operations of each BULK message.
+        '''
+        if (rowsPerMessage <= 0):
+            raise InvalidSSAPOperation("The number of rows per message must be positive")
+        rowFormat = self.__format
+        for start in range(0, self.__rowCount, rowsPerMessage):
+            end = min(start + rowsPerMessage, self.__rowCount)
+            items = [rowFormat % values for values in zip(*[column[start:end] for column in self.__values])]
+            yield _SerializedBulkMessage(self.__ontology, "[" + ",".join(items) + "]")
+
+    def __markReferences(self, value, columns, names):
+        '''
+        Returns a copy of the template whose column references have been replaced by markers.
+        '''
+        if (isinstance(value, dict)):
+            return dict((key, self.__markReferences(item, columns, names)) for (key, item) in value.items())
+        if (isinstance(value, (list, tuple))):
+            return [self.__markReferences(item, columns, names) for item in value]
+        if (isinstance(value, str) and value.startswith("$") and value[1:] in columns):
+            names.append(value[1:])
+            return ColumnarBulkEncoder.__marker + str(len(names) - 1) + ColumnarBulkEncoder.__marker
+        return value
+
+class _SerializedBulkMessage(object):
+    '''
+    A serialized BULK message whose session key is set when it is rendered. It can be sent as a
+    message template.
+    '''
+
+    __slots__ = ("__prefix", "__suffix")
+
+    def __init__(self, ontology, serializedBody):
+        prefix = "{\"body\":" + serializedBody + ",\"direction\":" + \
+            json.dumps(SSAP_MESSAGE_DIRECTION.toString(SSAP_MESSAGE_DIRECTION.REQUEST)) + \
+            ",\"messageType\":" + json.dumps(SSAP_MESSAGE_TYPE.toString(SSAP_MESSAGE_TYPE.BULK)) + \
+            ",\"ontology\":" + json.dumps(ontology) + ",\"sessionKey\":"
+        self.__prefix = prefix
+        self.__suffix = "}"
+
+    def render(self, sessionKey):
+        '''
+        Returns the serialized message with the given session key.
+        '''
+        return self.__prefix + json.dumps(sessionKey) + self.__suffix
+
+def _serializeColumn(column):
+    '''
+    Returns a list with the serialized values of a column.
+    '''
+    if (not numpy is None and isinstance(column, numpy.ndarray)):
+        return _serializeArray(column)
+    return list(map(_encoder.encode, column))
+
+def _serializeArray(array):
+    '''
+    Returns a list with the serialized values of a NumPy array. The rows of the two-dimensional
+    arrays are serialized as JSON arrays.
+    '''
+    if (array.ndim == 2):
+        columns = [_serializeArray(array[:, index]) for index in range(array.shape[1])]
+        rowFormat = "[" + ",".join(["%s"] * len(columns)) + "]"
+        return [rowFormat % values for values in zip(*columns)]
+    if (array.ndim != 1):
+        raise InvalidSSAPOperation("Only one and two-dimensional arrays can be serialized")
+    kind = array.dtype.kind
+    if (kind == "M"):
+        values = numpy.char.add(numpy.char.add("\"", numpy.datetime_as_string(array, unit="ms")), "Z\"").tolist()
+        return _replaceWithNull(values, numpy.isnat(array))
+    if (kind == "b"):
+        return numpy.where(array, "true", "false").tolist()
+    if (kind in "iu"):
+        return list(map(int.__repr__, array.tolist()))
+    if (kind == "f"):
+        return _replaceWithNull(list(map(float.__repr__, array.tolist())), ~numpy.isfinite(array))
+    return list(map(_encoder.encode, array.tolist()))
+
+def _replaceWithNull(values, mask):
+    for index in numpy.flatnonzero(mask).tolist():
+        values[index] = "null"
+    return values
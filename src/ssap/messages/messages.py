@@ -11,7 +11,9 @@ This module is part of the Python SSAP API, version 1.5
 '''
  
 import json
+import re
 import six
+import sys
 from ssap.utils.logs import LogFactory
 from ssap.utils.strings import bytes2String
 from ssap.core import SSAP_QUERY_TYPE, SSAP_MESSAGE_DIRECTION, SSAP_MESSAGE_TYPE, \
@@ -65,6 +67,181 @@ class SSAPBulkRequest(object):
         '''
         return self.__messages  
 
+class FrozenDict(dict):
+    '''
+    A read-only dictionary. It can be shared by several SSAP message handlers without copying it.
+    '''
+    __slots__ = ()
+    
+    def __readOnly(self, *args, **kwargs):
+        raise TypeError("SSAP message bodies are read-only. Use dict() to get a mutable copy.")
+    
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = __readOnly
+    
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+    
+class FrozenList(list):
+    '''
+    A read-only list. It can be shared by several SSAP message handlers without copying it.
+    '''
+    __slots__ = ()
+    
+    def __readOnly(self, *args, **kwargs):
+        raise TypeError("SSAP message bodies are read-only. Use list() to get a mutable copy.")
+    
+    __setitem__ = __delitem__ = append = extend = insert = pop = remove = clear = sort = reverse = \
+        __iadd__ = __imul__ = __readOnly
+    
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+    
+class SSAPMessage(object):
+    '''
+    A compact and immutable representation of a parsed SSAP message. The envelope fields are stored
+    in slots, the ontology name and the body keys are interned, and the body is a read-only view.
+    
+    The messages can be read like the dictionaries that the parser generates by default (e.g.
+    message["body"]["ok"]), so they can be handed to all the callbacks without defensive copies.
+    '''
+    
+    __slots__ = ("messageType", "direction", "sessionKey", "ontology", "messageId", "body", "_extra")
+    
+    __fields = ("messageType", "direction", "sessionKey", "ontology", "messageId", "body")
+    
+    @staticmethod
+    def fromDict(jsonMessage):
+        '''
+        Converts a parsed SSAP message into a compact one.
+        
+        Keyword arguments:
+        jsonMessage     -- the parsed message (a dictionary).
+        '''
+        message = object.__new__(SSAPMessage)
+        setter = object.__setattr__
+        extra = None
+        for (key, value) in jsonMessage.items():
+            if (key in SSAPMessage.__fields):
+                if (key == "ontology" and isinstance(value, str)):
+                    value = _intern(value)
+                setter(message, key, freeze(value))
+            else:
+                if (extra is None):
+                    extra = {}
+                extra[_intern(key)] = freeze(value)
+        if (not extra is None):
+            extra = FrozenDict(extra)
+        setter(message, "_extra", extra)
+        return message
+        
+    def __setattr__(self, name, value):
+        raise TypeError("SSAP messages are read-only")
+    
+    __delattr__ = __setattr__
+    
+    def __setitem__(self, key, value):
+        raise TypeError("SSAP messages are read-only. Use toDict() to get a mutable copy.")
+    
+    def __getitem__(self, key):
+        if (key in SSAPMessage.__fields):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) # The field is not present in the serialized message
+        if (not self._extra is None and key in self._extra):
+            return self._extra[key]
+        raise KeyError(key)
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+        
+    def __contains__(self, key):
+        if (key in SSAPMessage.__fields):
+            return hasattr(self, key)
+        return not self._extra is None and key in self._extra
+    
+    def keys(self):
+        keys = [key for key in SSAPMessage.__fields if hasattr(self, key)]
+        if (not self._extra is None):
+            keys.extend(self._extra.keys())
+        return keys
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+    
+    def __eq__(self, other):
+        if (isinstance(other, (SSAPMessage, dict))):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+    
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if (result is NotImplemented):
+            return result
+        return not result
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return "SSAPMessage({0})".format(dict(self.items()))
+    
+    def toDict(self):
+        '''
+        Returns a mutable deep copy of the message.
+        '''
+        return dict((key, _thaw(value)) for (key, value) in self.items())
+    
+def freeze(value):
+    '''
+    Returns a read-only copy of a deserialized JSON value. The keys of the dictionaries are interned.
+    
+    Keyword arguments:
+    value    -- the deserialized JSON value.
+    '''
+    valueType = type(value)
+    if (valueType is dict):
+        return FrozenDict({_intern(key) : freeze(item) for (key, item) in value.items()})
+    if (valueType is list):
+        return FrozenList([freeze(item) for item in value])
+    return value
+
+def _thaw(value):
+    if (isinstance(value, dict)):
+        return dict((key, _thaw(item)) for (key, item) in value.items())
+    if (isinstance(value, list)):
+        return [_thaw(item) for item in value]
+    return value
+
+_intern = sys.intern
+
+def _buildFrozenDict(pairs):
+    '''
+    Builds a read-only dictionary while a compact message is being decoded. Its values have already been
+    decoded, so only the lists that they contain must be frozen.
+    
+    Keyword arguments:
+    pairs    -- the decoded (key, value) pairs of a JSON object.
+    '''
+    return FrozenDict([(_intern(key), value if type(value) is not list else _freezeLists(value)) for (key, value) in pairs])
+
+def _freezeLists(value):
+    if (type(value) is list):
+        return FrozenList([_freezeLists(item) for item in value])
+    return value
+
+# The decoder of the compact messages. It builds the read-only structures directly, so the decoded
+# messages are never copied.
+_COMPACT_DECODER = json.JSONDecoder(object_pairs_hook=_buildFrozenDict)
+
 class _SSAPMessageFactory(object):
     '''
     This class contains methods to build SSAP messages.
@@ -97,6 +274,19 @@ class _SSAPMessageFactory(object):
 #         print(json.dumps(jsonObj, sort_keys=True, indent=4, separators=(",", ":")))
         return json.dumps(jsonObj, sort_keys=True, indent=None, separators=(",", ":"))
     
+    @staticmethod
+    def replaceSessionKey(serializedMessage, sessionKey):
+        '''
+        Replaces the session key of a serialized SSAP message.
+        
+        Keyword arguments:
+        serializedMessage    -- the serialized SSAP message.
+        sessionKey           -- the new session key.
+        '''
+        jsonObj = json.loads(serializedMessage)
+        jsonObj["sessionKey"] = sessionKey
+        return _SSAPMessageFactory.__serializeMessage(jsonObj)
+    
     @staticmethod
     def buildBulkMessage(ssapBulkRequest, ontology, sessionKey):
         '''
@@ -226,6 +416,23 @@ class _SSAPMessageFactory(object):
         jsonObj["ontology"] = ontology
         return _SSAPMessageFactory.__serializeMessage(jsonObj)   
     
+    @staticmethod
+    def buildQueryMessageTemplate(ontology, query, queryType):
+        '''
+        Builds a QUERY SSAP message template. Only its parameters and its session key can be changed.
+        
+        Keyword arguments:
+        ontology         -- the target ontology of the QUERY operation.
+        query            -- que query to perform.
+        queryType        -- the type of the query (native, SQL-like, configuration database, historical database).
+        '''
+        jsonObj = _SSAPMessageFactory.__buildMessageStructure(SSAP_MESSAGE_TYPE.QUERY, _SSAPMessageTemplate.placeholder("sessionKey"))
+        jsonObj["body"]["query"] = query
+        jsonObj["body"]["queryParams"] = _SSAPMessageTemplate.placeholder("queryParams")
+        jsonObj["body"]["queryType"] = SSAP_QUERY_TYPE.toString(queryType)
+        jsonObj["ontology"] = ontology
+        return _SSAPMessageTemplate(_SSAPMessageFactory.__serializeMessage(jsonObj))
+    
     @staticmethod
     def buildUpdateMessage(ontology, query, queryType, data, sessionKey, serialize = True):
         '''
@@ -301,6 +508,79 @@ class _SSAPMessageFactory(object):
         jsonObj["body"]["idSuscripcion"] = subscriptionId
         return _SSAPMessageFactory.__serializeMessage(jsonObj) 
     
+class _SSAPMessageTemplate(object):
+    '''
+    A serialized SSAP message with placeholders. The message is serialized only once, and the
+    placeholders are replaced by their serialized values when the template is rendered.
+    '''
+    
+    __marker = "\u0001"
+    
+    # json.dumps() builds a new encoder whenever it receives formatting options, so we reuse this one
+    __encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+    
+    @staticmethod
+    def placeholder(name):
+        '''
+        Returns the value that must be stored in a message field to turn it into a placeholder.
+        
+        Keyword arguments:
+        name    -- the name of the placeholder.
+        '''
+        return _SSAPMessageTemplate.__marker + name + _SSAPMessageTemplate.__marker
+    
+    def __init__(self, serializedMessage):
+        '''
+        Splits a serialized message into its constant fragments and its placeholders.
+        
+        Keyword arguments:
+        serializedMessage    -- the serialized message. Its placeholders must have been built with placeholder().
+        '''
+        serializedMarker = json.dumps(_SSAPMessageTemplate.__marker)[1:-1]
+        pieces = serializedMessage.split("\"" + serializedMarker)
+        self.__fragments = [pieces[0]]
+        self.__placeholders = []
+        for piece in pieces[1:]:
+            (name, fragment) = piece.split(serializedMarker + "\"", 1)
+            self.__placeholders.append(name)
+            self.__fragments.append(fragment)
+            
+    def render(self, **values):
+        '''
+        Returns the serialized message with the given placeholder values.
+        '''
+        fragments = self.__fragments
+        encode = _SSAPMessageTemplate.__encoder.encode
+        parts = [fragments[0]]
+        for (i, name) in enumerate(self.__placeholders):
+            parts.append(encode(values.get(name)))
+            parts.append(fragments[i + 1])
+        return "".join(parts)
+    
+    def bind(self, **values):
+        '''
+        Returns a message that fixes the values of some placeholders. The others will be set
+        when the message is rendered.
+        '''
+        return _BoundSSAPMessageTemplate(self, values)
+    
+class _BoundSSAPMessageTemplate(object):
+    '''
+    A SSAP message template whose values (except the session key) have already been set.
+    '''
+    
+    __slots__ = ("__template", "__values")
+    
+    def __init__(self, template, values):
+        self.__template = template
+        self.__values = values
+        
+    def render(self, sessionKey):
+        '''
+        Returns the serialized message with the given session key.
+        '''
+        return self.__template.render(sessionKey=sessionKey, **self.__values)
+    
 class _SSAPMessageParser(object):
     '''
     A class that parses the SSAP messages received from the SIB. 
@@ -329,18 +609,29 @@ class _SSAPMessageParser(object):
                        "INSERT" : SSAP_MESSAGE_TYPE.INSERT, "UPDATE" : SSAP_MESSAGE_TYPE.UPDATE,
                        "DELETE" : SSAP_MESSAGE_TYPE.DELETE, "QUERY" : SSAP_MESSAGE_TYPE.QUERY,
                        "SUBSCRIBE" : SSAP_MESSAGE_TYPE.SUBSCRIBE, "UNSUBSCRIBE" : SSAP_MESSAGE_TYPE.UNSUBSCRIBE,
-                       "INDICATION" : SSAP_MESSAGE_TYPE.INDICATION, "CONFIG" : SSAP_MESSAGE_TYPE.CONFIG}
+                       "INDICATION" : SSAP_MESSAGE_TYPE.INDICATION, "CONFIG" : SSAP_MESSAGE_TYPE.CONFIG,
+                       "BULK" : SSAP_MESSAGE_TYPE.BULK}
     
     @staticmethod
-    def parse(serializedData):
+    def parse(serializedData, rowHandler=None, compact=False):
         '''
         Parses a serialized JSON message received from the SIB.
         
         Keyword arguments:
         serializedData: a serialized JSON messages
-        '''
-        dataWithoutEscapedQuotes = serializedData.replace(b"\\\\", b"")
-        jsonMessage = json.loads(bytes2String(dataWithoutEscapedQuotes))
+        rowHandler: a SSAPRowHandler. If the message is a successful QUERY response, its rows will be
+                    decoded one by one and passed to the handler, and the data field will be set to None.
+        compact: if True, the message will be returned as a read-only SSAPMessage instead of a dictionary.
+        '''
+        jsonMessage = None
+        if (not rowHandler is None):
+            jsonMessage = _SSAPMessageParser.__parseStreamedQueryResponse(serializedData, rowHandler)
+        streamed = not jsonMessage is None
+        if (not streamed):
+            dataWithoutEscapedQuotes = serializedData.replace(b"\\\\", b"")
+            jsonMessage = _SSAPMessageParser.__loads(dataWithoutEscapedQuotes, compact)
+            if (compact):
+                jsonMessage = dict(jsonMessage) # The envelope is modified below
         
         jsonMessage["messageType"] = _SSAPMessageParser.__message_types[jsonMessage["messageType"]]
         jsonMessage["direction"] = _SSAPMessageParser.__message_directions[jsonMessage["direction"]]
@@ -351,7 +642,11 @@ class _SSAPMessageParser(object):
             if(jsonMessage["messageType"] == SSAP_MESSAGE_TYPE.INDICATION) :
                 jsonMessage["body"] = six.b(jsonMessage["body"]).replace(b"\"[", b"[").replace(b"]\"", b"]")
                 
-            jsonMessage["body"] = json.loads(jsonMessage["body"])
+            jsonMessage["body"] = _SSAPMessageParser.__loads(jsonMessage["body"], compact)
+        
+        if (type(jsonMessage["body"]) is FrozenDict):
+            # The body is modified below. Its values will not be copied again.
+            jsonMessage["body"] = dict(jsonMessage["body"])
         
         if (SSAPEndpoint.hasOkField(jsonMessage) and jsonMessage["body"]["ok"] and 
                 jsonMessage["messageType"] in [SSAP_MESSAGE_TYPE.INSERT, SSAP_MESSAGE_TYPE.UPDATE]) :
@@ -360,9 +655,275 @@ class _SSAPMessageParser(object):
             patched_data = patched_data.replace(b"ObjectId", b"\"ObjectId")
             patched_data = patched_data.replace(b"(\"", b"('")
             patched_data = patched_data.replace(b"\")", b"')\"")           
-            jsonMessage["body"]["data"] = json.loads(bytes2String(patched_data))
+            jsonMessage["body"]["data"] = _SSAPMessageParser.__loads(patched_data, compact)
+            
+        if (not rowHandler is None and not streamed and jsonMessage["messageType"] == SSAP_MESSAGE_TYPE.QUERY and
+                jsonMessage["body"]["ok"]) :
+            _SSAPMessageParser.__streamRows(jsonMessage["body"], rowHandler)
 
         if ("errorCode" in jsonMessage["body"] and not (jsonMessage["body"]["errorCode"] is None)):
             jsonMessage["body"]["errorCode"] = _SSAPMessageParser.__error_codes[jsonMessage["body"]["errorCode"]]
         
+        if (compact):
+            return SSAPMessage.fromDict(jsonMessage)
+        return jsonMessage
+    
+    @staticmethod
+    def __loads(serializedJson, compact):
+        '''
+        Deserializes a JSON document. In compact mode, its objects and arrays are read-only and the keys
+        of its objects are interned.
+        
+        Keyword arguments:
+        serializedJson   -- the serialized JSON document (a string or a bytes object).
+        compact          -- if True, the document will be decoded into FrozenDict and FrozenList objects.
+        '''
+        if (isinstance(serializedJson, bytes)):
+            serializedJson = bytes2String(serializedJson)
+        if (compact):
+            return _COMPACT_DECODER.decode(serializedJson)
+        return json.loads(serializedJson)
+    
+    @staticmethod
+    def __parseStreamedQueryResponse(serializedData, rowHandler):
+        '''
+        Parses a successful QUERY response whose data field is a serialized JSON array, passing its rows
+        to a row handler while the serialized data is being unescaped. Neither the data field nor the
+        result set are ever stored in memory: only the message and a chunk of the data field are.
+        Returns the message without its data field, or None if the message is not a successful QUERY
+        response with a serialized data field.
+        
+        Keyword arguments:
+        serializedData   -- the serialized message (a bytes object).
+        rowHandler       -- the SSAPRowHandler that will process the rows.
+        '''
+        span = _SSAPMessageParser.__findSerializedBodyData(serializedData)
+        if (span is None):
+            return None
+        (start, end) = span
+        envelope = serializedData[:start] + b"null" + serializedData[end:]
+        jsonMessage = json.loads(bytes2String(envelope.replace(b"\\\\", b"")))
+        body = jsonMessage.get("body")
+        if (jsonMessage.get("messageType") != "QUERY" or not isinstance(body, dict) or not body.get("ok")):
+            return None
+        if (end - start > 2):
+            decoder = _SSAPRowDecoder()
+            rows = (row for chunk in _SSAPMessageParser.__unescapeChunks(serializedData, start + 1, end - 1)
+                    for row in decoder.feed(chunk))
+            if (_SSAPMessageParser.__passRows(rows, rowHandler, body) and not decoder.isFinished()):
+                raise ValueError("The QUERY response contains an incomplete JSON array")
         return jsonMessage
+    
+    @staticmethod
+    def __findSerializedBodyData(serializedData):
+        '''
+        Returns the start and the end of the data field of a message body (including its quotes), or
+        None if the message body is not an object or its data field is not a string. The data field is
+        skipped by a regular expression, so it is never copied.
+        '''
+        containers = []
+        key = None
+        isValue = False
+        for match in _JSON_TOKEN.finditer(serializedData):
+            (start, end) = match.span()
+            first = serializedData[start]
+            if (isValue):
+                isValue = False
+                if (len(containers) == 2 and containers[1] == b"\"body\"" and key == b"\"data\""):
+                    if (first == 0x22):
+                        return (start, end)
+                    return None
+            if (first == 0x7B or first == 0x5B): # { or [
+                containers.append(key)
+                key = None
+            elif (first == 0x7D or first == 0x5D): # } or ]
+                containers.pop()
+                if (len(containers) == 0):
+                    return None
+            elif (first == 0x3A): # :
+                isValue = True
+            elif (first == 0x22): # "
+                key = bytes(serializedData[start:end]) if end - start <= _MAX_KEY_LENGTH else None
+        return None
+    
+    @staticmethod
+    def __unescapeChunks(serializedData, start, end):
+        '''
+        Returns a generator that unescapes the contents of a serialized JSON string chunk by chunk. The
+        chunks never end in the middle of an UTF-8 sequence, an escape sequence or a surrogate pair.
+        '''
+        position = start
+        while (position < end):
+            cut = min(position + _ROW_STREAM_CHUNK_SIZE, end)
+            if (cut < end):
+                while (cut > position and (serializedData[cut] & 0xC0) == 0x80):
+                    cut = cut - 1
+                backslash = serializedData.rfind(b"\\", max(position, cut - 6), cut)
+                if (backslash != -1):
+                    cut = backslash
+                if (_HIGH_SURROGATE_ESCAPE.match(serializedData, max(position, cut - 6), cut)):
+                    cut = cut - 6
+                # A chunk can only end before a whole run of backslashes
+                while (cut > position and serializedData[cut - 1] == 0x5C):
+                    cut = cut - 1
+                if (cut == position):
+                    cut = end
+            chunk = serializedData[position:cut].replace(b"\\\\", b"")
+            yield json.loads(bytes2String(b"\"" + chunk + b"\""))
+            position = cut
+    
+    @staticmethod
+    def __streamRows(body, rowHandler):
+        '''
+        Passes the rows of a QUERY response to a row handler, decoding them one by one.
+        
+        Keyword arguments:
+        body         -- the body of the QUERY response.
+        rowHandler   -- the SSAPRowHandler that will process the rows.
+        '''
+        data = body["data"]
+        body["data"] = None
+        if (data is None):
+            return
+        if (isinstance(data, list)):
+            rows = data
+        else:
+            decoder = _SSAPRowDecoder()
+            rows = decoder.feed(data)
+        if (_SSAPMessageParser.__passRows(rows, rowHandler, body) and not isinstance(data, list) and
+                not decoder.isFinished()):
+            raise ValueError("The QUERY response contains an incomplete JSON array")
+        
+    @staticmethod
+    def __passRows(rows, rowHandler, body):
+        '''
+        Passes the rows of a QUERY response to a row handler. If the handler fails, the remaining rows
+        are skipped and the response is turned into an error response. Returns False if the handler failed.
+        
+        Keyword arguments:
+        rows         -- an iterable with the decoded rows.
+        rowHandler   -- the SSAPRowHandler that will process the rows.
+        body         -- the body of the QUERY response.
+        '''
+        for row in rows:
+            try:
+                rowHandler.onRow(row)
+            except Exception as e:
+                body["ok"] = False
+                body["data"] = None
+                body["error"] = "The row handler failed: " + str(e)
+                body["errorCode"] = "OTHER"
+                return False
+        return True
+    
+    @staticmethod
+    def isIndication(serializedData):
+        '''
+        Checks if a serialized message received from the SIB is an INDICATION message without parsing
+        it. Only the top-level fields of the message are examined.
+        
+        Keyword arguments:
+        serializedData   -- the serialized message (a bytes object).
+        '''
+        if (serializedData.find(b"INDICATION") == -1):
+            return False
+        depth = 0
+        key = None
+        isValue = False
+        for match in _JSON_TOKEN.finditer(serializedData):
+            (start, end) = match.span()
+            first = serializedData[start]
+            if (isValue):
+                isValue = False
+                if (depth == 1 and key == b"\"messageType\""):
+                    return serializedData[start:end] == b"\"INDICATION\""
+            if (first == 0x7B or first == 0x5B): # { or [
+                depth = depth + 1
+            elif (first == 0x7D or first == 0x5D): # } or ]
+                depth = depth - 1
+                if (depth == 0):
+                    return False
+            elif (first == 0x3A): # :
+                isValue = True
+            elif (first == 0x22): # "
+                key = bytes(serializedData[start:end]) if end - start <= _MAX_KEY_LENGTH else None
+        return False
+    
+# The tokens of a serialized JSON document. The strings are matched as a whole.
+_JSON_TOKEN = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]:,]|[^\s{}\[\]:,"]+')
+_HIGH_SURROGATE_ESCAPE = re.compile(br'\\u[dD][89abAB][0-9a-fA-F]{2}$')
+_MAX_KEY_LENGTH = 64
+# The number of bytes of the serialized data field that are unescaped at once
+_ROW_STREAM_CHUNK_SIZE = 256 * 1024
+
+class _SSAPRowDecoder(object):
+    '''
+    Decodes the elements of a serialized JSON array incrementally. Each element is deserialized
+    as soon as it is complete, so the array is never stored in memory.
+    '''
+    
+    __decoder = json.JSONDecoder()
+    __whitespace = " \t\n\r"
+    
+    def __init__(self):
+        '''
+        Initializes the state of the decoder.
+        '''
+        self.__buffer = ""
+        self.__arrayStarted = False
+        self.__arrayFinished = False
+        
+    def isFinished(self):
+        '''
+        Checks if the end of the array has been reached.
+        '''
+        return self.__arrayFinished
+        
+    def feed(self, text):
+        '''
+        Appends a chunk of the serialized array to the decoder and returns a generator that yields the
+        elements that have been completed.
+        
+        Keyword arguments:
+        text     -- the serialized chunk (a str or a bytes object).
+        '''
+        if (isinstance(text, bytes)):
+            text = bytes2String(text)
+        buf = self.__buffer + text
+        self.__buffer = ""
+        position = 0
+        length = len(buf)
+        try:
+            while (not self.__arrayFinished):
+                position = self.__skipWhitespace(buf, position)
+                if (position == length):
+                    break
+                if (not self.__arrayStarted):
+                    if (buf[position] != "["):
+                        raise ValueError("The serialized data is not a JSON array")
+                    self.__arrayStarted = True
+                    position = position + 1
+                    continue
+                if (buf[position] == "]"):
+                    self.__arrayFinished = True
+                    position = position + 1
+                    break
+                if (buf[position] == ","):
+                    position = self.__skipWhitespace(buf, position + 1)
+                try:
+                    (row, end) = _SSAPRowDecoder.__decoder.raw_decode(buf, position)
+                except ValueError:
+                    break # The element is not complete yet
+                if (end == length and not buf[end - 1] in "}]\""):
+                    break # Numbers and literals might continue in the next chunk
+                position = end
+                yield row
+        finally:
+            self.__buffer = buf[position:]
+    
+    @staticmethod
+    def __skipWhitespace(buf, position):
+        length = len(buf)
+        while (position < length and buf[position] in _SSAPRowDecoder.__whitespace):
+            position = position + 1
+        return position
@@ -0,0 +1,545 @@
+# -*- coding: utf8 -*-
+'''
+An on-demand profiler for live SSAP endpoints.
+
+The profiler samples the stacks of all the threads of the process, charges the CPU time that
+each thread has used since the previous sample to the SSAP stage that it is running, and
+(optionally) traces the memory allocations with tracemalloc while it is active. The stages are:
+
+    building     -- building and serializing the SSAP requests.
+    parsing      -- deserializing the SSAP responses and INDICATION messages.
+    dispatch     -- queueing the requests, correlating the responses and invoking the callbacks.
+    transport    -- the websocket clients.
+    handlers     -- the callbacks and the row handlers of the application.
+    other        -- the threads that are not running SSAP code.
+
+Profiling can be enabled at runtime through startProfiling() and stopProfiling(), or through
+these environment variables, which are read when the first endpoint is created:
+
+    SSAP_PROFILE              -- a number of seconds (to profile the endpoints as soon as they are
+                                 created) or "signal" (to start and stop the profiler when the
+                                 process receives SIGUSR2, i.e. kill -USR2 <pid>). "signal:NAME"
+                                 uses another signal.
+    SSAP_PROFILE_ALLOCATIONS  -- if set to 1, the memory allocations will be traced too.
+    SSAP_PROFILE_INTERVAL     -- the sampling interval in milliseconds (5 by default).
+    SSAP_PROFILE_OUTPUT       -- the file that the reports will be appended to. If its extension is
+                                 .json, the reports will be written as JSON. By default, the reports
+                                 are logged.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import ast
+import json
+import logging
+import os
+import signal
+import sys
+import sysconfig
+import time
+import tracemalloc
+from threading import Event, Lock, Thread, Timer, current_thread, enumerate as enumerateThreads
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.utils.logs import LogFactory
+
+STAGES = ("building", "parsing", "dispatch", "transport", "handlers", "other")
+
+_SSAP_DIRECTORY = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+_LIBRARY_DIRECTORIES = tuple(set(os.path.abspath(path) + os.sep for (name, path) in sysconfig.get_paths().items()
+                                 if name in ("stdlib", "platstdlib", "purelib", "platlib")))
+
+# The ssap modules whose stage does not depend on the function that is running
+_MODULE_STAGES = {"implementations/ws4pyclient.py" : "transport", "implementations/rfc6455.py" : "transport",
+                  "implementations/loopback.py" : "transport", "implementations/capture.py" : "transport",
+                  "views.py" : "handlers", "spatial.py" : "handlers", "timeseries.py" : "handlers",
+                  "subscriptions.py" : "handlers", "utils/filters.py" : "handlers", "loadgen.py" : "handlers",
+                  "profiling.py" : None}
+
+# The classes and functions of the messages package that deserialize the incoming messages
+_PARSING_NAMES = ("_SSAPMessageParser", "_SSAPRowDecoder", "SSAPMessage", "FrozenDict", "FrozenList",
+                  "freeze", "_thaw")
+
+# The standard library functions in which the threads wait for events or for data. The samples
+# of the threads that are blocked in them are discarded.
+_IDLE_FUNCTIONS = frozenset((("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+                             ("selectors.py", "select"), ("socket.py", "readinto"), ("socket.py", "accept"),
+                             ("ssl.py", "read"), ("ssl.py", "recv"), ("ssl.py", "recv_into")))
+
+_USER_CODE = "user"
+
+class _QualifiedNameIndex(object):
+    '''
+    Finds the qualified name of the function that contains a line of a source file. It is used to
+    classify the tracemalloc frames, which do not reference code objects.
+    '''
+
+    def __init__(self):
+        self.__functions = {}
+
+    def find(self, filename, lineno):
+        functions = self.__functions.get(filename)
+        if (functions is None):
+            functions = self.__functions[filename] = _QualifiedNameIndex.__parse(filename)
+        qualname = ""
+        for (firstLine, lastLine, name) in functions:
+            if (firstLine <= lineno <= lastLine):
+                qualname = name # The functions are sorted, so the innermost one is the last match
+        return qualname
+
+    @staticmethod
+    def __parse(filename):
+        try:
+            with open(filename, "rb") as sourceFile:
+                tree = ast.parse(sourceFile.read(), filename)
+        except (IOError, SyntaxError, ValueError):
+            return []
+        functions = []
+        def visit(node, prefix):
+            for child in ast.iter_child_nodes(node):
+                if (isinstance(child, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef))):
+                    name = prefix + child.name
+                    functions.append((child.lineno, getattr(child, "end_lineno", child.lineno), name))
+                    visit(child, name + ".")
+        visit(tree, "")
+        return functions
+
+class _StageClassifier(object):
+    '''
+    Assigns the frames of a stack to the SSAP stages.
+    '''
+
+    def __init__(self):
+        self.__codeKinds = {}
+        self.__idleCodes = {}
+        self.__lineKinds = {}
+        self.__names = _QualifiedNameIndex()
+
+    def isIdle(self, frame):
+        '''
+        Returns True if the innermost frame of a thread is waiting for an event or for data.
+        '''
+        code = frame.f_code
+        idle = self.__idleCodes.get(code)
+        if (idle is None):
+            idle = self.__idleCodes[code] = (os.path.basename(code.co_filename), code.co_name) in _IDLE_FUNCTIONS
+        return idle
+
+    def classifyFrame(self, frame):
+        '''
+        Returns the SSAP stage of the innermost SSAP frame of a thread.
+        '''
+        codeKinds = self.__codeKinds
+        sawUserCode = False
+        while (not frame is None):
+            code = frame.f_code
+            kind = codeKinds.get(code, False)
+            if (kind is False and code.co_name == "<module>"):
+                kind = codeKinds[code] = None # Module imports are charged to the importer
+            elif (kind is False):
+                kind = codeKinds[code] = self.__classify(code.co_filename,
+                                                         lambda: getattr(code, "co_qualname", None) or
+                                                         self.__names.find(code.co_filename, code.co_firstlineno))
+            if (kind == _USER_CODE):
+                sawUserCode = True
+            elif (not kind is None):
+                # The application code that SSAP code calls runs in the handlers stage
+                return "handlers" if sawUserCode else kind
+            frame = frame.f_back
+        return "other"
+
+    def classifyTraceback(self, traceback):
+        '''
+        Returns the SSAP stage of a tracemalloc traceback.
+        '''
+        lineKinds = self.__lineKinds
+        sawUserCode = False
+        for frame in reversed(traceback): # tracemalloc sorts the frames from the oldest to the most recent one
+            location = (frame.filename, frame.lineno)
+            kind = lineKinds.get(location, False)
+            if (kind is False):
+                kind = lineKinds[location] = self.__classify(frame.filename,
+                                                             lambda: self.__names.find(frame.filename, frame.lineno))
+            if (kind == _USER_CODE):
+                sawUserCode = True
+            elif (not kind is None):
+                return "handlers" if sawUserCode else kind
+        return "other"
+
+    @staticmethod
+    def __classify(filename, getQualifiedName):
+        '''
+        Returns the stage of a source file, _USER_CODE for the application code and None for the
+        libraries (which are charged to the stage of their callers).
+        '''
+        path = os.path.abspath(filename)
+        if (path.startswith(_SSAP_DIRECTORY)):
+            module = path[len(_SSAP_DIRECTORY):].replace(os.sep, "/")
+            if (module.startswith("tests/")):
+                return _USER_CODE
+            if (module in _MODULE_STAGES):
+                return _MODULE_STAGES[module]
+            if (module.startswith("messages/")):
+                qualname = getQualifiedName()
+                if (qualname.split(".")[0] in _PARSING_NAMES):
+                    return "parsing"
+                return "building"
+            return "dispatch"
+        if (filename.startswith("<") or path.startswith(_LIBRARY_DIRECTORIES)):
+            return None
+        return _USER_CODE
+
+def _describeLocation(filename, name):
+    return "{0}:{1}".format(os.path.join(os.path.basename(os.path.dirname(filename)), os.path.basename(filename)), name)
+
+class ProfileReport(object):
+    '''
+    The results of a profiling session.
+    '''
+
+    def __init__(self, duration, samples, clock, stages, functions, allocations):
+        self.duration = duration
+        self.samples = samples
+        self.clock = clock
+        self.stages = stages
+        self.functions = functions
+        self.allocations = allocations
+
+    def toDict(self, topFunctions=10):
+        '''
+        Returns a dictionary with the results. It can be serialized to JSON.
+
+        Keyword arguments:
+        topFunctions    -- the number of functions that will be reported for each stage.
+        '''
+        total = sum(self.stages.values())
+        stages = {}
+        for stage in STAGES:
+            seconds = self.stages.get(stage, 0.0)
+            if (seconds == 0 and (self.allocations is None or not stage in self.allocations)):
+                continue
+            functions = sorted(self.functions.get(stage, {}).items(), key=lambda item: -item[1])[:topFunctions]
+            stages[stage] = {"seconds" : round(seconds, 4),
+                             "percent" : round(100.0 * seconds / total, 1) if total > 0 else 0.0,
+                             "functions" : [{"function" : name, "seconds" : round(value, 4)} for (name, value) in functions]}
+            if (not self.allocations is None):
+                stages[stage]["allocations"] = self.allocations.get(stage, {"size" : 0, "count" : 0, "top" : []})
+        return {"duration" : round(self.duration, 3), "samples" : self.samples, "clock" : self.clock, "stages" : stages}
+
+    def format(self, topFunctions=5):
+        '''
+        Returns the results as text.
+
+        Keyword arguments:
+        topFunctions    -- the number of functions that will be reported for each stage.
+        '''
+        report = self.toDict(topFunctions)
+        lines = ["SSAP profile: {0} s, {1} samples ({2} time)".format(report["duration"], report["samples"], report["clock"])]
+        for stage in STAGES:
+            stats = report["stages"].get(stage)
+            if (stats is None):
+                continue
+            line = "  {0:<10} {1:>9.4f} s {2:>6.1f} %".format(stage, stats["seconds"], stats["percent"])
+            if ("allocations" in stats):
+                line += "  {0:>12} bytes in {1} blocks".format(stats["allocations"]["size"], stats["allocations"]["count"])
+            lines.append(line)
+            for function in stats["functions"]:
+                lines.append("      {0:>9.4f} s  {1}".format(function["seconds"], function["function"]))
+            for allocation in stats.get("allocations", {}).get("top", ()):
+                lines.append("      {0:>9} B  {1}".format(allocation["size"], allocation["location"]))
+        return "\n".join(lines)
+
+class EndpointProfiler(object):
+    '''
+    A sampling profiler. While it is running, a daemon thread inspects the stacks of the other
+    threads of the process. The CPU time that each thread uses while the profiler is running is
+    split between the stages and the functions in proportion to the samples in which the thread
+    was running them.
+    '''
+
+    # While the profiler is running, the threads release the GIL more often, so that the sampler
+    # can see them while they are busy
+    SWITCH_INTERVAL = 0.0001
+
+    def __init__(self, interval=0.005, traceAllocations=False, allocationFrames=16):
+        '''
+        Initializes the state of the profiler.
+
+        Keyword arguments:
+        interval            -- the sampling interval (in seconds).
+        traceAllocations    -- if True, the memory allocations will be traced with tracemalloc.
+        allocationFrames    -- the number of frames that tracemalloc will store for each allocation.
+        '''
+        self.__interval = interval
+        self.__traceAllocations = traceAllocations
+        self.__allocationFrames = allocationFrames
+        self.__classifier = _StageClassifier()
+        self.__stopped = Event()
+        self.__thread = None
+        self.__threads = {}
+        self.__samples = 0
+        self.__startTime = None
+        self.__switchInterval = None
+        self.__snapshot = None
+        self.__startedTracemalloc = False
+        self.__clock = "cpu" if hasattr(time, "pthread_getcpuclockid") else "wall"
+
+    def isRunning(self):
+        return not self.__thread is None and not self.__stopped.is_set()
+
+    def start(self):
+        if (not self.__thread is None):
+            raise InvalidSSAPOperation("The profiler has already been started")
+        if (self.__traceAllocations):
+            if (not tracemalloc.is_tracing()):
+                tracemalloc.start(self.__allocationFrames)
+                self.__startedTracemalloc = True
+            self.__snapshot = tracemalloc.take_snapshot()
+        self.__switchInterval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.__switchInterval, EndpointProfiler.SWITCH_INTERVAL))
+        self.__startTime = time.monotonic()
+        self.__thread = Thread(target=self.__run, name="SSAPProfiler")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        '''
+        Stops the profiler and returns a ProfileReport.
+        '''
+        if (self.__thread is None):
+            raise InvalidSSAPOperation("The profiler has not been started")
+        self.__stopped.set()
+        if (not self.__thread is current_thread()):
+            self.__thread.join()
+        sys.setswitchinterval(self.__switchInterval)
+        duration = time.monotonic() - self.__startTime
+        allocations = None
+        if (not self.__snapshot is None):
+            allocations = self.__summarizeAllocations(tracemalloc.take_snapshot())
+            self.__snapshot = None
+            if (self.__startedTracemalloc):
+                tracemalloc.stop()
+        (stages, functions) = self.__splitTimes()
+        return ProfileReport(duration, self.__samples, self.__clock, stages, functions, allocations)
+
+    def __run(self):
+        ownIdentifier = current_thread().ident
+        while (not self.__stopped.wait(self.__interval)):
+            frames = sys._current_frames()
+            for thread in enumerateThreads():
+                identifier = thread.ident
+                if (identifier == ownIdentifier or not identifier in frames):
+                    continue
+                threadTime = None
+                if (self.__clock == "cpu"):
+                    try:
+                        threadTime = time.clock_gettime(time.pthread_getcpuclockid(identifier))
+                    except (OSError, OverflowError):
+                        continue # The thread has finished
+                state = self.__threads.get(identifier)
+                if (state is None):
+                    # [first CPU time, last CPU time, samples by (stage, function)]
+                    state = self.__threads[identifier] = [threadTime, threadTime, {}]
+                state[1] = threadTime
+                frame = frames[identifier]
+                if (self.__classifier.isIdle(frame)):
+                    continue
+                key = (self.__classifier.classifyFrame(frame), _describeLocation(frame.f_code.co_filename, frame.f_code.co_name))
+                state[2][key] = state[2].get(key, 0) + 1
+            self.__samples += 1
+
+    def __splitTimes(self):
+        '''
+        Splits the time of each thread between the stages and the functions that it was running.
+        Returns a (time by stage, time by stage and function) tuple.
+        '''
+        stages = {}
+        functions = {}
+        for (firstTime, lastTime, samples) in self.__threads.values():
+            busySamples = sum(samples.values())
+            if (busySamples == 0):
+                continue
+            if (self.__clock == "cpu"):
+                secondsPerSample = (lastTime - firstTime) / busySamples
+            else:
+                secondsPerSample = self.__interval
+            for ((stage, location), count) in samples.items():
+                seconds = count * secondsPerSample
+                stages[stage] = stages.get(stage, 0.0) + seconds
+                stageFunctions = functions.setdefault(stage, {})
+                stageFunctions[location] = stageFunctions.get(location, 0.0) + seconds
+        return (stages, functions)
+
+    def __summarizeAllocations(self, snapshot, topAllocations=5):
+        '''
+        Groups the memory blocks that have been allocated since the profiler was started (and are
+        still alive) by stage.
+        '''
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)))
+        allocations = {}
+        for statistic in snapshot.compare_to(self.__snapshot, "traceback"):
+            if (statistic.size_diff <= 0):
+                continue
+            stage = self.__classifier.classifyTraceback(statistic.traceback)
+            stats = allocations.get(stage)
+            if (stats is None):
+                stats = allocations[stage] = {"size" : 0, "count" : 0, "top" : []}
+            stats["size"] += statistic.size_diff
+            stats["count"] += max(0, statistic.count_diff)
+            frame = statistic.traceback[-1]
+            stats["top"].append({"location" : _describeLocation(frame.filename, frame.lineno), "size" : statistic.size_diff})
+        for stats in allocations.values():
+            stats["top"] = sorted(stats["top"], key=lambda item: -item["size"])[:topAllocations]
+        return allocations
+
+class _ProfilingController(object):
+    '''
+    Manages the profiling session of the process.
+    '''
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__profiler = None
+        self.__timer = None
+        self.__output = None
+        self.__configured = False
+        self.__lastReport = None
+        self.__logger = LogFactory.configureLogger(self, logging.INFO, LogFactory.DEFAULT_LOG_FILE)
+
+    def start(self, duration=None, interval=0.005, traceAllocations=False, allocationFrames=16, output=None):
+        with self.__lock:
+            if (not self.__profiler is None):
+                raise InvalidSSAPOperation("The profiler is already running")
+            self.__profiler = EndpointProfiler(interval, traceAllocations, allocationFrames)
+            self.__profiler.start()
+            self.__output = output
+            if (not duration is None):
+                self.__timer = Timer(duration, self.__stopAndDump)
+                self.__timer.daemon = True
+                self.__timer.start()
+        self.__logger.info("SSAP profiling started")
+
+    def stop(self):
+        with self.__lock:
+            if (self.__profiler is None):
+                return None
+            if (not self.__timer is None):
+                self.__timer.cancel()
+                self.__timer = None
+            profiler = self.__profiler
+            self.__profiler = None
+            self.__lastReport = profiler.stop()
+            return self.__lastReport
+
+    def isRunning(self):
+        return not self.__profiler is None
+
+    def getLastReport(self):
+        return self.__lastReport
+
+    def toggle(self):
+        if (self.isRunning()):
+            self.__stopAndDump()
+        else:
+            (interval, traceAllocations, output) = _ProfilingController.__readOptions()
+            try:
+                self.start(None, interval, traceAllocations, output=output)
+            except InvalidSSAPOperation:
+                pass # Another thread has started the profiler
+
+    def configureFromEnvironment(self):
+        '''
+        Reads the SSAP_PROFILE environment variables. Only the first call has any effect.
+        '''
+        with self.__lock:
+            if (self.__configured):
+                return
+            self.__configured = True
+        value = os.environ.get("SSAP_PROFILE", "").strip()
+        if (len(value) == 0):
+            return
+        (interval, traceAllocations, output) = _ProfilingController.__readOptions()
+        if (value.lower().startswith("signal")):
+            signalName = value.partition(":")[2].strip().upper() or "SIGUSR2"
+            if (not signalName.startswith("SIG")):
+                signalName = "SIG" + signalName
+            try:
+                # The signal handlers run in the main thread, so the report is generated by another thread
+                signal.signal(getattr(signal, signalName), lambda signum, frame: Thread(target=self.toggle).start())
+            except (AttributeError, ValueError) as e:
+                self.__logger.warning("The SSAP profiler signal handler could not be installed: {0}".format(e))
+            return
+        try:
+            duration = float(value)
+        except ValueError:
+            self.__logger.warning("Invalid SSAP_PROFILE value: {0}".format(value))
+            return
+        try:
+            self.start(duration, interval, traceAllocations, output=output)
+        except InvalidSSAPOperation:
+            pass
+
+    @staticmethod
+    def __readOptions():
+        interval = float(os.environ.get("SSAP_PROFILE_INTERVAL", "5")) / 1000.0
+        traceAllocations = os.environ.get("SSAP_PROFILE_ALLOCATIONS", "0").strip() in ("1", "true", "yes")
+        return (interval, traceAllocations, os.environ.get("SSAP_PROFILE_OUTPUT") or None)
+
+    def __stopAndDump(self):
+        output = self.__output
+        report = self.stop()
+        if (report is None):
+            return
+        if (output is None):
+            self.__logger.info(report.format())
+        elif (output.endswith(".json")):
+            with open(output, "a") as outputFile:
+                outputFile.write(json.dumps(report.toDict()) + "\n")
+        else:
+            with open(output, "a") as outputFile:
+                outputFile.write(report.format() + "\n\n")
+
+_controller = _ProfilingController()
+
+def startProfiling(duration=None, interval=0.005, traceAllocations=False, allocationFrames=16, output=None):
+    '''
+    Starts profiling the process.
+
+    Keyword arguments:
+    duration            -- the number of seconds to profile. When they elapse, the report will be written
+                           to the output. If None, the profiler will run until stopProfiling() is called.
+    interval            -- the sampling interval (in seconds).
+    traceAllocations    -- if True, the memory allocations will be traced with tracemalloc while the
+                           profiler is running.
+    allocationFrames    -- the number of frames that tracemalloc will store for each allocation.
+    output              -- the file that the report will be appended to when the duration elapses. If
+                           None, the report will be logged.
+    '''
+    _controller.start(duration, interval, traceAllocations, allocationFrames, output)
+
+def stopProfiling():
+    '''
+    Stops the profiler and returns its ProfileReport, or None if it was not running.
+    '''
+    return _controller.stop()
+
+def isProfiling():
+    return _controller.isRunning()
+
+def getLastProfileReport():
+    '''
+    Returns the ProfileReport of the last profiling session, or None.
+    '''
+    return _controller.getLastReport()
+
+def configureFromEnvironment():
+    '''
+    Enables the profiler if the SSAP_PROFILE environment variable is set. The endpoints call this
+    function when they are created.
+    '''
+    _controller.configureFromEnvironment()
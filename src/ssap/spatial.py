@@ -0,0 +1,260 @@
+# -*- coding: utf8 -*-
+'''
+A client-side spatial index for ontology instances that contain geometry points.
+
+The index is a uniform grid of latitude/longitude cells. The coordinates are stored in flat
+arrays and the cells only store the positions of the points in those arrays, so the index is
+compact and the bounding box and radius queries only visit the cells that they overlap.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+from array import array
+from math import radians, sin, cos, asin, sqrt, floor
+from threading import RLock
+from ssap.core import SSAPRowHandler
+from ssap.utils.filters import compileFieldGetter
+
+EARTH_RADIUS_IN_METERS = 6371008.8
+
+_METERS_PER_DEGREE = 111319.49
+
+def haversineDistance(latitude1, longitude1, latitude2, longitude2):
+    '''
+    Returns the great-circle distance (in meters) between two points.
+    '''
+    latitude1 = radians(latitude1)
+    latitude2 = radians(latitude2)
+    a = sin((latitude2 - latitude1) / 2) ** 2 + \
+        cos(latitude1) * cos(latitude2) * sin(radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_IN_METERS * asin(min(1.0, sqrt(a)))
+
+class SpatialGridIndex(SSAPRowHandler):
+    '''
+    Indexes the geometry points of ontology instances by their key field. Instances can be added
+    one by one, by passing the index as the row handler of a QUERY, or by registering its
+    onIndication() method as an INDICATION handler.
+    '''
+
+    def __init__(self, cellSizeInDegrees=0.01, key="Sensor.assetId", coordinates="Sensor.geometry.coordinates",
+                 latitudeFirst=True):
+        '''
+        Initializes the state of the index.
+
+        Keyword arguments:
+        cellSizeInDegrees  -- the size of the grid cells. The queries are fastest when their size is
+                              similar to a few cells.
+        key                -- the dotted path of the field that identifies the instances.
+        coordinates        -- the dotted path of the [latitude, longitude] array of the instances.
+        latitudeFirst      -- if False, the coordinates arrays will be read as [longitude, latitude] (GeoJSON order).
+        '''
+        self.__cellSize = float(cellSizeInDegrees)
+        self.__getKey = compileFieldGetter(key)
+        self.__getCoordinates = compileFieldGetter(coordinates)
+        self.__latitudeFirst = latitudeFirst
+        self.__lock = RLock()
+        self.__latitudes = array("d")
+        self.__longitudes = array("d")
+        self.__keys = []
+        self.__slotsByKey = {}
+        self.__freeSlots = []
+        self.__cells = {}
+
+    def __len__(self):
+        return len(self.__slotsByKey)
+
+    def __contains__(self, key):
+        return key in self.__slotsByKey
+
+    def add(self, instance):
+        '''
+        Adds an ontology instance to the index, or moves it if it is already indexed. Returns False
+        if the instance has no key or no valid coordinates.
+
+        Keyword arguments:
+        instance    -- the ontology instance.
+        '''
+        key = self.__getKey(instance)
+        coordinates = self.__getCoordinates(instance)
+        if (key is None or not isinstance(coordinates, (list, tuple)) or len(coordinates) < 2):
+            return False
+        if (self.__latitudeFirst):
+            (latitude, longitude) = (coordinates[0], coordinates[1])
+        else:
+            (longitude, latitude) = (coordinates[0], coordinates[1])
+        try:
+            self.addPoint(key, float(latitude), float(longitude))
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def addPoint(self, key, latitude, longitude):
+        '''
+        Adds a point to the index, or moves it if its key is already indexed.
+
+        Keyword arguments:
+        key          -- the key of the point.
+        latitude     -- the latitude of the point (in degrees).
+        longitude    -- the longitude of the point (in degrees).
+        '''
+        cell = self.__getCell(latitude, longitude)
+        with self.__lock:
+            slot = self.__slotsByKey.get(key)
+            if (slot is None):
+                if (self.__freeSlots):
+                    slot = self.__freeSlots.pop()
+                    self.__latitudes[slot] = latitude
+                    self.__longitudes[slot] = longitude
+                    self.__keys[slot] = key
+                else:
+                    slot = len(self.__keys)
+                    self.__latitudes.append(latitude)
+                    self.__longitudes.append(longitude)
+                    self.__keys.append(key)
+                self.__slotsByKey[key] = slot
+            else:
+                previousCell = self.__getCell(self.__latitudes[slot], self.__longitudes[slot])
+                self.__latitudes[slot] = latitude
+                self.__longitudes[slot] = longitude
+                if (previousCell == cell):
+                    return
+                self.__removeFromCell(previousCell, slot)
+            cellSlots = self.__cells.get(cell)
+            if (cellSlots is None):
+                self.__cells[cell] = array("l", (slot,))
+            else:
+                cellSlots.append(slot)
+
+    def remove(self, key):
+        '''
+        Removes a point from the index. Returns False if it was not indexed.
+
+        Keyword arguments:
+        key    -- the key of the point.
+        '''
+        with self.__lock:
+            slot = self.__slotsByKey.pop(key, None)
+            if (slot is None):
+                return False
+            self.__removeFromCell(self.__getCell(self.__latitudes[slot], self.__longitudes[slot]), slot)
+            self.__keys[slot] = None
+            self.__freeSlots.append(slot)
+            return True
+
+    def getPoint(self, key):
+        '''
+        Returns the (latitude, longitude) tuple of a point, or None if it is not indexed.
+
+        Keyword arguments:
+        key    -- the key of the point.
+        '''
+        with self.__lock:
+            slot = self.__slotsByKey.get(key)
+            if (slot is None):
+                return None
+            return (self.__latitudes[slot], self.__longitudes[slot])
+
+    def queryBoundingBox(self, minLatitude, minLongitude, maxLatitude, maxLongitude):
+        '''
+        Returns the keys of the points that are inside a bounding box (borders included).
+
+        Keyword arguments:
+        minLatitude, minLongitude    -- the south-west corner of the box.
+        maxLatitude, maxLongitude    -- the north-east corner of the box.
+        '''
+        latitudes = self.__latitudes
+        longitudes = self.__longitudes
+        keys = self.__keys
+        with self.__lock:
+            return [keys[slot] for slot in self.__candidateSlots(minLatitude, minLongitude, maxLatitude, maxLongitude)
+                    if minLatitude <= latitudes[slot] <= maxLatitude and minLongitude <= longitudes[slot] <= maxLongitude]
+
+    def queryRadius(self, latitude, longitude, radiusInMeters):
+        '''
+        Returns a list of (key, distance in meters) tuples with the points that are inside a circle,
+        sorted by their distance to its center.
+
+        Keyword arguments:
+        latitude, longitude    -- the center of the circle (in degrees).
+        radiusInMeters         -- the radius of the circle.
+        '''
+        latitudeDelta = radiusInMeters / _METERS_PER_DEGREE
+        cosine = cos(radians(min(89.9, abs(latitude) + latitudeDelta)))
+        longitudeDelta = latitudeDelta / cosine
+        if (longitudeDelta >= 180.0):
+            longitudeRanges = [(-180.0, 180.0)]
+        elif (longitude - longitudeDelta < -180.0):
+            # The circle crosses the antimeridian: the box is split in two
+            longitudeRanges = [(-180.0, longitude + longitudeDelta), (longitude - longitudeDelta + 360.0, 180.0)]
+        elif (longitude + longitudeDelta > 180.0):
+            longitudeRanges = [(longitude - longitudeDelta, 180.0), (-180.0, longitude + longitudeDelta - 360.0)]
+        else:
+            longitudeRanges = [(longitude - longitudeDelta, longitude + longitudeDelta)]
+        latitudes = self.__latitudes
+        longitudes = self.__longitudes
+        keys = self.__keys
+        result = []
+        with self.__lock:
+            for (minLongitude, maxLongitude) in longitudeRanges:
+                for slot in self.__candidateSlots(latitude - latitudeDelta, minLongitude,
+                                                  latitude + latitudeDelta, maxLongitude):
+                    distance = haversineDistance(latitude, longitude, latitudes[slot], longitudes[slot])
+                    if (distance <= radiusInMeters):
+                        result.append((keys[slot], distance))
+        result.sort(key=lambda item: item[1])
+        return result
+
+    def onRow(self, row):
+        # Do not call this method from client code!!!
+        self.add(row)
+
+    def onIndication(self, message):
+        '''
+        Indexes the instances of an INDICATION message. This method can be registered as an
+        INDICATION handler.
+
+        Keyword arguments:
+        message    -- a parsed INDICATION message.
+        '''
+        data = message["body"].get("data")
+        if (data is None):
+            return
+        if (not isinstance(data, list)):
+            data = [data]
+        for instance in data:
+            self.add(instance)
+
+    def __getCell(self, latitude, longitude):
+        return (int(floor(latitude / self.__cellSize)), int(floor(longitude / self.__cellSize)))
+
+    def __removeFromCell(self, cell, slot):
+        cellSlots = self.__cells[cell]
+        cellSlots.remove(slot)
+        if (not cellSlots):
+            del self.__cells[cell]
+
+    def __candidateSlots(self, minLatitude, minLongitude, maxLatitude, maxLongitude):
+        '''
+        Yields the slots of the points that are stored in the cells that overlap a bounding box.
+        '''
+        (minRow, minColumn) = self.__getCell(minLatitude, minLongitude)
+        (maxRow, maxColumn) = self.__getCell(maxLatitude, maxLongitude)
+        cells = self.__cells
+        if ((maxRow - minRow + 1) * (maxColumn - minColumn + 1) > len(cells)):
+            # The box is larger than the populated area: it's cheaper to visit the non-empty cells
+            for ((row, column), cellSlots) in cells.items():
+                if (minRow <= row <= maxRow and minColumn <= column <= maxColumn):
+                    for slot in cellSlots:
+                        yield slot
+            return
+        for row in range(minRow, maxRow + 1):
+            for column in range(minColumn, maxColumn + 1):
+                cellSlots = cells.get((row, column))
+                if (not cellSlots is None):
+                    for slot in cellSlots:
+                        yield slot
@@ -0,0 +1,584 @@
+# -*- coding: utf8 -*-
+'''
+Reference-counted shared subscriptions.
+
+Identical subscriptions (same ontology, query, query type and refresh time) are deduplicated
+into a single server-side subscription. Each INDICATION is parsed once and handed to all the
+local subscribers, and the server-side subscription is cancelled when the last local
+subscriber leaves.
+
+When the connection with the SIB is lost, the subscriptions are sent again after the endpoint
+JOINs the SIB. If a subscription tracks the timestamps of its instances, the instances that
+were inserted while the client was disconnected are retrieved with a historical query and
+handed to the subscribers before the new INDICATION messages.
+
+Each endpoint has a single manager (see SharedSubscriptionManager.forEndpoint()). The SUBSCRIBE
+responses carry no query, so they are matched with the requests of the manager in order: the
+SUBSCRIBE requests of an ontology must not be sent to the SIB without using the manager.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import logging
+from threading import RLock
+from time import time
+from weakref import WeakKeyDictionary
+from ssap.core import SSAPConnectionListener, SSAPRowHandler, SSAP_MESSAGE_TYPE, SSAP_QUERY_TYPE, SSAP_MESSAGE_DIRECTION
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.utils.filters import compileFieldGetter
+from ssap.utils.logs import LogFactory
+from ssap.utils.queries import restrictNativeQuery
+from ssap.utils.timestamps import toEpochSeconds, toExtendedJsonDate
+
+def buildBackfillQuery(query, timestampField, since, until=None):
+    '''
+    Builds a native query that selects the instances of a "db.<ontology>.find(<criteria>)" query whose
+    timestamp is in the (since, until] interval, sorted by their timestamp.
+
+    Keyword arguments:
+    query             -- the native query of the subscription.
+    timestampField    -- the dotted path of the timestamp field.
+    since             -- the start of the interval (in seconds since the epoch). It is excluded.
+    until             -- the end of the interval (in seconds since the epoch). It is included. If it is None,
+                         the interval has no end.
+    '''
+    interval = {"$gt" : toExtendedJsonDate(since)}
+    if (not until is None):
+        interval["$lte"] = toExtendedJsonDate(until)
+    interval = {timestampField : interval}
+    return restrictNativeQuery(query, interval, timestampField)
+
+# The manager of each endpoint
+_managers = WeakKeyDictionary()
+_managersLock = RLock()
+
+class SharedSubscriptionManager(SSAPConnectionListener):
+    '''
+    Deduplicates the subscriptions of several local components, and restores them after the
+    connection with the SIB is lost. An endpoint can only have one manager.
+    '''
+
+    # The body fields that might contain the subscription ID of an INDICATION message
+    SUBSCRIPTION_ID_FIELDS = ("subscriptionId",)
+
+    @staticmethod
+    def forEndpoint(endpoint, callback, debugMode=False):
+        '''
+        Returns the manager of an endpoint. It will be created if the endpoint has none.
+
+        Keyword arguments:
+        endpoint     -- the SSAP endpoint that will send the SUBSCRIBE and UNSUBSCRIBE requests.
+        callback     -- the MultiHandlerSSAPCallback used by the endpoint.
+        debugMode    -- enables debug log messages.
+        '''
+        with _managersLock:
+            manager = _managers.get(endpoint)
+            if (manager is None):
+                manager = SharedSubscriptionManager(endpoint, callback, debugMode)
+            return manager
+
+    def __init__(self, endpoint, callback, debugMode=False):
+        '''
+        Initializes the state of the manager.
+
+        Keyword arguments:
+        endpoint     -- the SSAP endpoint that will send the SUBSCRIBE and UNSUBSCRIBE requests. It must be joined.
+                        If it supports connection listeners, the subscriptions will be sent again after it
+                        JOINs the SIB again. Otherwise, invoke onConnectionLost() when the connection is lost.
+                        If it already has a manager, an InvalidSSAPOperation will be raised.
+        callback     -- the MultiHandlerSSAPCallback used by the endpoint.
+        debugMode    -- enables debug log messages.
+        '''
+        with _managersLock:
+            if (endpoint in _managers):
+                raise InvalidSSAPOperation("The endpoint already has a subscription manager. Use SharedSubscriptionManager.forEndpoint()")
+            _managers[endpoint] = self
+        if (debugMode) :
+            logLevel = logging.DEBUG
+        else:
+            logLevel = logging.INFO
+        self.__logger = LogFactory.configureLogger(self, logLevel, LogFactory.DEFAULT_LOG_FILE)
+        self.__endpoint = endpoint
+        self.__callback = callback
+        self.__lock = RLock()
+        self.__subscriptionsByKey = {}
+        self.__subscriptionsById = {}
+        self.__pendingByOntology = {}
+        self.__ontologies = set()
+        self.__lostSubscriptions = []
+        self.__callback.registerHandler(SSAP_MESSAGE_TYPE.JOIN, self.__onJoinResponse)
+        if (hasattr(endpoint, "addConnectionListener")):
+            endpoint.addConnectionListener(self)
+
+    def subscribe(self, ontology, query, handler, queryType=SSAP_QUERY_TYPE.NATIVE, refreshTimeInMillis=1000,
+                  timestampField=None, backfillQuery=None, backfillQueryType=SSAP_QUERY_TYPE.HDB, errorHandler=None):
+        '''
+        Subscribes a handler to the INDICATION messages of a query. A SUBSCRIBE request will only be
+        sent if no other local handler is subscribed to the same query.
+
+        Keyword arguments:
+        ontology             -- the target ontology of the subscription.
+        query                -- the query that selects the data that will generate subscription notifications.
+        handler              -- the function that will handle the INDICATION messages.
+        queryType            -- the type of the query (NATIVE, SQL-LIKE, CDB, SIB-DEFINED).
+        refreshTimeInMillis  -- the period of time that will separate two consecutive subscription notifications.
+        timestampField       -- the dotted path of the timestamp field of the instances (e.g. "Sensor.timestamp").
+                                If it is set, the gaps caused by disconnections will be filled. The instances that
+                                were inserted while the client was disconnected will be handed to the handler in a
+                                single INDICATION-like message, with a true "backfill" body field, before the new
+                                INDICATION messages. A gap starts at the timestamp of the newest instance that was
+                                handed to the handlers, so the local clock is only used if none was received before
+                                the connection was lost (the gap then starts when the subscription was confirmed).
+        backfillQuery        -- a function that receives the start and the end of a gap (in seconds since the epoch)
+                                and returns the query that selects its instances. The end is None: the gap lasts
+                                until the new subscription is confirmed, and the instances that are also notified by
+                                it are handed only once. By default, the timestamp condition
+                                is added to the native subscription query (see buildBackfillQuery()).
+        backfillQueryType    -- the type of the queries that fill the gaps.
+        errorHandler         -- the function that will receive the SUBSCRIBE response if the SIB rejects the
+                                subscription. The handle of a rejected subscription will receive no INDICATION
+                                messages, and it should be cancelled.
+        '''
+        if (not timestampField is None and backfillQuery is None):
+            if (queryType != SSAP_QUERY_TYPE.NATIVE):
+                raise InvalidSSAPOperation("A backfill query is required to fill the gaps of non-native subscriptions")
+            buildBackfillQuery(query, timestampField, 0) # Checks that the query can be extended
+            backfillQuery = lambda since, until: buildBackfillQuery(query, timestampField, since, until)
+        key = (ontology, query, queryType, refreshTimeInMillis, timestampField)
+        with self.__lock:
+            self.__registerOntology(ontology)
+            subscription = self.__subscriptionsByKey.get(key)
+            if (subscription is None):
+                subscription = _SharedSubscription(key, timestampField, backfillQuery, backfillQueryType)
+                self.__subscriptionsByKey[key] = subscription
+                self.__sendSubscribeRequest(subscription)
+            handle = SharedSubscriptionHandle(self, subscription, handler, errorHandler)
+            subscription.addHandle(handle)
+            return handle
+
+    def onConnectionLost(self, reason):
+        '''
+        Forgets the server-side subscriptions. They will be sent again when the endpoint JOINs the SIB.
+
+        Keyword arguments:
+        reason     -- a string that describes why the connection was lost.
+        '''
+        with self.__lock:
+            self.__subscriptionsById.clear()
+            self.__pendingByOntology.clear()
+            self.__lostSubscriptions = list(self.__subscriptionsByKey.values())
+            for subscription in self.__lostSubscriptions:
+                subscription.setLost()
+        self.__logger.info("{0} subscriptions will be sent again after joining the SIB".format(len(self.__lostSubscriptions)))
+
+    def getServerSubscriptionCount(self):
+        '''
+        Returns the number of server-side subscriptions (including the ones that have not been confirmed yet).
+        '''
+        return len(self.__subscriptionsByKey)
+
+    def _cancel(self, handle):
+        '''
+        Removes a local subscriber. This method is invoked from the subscription handles.
+
+        Keyword arguments:
+        handle    -- the handle of the local subscriber.
+        '''
+        with self.__lock:
+            subscription = handle._getSubscription()
+            subscription.removeHandle(handle)
+            if (subscription.getHandleCount() != 0):
+                return
+            self.__forget(subscription)
+            if (subscription.isRejected()):
+                return # There is no server-side subscription
+            subscriptionId = subscription.getSubscriptionId()
+            if (subscriptionId is None):
+                # The SUBSCRIBE response has not been received yet. We'll UNSUBSCRIBE after receiving it.
+                subscription.setCancelled()
+            else:
+                self.__subscriptionsById.pop(subscriptionId, None)
+                self.__endpoint.unsubscribe(subscriptionId)
+
+    def __forget(self, subscription):
+        '''
+        Removes a subscription from the index of the active ones. An identical subscription might have
+        replaced it after it was rejected.
+        '''
+        if (self.__subscriptionsByKey.get(subscription.getKey()) is subscription):
+            del self.__subscriptionsByKey[subscription.getKey()]
+
+    def __sendSubscribeRequest(self, subscription):
+        (ontology, query, queryType, refreshTimeInMillis, _timestampField) = subscription.getKey()
+        self.__pendingByOntology.setdefault(ontology, []).append(subscription)
+        self.__endpoint.subscribe(ontology, query, queryType, refreshTimeInMillis)
+
+    def __registerOntology(self, ontology):
+        '''
+        Registers the handlers of the manager for the subscription messages of an ontology.
+        '''
+        if (ontology in self.__ontologies):
+            return
+        self.__ontologies.add(ontology)
+        self.__callback.registerSubscriptionHandler(SSAP_MESSAGE_TYPE.SUBSCRIBE, ontology, self.__onSubscribeResponse)
+        self.__callback.registerSubscriptionHandler(SSAP_MESSAGE_TYPE.INDICATION, ontology, self.__onIndication)
+
+    def __onJoinResponse(self, message):
+        '''
+        Sends the lost subscriptions again after joining the SIB.
+        '''
+        if (not message["body"]["ok"]):
+            return
+        with self.__lock:
+            lostSubscriptions = self.__lostSubscriptions
+            self.__lostSubscriptions = []
+            for subscription in lostSubscriptions:
+                if (subscription.getHandleCount() != 0):
+                    self.__sendSubscribeRequest(subscription)
+
+    def __onSubscribeResponse(self, message):
+        '''
+        Processes a SUBSCRIBE response. The SIB answers the requests in order, and the endpoint has
+        no other manager, so it belongs to the oldest pending subscription of its ontology.
+        '''
+        with self.__lock:
+            pending = self.__pendingByOntology.get(message["ontology"])
+            if (not pending):
+                return # The request was not sent by the manager
+            subscription = pending.pop(0)
+            if (message["body"]["ok"]):
+                self.__onSubscriptionConfirmed(subscription, message)
+                return
+            self.__logger.warning("The SIB rejected the subscription to {0}: {1}".format(subscription.getKey(),
+                                                                                      message["body"].get("error")))
+            self.__forget(subscription)
+            subscription.setRejected(message["body"].get("error"))
+            errorHandlers = subscription.getErrorHandlers()
+        for errorHandler in errorHandlers:
+            errorHandler(message)
+
+    def __onSubscriptionConfirmed(self, subscription, message):
+        '''
+        Stores the ID of a server-side subscription and fills its gap (if any).
+        '''
+        subscriptionId = message["body"]["data"]
+        subscription.setSubscriptionId(subscriptionId)
+        if (subscription.isCancelled()):
+            self.__endpoint.unsubscribe(subscriptionId)
+            return
+        self.__subscriptionsById[subscriptionId] = subscription
+        since = subscription.getGapStart()
+        if (since is None):
+            return
+        # The INDICATION messages will be buffered until the instances of the gap are received. The gap has no end:
+        # the SIB clock might not agree with ours, so only the timestamps of the instances are compared.
+        subscription.startBackfill()
+        backfillQuery = subscription.getBackfillQuery()(since, None)
+        self.__logger.debug("Filling the gap of {0} with {1}".format(subscription.getKey(), backfillQuery))
+        self.__endpoint.query(message["ontology"], backfillQuery, subscription.getBackfillQueryType(),
+                              rowHandler=_BackfillRowHandler(self, subscription))
+
+    def _onBackfillCompleted(self, subscription, rows, message):
+        '''
+        Hands the instances of a gap and the buffered INDICATION messages to the local subscribers.
+        This method is invoked from the backfill row handlers.
+
+        Keyword arguments:
+        subscription    -- the shared subscription.
+        rows            -- the instances returned by the backfill query.
+        message         -- the QUERY response.
+        '''
+        with self.__lock:
+            if (not subscription.isBackfilling()):
+                return # The connection was lost again
+            (since, bufferedMessages) = subscription.stopBackfill()
+            if (not message["body"]["ok"]):
+                self.__logger.warning("Couldn't fill the gap of {0}: {1}".format(subscription.getKey(), message["body"].get("error")))
+                rows = []
+            getTimestamp = subscription.getTimestamp
+            rows = [row for row in rows if not getTimestamp(row) is None and since < getTimestamp(row)]
+            rows.sort(key=getTimestamp)
+            subscription.updateLastSeen(rows)
+            # The gap ends with the newest instance that was retrieved
+            if (rows):
+                until = getTimestamp(rows[-1])
+            else:
+                until = since
+            messages = []
+            if (rows):
+                messages.append({"messageId" : None, "sessionKey" : message["sessionKey"], "ontology" : message["ontology"],
+                                 "messageType" : SSAP_MESSAGE_TYPE.INDICATION, "direction" : SSAP_MESSAGE_DIRECTION.RESPONSE,
+                                 "body" : {"subscriptionId" : subscription.getSubscriptionId(), "data" : rows, "backfill" : True}})
+            for bufferedMessage in bufferedMessages:
+                # The instances of the gap might have been notified too
+                bufferedMessage = _removeInstances(bufferedMessage, lambda instance: not getTimestamp(instance) is None and
+                                                   getTimestamp(instance) <= until)
+                if (not bufferedMessage is None):
+                    messages.append(bufferedMessage)
+            handlers = subscription.getHandlers()
+        self.__logger.debug("{0} instances were retrieved to fill the gap of {1}".format(len(rows), subscription.getKey()))
+        for message in messages:
+            for handler in handlers:
+                handler(message)
+
+    def __onIndication(self, message):
+        '''
+        Hands an INDICATION message to all the local subscribers of its subscription.
+        '''
+        with self.__lock:
+            subscription = None
+            for field in SharedSubscriptionManager.SUBSCRIPTION_ID_FIELDS:
+                if (field in message["body"]):
+                    subscription = self.__subscriptionsById.get(message["body"][field])
+                    break
+            else:
+                # Without a subscription ID, we can only route the message if the ontology has one subscription
+                candidates = [s for s in self.__subscriptionsById.values() if s.getKey()[0] == message["ontology"]]
+                if (len(candidates) == 1):
+                    subscription = candidates[0]
+            if (subscription is None):
+                return
+            if (subscription.isBackfilling()):
+                subscription.bufferMessage(message)
+                return
+            subscription.updateLastSeen(_getInstances(message))
+            handlers = subscription.getHandlers()
+        for handler in handlers:
+            handler(message)
+
+def _getInstances(message):
+    data = message["body"].get("data")
+    if (data is None):
+        return ()
+    if (not isinstance(data, (list, tuple))):
+        return (data,)
+    return data
+
+def _removeInstances(message, predicate):
+    '''
+    Returns a copy of an INDICATION message without the instances that match a predicate, the
+    message itself if none of them matches, or None if all of them match.
+    '''
+    instances = _getInstances(message)
+    remainingInstances = [instance for instance in instances if not predicate(instance)]
+    if (len(remainingInstances) == len(instances)):
+        return message
+    if (not remainingInstances):
+        return None
+    copy = dict((key, message[key]) for key in message.keys())
+    copy["body"] = dict(message["body"].items())
+    copy["body"]["data"] = remainingInstances
+    return copy
+
+class _BackfillRowHandler(SSAPRowHandler):
+    '''
+    Collects the instances of a gap.
+    '''
+
+    def __init__(self, manager, subscription):
+        self.__manager = manager
+        self.__subscription = subscription
+        self.__rows = []
+
+    def onRow(self, row):
+        # Do not call this method from client code!!!
+        self.__rows.append(row)
+
+    def onQueryCompleted(self, message):
+        # Do not call this method from client code!!!
+        rows = self.__rows
+        data = message["body"].get("data")
+        if (not rows and isinstance(data, list)):
+            rows = list(data) # The rows were not streamed
+        self.__manager._onBackfillCompleted(self.__subscription, rows, message)
+
+class SharedSubscriptionHandle(object):
+    '''
+    Represents a local subscriber of a shared subscription.
+    '''
+
+    def __init__(self, manager, subscription, handler, errorHandler=None):
+        '''
+        Initializes the state of the handle.
+
+        Keyword arguments:
+        manager        -- the SharedSubscriptionManager that created the handle.
+        subscription   -- the shared subscription.
+        handler        -- the function that will handle the INDICATION messages.
+        errorHandler   -- the function that will receive the SUBSCRIBE response if the subscription is rejected.
+        '''
+        self.__manager = manager
+        self.__subscription = subscription
+        self.__handler = handler
+        self.__errorHandler = errorHandler
+        self.__cancelled = False
+
+    def getHandler(self):
+        '''
+        Returns the function that handles the INDICATION messages.
+        '''
+        return self.__handler
+
+    def getErrorHandler(self):
+        '''
+        Returns the function that handles the rejection of the subscription (or None).
+        '''
+        return self.__errorHandler
+
+    def isRejected(self):
+        '''
+        Checks if the SIB has rejected the server-side subscription.
+        '''
+        return self.__subscription.isRejected()
+
+    def getError(self):
+        '''
+        Returns the error message of the SIB if it has rejected the server-side subscription (or None).
+        '''
+        return self.__subscription.getError()
+
+    def getSubscriptionId(self):
+        '''
+        Returns the ID of the server-side subscription (or None if it has not been confirmed yet).
+        '''
+        return self.__subscription.getSubscriptionId()
+
+    def cancel(self):
+        '''
+        Removes the local subscriber. The server-side subscription will be cancelled if there are no
+        other local subscribers.
+        '''
+        if (self.__cancelled):
+            raise InvalidSSAPOperation("The subscription has already been cancelled")
+        self.__cancelled = True
+        self.__manager._cancel(self)
+
+    def _getSubscription(self):
+        return self.__subscription
+
+class _SharedSubscription(object):
+    '''
+    A server-side subscription and its local subscribers.
+    '''
+
+    def __init__(self, key, timestampField=None, backfillQuery=None, backfillQueryType=None):
+        self.__key = key
+        self.__subscriptionId = None
+        self.__handles = []
+        self.__handlers = ()
+        self.__cancelled = False
+        self.__rejected = False
+        self.__error = None
+        if (timestampField is None):
+            self.__getTimestamp = None
+        else:
+            self.__getTimestamp = compileFieldGetter(timestampField)
+        self.__backfillQuery = backfillQuery
+        self.__backfillQueryType = backfillQueryType
+        # The timestamp of the newest instance that has been handed to the subscribers
+        self.__lastSeen = None
+        # The start of the gap that will be filled after subscribing again
+        self.__gapStart = None
+        # While the gap is being filled, the INDICATION messages are buffered here
+        self.__bufferedMessages = None
+
+    def getKey(self):
+        return self.__key
+
+    def getSubscriptionId(self):
+        return self.__subscriptionId
+
+    def setSubscriptionId(self, subscriptionId):
+        self.__subscriptionId = subscriptionId
+        if (self.__lastSeen is None and not self.__getTimestamp is None):
+            # Until an instance is received, the gaps start when the subscription is confirmed for the first time
+            self.__lastSeen = time()
+
+    def getTimestamp(self, instance):
+        return toEpochSeconds(self.__getTimestamp(instance))
+
+    def getBackfillQuery(self):
+        return self.__backfillQuery
+
+    def getBackfillQueryType(self):
+        return self.__backfillQueryType
+
+    def updateLastSeen(self, instances):
+        if (self.__getTimestamp is None):
+            return
+        for instance in instances:
+            timestamp = self.getTimestamp(instance)
+            if (not timestamp is None and (self.__lastSeen is None or timestamp > self.__lastSeen)):
+                self.__lastSeen = timestamp
+
+    def setLost(self):
+        '''
+        Marks the server-side subscription as lost.
+        '''
+        self.__subscriptionId = None
+        if (self.__getTimestamp is None):
+            return
+        if (self.__bufferedMessages is None):
+            self.__gapStart = self.__lastSeen
+        # Otherwise, the previous gap was not filled. The buffered messages will be retrieved with it.
+        self.__bufferedMessages = None
+
+    def getGapStart(self):
+        return self.__gapStart
+
+    def startBackfill(self):
+        self.__bufferedMessages = []
+
+    def isBackfilling(self):
+        return not self.__bufferedMessages is None
+
+    def bufferMessage(self, message):
+        self.__bufferedMessages.append(message)
+
+    def stopBackfill(self):
+        '''
+        Returns the (start, buffered messages) tuple of the gap.
+        '''
+        result = (self.__gapStart, self.__bufferedMessages)
+        self.__gapStart = None
+        self.__bufferedMessages = None
+        return result
+
+    def isCancelled(self):
+        return self.__cancelled
+
+    def setCancelled(self):
+        self.__cancelled = True
+
+    def isRejected(self):
+        return self.__rejected
+
+    def setRejected(self, error):
+        self.__rejected = True
+        self.__error = error
+
+    def getError(self):
+        return self.__error
+
+    def addHandle(self, handle):
+        self.__handles.append(handle)
+        self.__handlers = tuple(h.getHandler() for h in self.__handles)
+
+    def removeHandle(self, handle):
+        self.__handles.remove(handle)
+        self.__handlers = tuple(h.getHandler() for h in self.__handles)
+
+    def getHandleCount(self):
+        return len(self.__handles)
+
+    def getHandlers(self):
+        # An immutable snapshot, so the handlers can be invoked without holding the lock
+        return self.__handlers
+
+    def getErrorHandlers(self):
+        return tuple(h.getErrorHandler() for h in self.__handles if not h.getErrorHandler() is None)
@@ -0,0 +1,85 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+ 
+ Measures the cold-start cost of the SSAP API. Each measurement runs in a fresh interpreter.
+ 
+ Usage: python -m ssap.tests.benchmarks.importtime [module] [repetitions]
+'''
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# The modules that must not be imported by "import ssap.factories"
+DEFERRED_MODULES = ("ws4py", "inspect", "ssap.implementations.websockets", "ssap.implementations.rfc6455",
+                    "ssap.implementations.multiplex", "ssap.implementations.capture")
+
+_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {0}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed" : elapsed, "modules" : sorted(sys.modules.keys())}}))
+'''
+
+def measureImport(moduleName):
+    '''
+    Imports a module in a fresh interpreter. Returns the import time (in seconds) and the names
+    of the modules that were loaded.
+    
+    Keyword arguments:
+    moduleName    -- the name of the module to import.
+    '''
+    environment = dict(os.environ)
+    sourceDirectory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [sourceDirectory, environment.get("PYTHONPATH")]))
+    output = subprocess.check_output([sys.executable, "-c", _PROBE.format(moduleName)], env=environment)
+    result = json.loads(output.decode("utf-8").splitlines()[-1])
+    return (result["elapsed"], result["modules"])
+
+def benchmark(moduleName, repetitions):
+    '''
+    Returns the minimum and the median import times of a module (in seconds) and the modules
+    that it loads.
+    '''
+    times = []
+    for _ in range(repetitions):
+        (elapsed, modules) = measureImport(moduleName)
+        times.append(elapsed)
+    times.sort()
+    return (times[0], times[len(times) // 2], modules)
+
+class TestImportTime(unittest.TestCase):
+    
+    def testFactoriesDoNotImportTransports(self):
+        (_elapsed, modules) = measureImport("ssap.factories")
+        for moduleName in DEFERRED_MODULES:
+            self.assertNotIn(moduleName, modules)
+    
+    def testTransportsAreImportedOnDemand(self):
+        (_elapsed, modules) = measureImport("ssap.factories; " +
+            "ssap.factories.SSAPEndpointFactory.buildTransportFactory('native')")
+        self.assertIn("ssap.implementations.rfc6455", modules)
+        self.assertNotIn("ws4py", modules)
+        
+if __name__ == "__main__":
+    moduleName = "ssap.factories"
+    repetitions = 20
+    if (len(sys.argv) > 1):
+        moduleName = sys.argv[1]
+    if (len(sys.argv) > 2):
+        repetitions = int(sys.argv[2])
+    (best, median, modules) = benchmark(moduleName, repetitions)
+    ssapModules = [name for name in modules if name.startswith("ssap")]
+    print("import {0}: best {1:.2f} ms, median {2:.2f} ms ({3} repetitions)".format(moduleName, best * 1000,
+                                                                                median * 1000, repetitions))
+    print("{0} modules loaded, {1} of them from the SSAP API: {2}".format(len(modules), len(ssapModules),
+                                                                         ", ".join(ssapModules)))
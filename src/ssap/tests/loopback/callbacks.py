@@ -0,0 +1,66 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import unittest
+from functools import partial
+from ssap.core import MultiHandlerSSAPCallback, SSAP_MESSAGE_TYPE
+from ssap.exceptions import InvalidSSAPCallback
+
+class MessageCollector(object):
+    
+    def __init__(self):
+        self.messages = []
+        
+    def __call__(self, message):
+        self.messages.append(message)
+        
+    def collect(self, message):
+        self.messages.append(message)
+        
+    def collectWithTag(self, tag, message):
+        self.messages.append((tag, message))
+
+class TestHandlerValidation(unittest.TestCase):
+    
+    def testValidHandlersAreAccepted(self):
+        collector = MessageCollector()
+        def handler(message):
+            pass
+        def handlerWithDefaults(message, retries=3, *args, **kwargs):
+            pass
+        for validHandler in (handler, handlerWithDefaults, lambda message: None, lambda *args: None, collector,
+                             collector.collect, partial(collector.collectWithTag, "tag"), partial(handlerWithDefaults, retries=1),
+                             [].append, print):
+            MultiHandlerSSAPCallback().registerHandler(SSAP_MESSAGE_TYPE.INSERT, validHandler)
+            
+    def testInvalidHandlersAreRejected(self):
+        collector = MessageCollector()
+        def noArguments():
+            pass
+        def twoArguments(first, second):
+            pass
+        def keywordOnly(message, *, required):
+            pass
+        for invalidHandler in (None, "handler", noArguments, twoArguments, keywordOnly, collector.collectWithTag,
+                               partial(collector.collect, "message")):
+            with self.assertRaises(InvalidSSAPCallback):
+                MultiHandlerSSAPCallback().registerHandler(SSAP_MESSAGE_TYPE.INSERT, invalidHandler)
+                
+    def testPartialAndCallableHandlersReceiveTheMessages(self):
+        callback = MultiHandlerSSAPCallback()
+        collector = MessageCollector()
+        callback.registerHandler(SSAP_MESSAGE_TYPE.QUERY, collector)
+        callback.registerHandler(SSAP_MESSAGE_TYPE.QUERY, partial(collector.collectWithTag, "partial"))
+        message = {"messageType" : SSAP_MESSAGE_TYPE.QUERY, "body" : {"ok" : True, "data" : None}}
+        callback.onSSAPMessageReceived(message)
+        self.assertEqual(collector.messages, [message, ("partial", message)])
+        
+if __name__ == "__main__":
+    unittest.main()
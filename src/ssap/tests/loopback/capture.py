@@ -0,0 +1,82 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep
+from ssap.core import SSAP_MESSAGE_TYPE
+from ssap.factories import SSAPEndpointFactory
+from ssap.implementations.capture import RecordingTransportFactory, ReplayTransportFactory, SSAPCaptureReader, \
+    FRAME_SENT, FRAME_RECEIVED
+from ssap.implementations.loopback import LoopbackSIB, LoopbackTransportFactory
+from ssap.tests.utils.loopback import CollectingCallback, TOKEN, INSTANCE
+
+class TestCapture(unittest.TestCase):
+    
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__capturePath = os.path.join(self.__directory, "session.ssapcap")
+        
+    def tearDown(self):
+        shutil.rmtree(self.__directory, ignore_errors=True)
+        
+    def readMessageTypes(self, path, direction):
+        return [json.loads(payload.decode("utf-8"))["messageType"] for (frameDirection, _timestamp, payload)
+                in SSAPCaptureReader(path) if frameDirection == direction]
+        
+    def record(self):
+        factory = RecordingTransportFactory(self.__capturePath, LoopbackTransportFactory(LoopbackSIB()))
+        callback = CollectingCallback()
+        endpoint = SSAPEndpointFactory.buildWebsocketBasedSSAPEndpoint("loopback://sib", callback, False, None, factory)
+        endpoint.joinWithToken(TOKEN, INSTANCE)
+        endpoint.insert("Sensor", '{"Sensor" : {"measure" : 1}}')
+        callback.waitFor(SSAP_MESSAGE_TYPE.INSERT)
+        return (factory, callback, endpoint)
+    
+    def testFramesCanBeReadWhileRecording(self):
+        (_factory, _callback, _endpoint) = self.record()
+        self.assertEqual(["JOIN", "INSERT"], self.readMessageTypes(self.__capturePath, FRAME_SENT))
+        self.assertEqual(["JOIN", "INSERT"], self.readMessageTypes(self.__capturePath, FRAME_RECEIVED))
+        
+    def testTruncatedFramesAreIgnored(self):
+        self.record()
+        with open(self.__capturePath, "ab") as captureFile:
+            captureFile.write(b"\x00" * 20)
+        self.assertEqual(["JOIN", "INSERT"], self.readMessageTypes(self.__capturePath, FRAME_RECEIVED))
+        
+    def testReconnectionsAreRecordedInSeparateFiles(self):
+        (factory, callback, endpoint) = self.record()
+        endpoint.leave()
+        callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        sleep(0.2) # The connection is closed after the callback processes the LEAVE response
+        endpoint.joinWithToken(TOKEN, INSTANCE)
+        callback.waitFor(SSAP_MESSAGE_TYPE.JOIN, 2)
+        endpoint.query("Sensor", "db.Sensor.find()")
+        callback.waitFor(SSAP_MESSAGE_TYPE.QUERY)
+        paths = factory.getCapturePaths()
+        self.assertEqual([self.__capturePath, self.__capturePath + ".1"], paths)
+        self.assertEqual(["JOIN", "INSERT", "LEAVE"], self.readMessageTypes(paths[0], FRAME_SENT))
+        self.assertEqual(["JOIN", "QUERY"], self.readMessageTypes(paths[1], FRAME_SENT))
+        
+    def testReplay(self):
+        (_factory, recordingCallback, _endpoint) = self.record()
+        callback = CollectingCallback()
+        endpoint = SSAPEndpointFactory.buildWebsocketBasedSSAPEndpoint("loopback://sib", callback, False, None,
+                                                                        ReplayTransportFactory(self.__capturePath, False))
+        endpoint.joinWithToken(TOKEN, INSTANCE)
+        endpoint.insert("Sensor", '{"Sensor" : {"measure" : 1}}')
+        replayed = callback.waitFor(SSAP_MESSAGE_TYPE.INSERT)
+        self.assertEqual(recordingCallback.getMessages(SSAP_MESSAGE_TYPE.INSERT), replayed)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import unittest
+from ssap.core import SSAP_MESSAGE_TYPE
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.messages import columnar
+from ssap.messages.columnar import ColumnarBulkEncoder
+from ssap.messages.messages import SSAPBulkRequest, _SSAPMessageFactory
+from ssap.tests.utils.loopback import RecordingSIB, CollectingCallback, buildLoopbackEndpoint
+
+numpy = columnar.numpy
+
+class TestColumnarBulkEncoder(unittest.TestCase):
+    
+    TEMPLATE = {"Sensor" : {"assetId" : "$assetId", "measure" : "$measure", "unit" : "$unknown", "percent" : "100%s",
+                            "geometry" : {"type" : "Point", "coordinates" : ["$latitude", "$longitude"]}}}
+    
+    COLUMNS = {"assetId" : ["S_%02d" % index for index in range(5)], "measure" : [0, 1.5, None, True, "x \"y\""],
+               "latitude" : [40.0 + index for index in range(5)], "longitude" : [-3.5] * 5}
+    
+    def buildRows(self, columns, count):
+        return [{"Sensor" : {"assetId" : columns["assetId"][index], "measure" : columns["measure"][index],
+                             "unit" : "$unknown", "percent" : "100%s",
+                             "geometry" : {"type" : "Point", "coordinates" : [columns["latitude"][index], columns["longitude"][index]]}}}
+                for index in range(count)]
+    
+    def testMessagesMatchTheFactoryMessages(self):
+        encoder = ColumnarBulkEncoder("Sensor", TestColumnarBulkEncoder.TEMPLATE, TestColumnarBulkEncoder.COLUMNS)
+        self.assertEqual(encoder.getRowCount(), 5)
+        rows = self.buildRows(TestColumnarBulkEncoder.COLUMNS, 5)
+        messages = list(encoder.encode(rowsPerMessage=2))
+        self.assertEqual(len(messages), 3)
+        for (index, message) in enumerate(messages):
+            bulkRequest = SSAPBulkRequest()
+            for row in rows[index * 2:index * 2 + 2]:
+                bulkRequest.addInsertMessage("Sensor", row)
+            self.assertEqual(message.render("key"), _SSAPMessageFactory.buildBulkMessage(bulkRequest, "Sensor", "key"))
+            
+    def testInvalidColumns(self):
+        self.assertRaises(InvalidSSAPOperation, ColumnarBulkEncoder, "Sensor", {"Sensor" : {"measure" : 1}}, {"measure" : [1]})
+        self.assertRaises(InvalidSSAPOperation, ColumnarBulkEncoder, "Sensor", {"a" : "$a", "b" : "$b"}, {"a" : [1, 2], "b" : [1]})
+        encoder = ColumnarBulkEncoder("Sensor", {"a" : "$a"}, {"a" : [1]})
+        self.assertRaises(InvalidSSAPOperation, list, encoder.encode(0))
+        
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def testArraysAreSerializedLikeTheirValues(self):
+        columns = {"measure" : numpy.array([1.25, numpy.nan, numpy.inf, -2.0]),
+                   "count" : numpy.array([1, 2, 3, 4], dtype=numpy.uint16),
+                   "valid" : numpy.array([True, False, True, False]),
+                   "timestamp" : numpy.array(["2014-04-29T08:24:54.005", "NaT", "2014-04-29T08:24:55", "2014-04-30"],
+                                             dtype="datetime64[ms]"),
+                   "coordinates" : numpy.array([[40.5, -3.5], [41.0, -3.0], [42.0, -2.0], [43.0, -1.0]]),
+                   "name" : numpy.array(["a", "b", "c", "ñ"])}
+        template = {"Sensor" : {"measure" : "$measure", "count" : "$count", "valid" : "$valid", "name" : "$name",
+                                "timestamp" : {"$date" : "$timestamp"}, "coordinates" : "$coordinates"}}
+        encoder = ColumnarBulkEncoder("Sensor", template, columns)
+        (message,) = list(encoder.encode())
+        items = json.loads(message.render(None))["body"]
+        instances = [item["body"]["data"]["Sensor"] for item in items]
+        self.assertEqual([instance["measure"] for instance in instances], [1.25, None, None, -2.0])
+        self.assertEqual([instance["count"] for instance in instances], [1, 2, 3, 4])
+        self.assertEqual([instance["valid"] for instance in instances], [True, False, True, False])
+        self.assertEqual([instance["timestamp"]["$date"] for instance in instances],
+                         ["2014-04-29T08:24:54.005Z", None, "2014-04-29T08:24:55.000Z", "2014-04-30T00:00:00.000Z"])
+        self.assertEqual(instances[0]["coordinates"], [40.5, -3.5])
+        self.assertEqual(instances[3]["name"], "ñ")
+        self.assertTrue(all(item["type"] == "INSERT" and item["ontology"] == "Sensor" for item in items))
+        
+    def testEndpointsInsertTheColumns(self):
+        sib = RecordingSIB(queryLimit=100)
+        callback = CollectingCallback()
+        endpoint = buildLoopbackEndpoint(sib, callback)
+        callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)
+        columns = {"assetId" : ["S_%02d" % index for index in range(25)], "measure" : list(range(25)),
+                   "latitude" : [40.0] * 25, "longitude" : [-3.5] * 25}
+        self.assertEqual(endpoint.insertColumns("Sensor", TestColumnarBulkEncoder.TEMPLATE, columns, rowsPerMessage=10), 3)
+        responses = callback.waitFor(SSAP_MESSAGE_TYPE.BULK, 3)
+        self.assertTrue(all(response["body"]["ok"] for response in responses))
+        endpoint.query("Sensor", "db.Sensor.find()")
+        data = callback.waitFor(SSAP_MESSAGE_TYPE.QUERY)[0]["body"]["data"]
+        self.assertEqual(json.loads(data), self.buildRows(columns, 25))
+        endpoint.leave()
+        callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        
+if __name__ == "__main__":
+    unittest.main()
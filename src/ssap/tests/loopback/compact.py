@@ -0,0 +1,138 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import io
+import json
+import sys
+import unittest
+from contextlib import redirect_stdout
+from ssap.core import SSAP_MESSAGE_TYPE, MultiHandlerSSAPCallback
+from ssap.factories import SSAPEndpointFactory
+from ssap.implementations.loopback import LoopbackTransportFactory
+from ssap.messages.messages import SSAPMessage, FrozenDict, FrozenList, _SSAPMessageParser
+from ssap.tests.utils.callbacks import TestCallback
+from ssap.tests.utils.loopback import TOKEN, INSTANCE, RecordingSIB, CollectingCallback, waitUntil
+
+class TestCompactMessages(unittest.TestCase):
+    
+    INDICATION = json.dumps({"messageType" : "INDICATION", "direction" : "RESPONSE", "sessionKey" : "key", "ontology" : "Sensor",
+                             "body" : '{"data":"[{"Sensor":{"measure":1,"tags":["a","b"]}}]","subscriptionId":"s"}'}).encode("utf-8")
+    
+    def setUp(self):
+        self.sib = RecordingSIB()
+        
+    def buildEndpoint(self, callback, transportFactory=None):
+        if (transportFactory is None):
+            transportFactory = LoopbackTransportFactory(self.sib)
+        endpoint = SSAPEndpointFactory.buildWebsocketBasedSSAPEndpoint("loopback://sib", callback, False, None,
+                                                                        transportFactory, True)
+        endpoint.joinWithToken(TOKEN, INSTANCE)
+        return endpoint
+    
+    def leave(self, endpoint, callback):
+        endpoint.leave()
+        callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        
+    def assertFrozen(self, value):
+        if (isinstance(value, dict)):
+            self.assertIs(FrozenDict, type(value))
+            for (key, item) in value.items():
+                self.assertIs(sys.intern(key), key)
+                self.assertFrozen(item)
+        elif (isinstance(value, list)):
+            self.assertIs(FrozenList, type(value))
+            for item in value:
+                self.assertFrozen(item)
+                
+    def testMessagesAreReadOnly(self):
+        callback = CollectingCallback()
+        endpoint = self.buildEndpoint(callback)
+        callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)
+        endpoint.subscribe("Sensor", "db.Sensor.find()")
+        callback.waitFor(SSAP_MESSAGE_TYPE.SUBSCRIBE)
+        endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1, "tags" : ["a", "b"]}}))
+        indication = callback.waitFor(SSAP_MESSAGE_TYPE.INDICATION)[0]
+        self.assertIsInstance(indication, SSAPMessage)
+        self.assertFrozen(indication["body"])
+        instance = indication["body"]["data"][0]
+        self.assertEqual({"Sensor" : {"measure" : 1, "tags" : ["a", "b"]}}, instance)
+        with self.assertRaises(TypeError):
+            indication["ontology"] = "Other"
+        with self.assertRaises(TypeError):
+            indication["body"]["ok"] = False
+        with self.assertRaises(TypeError):
+            indication["body"]["data"].append({})
+        with self.assertRaises(TypeError):
+            instance["Sensor"]["measure"] = 2
+        with self.assertRaises(TypeError):
+            instance["Sensor"]["tags"].sort()
+        # The copies are mutable
+        copy = indication.toDict()
+        copy["body"]["data"][0]["Sensor"]["measure"] = 2
+        self.assertEqual(1, instance["Sensor"]["measure"])
+        self.leave(endpoint, callback)
+        
+    def testHandlersShareTheMessage(self):
+        received = []
+        rejected = []
+        def modifyingHandler(message):
+            received.append(message)
+            try:
+                message["body"]["data"] = None
+            except TypeError as e:
+                rejected.append(e)
+        callback = MultiHandlerSSAPCallback()
+        callback.registerHandler(SSAP_MESSAGE_TYPE.INSERT, modifyingHandler)
+        callback.registerHandler(SSAP_MESSAGE_TYPE.INSERT, received.append)
+        endpoint = self.buildEndpoint(callback)
+        waitUntil(lambda: self.sib.requests == ["JOIN"])
+        endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        waitUntil(lambda: len(received) == 2)
+        self.assertIs(received[0], received[1])
+        # The first handler could not modify the message that the second one received
+        self.assertEqual(1, len(rejected))
+        self.assertIsNotNone(received[1]["body"]["data"])
+        
+    def testCompactMessagesHaveTheShapeOfTheDictionaries(self):
+        serializedMessages = [TestCompactMessages.INDICATION]
+        loopbackTransportFactory = LoopbackTransportFactory(self.sib)
+        def transportFactory(serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+            def capture(data):
+                serializedMessages.append(data)
+                dataReceivedEventHandler(data)
+            return loopbackTransportFactory(serverUrl, protocols, connectionEstablishedHandler, capture)
+        callback = CollectingCallback()
+        endpoint = self.buildEndpoint(callback, transportFactory)
+        endpoint.subscribe("Sensor", "db.Sensor.find()")
+        endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1, "tags" : ["a", "b"]}}))
+        endpoint.query("Sensor", "db.Sensor.find()")
+        self.sib.rejected["DELETE"] = 1
+        self.sib.errorCodes["DELETE"] = "PERSISTENCE"
+        endpoint.delete("Sensor", "db.Sensor.remove()")
+        callback.waitFor(SSAP_MESSAGE_TYPE.DELETE)
+        self.leave(endpoint, callback)
+        self.assertEqual(8, len(serializedMessages))
+        for serializedMessage in serializedMessages:
+            message = _SSAPMessageParser.parse(serializedMessage)
+            compactMessage = _SSAPMessageParser.parse(serializedMessage, compact=True)
+            self.assertEqual(message, compactMessage)
+            self.assertEqual(message, compactMessage.toDict())
+            self.assertEqual(sorted(message.keys()), sorted(compactMessage.keys()))
+            self.assertFrozen(compactMessage["body"])
+            
+    def testCompactMessagesCanBePrinted(self):
+        message = _SSAPMessageParser.parse(TestCompactMessages.INDICATION, compact=True)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            TestCallback().onSSAPMessageReceived(message)
+        self.assertIn('"measure":1', output.getvalue())
+        
+if __name__ == "__main__":
+    unittest.main()
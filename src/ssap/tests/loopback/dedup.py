@@ -0,0 +1,89 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import unittest
+from unittest import mock
+from ssap.dedup import DeduplicatingHandler
+from ssap.exceptions import InvalidSSAPOperation
+
+def buildIndication(*instances):
+    return {"messageType" : "INDICATION", "body" : {"subscriptionId" : "s1", "data" : list(instances)}}
+
+def buildInstance(identifier, timestamp=None, measure=0):
+    instance = {"_id" : {"$oid" : identifier}, "Sensor" : {"assetId" : "S_" + identifier, "measure" : measure}}
+    if (not timestamp is None):
+        instance["Sensor"]["timestamp"] = timestamp
+    return instance
+
+class TestDeduplicatingHandler(unittest.TestCase):
+    
+    def setUp(self):
+        self.received = []
+        
+    def receivedInstances(self):
+        return [instance for message in self.received for instance in message["body"]["data"]]
+    
+    def testTheIdKeyRequiresATimestampOrAWindow(self):
+        self.assertRaises(InvalidSSAPOperation, DeduplicatingHandler, self.received.append)
+        DeduplicatingHandler(self.received.append, timestampField="Sensor.timestamp")
+        DeduplicatingHandler(self.received.append, windowInSeconds=60)
+        DeduplicatingHandler(self.received.append, key="Sensor.assetId")
+        self.assertRaises(InvalidSSAPOperation, DeduplicatingHandler, self.received.append, key="Sensor.assetId", maxEntries=0)
+        self.assertRaises(InvalidSSAPOperation, DeduplicatingHandler, self.received.append, key="Sensor.assetId", windowInSeconds=0)
+        
+    def testDuplicatesAreDiscardedAndUpdatesAreDelivered(self):
+        handler = DeduplicatingHandler(self.received.append, timestampField="Sensor.timestamp")
+        inserted = buildInstance("a", timestamp=1, measure=1)
+        handler(buildIndication(inserted, buildInstance("b", timestamp=1)))
+        # A resubscription delivers the instance again, and then it is updated
+        handler(buildIndication(inserted))
+        updated = buildInstance("a", timestamp=2, measure=2)
+        handler(buildIndication(inserted, updated, {"Sensor" : {"measure" : 3}}))
+        self.assertEqual(len(self.received), 2)
+        self.assertEqual(self.receivedInstances(), [inserted, buildInstance("b", timestamp=1), updated, {"Sensor" : {"measure" : 3}}])
+        stats = handler.getStats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["unkeyed"], stats["size"]), (2, 3, 1, 3))
+        
+    def testTheLeastRecentlySeenIdentitiesAreEvicted(self):
+        handler = DeduplicatingHandler(self.received.append, key="Sensor.assetId", maxEntries=2)
+        handler(buildIndication(buildInstance("a"), buildInstance("b")))
+        handler(buildIndication(buildInstance("a"))) # "b" is now the least recently seen identity
+        handler(buildIndication(buildInstance("c")))
+        self.assertEqual(handler.getStats()["evictions"], 1)
+        self.assertEqual(len(handler), 2)
+        handler(buildIndication(buildInstance("a"), buildInstance("b")))
+        self.assertEqual([instance["Sensor"]["assetId"] for instance in self.receivedInstances()], ["S_a", "S_b", "S_c", "S_b"])
+        
+    def testIdentitiesExpire(self):
+        with mock.patch("ssap.dedup.monotonic") as monotonic:
+            monotonic.return_value = 100.0
+            handler = DeduplicatingHandler(self.received.append, windowInSeconds=10)
+            handler(buildIndication(buildInstance("a")))
+            monotonic.return_value = 105.0
+            handler(buildIndication(buildInstance("a"), buildInstance("b")))
+            # Seeing "a" again has renewed it
+            monotonic.return_value = 112.0
+            handler(buildIndication(buildInstance("a")))
+            self.assertEqual(handler.getStats()["expirations"], 0)
+            monotonic.return_value = 125.0
+            self.assertEqual(handler.getStats()["expirations"], 2)
+            handler(buildIndication(buildInstance("a")))
+        self.assertEqual([instance["_id"]["$oid"] for instance in self.receivedInstances()], ["a", "b", "a"])
+        
+    def testClearForgetsTheIdentities(self):
+        handler = DeduplicatingHandler(self.received.append, key="Sensor.assetId")
+        handler(buildIndication(buildInstance("a")))
+        handler.clear()
+        handler(buildIndication(buildInstance("a")))
+        self.assertEqual(len(self.received), 2)
+        self.assertEqual(handler.getStats()["misses"], 2)
+        
+if __name__ == "__main__":
+    unittest.main()
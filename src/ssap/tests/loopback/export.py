@@ -0,0 +1,133 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from ssap.core import SSAP_QUERY_TYPE
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.export import OntologyExporter, buildArgumentParser, buildKeyPartitions, buildTimePartitions
+from ssap.implementations.loopback import LoopbackTransportFactory
+from ssap.tests.utils.loopback import RecordingSIB, TOKEN, INSTANCE
+
+class _NullTransport(object):
+    
+    def _deliver(self, data):
+        pass
+
+class PartitionFailingSIB(RecordingSIB):
+    '''
+    A loopback SIB that rejects the QUERY requests of a partition a number of times.
+    '''
+    
+    def __init__(self, failingQuery, failures):
+        RecordingSIB.__init__(self, queryLimit=100)
+        self.failingQuery = failingQuery
+        self.failures = failures
+        self.queries = []
+        
+    def process(self, transport, request):
+        if (request["messageType"] == "QUERY"):
+            query = request["body"]["query"]
+            self.queries.append(query)
+            if (query == self.failingQuery and self.failures > 0):
+                self.failures = self.failures - 1
+                self.rejected["QUERY"] = 1
+        RecordingSIB.process(self, transport, request)
+
+class TestOntologyExporter(unittest.TestCase):
+    
+    QUERY = "db.Sensor.find({})"
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.partitions = buildKeyPartitions(TestOntologyExporter.QUERY, "Sensor.assetId", ["S_02", "S_04"])
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def buildSIB(self, failures):
+        sib = PartitionFailingSIB(self.partitions[1], failures)
+        for index in range(5):
+            sib.process(_NullTransport(), {"messageType" : "INSERT", "ontology" : "Sensor", "sessionKey" : None,
+                                           "body" : {"data" : {"Sensor" : {"assetId" : "S_%02d" % index, "measure" : index}}}})
+        return sib
+        
+    def buildOptions(self, *arguments):
+        options = buildArgumentParser().parse_args(["--url", "loopback://sib", "--token", TOKEN, "--instance", INSTANCE,
+                                                    "--ontology", "Sensor", "--field", "Sensor.assetId", "--sessions", "2",
+                                                    "--output-dir", self.directory, "--timeout", "5", "--quiet"] + list(arguments))
+        options.transport = "loopback"
+        options.queryType = SSAP_QUERY_TYPE.NATIVE
+        options.fields = None if options.fields is None else options.fields.split(",")
+        return options
+    
+    def export(self, sib, *arguments):
+        return OntologyExporter(self.buildOptions(*arguments), self.partitions, LoopbackTransportFactory(sib)).run()
+    
+    def getFileNames(self):
+        return sorted(os.listdir(self.directory))
+        
+    def testFailedPartitionsAreRetriedIndividually(self):
+        sib = self.buildSIB(failures=2)
+        results = self.export(sib, "--retries", "2")
+        self.assertEqual(results["failed"], [])
+        self.assertEqual((results["exported"], results["rows"]), (3, 15))
+        self.assertEqual(self.getFileNames(), ["Sensor-0000.jsonl", "Sensor-0001.jsonl", "Sensor-0002.jsonl"])
+        # Only the failed partition was queried again
+        self.assertEqual(sorted(sib.queries), sorted(self.partitions + [self.partitions[1]] * 2))
+        with open(os.path.join(self.directory, "Sensor-0001.jsonl")) as partitionFile:
+            rows = [json.loads(line) for line in partitionFile]
+        self.assertEqual([row["Sensor"]["assetId"] for row in rows], ["S_%02d" % index for index in range(5)])
+        
+    def testExhaustedPartitionsAreResumed(self):
+        sib = self.buildSIB(failures=2)
+        results = self.export(sib, "--retries", "1")
+        self.assertEqual(results["exported"], 2)
+        self.assertEqual([(failure["index"], failure["attempts"], failure["error"]) for failure in results["failed"]],
+                         [(1, 2, "Rejected by the test")])
+        # The temporary file of the failed partition is removed
+        self.assertEqual(self.getFileNames(), ["Sensor-0000.jsonl", "Sensor-0002.jsonl"])
+        sib.queries = []
+        results = self.export(sib, "--retries", "1")
+        self.assertEqual((results["exported"], results["skipped"], results["failed"]), (1, 2, []))
+        self.assertEqual(sib.queries, [self.partitions[1]])
+        results = self.export(sib, "--restart")
+        self.assertEqual((results["exported"], results["skipped"]), (3, 0))
+        
+    def testCsvFiles(self):
+        sib = self.buildSIB(failures=0)
+        results = self.export(sib, "--format", "csv", "--fields", "Sensor.assetId,Sensor.measure,Sensor.missing")
+        self.assertEqual(results["failed"], [])
+        with open(os.path.join(self.directory, "Sensor-0002.csv"), newline="") as partitionFile:
+            rows = list(csv.reader(partitionFile))
+        self.assertEqual(rows[0], ["Sensor.assetId", "Sensor.measure", "Sensor.missing"])
+        self.assertEqual(rows[1:], [["S_%02d" % index, str(index), ""] for index in range(5)])
+        self.assertRaises(ValueError, OntologyExporter, self.buildOptions("--format", "csv"), self.partitions)
+        
+    def testPartitionQueries(self):
+        self.assertEqual(self.partitions[1], 'db.Sensor.find({"Sensor.assetId": {"$gte": "S_02", "$lt": "S_04"}})'
+                         '.sort({"Sensor.assetId": 1})')
+        self.assertEqual(len(self.partitions), 3)
+        partitions = buildTimePartitions('db.Sensor.find({"Sensor.measure": 1})', "Sensor.timestamp", 0, 10, 4)
+        self.assertEqual(len(partitions), 4)
+        self.assertIn('"$gte": {"$date": "1970-01-01T00:00:02.500Z"}', partitions[1])
+        self.assertIn('"$lt": {"$date": "1970-01-01T00:00:10.000Z"}', partitions[3])
+        self.assertIn('{"Sensor.measure": 1}', partitions[0])
+        # Every partition is at least a millisecond long
+        self.assertEqual(len(buildTimePartitions(TestOntologyExporter.QUERY, "t", 0, 0.002, 10)), 2)
+        self.assertRaises(InvalidSSAPOperation, buildTimePartitions, TestOntologyExporter.QUERY, "t", 10, 10, 2)
+        self.assertRaises(InvalidSSAPOperation, buildKeyPartitions, TestOntologyExporter.QUERY, "k", [2, 1])
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import socket
+import unittest
+from time import sleep
+from ssap.core import SSAP_MESSAGE_TYPE, SSAPConnectionListener
+from ssap.implementations.failover import probeServerUrl, rankServerUrls
+from ssap.implementations.loopback import LoopbackTransportFactory
+from ssap.implementations.websockets import WebsocketBasedSSAPEndpoint, WebsocketConnectionData
+from ssap.tests.utils.loopback import RecordingSIB, CollectingCallback, TOKEN, INSTANCE, waitUntil
+
+class FakeHealthCheck(object):
+    '''
+    Returns fixed latencies and records the probed URLs.
+    '''
+    
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.probedUrls = []
+        
+    def __call__(self, url, timeout):
+        self.probedUrls.append(url)
+        latency = self.latencies[url]
+        if (isinstance(latency, Exception)):
+            raise latency
+        return latency
+
+class RecordingListener(SSAPConnectionListener):
+    
+    def __init__(self):
+        self.lost = []
+        self.restored = []
+        
+    def onConnectionLost(self, reason):
+        self.lost.append(reason)
+        
+    def onConnectionRestored(self, serverUrl):
+        self.restored.append(serverUrl)
+
+class TestFailover(unittest.TestCase):
+    
+    def testHealthyUrlsAreSortedByLatency(self):
+        healthCheck = FakeHealthCheck({"ws://a" : 0.3, "ws://b" : None, "ws://c" : 0.1, "ws://d" : ValueError("Boom"),
+                                       "ws://e" : 0.2})
+        (healthyUrls, unhealthyUrls) = rankServerUrls(["ws://a", "ws://b", "ws://c", "ws://d", "ws://e"], 1, healthCheck)
+        self.assertEqual(healthyUrls, ["ws://c", "ws://e", "ws://a"])
+        self.assertEqual(unhealthyUrls, ["ws://b", "ws://d"])
+        
+    def testSlowProbesAreUnhealthy(self):
+        def healthCheck(url, timeout):
+            if (url == "ws://slow"):
+                sleep(1)
+            return 0.0
+        (healthyUrls, unhealthyUrls) = rankServerUrls(["ws://slow", "ws://fast"], 0.2, healthCheck)
+        self.assertEqual((healthyUrls, unhealthyUrls), (["ws://fast"], ["ws://slow"]))
+        
+    def testTheFailedUrlIsTriedLast(self):
+        healthCheck = FakeHealthCheck({"ws://a" : 0.1, "ws://b" : None, "ws://c" : 0.2})
+        connectionData = WebsocketConnectionData(["ws://a", "ws://b", "ws://c"], healthCheck=healthCheck)
+        self.assertEqual(connectionData.getCandidateServerUrls(), ["ws://a", "ws://c", "ws://b"])
+        healthCheck.probedUrls = []
+        self.assertEqual(connectionData.getCandidateServerUrls("ws://a"), ["ws://c", "ws://b", "ws://a"])
+        # The failed server is not probed
+        self.assertEqual(sorted(healthCheck.probedUrls), ["ws://b", "ws://c"])
+        
+    def testASingleUrlIsNotProbed(self):
+        healthCheck = FakeHealthCheck({})
+        connectionData = WebsocketConnectionData("ws://a", healthCheck=healthCheck)
+        self.assertEqual(connectionData.getCandidateServerUrls("ws://a"), ["ws://a"])
+        self.assertEqual(healthCheck.probedUrls, [])
+        
+    def testProbes(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        try:
+            port = server.getsockname()[1]
+            self.assertGreaterEqual(probeServerUrl("ws://127.0.0.1:{0}/sib".format(port), 1), 0)
+        finally:
+            server.close()
+        self.assertIsNone(probeServerUrl("ws://127.0.0.1:{0}/sib".format(port), 1))
+        self.assertIsNone(probeServerUrl("ws://127.0.0.1:99999/sib", 1))
+        self.assertEqual(probeServerUrl("loopback://sib", 1), 0.0)
+        
+    def testEndpointsConnectToTheFastestAvailableServer(self):
+        sib = RecordingSIB()
+        loopbackTransportFactory = LoopbackTransportFactory(sib)
+        def transportFactory(serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+            if (serverUrl == "loopback://b"):
+                raise Exception("Connection refused")
+            return loopbackTransportFactory(serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler)
+        healthCheck = FakeHealthCheck({"loopback://a" : 0.5, "loopback://b" : 0.1, "loopback://c" : 0.3, "loopback://d" : None})
+        connectionData = WebsocketConnectionData(["loopback://a", "loopback://b", "loopback://c", "loopback://d"],
+                                                 transportFactory, connectTimeout=1, healthCheck=healthCheck)
+        callback = CollectingCallback()
+        endpoint = WebsocketBasedSSAPEndpoint(callback, connectionData)
+        endpoint.joinWithToken(TOKEN, INSTANCE)
+        self.assertTrue(callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)[0]["body"]["ok"])
+        # "b" is the fastest server, but it refuses the connection
+        self.assertEqual(endpoint.getConnectedServerUrl(), "loopback://c")
+        endpoint.leave()
+        callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        
+class TestFailoverAfterAServerDies(unittest.TestCase):
+    
+    def setUp(self):
+        self.sibs = {"loopback://a" : RecordingSIB(), "loopback://b" : RecordingSIB()}
+        def transportFactory(serverUrl, protocols, connectionEstablishedHandler, dataReceivedEventHandler):
+            return LoopbackTransportFactory(self.sibs[serverUrl])(serverUrl, protocols, connectionEstablishedHandler,
+                                                                  dataReceivedEventHandler)
+        healthCheck = FakeHealthCheck({"loopback://a" : 0.1, "loopback://b" : 0.2})
+        connectionData = WebsocketConnectionData(["loopback://a", "loopback://b"], transportFactory, connectTimeout=1,
+                                                 healthCheck=healthCheck)
+        self.callback = CollectingCallback()
+        self.listener = RecordingListener()
+        self.endpoint = WebsocketBasedSSAPEndpoint(self.callback, connectionData)
+        self.endpoint.addConnectionListener(self.listener)
+        
+    def tearDown(self):
+        self.endpoint.stopHeartbeat()
+        self.endpoint.disableHotStandby()
+        
+    def join(self):
+        self.endpoint.joinWithToken(TOKEN, INSTANCE)
+        self.assertTrue(self.callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)[0]["body"]["ok"])
+        self.assertEqual(self.endpoint.getConnectedServerUrl(), "loopback://a")
+        
+    def killTheActiveServer(self):
+        '''
+        Makes the active server stop answering, sends an INSERT request and queues a SUBSCRIBE request
+        behind it, and lets the heartbeat detect the dead connection.
+        '''
+        self.sibs["loopback://a"].setResponsive(False)
+        self.endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        self.endpoint.subscribe("Sensor", "db.Sensor.find()")
+        waitUntil(lambda: self.sibs["loopback://a"].requests[-1] == "INSERT")
+        self.endpoint.startHeartbeat(0.05, 0.05, 1)
+        
+    def testRequestsAreSentAgainBehindTheNewJoin(self):
+        self.join()
+        self.killTheActiveServer()
+        insert = self.callback.waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]
+        self.assertTrue(insert["body"]["ok"])
+        # The subscription belonged to the lost session
+        subscribe = self.callback.waitFor(SSAP_MESSAGE_TYPE.SUBSCRIBE)[0]
+        self.assertFalse(subscribe["body"]["ok"])
+        self.assertEqual(["JOIN", "INSERT"], self.sibs["loopback://b"].requests)
+        joins = self.callback.getMessages(SSAP_MESSAGE_TYPE.JOIN)
+        self.assertEqual(2, len(joins))
+        self.assertEqual(joins[1]["sessionKey"], self.endpoint._sessionKey)
+        waitUntil(lambda: self.listener.restored == ["loopback://b"])
+        self.assertEqual(1, len(self.listener.lost))
+        self.assertEqual(self.endpoint.getConnectedServerUrl(), "loopback://b")
+        
+    def testTheHotStandbyIsPromoted(self):
+        self.endpoint.enableHotStandby(60)
+        self.join()
+        # The standby connection joins the SIB in background
+        waitUntil(lambda: self.sibs["loopback://b"].requests == ["JOIN"])
+        sleep(0.1)
+        self.killTheActiveServer()
+        self.assertTrue(self.callback.waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]["body"]["ok"])
+        waitUntil(lambda: self.listener.restored == ["loopback://b"])
+        # No JOIN request was sent after the failure
+        self.assertEqual(["JOIN", "INSERT"], self.sibs["loopback://b"].requests)
+        self.assertEqual(2, len(self.callback.getMessages(SSAP_MESSAGE_TYPE.JOIN)))
+        
+    def testRequestsFailWhenTheNewJoinIsRejected(self):
+        self.sibs["loopback://b"].rejected["JOIN"] = 1
+        self.join()
+        self.killTheActiveServer()
+        insert = self.callback.waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]
+        self.assertFalse(insert["body"]["ok"])
+        self.assertIn("could not be joined again", insert["body"]["error"])
+        self.assertEqual(["JOIN"], self.sibs["loopback://b"].requests)
+        self.assertFalse(self.callback.getMessages(SSAP_MESSAGE_TYPE.JOIN)[1]["body"]["ok"])
+        self.assertEqual([], self.listener.restored)
+        
+if __name__ == "__main__":
+    unittest.main()
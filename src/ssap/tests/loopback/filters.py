@@ -0,0 +1,110 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import unittest
+from ssap.core import MultiHandlerSSAPCallback, SSAP_MESSAGE_TYPE
+from ssap.exceptions import InvalidSSAPFilter
+from ssap.utils.filters import compilePredicate, compileProjection, compileFieldGetter, IndicationFilter, FilteredHandler
+
+class TestFilters(unittest.TestCase):
+    
+    INSTANCES = [{"Sensor" : {"assetId" : "S_01", "measure" : 25, "location" : {"city" : "Madrid"}}},
+                 {"Sensor" : {"assetId" : "S_02", "measure" : 35.5, "location" : {"city" : "Bilbao"}}},
+                 {"Sensor" : {"assetId" : "S_03", "measure" : "unknown"}},
+                 {"Sensor" : {"assetId" : "S_04"}}]
+    
+    def select(self, expression):
+        predicate = compilePredicate(expression)
+        return [instance["Sensor"]["assetId"] for instance in TestFilters.INSTANCES if predicate(instance)]
+    
+    def testComparisons(self):
+        self.assertEqual(self.select("Sensor.measure > 30"), ["S_02"])
+        self.assertEqual(self.select("Sensor.measure <= 25"), ["S_01"])
+        self.assertEqual(self.select("Sensor.assetId == 'S_03'"), ["S_03"])
+        self.assertEqual(self.select('Sensor.location.city != "Madrid"'), ["S_02"])
+        self.assertEqual(self.select("Sensor.measure == 3.55e1"), ["S_02"])
+        
+    def testMissingFieldsAndMixedTypesNeverMatch(self):
+        self.assertEqual(self.select("Sensor.measure != 0"), ["S_01", "S_02", "S_03"])
+        self.assertEqual(self.select("Sensor.location.city.name == 'x'"), [])
+        
+    def testBooleanOperatorsAndPrecedence(self):
+        self.assertEqual(self.select("Sensor.measure > 30 OR Sensor.assetId == 'S_01' AND Sensor.measure > 100"), ["S_02"])
+        self.assertEqual(self.select("(Sensor.measure > 30 OR Sensor.assetId == 'S_01') AND Sensor.measure < 100"), ["S_01", "S_02"])
+        self.assertEqual(self.select("not Sensor.measure > 30 and Sensor.measure < 100"), ["S_01"])
+        
+    def testConstants(self):
+        predicate = compilePredicate("a.valid == true AND a.extra == null")
+        self.assertTrue(predicate({"a" : {"valid" : True, "extra" : None}}))
+        self.assertFalse(predicate({"a" : {"valid" : False, "extra" : None}}))
+        
+    def testInvalidExpressions(self):
+        for expression in ("", "Sensor.measure >", "Sensor.measure > 3 AND", "(Sensor.measure > 3",
+                           "Sensor.measure 3", "Sensor.measure > 3 4", "Sensor.measure > other", "Sensor.measure # 3"):
+            with self.assertRaises(InvalidSSAPFilter):
+                compilePredicate(expression)
+                
+    def testProjection(self):
+        project = compileProjection(["Sensor.assetId", "Sensor.location.city", "Sensor.missing"])
+        self.assertEqual(project(TestFilters.INSTANCES[1]), {"Sensor" : {"assetId" : "S_02", "location" : {"city" : "Bilbao"}}})
+        self.assertEqual(project(TestFilters.INSTANCES[3]), {"Sensor" : {"assetId" : "S_04"}})
+        self.assertEqual(project({"Other" : 1}), {})
+        # The values are not copied and the original instance is not modified
+        instance = {"Sensor" : {"assetId" : "S_05", "location" : {"city" : "Soria"}, "measure" : 1}}
+        projected = compileProjection(["Sensor.location"])(instance)
+        self.assertIs(projected["Sensor"]["location"], instance["Sensor"]["location"])
+        self.assertEqual(instance["Sensor"]["measure"], 1)
+        
+    def testFieldGetter(self):
+        getCity = compileFieldGetter("Sensor.location.city", default="none")
+        self.assertEqual(getCity(TestFilters.INSTANCES[0]), "Madrid")
+        self.assertEqual(getCity(TestFilters.INSTANCES[2]), "none")
+        
+    def testIndicationFilter(self):
+        message = {"body" : {"data" : json.dumps(TestFilters.INSTANCES), "ok" : True}, "messageType" : "INDICATION"}
+        indicationFilter = IndicationFilter(where="Sensor.measure >= 25", fields=["Sensor.assetId"])
+        filteredMessage = indicationFilter.apply(message)
+        self.assertEqual(filteredMessage["body"]["data"], [{"Sensor" : {"assetId" : "S_01"}}, {"Sensor" : {"assetId" : "S_02"}}])
+        self.assertEqual(filteredMessage["messageType"], "INDICATION")
+        self.assertIsInstance(message["body"]["data"], str)
+        self.assertIsNone(IndicationFilter(where="Sensor.measure > 1000").apply(message))
+        # A single instance is not turned into a list
+        single = {"body" : {"data" : TestFilters.INSTANCES[0]}}
+        self.assertEqual(IndicationFilter().apply(single)["body"]["data"], TestFilters.INSTANCES[0])
+        self.assertEqual(indicationFilter.apply(single)["body"]["data"], {"Sensor" : {"assetId" : "S_01"}})
+        self.assertIsNone(IndicationFilter(where="Sensor.measure > 1000").apply(single))
+        
+    def testFilteredHandler(self):
+        received = []
+        handler = FilteredHandler(received.append, IndicationFilter(where="Sensor.assetId == 'S_04'"))
+        handler({"body" : {"data" : TestFilters.INSTANCES}})
+        handler({"body" : {"data" : TestFilters.INSTANCES[:1]}})
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]["body"]["data"], [TestFilters.INSTANCES[3]])
+        self.assertEqual(handler, received.append)
+        self.assertEqual(hash(handler), hash(received.append))
+        
+    def testFilteredHandlersShareTheParsedData(self):
+        (first, second, unfiltered) = ([], [], [])
+        callback = MultiHandlerSSAPCallback()
+        callback.registerSubscriptionHandler(SSAP_MESSAGE_TYPE.INDICATION, "Sensor", first.append, where="Sensor.measure > 30")
+        callback.registerSubscriptionHandler(SSAP_MESSAGE_TYPE.INDICATION, "Sensor", second.append, fields=["Sensor.location"])
+        callback.registerSubscriptionHandler(SSAP_MESSAGE_TYPE.INDICATION, "Sensor", unfiltered.append)
+        data = json.dumps(TestFilters.INSTANCES)
+        callback.onSSAPMessageReceived({"messageType" : SSAP_MESSAGE_TYPE.INDICATION, "ontology" : "Sensor",
+                                        "body" : {"data" : data}})
+        self.assertEqual(first[0]["body"]["data"], [TestFilters.INSTANCES[1]])
+        # The JSON string was deserialized once
+        self.assertIs(first[0]["body"]["data"][0]["Sensor"]["location"], second[0]["body"]["data"][1]["Sensor"]["location"])
+        self.assertIs(unfiltered[0]["body"]["data"], data)
+        
+if __name__ == '__main__':
+    unittest.main()
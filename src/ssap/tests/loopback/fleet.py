@@ -0,0 +1,96 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import multiprocessing
+import os
+import unittest
+from ssap.core import SSAP_MESSAGE_TYPE
+from ssap.exceptions import InvalidSSAPOperation, SSAPConnectionError
+from ssap.fleet import SSAPFleet
+from ssap.tests.utils.loopback import TOKEN, RecordingSIB, CollectingCallback, buildLoopbackEndpoint, waitUntil
+
+def insertAfterFork(endpoint):
+    '''
+    Tries to use an endpoint in a forked process. The exit code is 0 if the endpoint refuses it.
+    '''
+    try:
+        endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+    except InvalidSSAPOperation:
+        os._exit(0)
+    os._exit(1)
+
+class TestSSAPFleet(unittest.TestCase):
+    
+    def buildFleet(self, workers=2, **kwargs):
+        fleet = SSAPFleet("loopback://sib", TOKEN, "KPLoopback:KPLoopback{0}", workers, transport="loopback",
+                          restartDelay=0.1, **kwargs)
+        fleet.start()
+        return fleet
+    
+    def testOperationsAreCountedOnce(self):
+        fleet = self.buildFleet(maxPendingRequests=4)
+        for index in range(20):
+            fleet.insert("Sensor", json.dumps({"Sensor" : {"measure" : index}}))
+        # Every insertColumns operation sends three BULK requests
+        for _index in range(2):
+            fleet.submit("insertColumns", "Sensor", {"Sensor" : {"measure" : "$measure"}}, {"measure" : [1, 2, 3, 4, 5]}, 2)
+        fleet.stop(10)
+        stats = fleet.getStats()
+        self.assertEqual((22, 22, 0, 0), (stats["submitted"], stats["ok"], stats["failed"], stats["lost"]))
+        self.assertEqual(22, sum(worker["ok"] for worker in stats["workers"]))
+        self.assertEqual([False, False], [worker["alive"] for worker in stats["workers"]])
+        
+    def testInvalidOperationsAreRejected(self):
+        fleet = SSAPFleet("loopback://sib", TOKEN, "KPLoopback:KPLoopback{0}", 1, transport="loopback")
+        self.assertRaises(InvalidSSAPOperation, fleet.insert, "Sensor", "{}")
+        fleet.start()
+        self.assertRaises(InvalidSSAPOperation, fleet.submit, "leave")
+        self.assertRaises(InvalidSSAPOperation, fleet.submit, "prepare", "Sensor", "db.Sensor.find()")
+        self.assertRaises(InvalidSSAPOperation, fleet.start)
+        fleet.stop(10)
+        self.assertRaises(InvalidSSAPOperation, fleet.insert, "Sensor", "{}")
+        
+    def testCrashedWorkersAreRestarted(self):
+        fleet = self.buildFleet(1)
+        fleet._SSAPFleet__processes[0].kill()
+        waitUntil(lambda: fleet.getStats()["restarts"] == 1 and fleet.getStats()["workers"][0]["alive"], 10)
+        fleet.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        fleet.stop(10)
+        stats = fleet.getStats()
+        self.assertEqual((1, 1, 1), (stats["submitted"], stats["ok"], stats["restarts"]))
+        
+    def testWorkersThatCrashTooOftenAreAbandoned(self):
+        fleet = self.buildFleet(1, maxRestarts=0)
+        fleet._SSAPFleet__processes[0].kill()
+        waitUntil(lambda: fleet.getStats()["workers"][0]["abandoned"], 10)
+        self.assertRaises(SSAPConnectionError, fleet.insert, "Sensor", "{}")
+        fleet.stop(10)
+        
+    def testForkedWorkersBuildTheirOwnEndpoints(self):
+        fleet = self.buildFleet(startMethod="fork")
+        for index in range(5):
+            fleet.insert("Sensor", json.dumps({"Sensor" : {"measure" : index}}))
+        fleet.stop(10)
+        self.assertEqual(5, fleet.getStats()["ok"])
+        
+    def testEndpointsCannotBeUsedAfterAFork(self):
+        callback = CollectingCallback()
+        endpoint = buildLoopbackEndpoint(RecordingSIB(), callback)
+        callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)
+        process = multiprocessing.get_context("fork").Process(target=insertAfterFork, args=(endpoint,))
+        process.start()
+        process.join(10)
+        self.assertEqual(0, process.exitcode)
+        endpoint.leave()
+        callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import unittest
+from time import sleep
+from ssap.core import SSAP_ERROR_CODE, SSAP_MESSAGE_TYPE
+from ssap.utils.flowcontrol import TokenBucket, AIMDFlowController
+from ssap.tests.utils.loopback import RecordingSIB, CollectingCallback, buildLoopbackEndpoint
+
+class TestTokenBucket(unittest.TestCase):
+    
+    def testBurstThenWait(self):
+        bucket = TokenBucket(10, capacity=2)
+        self.assertEqual(0, bucket.tryAcquire())
+        self.assertEqual(0, bucket.tryAcquire())
+        delay = bucket.tryAcquire()
+        self.assertTrue(0 < delay <= 0.1)
+        
+    def testTokensAreRefilled(self):
+        bucket = TokenBucket(100, capacity=1)
+        self.assertEqual(0, bucket.tryAcquire())
+        sleep(0.05)
+        self.assertEqual(0, bucket.tryAcquire())
+
+class TestAIMDFlowController(unittest.TestCase):
+    
+    def testWindowGrowsAdditivelyUpToTheLimit(self):
+        controller = AIMDFlowController(maxInFlight=4, latencyTarget=1.0)
+        self.assertEqual(1, controller.getInFlightLimit())
+        controller.onResponse(0.001)
+        self.assertEqual(2, controller.getInFlightLimit())
+        for _i in range(100):
+            controller.onResponse(0.001)
+        self.assertEqual(4, controller.getInFlightLimit())
+        
+    def testOverloadHalvesTheLimits(self):
+        controller = AIMDFlowController(maxInFlight=8, maxRate=100, minRate=10, latencyTarget=1.0)
+        for _i in range(200):
+            controller.onResponse(0.001)
+        self.assertEqual(8, controller.getInFlightLimit())
+        controller.onResponse(0.001, SSAP_ERROR_CODE.PERSISTENCE)
+        self.assertEqual(4, controller.getInFlightLimit())
+        self.assertEqual(50, controller.getRate())
+        self.assertEqual(1, controller.getStats()["overloads"])
+        
+    def testSlowResponsesCountAsOverloads(self):
+        controller = AIMDFlowController(maxInFlight=8, latencyTarget=0.5)
+        for _i in range(200):
+            controller.onResponse(0.001)
+        controller.onResponse(0.6)
+        self.assertEqual(4, controller.getInFlightLimit())
+        
+    def testLimitsDecreaseOncePerRoundTrip(self):
+        controller = AIMDFlowController(maxInFlight=8, latencyTarget=10)
+        for _i in range(200):
+            controller.onResponse(8.0)
+        for _i in range(5):
+            controller.onResponse(8.0, SSAP_ERROR_CODE.PROCESSOR)
+        self.assertEqual(4, controller.getInFlightLimit())
+        
+    def testRateNeverGoesBelowTheMinimum(self):
+        controller = AIMDFlowController(maxRate=100, minRate=30, latencyTarget=1.0)
+        controller.onResponse(0.001, SSAP_ERROR_CODE.PROCESSOR)
+        sleep(0.01)
+        controller.onResponse(0.001, SSAP_ERROR_CODE.PROCESSOR)
+        self.assertEqual(30, controller.getRate())
+        
+    def testEndpointPipelinesRequests(self):
+        sib = RecordingSIB()
+        callback = CollectingCallback()
+        controller = AIMDFlowController(maxInFlight=4, latencyTarget=1.0)
+        endpoint = buildLoopbackEndpoint(sib, callback, controller)
+        for index in range(50):
+            endpoint.insert("Sensor", '{"Sensor" : {"index" : %d}}' % index)
+        inserts = callback.waitFor(SSAP_MESSAGE_TYPE.INSERT, 50)
+        self.assertTrue(all(message["body"]["ok"] for message in inserts))
+        self.assertEqual(4, controller.getInFlightLimit())
+
+if __name__ == "__main__":
+    unittest.main()
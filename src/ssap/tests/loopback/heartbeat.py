@@ -0,0 +1,128 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import logging
+import unittest
+from time import sleep
+from ssap.core import SSAP_MESSAGE_TYPE, SSAPConnectionListener
+from ssap.implementations.websockets import _SSAPHeartbeat
+from ssap.tests.utils.loopback import RecordingSIB, CollectingCallback, buildLoopbackEndpoint, waitUntil
+
+class RecordingListener(SSAPConnectionListener):
+    
+    def __init__(self):
+        self.lost = []
+        self.restored = []
+        
+    def onConnectionLost(self, reason):
+        self.lost.append(reason)
+        
+    def onConnectionRestored(self, serverUrl):
+        self.restored.append(serverUrl)
+        
+class FakePeer(object):
+    '''
+    Records the pings and the dead connections that a heartbeat reports.
+    '''
+    
+    def __init__(self):
+        self.websocket = object()
+        self.pings = []
+        self.dead = []
+        
+    def ping(self, payload):
+        self.pings.append(payload)
+        return self.websocket
+    
+    def onConnectionDead(self, websocket, reason):
+        self.dead.append((websocket, reason))
+        
+class TestHeartbeat(unittest.TestCase):
+    
+    def buildHeartbeat(self, peer, timeoutInSeconds=0, maxMissedPongs=2):
+        return _SSAPHeartbeat(peer.ping, peer.onConnectionDead, 0.05, timeoutInSeconds, maxMissedPongs,
+                              logging.getLogger("Heartbeat"))
+    
+    def testConsecutiveMissedPongsMakeTheConnectionDead(self):
+        peer = FakePeer()
+        heartbeat = self.buildHeartbeat(peer, maxMissedPongs=3)
+        beat = heartbeat._SSAPHeartbeat__beat
+        for _ in range(3):
+            beat()
+        self.assertEqual(peer.dead, [])
+        beat()
+        self.assertEqual(len(peer.dead), 1)
+        self.assertIs(peer.dead[0][0], peer.websocket)
+        self.assertIn("3 consecutive pongs", peer.dead[0][1])
+        self.assertEqual(peer.pings, ["1", "2", "3"])
+        
+    def testAnyPongResetsTheMissedPongs(self):
+        peer = FakePeer()
+        heartbeat = self.buildHeartbeat(peer)
+        beat = heartbeat._SSAPHeartbeat__beat
+        # Each beat misses the pong of the previous ping
+        for _ in range(10):
+            beat()
+            heartbeat.onPong(b"unrelated")
+        self.assertEqual(peer.dead, [])
+        # The round-trip time is only measured with the pongs of the pending pings
+        self.assertIsNone(heartbeat.getRoundTripTime())
+        
+    def testANewConnectionResetsTheMissedPongs(self):
+        peer = FakePeer()
+        heartbeat = self.buildHeartbeat(peer)
+        beat = heartbeat._SSAPHeartbeat__beat
+        beat()
+        peer.websocket = object()
+        beat()
+        beat()
+        self.assertEqual(peer.dead, [])
+        beat()
+        self.assertEqual(len(peer.dead), 1)
+        
+    def testRoundTripTimes(self):
+        peer = FakePeer()
+        heartbeat = self.buildHeartbeat(peer, timeoutInSeconds=60)
+        beat = heartbeat._SSAPHeartbeat__beat
+        beat()
+        heartbeat.onPong(b"1")
+        firstRoundTripTime = heartbeat.getRoundTripTime()
+        self.assertEqual(firstRoundTripTime, heartbeat.getLastRoundTripTime())
+        beat()
+        sleep(0.05)
+        heartbeat.onPong("2")
+        self.assertGreaterEqual(heartbeat.getLastRoundTripTime(), 0.05)
+        expected = firstRoundTripTime + _SSAPHeartbeat.RTT_GAIN * (heartbeat.getLastRoundTripTime() - firstRoundTripTime)
+        self.assertAlmostEqual(heartbeat.getRoundTripTime(), expected)
+        
+    def testDeadPeersAreDetected(self):
+        sib = RecordingSIB()
+        callback = CollectingCallback()
+        endpoint = buildLoopbackEndpoint(sib, callback)
+        callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)
+        listener = RecordingListener()
+        endpoint.addConnectionListener(listener)
+        endpoint.startHeartbeat(0.05, maxMissedPongs=2)
+        try:
+            # A live peer answers the pings
+            waitUntil(lambda: not endpoint.getRoundTripTime() is None)
+            sleep(0.3)
+            self.assertEqual(listener.lost, [])
+            sib.setResponsive(False)
+            endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+            waitUntil(lambda: len(listener.lost) == 1)
+            self.assertIn("consecutive pongs were missed", listener.lost[0])
+            self.assertFalse(callback.waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]["body"]["ok"])
+        finally:
+            endpoint.stopHeartbeat()
+            
+if __name__ == "__main__":
+    unittest.main()
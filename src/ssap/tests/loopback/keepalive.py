@@ -0,0 +1,55 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import unittest
+from ssap.core import SSAP_MESSAGE_TYPE
+from ssap.tests.utils.loopback import RecordingSIB, CollectingCallback, buildLoopbackEndpoint
+
+class TestSessionKeepAlive(unittest.TestCase):
+    
+    def setUp(self):
+        self.sib = RecordingSIB()
+        self.callback = CollectingCallback()
+        self.endpoint = buildLoopbackEndpoint(self.sib, self.callback)
+        self.callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)
+        # The renewal interval is long enough for the session not to be renewed during the tests
+        self.endpoint.startSessionKeepAlive(60)
+        self.sib.rejected["INSERT"] = 1
+        self.sib.errorCodes["INSERT"] = "AUTENTICATION"
+        
+    def tearDown(self):
+        self.endpoint.stopSessionKeepAlive()
+        self.endpoint.leave()
+        self.callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        
+    def testExpiredRequestsAreSentAgainAfterJoining(self):
+        self.endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        insert = self.callback.waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]
+        self.assertTrue(insert["body"]["ok"])
+        self.assertEqual(["JOIN", "INSERT", "JOIN", "INSERT"], self.sib.requests)
+        joins = self.callback.getMessages(SSAP_MESSAGE_TYPE.JOIN)
+        self.assertEqual(2, len(joins))
+        self.assertTrue(joins[1]["body"]["ok"])
+        self.assertEqual(1, len(self.callback.getMessages(SSAP_MESSAGE_TYPE.INSERT)))
+        
+    def testExpiredRequestsFailWhenTheSIBCannotBeJoinedAgain(self):
+        self.sib.rejected["JOIN"] = 1
+        self.endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        insert = self.callback.waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]
+        self.assertFalse(insert["body"]["ok"])
+        self.assertIn("could not be joined again", insert["body"]["error"])
+        self.assertIn("Rejected by the test", insert["body"]["error"])
+        self.assertEqual(["JOIN", "INSERT", "JOIN"], self.sib.requests)
+        self.assertFalse(self.callback.getMessages(SSAP_MESSAGE_TYPE.JOIN)[1]["body"]["ok"])
+        self.assertEqual(1, len(self.callback.getMessages(SSAP_MESSAGE_TYPE.INSERT)))
+        
+if __name__ == "__main__":
+    unittest.main()
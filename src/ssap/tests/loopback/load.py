@@ -0,0 +1,134 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from ssap.implementations.loopback import LoopbackTransportFactory
+from ssap.load import FileLoader, buildArgumentParser, readRecords
+from ssap.tests.utils.loopback import RecordingSIB, TOKEN, INSTANCE
+
+MAPPING = {"Sensor" : {"assetId" : "$id", "measure" : "$value:float"}}
+
+class FailingSIB(RecordingSIB):
+    '''
+    A loopback SIB that rejects the BULK requests after accepting a number of them.
+    '''
+    
+    def __init__(self, acceptedBulkRequests):
+        RecordingSIB.__init__(self)
+        self.acceptedBulkRequests = acceptedBulkRequests
+        
+    def process(self, transport, request):
+        if (request["messageType"] == "BULK"):
+            if (self.acceptedBulkRequests == 0):
+                self.rejected["BULK"] = 1
+            else:
+                self.acceptedBulkRequests = self.acceptedBulkRequests - 1
+        RecordingSIB.process(self, transport, request)
+        
+def getStoredInstances(sib):
+    return list(sib._LoopbackSIB__instances.get("Sensor", ()))
+
+class TestFileLoader(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "readings.jsonl")
+        with open(self.path, "w") as recordsFile:
+            for index in range(50):
+                recordsFile.write(json.dumps({"id" : "S_%02d" % index, "value" : str(index)}) + "\n")
+                
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def buildOptions(self, *arguments):
+        options = buildArgumentParser().parse_args([self.path, "--url", "loopback://sib", "--token", TOKEN, "--instance", INSTANCE,
+                                                    "--ontology", "Sensor", "--batch-size", "10", "--connections", "1",
+                                                    "--pipeline", "1", "--timeout", "5", "--quiet"] + list(arguments))
+        options.format = "jsonl"
+        options.transport = "loopback"
+        options.checkpoint = self.path + ".checkpoint"
+        options.mapping = MAPPING
+        return options
+    
+    def readCheckpoint(self):
+        with open(self.path + ".checkpoint") as checkpointFile:
+            return json.load(checkpointFile)
+        
+    def testCompletedLoadsAreCheckpointed(self):
+        sib = RecordingSIB()
+        results = FileLoader(self.buildOptions("--pipeline", "2", "--connections", "2"), LoopbackTransportFactory(sib)).run()
+        self.assertIsNone(results["error"])
+        self.assertEqual((results["records"], results["batches"]), (50, 5))
+        checkpoint = self.readCheckpoint()
+        self.assertTrue(checkpoint["completed"])
+        self.assertEqual((checkpoint["offset"], checkpoint["records"]), (os.path.getsize(self.path), 50))
+        self.assertEqual(sorted(instance["Sensor"]["measure"] for instance in getStoredInstances(sib)), [float(index) for index in range(50)])
+        # Running it again does not insert anything
+        results = FileLoader(self.buildOptions(), LoopbackTransportFactory(sib)).run()
+        self.assertEqual((results["records"], results["totalRecords"]), (0, 50))
+        self.assertEqual(len(getStoredInstances(sib)), 50)
+        
+    def testInterruptedLoadsAreResumed(self):
+        sib = FailingSIB(acceptedBulkRequests=2)
+        results = FileLoader(self.buildOptions("--retries", "0"), LoopbackTransportFactory(sib)).run()
+        self.assertIn("failed 1 times", results["error"])
+        checkpoint = self.readCheckpoint()
+        self.assertFalse(checkpoint["completed"])
+        self.assertEqual(checkpoint["records"], 20)
+        with open(self.path, "rb") as recordsFile:
+            self.assertEqual(checkpoint["offset"], len(b"".join(recordsFile.readlines()[:20])))
+        sib.acceptedBulkRequests = -1
+        results = FileLoader(self.buildOptions(), LoopbackTransportFactory(sib)).run()
+        self.assertIsNone(results["error"])
+        self.assertEqual((results["records"], results["totalRecords"]), (30, 50))
+        # The batches that were sent after the failed one might be inserted twice, but the records
+        # before the checkpoint are never sent again
+        assetIds = [instance["Sensor"]["assetId"] for instance in getStoredInstances(sib)]
+        self.assertEqual(set(assetIds), set("S_%02d" % index for index in range(50)))
+        self.assertEqual([assetId for assetId in assetIds if assetId < "S_20"], ["S_%02d" % index for index in range(20)])
+        self.assertTrue(self.readCheckpoint()["completed"])
+        
+    def testFailedBatchesAreRetried(self):
+        sib = RecordingSIB()
+        sib.rejected["BULK"] = 2
+        results = FileLoader(self.buildOptions("--retries", "2"), LoopbackTransportFactory(sib)).run()
+        self.assertIsNone(results["error"])
+        self.assertEqual(results["records"], 50)
+        self.assertEqual(sib.requests.count("BULK"), 7)
+        self.assertEqual(len(getStoredInstances(sib)), 50)
+        
+    def testCheckpointsOfOtherLoadsAreRejected(self):
+        sib = FailingSIB(acceptedBulkRequests=1)
+        FileLoader(self.buildOptions("--retries", "0"), LoopbackTransportFactory(sib)).run()
+        options = self.buildOptions()
+        options.mapping = {"Sensor" : {"assetId" : "$id"}}
+        self.assertRaises(ValueError, FileLoader(options, LoopbackTransportFactory(sib)).run)
+        sib.acceptedBulkRequests = -1
+        results = FileLoader(self.buildOptions("--restart"), LoopbackTransportFactory(sib)).run()
+        self.assertEqual(results["records"], 50)
+        
+    def testRecordsAreReadFromTheCheckpointOffset(self):
+        csvPath = os.path.join(self.directory, "readings.csv")
+        with open(csvPath, "wb") as recordsFile:
+            recordsFile.write("﻿id,value\nS_01,1\nS_02,2\nS_03\nS_04,4\n".encode("utf-8"))
+        records = list(readRecords(csvPath, "csv"))
+        self.assertEqual([record for (record, _offset) in records],
+                         [{"id" : "S_01", "value" : "1"}, {"id" : "S_02", "value" : "2"}, None, {"id" : "S_04", "value" : "4"}])
+        self.assertEqual(records[-1][1], os.path.getsize(csvPath))
+        # The header is read even if the load is resumed
+        self.assertEqual(list(readRecords(csvPath, "csv", records[1][1])), records[2:])
+        self.assertEqual(list(readRecords(self.path, "jsonl", os.path.getsize(self.path))), [])
+        
+if __name__ == "__main__":
+    unittest.main()
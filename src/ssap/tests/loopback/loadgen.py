@@ -0,0 +1,71 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from ssap.loadgen import formatReport, main, parseMix
+
+class TestLoadGenerator(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "report.json")
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def runLoadTest(self, *arguments):
+        self.assertEqual(0, main(["--url", "loopback://", "--format", "json", "--output", self.path, "--timeout", "5"] +
+                                 list(arguments)))
+        with open(self.path) as reportFile:
+            return json.load(reportFile)
+    
+    def testShortLoopbackRun(self):
+        results = self.runLoadTest("--duration", "0.5", "--connections", "2", "--pipeline", "4",
+                                   "--mix", "insert=3,query=1", "--payload-size", "16")
+        self.assertEqual("loopback", results["transport"])
+        self.assertEqual(2, results["connections"])
+        self.assertEqual(4, results["pipeline"])
+        self.assertEqual({"insert" : 3.0, "query" : 1.0}, results["mix"])
+        self.assertEqual(16, results["payloadSize"])
+        self.assertTrue(0.5 <= results["duration"] < 5.5)
+        operations = results["operations"]
+        # Only the operations of the mix are sent
+        self.assertEqual(set(["insert", "query", "total"]), set(operations))
+        self.assertEqual(operations["total"]["count"], operations["insert"]["count"] + operations["query"]["count"])
+        self.assertGreater(operations["insert"]["count"], operations["query"]["count"])
+        for stats in operations.values():
+            self.assertEqual(0, stats["errors"])
+            # The reported duration is rounded to milliseconds
+            self.assertAlmostEqual(stats["count"] / results["duration"], stats["throughput"], delta=stats["throughput"] / 100 + 0.1)
+            self.assertTrue(stats["p50"] <= stats["p95"] <= stats["p99"] <= stats["max"])
+        self.assertGreater(results["insertToIndication"]["count"], 0)
+        report = formatReport(results)
+        for name in ("insert", "query", "total", "insert->INDICATION"):
+            self.assertIn(name, report)
+    
+    def testRunsWithoutInserts(self):
+        results = self.runLoadTest("--duration", "0.2", "--connections", "1", "--mix", "query=1", "--no-indications")
+        self.assertEqual(set(["query", "total"]), set(results["operations"]))
+        self.assertGreater(results["operations"]["query"]["count"], 0)
+        self.assertIsNone(results["insertToIndication"])
+        self.assertFalse("insert->INDICATION" in formatReport(results))
+    
+    def testTrafficMixes(self):
+        self.assertEqual([("insert", 60.0), ("query", 1.0)], parseMix("insert=60, QUERY"))
+        self.assertEqual([("query", 1.0)], parseMix("insert=0,query=1"))
+        self.assertRaises(ValueError, parseMix, "delete=1")
+        self.assertRaises(ValueError, parseMix, "insert=0")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import unittest
+from time import sleep
+from ssap.core import SSAP_MESSAGE_TYPE, SSAPConnectionListener
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.factories import SSAPEndpointFactory
+from ssap.implementations.loopback import LoopbackTransportFactory
+from ssap.utils.flowcontrol import AIMDFlowController
+from ssap.tests.utils.loopback import TOKEN, INSTANCE, RecordingSIB, CollectingCallback, waitUntil
+
+class RecordingListener(SSAPConnectionListener):
+    
+    def __init__(self, onLost=None):
+        self.lost = []
+        self.restored = []
+        self.__onLost = onLost
+        
+    def onConnectionLost(self, reason):
+        self.lost.append(reason)
+        if (not self.__onLost is None):
+            self.__onLost()
+        
+    def onConnectionRestored(self, serverUrl):
+        self.restored.append(serverUrl)
+
+class TestMultiplexedConnection(unittest.TestCase):
+    
+    def setUp(self):
+        self.sib = RecordingSIB()
+        
+    def buildConnection(self, serverUrl="loopback://sib", flowController=None):
+        return SSAPEndpointFactory.buildMultiplexedWebsocketConnection(serverUrl, False, flowController,
+                                                                       LoopbackTransportFactory(self.sib))
+        
+    def createSessions(self, connection, count, join=True):
+        sessions = []
+        callbacks = []
+        for _index in range(count):
+            callback = CollectingCallback()
+            sessions.append(connection.createSession(callback))
+            callbacks.append(callback)
+        if (join):
+            for session in sessions:
+                session.joinWithToken(TOKEN, INSTANCE)
+            for callback in callbacks:
+                callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)
+        return (sessions, callbacks)
+    
+    def testMessagesAreRoutedToTheirSessions(self):
+        connection = self.buildConnection()
+        ((subscriber, publisher), (subscriberCallback, publisherCallback)) = self.createSessions(connection, 2)
+        self.assertEqual(2, connection.getSessionCount())
+        subscriber.subscribe("Sensor", "db.Sensor.find()")
+        subscriberCallback.waitFor(SSAP_MESSAGE_TYPE.SUBSCRIBE)
+        publisher.insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        publisherCallback.waitFor(SSAP_MESSAGE_TYPE.INSERT)
+        indication = subscriberCallback.waitFor(SSAP_MESSAGE_TYPE.INDICATION)[0]
+        self.assertEqual(subscriberCallback.getMessages(SSAP_MESSAGE_TYPE.JOIN)[0]["sessionKey"], indication["sessionKey"])
+        self.assertEqual([], publisherCallback.getMessages(SSAP_MESSAGE_TYPE.INDICATION))
+        self.assertEqual([], subscriberCallback.getMessages(SSAP_MESSAGE_TYPE.INSERT))
+        
+    def testSessionsDoNotWaitForEachOther(self):
+        connection = self.buildConnection()
+        (sessions, callbacks) = self.createSessions(connection, 3, False)
+        self.sib.hold()
+        for session in sessions:
+            session.joinWithToken(TOKEN, INSTANCE)
+        # The pending JOIN requests do not block the other sessions
+        waitUntil(lambda: len(self.sib.requests) == 3)
+        self.sib.release()
+        for callback in callbacks:
+            callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)
+        self.sib.hold()
+        for session in sessions:
+            for index in range(3):
+                session.insert("Sensor", json.dumps({"Sensor" : {"measure" : index}}))
+        waitUntil(lambda: len(self.sib.requests) == 6)
+        sleep(0.1)
+        # Without a flow controller, every session sends its requests one at a time
+        self.assertEqual(6, len(self.sib.requests))
+        self.sib.release()
+        for callback in callbacks:
+            self.assertEqual(3, len(callback.waitFor(SSAP_MESSAGE_TYPE.INSERT, 3)))
+            
+    def testFlowControllerIsShared(self):
+        connection = self.buildConnection(flowController=AIMDFlowController(maxInFlight=4, latencyTarget=1.0))
+        (sessions, callbacks) = self.createSessions(connection, 2)
+        self.sib.hold()
+        for session in sessions:
+            for index in range(5):
+                session.insert("Sensor", json.dumps({"Sensor" : {"measure" : index}}))
+        waitUntil(lambda: len(self.sib.requests) == 2 + connection.getFlowController().getInFlightLimit())
+        sleep(0.1)
+        self.assertEqual(2 + connection.getFlowController().getInFlightLimit(), len(self.sib.requests))
+        self.sib.release()
+        for callback in callbacks:
+            callback.waitFor(SSAP_MESSAGE_TYPE.INSERT, 5)
+            
+    def testSessionsKeepTheirSessionsAlive(self):
+        connection = self.buildConnection()
+        (sessions, callbacks) = self.createSessions(connection, 2)
+        sessions[0].startSessionKeepAlive(0.05)
+        callbacks[0].waitFor(SSAP_MESSAGE_TYPE.JOIN, 3)
+        sessions[0].stopSessionKeepAlive()
+        self.assertEqual(1, len(callbacks[1].getMessages(SSAP_MESSAGE_TYPE.JOIN)))
+        
+    def testHeartbeatWatchesAllTheSessions(self):
+        connection = self.buildConnection()
+        (sessions, callbacks) = self.createSessions(connection, 2)
+        listeners = []
+        for session in sessions:
+            listener = RecordingListener()
+            session.addConnectionListener(listener)
+            listeners.append(listener)
+        self.sib.setResponsive(False)
+        sessions[0].insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        sessions[1].startHeartbeat(0.05, maxMissedPongs=2)
+        for listener in listeners:
+            waitUntil(lambda: len(listener.lost) == 1)
+        sessions[1].stopHeartbeat()
+        self.assertFalse(callbacks[0].waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]["body"]["ok"])
+        self.assertEqual(0, connection.getSessionCount())
+        self.assertFalse(connection.isConnected())
+        
+    def testSessionsFailOverTogether(self):
+        connection = self.buildConnection(["loopback://a", "loopback://b"])
+        (sessions, callbacks) = self.createSessions(connection, 2)
+        firstUrl = sessions[0].getConnectedServerUrl()
+        oldKeys = [callback.getMessages(SSAP_MESSAGE_TYPE.JOIN)[0]["sessionKey"] for callback in callbacks]
+        listeners = []
+        for session in sessions:
+            listener = RecordingListener(lambda: self.sib.setResponsive(True))
+            session.addConnectionListener(listener)
+            listeners.append(listener)
+        self.sib.setResponsive(False)
+        sessions[0].startHeartbeat(0.05, maxMissedPongs=2)
+        for (listener, callback) in zip(listeners, callbacks):
+            waitUntil(lambda: len(listener.restored) == 1)
+            callback.waitFor(SSAP_MESSAGE_TYPE.JOIN, 2)
+        sessions[0].stopHeartbeat()
+        self.assertNotEqual(firstUrl, sessions[0].getConnectedServerUrl())
+        self.assertEqual(2, connection.getSessionCount())
+        newKeys = [callback.getMessages(SSAP_MESSAGE_TYPE.JOIN)[1]["sessionKey"] for callback in callbacks]
+        self.assertEqual([], [key for key in newKeys if key in oldKeys])
+        sessions[1].insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        self.assertTrue(callbacks[1].waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]["body"]["ok"])
+        
+    def testUnjoinedSessionsCannotSendRequests(self):
+        connection = self.buildConnection()
+        (sessions, _callbacks) = self.createSessions(connection, 1)
+        (unjoined, _callbacks) = self.createSessions(connection, 1, False)
+        self.assertRaises(InvalidSSAPOperation, unjoined[0].insert, "Sensor", "{}")
+        self.assertRaises(InvalidSSAPOperation, unjoined[0].enableHotStandby)
+        
+    def testSessionsCannotBeUsedAfterAFork(self):
+        connection = self.buildConnection()
+        (sessions, _callbacks) = self.createSessions(connection, 1)
+        connection._SSAPConnection__ownerPid = -1
+        self.assertRaises(InvalidSSAPOperation, sessions[0].insert, "Sensor", "{}")
+        
+    def testLeavingDoesNotCloseTheConnection(self):
+        connection = self.buildConnection()
+        (sessions, callbacks) = self.createSessions(connection, 2)
+        sessions[0].leave()
+        callbacks[0].waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        self.assertEqual(1, connection.getSessionCount())
+        sessions[1].insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        self.assertTrue(callbacks[1].waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]["body"]["ok"])
+        sessions[1].leave()
+        callbacks[1].waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        connection.close()
+        self.assertFalse(connection.isConnected())
+        
+    def testSessionsThatHaveLeftAreForgotten(self):
+        connection = self.buildConnection()
+        (sessions, callbacks) = self.createSessions(connection, 3)
+        sessions[1].leave()
+        callbacks[1].waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        waitUntil(lambda: len(connection._SSAPConnection__endpoints) == 2)
+        self.assertNotIn(sessions[1], connection._SSAPConnection__endpoints)
+        self.assertEqual(2, connection.getSessionCount())
+        # The session can join the SIB again
+        sleep(0.2)
+        sessions[1].joinWithToken(TOKEN, INSTANCE)
+        self.assertTrue(callbacks[1].waitFor(SSAP_MESSAGE_TYPE.JOIN, 2)[1]["body"]["ok"])
+        self.assertEqual(3, connection.getSessionCount())
+        sessions[1].insert("Sensor", json.dumps({"Sensor" : {"measure" : 1}}))
+        self.assertTrue(callbacks[1].waitFor(SSAP_MESSAGE_TYPE.INSERT)[0]["body"]["ok"])
+        
+    def testSessionsShareTheLoggerOfTheConnection(self):
+        connection = self.buildConnection()
+        handlerCount = len(connection.getLogger().handlers)
+        (sessions, _callbacks) = self.createSessions(connection, 20, False)
+        self.assertEqual(handlerCount, len(connection.getLogger().handlers))
+        for session in sessions:
+            self.assertIs(connection.getLogger(), session._WebsocketBasedSSAPEndpoint__logger)
+
+if __name__ == "__main__":
+    unittest.main()
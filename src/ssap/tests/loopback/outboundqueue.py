@@ -0,0 +1,65 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import unittest
+from ssap.core import SSAP_MESSAGE_TYPE, SSAP_REQUEST_PRIORITY
+from ssap.implementations.websockets import _SSAPOutboundQueue, _SSAPRequest
+from ssap.utils.flowcontrol import AIMDFlowController
+from ssap.tests.utils.loopback import RecordingSIB, CollectingCallback, buildLoopbackEndpoint
+
+class TestOutboundQueue(unittest.TestCase):
+    
+    def buildRequest(self, messageType, priority):
+        return _SSAPRequest(messageType, SSAP_MESSAGE_TYPE.toString(messageType), priority)
+    
+    def popAll(self, queue):
+        popped = []
+        while (not queue.isEmpty()):
+            popped.append(queue.pop().getType())
+        return popped
+
+    def testHigherPriorityLanesJumpAhead(self):
+        queue = _SSAPOutboundQueue()
+        queue.append(self.buildRequest(SSAP_MESSAGE_TYPE.INSERT, SSAP_REQUEST_PRIORITY.BULK))
+        queue.append(self.buildRequest(SSAP_MESSAGE_TYPE.QUERY, SSAP_REQUEST_PRIORITY.INTERACTIVE))
+        queue.append(self.buildRequest(SSAP_MESSAGE_TYPE.SUBSCRIBE, SSAP_REQUEST_PRIORITY.CONTROL))
+        self.assertEqual([SSAP_MESSAGE_TYPE.SUBSCRIBE, SSAP_MESSAGE_TYPE.QUERY, SSAP_MESSAGE_TYPE.INSERT], self.popAll(queue))
+        
+    def testLowPriorityLanesAreNotStarved(self):
+        queue = _SSAPOutboundQueue()
+        queue.append(self.buildRequest(SSAP_MESSAGE_TYPE.INSERT, SSAP_REQUEST_PRIORITY.BULK))
+        for _i in range(10):
+            queue.append(self.buildRequest(SSAP_MESSAGE_TYPE.QUERY, SSAP_REQUEST_PRIORITY.INTERACTIVE))
+        popped = self.popAll(queue)
+        self.assertEqual(_SSAPOutboundQueue.WEIGHTS[SSAP_REQUEST_PRIORITY.INTERACTIVE], popped.index(SSAP_MESSAGE_TYPE.INSERT))
+        
+    def testLeaveWaitsForTheQueuedRequests(self):
+        queue = _SSAPOutboundQueue()
+        for _i in range(3):
+            queue.append(self.buildRequest(SSAP_MESSAGE_TYPE.INSERT, SSAP_REQUEST_PRIORITY.BULK))
+        queue.append(self.buildRequest(SSAP_MESSAGE_TYPE.LEAVE, SSAP_REQUEST_PRIORITY.CONTROL))
+        queue.append(self.buildRequest(SSAP_MESSAGE_TYPE.JOIN, SSAP_REQUEST_PRIORITY.CONTROL))
+        self.assertEqual(5, queue.getSize())
+        self.assertEqual([SSAP_MESSAGE_TYPE.INSERT] * 3 + [SSAP_MESSAGE_TYPE.LEAVE, SSAP_MESSAGE_TYPE.JOIN], self.popAll(queue))
+        
+    def testLeaveIsSentAfterTheQueuedInserts(self):
+        for flowController in (None, AIMDFlowController(maxInFlight=8)):
+            sib = RecordingSIB()
+            callback = CollectingCallback()
+            endpoint = buildLoopbackEndpoint(sib, callback, flowController)
+            for index in range(20):
+                endpoint.insert("Sensor", '{"Sensor" : {"index" : %d}}' % index)
+            endpoint.leave()
+            callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+            self.assertEqual(["JOIN"] + ["INSERT"] * 20 + ["LEAVE"], sib.requests)
+            self.assertEqual(20, len(callback.getMessages(SSAP_MESSAGE_TYPE.INSERT)))
+
+if __name__ == "__main__":
+    unittest.main()
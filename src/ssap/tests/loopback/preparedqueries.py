@@ -0,0 +1,72 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import unittest
+from time import sleep
+from ssap.core import SSAP_MESSAGE_TYPE, SSAP_QUERY_TYPE
+from ssap.messages.messages import _SSAPMessageFactory
+from ssap.tests.utils.loopback import RecordingSIB, CollectingCallback, buildLoopbackEndpoint, TOKEN, INSTANCE
+
+class QueryRecordingSIB(RecordingSIB):
+    '''
+    A loopback SIB that also records the session keys and the parameters of the QUERY requests.
+    '''
+    
+    def __init__(self, **kwargs):
+        RecordingSIB.__init__(self, **kwargs)
+        self.queries = []
+        
+    def process(self, transport, request):
+        if (request["messageType"] == "QUERY"):
+            self.queries.append((request["sessionKey"], request["body"]["queryParams"]))
+        RecordingSIB.process(self, transport, request)
+
+class TestPreparedQueries(unittest.TestCase):
+    
+    PARAMETERS = [None, {}, {"assetId" : "S_01", "limit" : 10}, {"text" : "comillas \" y barras \\ €"},
+                  ["a", 1, 2.5, True, None], {"nested" : {"z" : 1, "a" : [1, {"b" : "\u0001"}]}}, "plain", 0]
+    
+    def testRenderedTemplatesMatchTheFactoryMessages(self):
+        for queryType in (SSAP_QUERY_TYPE.NATIVE, SSAP_QUERY_TYPE.SQLLIKE):
+            query = "db.Sensor.find({'Sensor.assetId': \"S_01\"})"
+            template = _SSAPMessageFactory.buildQueryMessageTemplate("Sensor", query, queryType)
+            for queryParams in TestPreparedQueries.PARAMETERS:
+                for sessionKey in (None, "key", "clave-ñ"):
+                    expected = _SSAPMessageFactory.buildQueryMessage("Sensor", query, queryType, queryParams, sessionKey)
+                    self.assertEqual(template.render(queryParams=queryParams, sessionKey=sessionKey), expected)
+                    self.assertEqual(template.bind(queryParams=queryParams).render(sessionKey), expected)
+                    
+    def testPreparedQueriesUseTheCurrentSessionKey(self):
+        sib = QueryRecordingSIB()
+        callback = CollectingCallback()
+        endpoint = buildLoopbackEndpoint(sib, callback)
+        callback.waitFor(SSAP_MESSAGE_TYPE.JOIN)
+        firstKey = endpoint._sessionKey
+        prepared = endpoint.prepare("Sensor", "db.Sensor.find()")
+        prepared.execute({"limit" : 1})
+        prepared.executeBatch([{"limit" : 2}, {"limit" : 3}])
+        responses = callback.waitFor(SSAP_MESSAGE_TYPE.QUERY, 3)
+        self.assertTrue(all(response["body"]["ok"] for response in responses))
+        self.assertEqual(sib.queries, [(firstKey, {"limit" : 1}), (firstKey, {"limit" : 2}), (firstKey, {"limit" : 3})])
+        endpoint.leave()
+        callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        sleep(0.2)
+        endpoint.joinWithToken(TOKEN, INSTANCE)
+        callback.waitFor(SSAP_MESSAGE_TYPE.JOIN, 2)
+        secondKey = endpoint._sessionKey
+        self.assertNotEqual(secondKey, firstKey)
+        prepared.execute()
+        callback.waitFor(SSAP_MESSAGE_TYPE.QUERY, 4)
+        self.assertEqual(sib.queries[-1], (secondKey, None))
+        endpoint.leave()
+        callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE, 2)
+            
+if __name__ == "__main__":
+    unittest.main()
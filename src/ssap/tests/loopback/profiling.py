@@ -0,0 +1,82 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from time import monotonic
+from ssap.core import MultiHandlerSSAPCallback, SSAP_MESSAGE_TYPE
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.profiling import STAGES, getLastProfileReport, isProfiling, startProfiling, stopProfiling
+from ssap.tests.utils.loopback import RecordingSIB, buildLoopbackEndpoint, waitUntil
+
+class TestProfiling(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.responses = []
+        self.callback = MultiHandlerSSAPCallback()
+        self.callback.registerHandler(SSAP_MESSAGE_TYPE.INSERT, self.busyHandler)
+        self.endpoint = buildLoopbackEndpoint(RecordingSIB(), self.callback)
+    
+    def tearDown(self):
+        stopProfiling()
+        shutil.rmtree(self.directory)
+    
+    def busyHandler(self, message):
+        deadline = monotonic() + 0.005
+        while (monotonic() < deadline):
+            pass
+        self.responses.append(message)
+    
+    def insert(self, count):
+        expected = len(self.responses) + count
+        for measure in range(count):
+            self.endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : measure}}))
+        waitUntil(lambda: len(self.responses) == expected)
+    
+    def testProfilerReportsTheStagesOfALiveEndpoint(self):
+        startProfiling(interval=0.001, traceAllocations=True)
+        self.assertTrue(isProfiling())
+        self.assertRaises(InvalidSSAPOperation, startProfiling)
+        self.insert(40)
+        report = stopProfiling()
+        self.assertFalse(isProfiling())
+        self.assertIs(report, getLastProfileReport())
+        self.assertIsNone(stopProfiling())
+        self.assertGreater(report.samples, 0)
+        results = json.loads(json.dumps(report.toDict()))
+        self.assertEqual(set(), set(results["stages"]) - set(STAGES))
+        # The time spent in the application handlers is charged to their stage
+        handlers = results["stages"]["handlers"]
+        self.assertGreater(handlers["seconds"], 0)
+        self.assertTrue(any(function["function"].endswith(":busyHandler") for function in handlers["functions"]))
+        for stats in results["stages"].values():
+            self.assertIn("allocations", stats)
+        self.assertIn("handlers", report.format())
+        # The endpoint still works after the profiler has been stopped
+        self.insert(1)
+    
+    def testTimedSessionsWriteTheirReports(self):
+        path = os.path.join(self.directory, "profile.json")
+        startProfiling(duration=0.2, interval=0.001, output=path)
+        self.insert(10)
+        waitUntil(lambda: not isProfiling() and os.path.exists(path))
+        waitUntil(lambda: os.path.getsize(path) > 0)
+        with open(path) as reportFile:
+            results = json.loads(reportFile.readline())
+        self.assertGreater(results["samples"], 0)
+        self.assertIn("handlers", results["stages"])
+        self.assertFalse("allocations" in results["stages"]["handlers"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import base64
+import hashlib
+import socket
+import struct
+import unittest
+from threading import Event, Thread
+from time import monotonic
+from ssap.exceptions import SSAPConnectionError
+from ssap.implementations.rfc6455 import NativeWebsocketTransportFactory, _WEBSOCKET_GUID
+from ssap.tests.utils.loopback import waitUntil
+
+class _WebsocketServer(object):
+    '''
+    A minimal websocket server. It accepts connections, completes the handshakes and sends
+    unmasked text frames on demand. It never reads the frames sent by the clients.
+    '''
+    
+    def __init__(self):
+        self.__listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__listener.bind(("127.0.0.1", 0))
+        self.__listener.listen(8)
+        self.connections = []
+        
+    def getUrl(self):
+        return "ws://127.0.0.1:{0}/sib/api_websocket".format(self.__listener.getsockname()[1])
+    
+    def accept(self, firstFrames=b""):
+        (connection, _address) = self.__listener.accept()
+        request = b""
+        while (not b"\r\n\r\n" in request):
+            request += connection.recv(4096)
+        key = [line.split(b":", 1)[1].strip() for line in request.split(b"\r\n") if line.lower().startswith(b"sec-websocket-key")][0]
+        accept = base64.b64encode(hashlib.sha1(key + _WEBSOCKET_GUID).digest())
+        connection.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n" +
+                           b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n" + firstFrames)
+        self.connections.append(connection)
+        return connection
+    
+    @staticmethod
+    def buildTextFrame(payload):
+        return struct.pack("!BB", 0x81, len(payload)) + payload
+    
+    def sendText(self, connection, payload):
+        connection.sendall(_WebsocketServer.buildTextFrame(payload))
+        
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.__listener.close()
+        
+class TestNativeWebsocketClient(unittest.TestCase):
+    
+    def setUp(self):
+        self.__server = _WebsocketServer()
+        
+    def tearDown(self):
+        self.__server.close()
+        
+    def connect(self, dataHandler, firstFrames=b"", **options):
+        client = NativeWebsocketTransportFactory(**options)(self.__server.getUrl(), [], lambda: None, dataHandler)
+        thread = Thread(target=self.__server.accept, args=(firstFrames,))
+        thread.start()
+        client.connect()
+        thread.join()
+        return (client, self.__server.connections[-1])
+    
+    def testFailingHandlerOnlyClosesItsConnection(self):
+        def failingHandler(data):
+            raise ValueError("Handler failure")
+        received = []
+        receivedEvent = Event()
+        def handler(data):
+            received.append(data)
+            receivedEvent.set()
+        (failingClient, failingConnection) = self.connect(failingHandler)
+        (_client, connection) = self.connect(handler)
+        self.__server.sendText(failingConnection, b"first")
+        self.__server.sendText(connection, b"second")
+        self.assertTrue(receivedEvent.wait(5))
+        self.assertEqual([b"second"], received)
+        waitUntil(lambda: self.isClosed(failingClient))
+        
+    def isClosed(self, client):
+        try:
+            client.send("data")
+            return False
+        except SSAPConnectionError:
+            return True
+        
+    def testMessagesAreDeliveredInOrder(self):
+        received = []
+        (_client, connection) = self.connect(received.append)
+        for index in range(200):
+            self.__server.sendText(connection, str(index).encode("ascii"))
+        waitUntil(lambda: len(received) == 200)
+        self.assertEqual([str(index).encode("ascii") for index in range(200)], received)
+        
+    def testSlowHandlersDoNotStallTheOtherConnections(self):
+        blocked = Event()
+        unblock = Event()
+        def slowHandler(data):
+            blocked.set()
+            unblock.wait(10)
+        received = []
+        (_slowClient, slowConnection) = self.connect(slowHandler)
+        (_client, connection) = self.connect(received.append)
+        try:
+            self.__server.sendText(slowConnection, b"slow")
+            self.assertTrue(blocked.wait(5))
+            self.__server.sendText(connection, b"fast")
+            waitUntil(lambda: received == [b"fast"])
+        finally:
+            unblock.set()
+            
+    def testFramesSentWithTheHandshakeAreDelivered(self):
+        received = []
+        firstFrames = _WebsocketServer.buildTextFrame(b"first") + _WebsocketServer.buildTextFrame(b"second")
+        (_client, connection) = self.connect(received.append, firstFrames)
+        self.__server.sendText(connection, b"third")
+        waitUntil(lambda: len(received) == 3)
+        self.assertEqual([b"first", b"second", b"third"], received)
+        
+    def testSendTimeoutClosesTheConnection(self):
+        (client, _connection) = self.connect(lambda data: None, sendTimeout=0.5, sendBufferSize=4096)
+        start = monotonic()
+        with self.assertRaises(SSAPConnectionError):
+            for _i in range(10000):
+                client.send(b"x" * 65536)
+        self.assertLess(monotonic() - start, 5)
+        self.assertRaises(SSAPConnectionError, client.ping)
+
+if __name__ == "__main__":
+    unittest.main()
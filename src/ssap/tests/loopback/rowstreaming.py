@@ -0,0 +1,155 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import unittest
+from ssap.core import SSAP_MESSAGE_TYPE, SSAP_ERROR_CODE
+from ssap.messages import messages
+from ssap.messages.messages import _SSAPMessageParser
+from ssap.tests.utils.callbacks import RecordingRowHandler
+from ssap.tests.utils.loopback import RecordingSIB, CollectingCallback, buildLoopbackEndpoint
+
+class FailingRowHandler(RecordingRowHandler):
+    '''
+    A row handler that fails after receiving a number of rows.
+    '''
+    
+    def __init__(self, failAfter):
+        RecordingRowHandler.__init__(self)
+        self.failAfter = failAfter
+        self.completedMessages = []
+        
+    def onRow(self, row):
+        if (len(self.getRows()) == self.failAfter):
+            raise RuntimeError("Boom")
+        RecordingRowHandler.onRow(self, row)
+        
+    def onQueryCompleted(self, message):
+        self.completedMessages.append(message)
+
+class TestRowStreaming(unittest.TestCase):
+    
+    ROWS = [{"Sensor" : {"assetId" : "S_%03d" % index, "measure" : index * 1.5, "note" : "línea %d € \U0001F600" % index,
+                         "tags" : ["a", "b"], "valid" : index % 2 == 0, "extra" : None}} for index in range(40)]
+    
+    def setUp(self):
+        self.__chunkSize = messages._ROW_STREAM_CHUNK_SIZE
+        
+    def tearDown(self):
+        messages._ROW_STREAM_CHUNK_SIZE = self.__chunkSize
+    
+    def buildQueryResponse(self, data, ok=True, ensureAscii=True):
+        return json.dumps({"body" : {"ok" : ok, "data" : data, "error" : None, "errorCode" : None},
+                           "direction" : "RESPONSE", "messageType" : "QUERY", "sessionKey" : "key"},
+                          ensure_ascii=ensureAscii).encode("utf-8")
+    
+    def testRowsAreDecodedForAnyChunkSize(self):
+        data = json.dumps(TestRowStreaming.ROWS, ensure_ascii=False)
+        # The first frame contains UTF-8 sequences, the second one escape sequences and surrogate pairs
+        for frame in (self.buildQueryResponse(data, ensureAscii=False), self.buildQueryResponse(data)):
+            for chunkSize in (1, 2, 3, 5, 7, 13, 64, 1000, 1 << 20):
+                messages._ROW_STREAM_CHUNK_SIZE = chunkSize
+                rowHandler = RecordingRowHandler()
+                message = _SSAPMessageParser.parse(frame, rowHandler)
+                self.assertEqual(TestRowStreaming.ROWS, rowHandler.getRows())
+                self.assertEqual(SSAP_MESSAGE_TYPE.QUERY, message["messageType"])
+                self.assertTrue(message["body"]["ok"])
+                self.assertIsNone(message["body"]["data"])
+            
+    def testStreamedRowsMatchTheParsedData(self):
+        messages._ROW_STREAM_CHUNK_SIZE = 10
+        frame = self.buildQueryResponse(json.dumps(TestRowStreaming.ROWS, ensure_ascii=False))
+        rowHandler = RecordingRowHandler()
+        _SSAPMessageParser.parse(frame, rowHandler)
+        self.assertEqual(json.loads(_SSAPMessageParser.parse(frame)["body"]["data"]), rowHandler.getRows())
+        
+    def testEmptyResultSet(self):
+        rowHandler = RecordingRowHandler()
+        message = _SSAPMessageParser.parse(self.buildQueryResponse("[]"), rowHandler)
+        self.assertEqual([], rowHandler.getRows())
+        self.assertTrue(message["body"]["ok"])
+        
+    def testIncompleteArraysAreRejected(self):
+        self.assertRaises(ValueError, _SSAPMessageParser.parse, self.buildQueryResponse('[{"a" : 1}, {"a"'), RecordingRowHandler())
+        
+    def testFailedQueriesKeepTheirData(self):
+        rowHandler = RecordingRowHandler()
+        message = _SSAPMessageParser.parse(self.buildQueryResponse("Wrong query", False), rowHandler)
+        self.assertEqual([], rowHandler.getRows())
+        self.assertEqual("Wrong query", message["body"]["data"])
+        
+    def testOtherMessagesAreNotStreamed(self):
+        indication = json.dumps({"body" : json.dumps({"subscriptionId" : "s", "data" : json.dumps([{"a" : 1}])}),
+                                 "direction" : "RESPONSE", "messageType" : "INDICATION", "sessionKey" : "key"}).encode("utf-8")
+        rowHandler = RecordingRowHandler()
+        message = _SSAPMessageParser.parse(indication, rowHandler)
+        self.assertEqual([], rowHandler.getRows())
+        self.assertEqual([{"a" : 1}], message["body"]["data"])
+        
+    def testRowHandlerFailuresBecomeErrorResponses(self):
+        data = json.dumps(TestRowStreaming.ROWS)
+        for frame in (self.buildQueryResponse(data), self.buildQueryResponse(TestRowStreaming.ROWS)):
+            rowHandler = FailingRowHandler(3)
+            message = _SSAPMessageParser.parse(frame, rowHandler)
+            self.assertEqual(3, len(rowHandler.getRows()))
+            self.assertFalse(message["body"]["ok"])
+            self.assertIsNone(message["body"]["data"])
+            self.assertEqual("The row handler failed: Boom", message["body"]["error"])
+            self.assertEqual(SSAP_ERROR_CODE.OTHER, message["body"]["errorCode"])
+            
+    def testIndicationsAreDetectedWithoutParsing(self):
+        indication = {"body" : {"subscriptionId" : "s", "data" : [{"messageType" : "QUERY"}]},
+                      "direction" : "RESPONSE", "messageType" : "INDICATION", "sessionKey" : "key"}
+        self.assertTrue(_SSAPMessageParser.isIndication(json.dumps(indication).encode("utf-8")))
+        self.assertTrue(_SSAPMessageParser.isIndication(json.dumps(indication, sort_keys=True).encode("utf-8")))
+        response = self.buildQueryResponse(json.dumps([{"messageType" : "INDICATION"}]))
+        self.assertFalse(_SSAPMessageParser.isIndication(response))
+        response = self.buildQueryResponse([{"messageType" : "INDICATION"}])
+        self.assertFalse(_SSAPMessageParser.isIndication(response))
+        
+    def testRowHandlerFailuresDoNotBlockTheEndpoint(self):
+        sib = RecordingSIB(queryLimit=100)
+        callback = CollectingCallback()
+        endpoint = buildLoopbackEndpoint(sib, callback)
+        rows = [{"Sensor" : {"assetId" : "S_%03d" % index, "measure" : index}} for index in range(10)]
+        for row in rows:
+            endpoint.insert("Sensor", json.dumps(row))
+        callback.waitFor(SSAP_MESSAGE_TYPE.INSERT, len(rows))
+        rowHandler = FailingRowHandler(2)
+        endpoint.query("Sensor", "db.Sensor.find()", rowHandler=rowHandler)
+        response = callback.waitFor(SSAP_MESSAGE_TYPE.QUERY)[0]
+        self.assertFalse(response["body"]["ok"])
+        self.assertEqual("The row handler failed: Boom", response["body"]["error"])
+        self.assertEqual([response], rowHandler.completedMessages)
+        # The connection keeps working
+        endpoint.insert("Sensor", json.dumps(rows[0]))
+        self.assertTrue(callback.waitFor(SSAP_MESSAGE_TYPE.INSERT, len(rows) + 1)[-1]["body"]["ok"])
+        endpoint.leave()
+        callback.waitFor(SSAP_MESSAGE_TYPE.LEAVE)
+        
+    def testQueryThroughTheEndpoint(self):
+        sib = RecordingSIB(queryLimit=100)
+        callback = CollectingCallback()
+        endpoint = buildLoopbackEndpoint(sib, callback)
+        rows = [{"Sensor" : {"assetId" : "S_%03d" % index, "measure" : index}} for index in range(40)]
+        for row in rows:
+            endpoint.insert("Sensor", json.dumps(row))
+        # Queries and inserts travel in different lanes
+        callback.waitFor(SSAP_MESSAGE_TYPE.INSERT, len(rows))
+        rowHandler = RecordingRowHandler()
+        endpoint.query("Sensor", "db.Sensor.find()", rowHandler=rowHandler)
+        endpoint.query("Sensor", "db.Sensor.find()")
+        responses = callback.waitFor(SSAP_MESSAGE_TYPE.QUERY, 2)
+        self.assertIsNone(responses[0]["body"]["data"])
+        self.assertEqual(rows, rowHandler.getRows())
+        self.assertEqual(json.loads(responses[1]["body"]["data"]), rowHandler.getRows())
+
+if __name__ == "__main__":
+    unittest.main()
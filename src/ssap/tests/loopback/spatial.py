@@ -0,0 +1,57 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import random
+import unittest
+from ssap.spatial import SpatialGridIndex, haversineDistance
+
+class TestSpatialGridIndex(unittest.TestCase):
+    
+    def bruteForce(self, points, latitude, longitude, radiusInMeters):
+        return sorted(key for (key, (pointLatitude, pointLongitude)) in points.items()
+                      if haversineDistance(latitude, longitude, pointLatitude, pointLongitude) <= radiusInMeters)
+    
+    def testRadiusQueriesCrossTheAntimeridian(self):
+        index = SpatialGridIndex(cellSizeInDegrees=0.5)
+        index.addPoint("east", 0.0, 179.9)
+        index.addPoint("west", 0.0, -179.9)
+        index.addPoint("far", 0.0, 170.0)
+        self.assertEqual([key for (key, _) in index.queryRadius(0.0, 179.95, 50000)], ["east", "west"])
+        self.assertEqual([key for (key, _) in index.queryRadius(0.0, -179.99, 50000)], ["west", "east"])
+        
+    def testRadiusQueriesMatchBruteForce(self):
+        randomGenerator = random.Random(7)
+        index = SpatialGridIndex(cellSizeInDegrees=1.0)
+        points = {}
+        for key in range(2000):
+            point = (randomGenerator.uniform(-89.0, 89.0), randomGenerator.uniform(-180.0, 180.0))
+            points[key] = point
+            index.addPoint(key, point[0], point[1])
+        for (latitude, longitude, radiusInMeters) in ((0.0, 179.5, 500000), (45.0, -179.0, 800000), (88.0, 10.0, 400000),
+                                                      (-60.0, 178.0, 1500000), (10.0, 20.0, 300000)):
+            result = index.queryRadius(latitude, longitude, radiusInMeters)
+            self.assertEqual(sorted(key for (key, _) in result), self.bruteForce(points, latitude, longitude, radiusInMeters))
+            distances = [distance for (_, distance) in result]
+            self.assertEqual(distances, sorted(distances))
+            
+    def testMovesAndRemovals(self):
+        index = SpatialGridIndex()
+        self.assertTrue(index.add({"Sensor" : {"assetId" : "S_01", "geometry" : {"coordinates" : [40.0, -3.0]}}}))
+        self.assertFalse(index.add({"Sensor" : {"assetId" : "S_02"}}))
+        index.addPoint("S_01", 41.0, -3.0)
+        self.assertEqual(index.getPoint("S_01"), (41.0, -3.0))
+        self.assertEqual(index.queryBoundingBox(39.5, -3.5, 40.5, -2.5), [])
+        self.assertEqual(index.queryBoundingBox(40.5, -3.5, 41.5, -2.5), ["S_01"])
+        self.assertTrue(index.remove("S_01"))
+        self.assertFalse(index.remove("S_01"))
+        self.assertEqual(len(index), 0)
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import json
+import unittest
+from ssap.core import MultiHandlerSSAPCallback, SSAPConnectionListener
+from ssap.exceptions import InvalidSSAPOperation
+from ssap.subscriptions import SharedSubscriptionManager
+from ssap.views import MaterializedView
+from ssap.tests.utils.loopback import RecordingSIB, buildLoopbackEndpoint, waitUntil
+
+class GapListener(SSAPConnectionListener):
+    
+    def __init__(self, onLost):
+        self.restored = []
+        self.__onLost = onLost
+        
+    def onConnectionLost(self, reason):
+        self.__onLost()
+        
+    def onConnectionRestored(self, serverUrl):
+        self.restored.append(serverUrl)
+
+class TestSharedSubscriptions(unittest.TestCase):
+    
+    QUERY = "db.Sensor.find()"
+    
+    def setUp(self):
+        self.sib = RecordingSIB()
+        self.callback = MultiHandlerSSAPCallback()
+        self.endpoint = buildLoopbackEndpoint(self.sib, self.callback)
+        self.manager = SharedSubscriptionManager.forEndpoint(self.endpoint, self.callback)
+        
+    def insert(self, measure):
+        self.endpoint.insert("Sensor", json.dumps({"Sensor" : {"measure" : measure}}))
+        
+    def testIdenticalSubscriptionsAreShared(self):
+        (first, second) = ([], [])
+        firstHandle = self.manager.subscribe("Sensor", TestSharedSubscriptions.QUERY, first.append)
+        secondHandle = self.manager.subscribe("Sensor", TestSharedSubscriptions.QUERY, second.append)
+        waitUntil(lambda: not firstHandle.getSubscriptionId() is None)
+        self.assertEqual(1, self.sib.requests.count("SUBSCRIBE"))
+        self.assertEqual(1, self.manager.getServerSubscriptionCount())
+        self.insert(1)
+        waitUntil(lambda: len(first) == 1 and len(second) == 1)
+        self.assertIs(first[0], second[0])
+        firstHandle.cancel()
+        self.assertRaises(InvalidSSAPOperation, firstHandle.cancel)
+        secondHandle.cancel()
+        waitUntil(lambda: "UNSUBSCRIBE" in self.sib.requests)
+        self.assertEqual(0, self.manager.getServerSubscriptionCount())
+        
+    def testSubscriptionsCancelledBeforeTheirResponse(self):
+        self.sib.hold()
+        handle = self.manager.subscribe("Sensor", TestSharedSubscriptions.QUERY, lambda message: None)
+        handle.cancel()
+        self.sib.release()
+        waitUntil(lambda: "UNSUBSCRIBE" in self.sib.requests)
+        self.assertEqual(0, self.manager.getServerSubscriptionCount())
+        
+    def testRejectedSubscriptions(self):
+        self.sib.rejected["SUBSCRIBE"] = 1
+        rejections = []
+        handle = self.manager.subscribe("Sensor", TestSharedSubscriptions.QUERY, lambda message: None,
+                                        errorHandler=rejections.append)
+        waitUntil(lambda: len(rejections) == 1)
+        self.assertTrue(handle.isRejected())
+        self.assertEqual("Rejected by the test", handle.getError())
+        self.assertFalse(rejections[0]["body"]["ok"])
+        self.assertEqual(0, self.manager.getServerSubscriptionCount())
+        # An identical subscription replaces the rejected one
+        messages = []
+        newHandle = self.manager.subscribe("Sensor", TestSharedSubscriptions.QUERY, messages.append)
+        waitUntil(lambda: not newHandle.getSubscriptionId() is None)
+        self.assertFalse(newHandle.isRejected())
+        handle.cancel()
+        self.assertEqual(1, self.manager.getServerSubscriptionCount())
+        self.insert(1)
+        waitUntil(lambda: len(messages) == 1)
+        self.assertFalse("UNSUBSCRIBE" in self.sib.requests)
+        
+    def testEachEndpointHasOneManager(self):
+        self.assertIs(self.manager, SharedSubscriptionManager.forEndpoint(self.endpoint, self.callback))
+        self.assertRaises(InvalidSSAPOperation, SharedSubscriptionManager, self.endpoint, self.callback)
+        
+    def testViewsShareTheManagerOfTheirEndpoint(self):
+        self.sib.rejected["SUBSCRIBE"] = 1
+        rejectedView = MaterializedView(self.endpoint, "Sensor", key="Sensor.measure", query="db.Sensor.find({})")
+        view = MaterializedView(self.endpoint, "Sensor", key="Sensor.measure")
+        rejectedView.start()
+        view.start()
+        self.assertRaises(InvalidSSAPOperation, rejectedView.waitUntilReady, 5)
+        self.assertTrue(view.waitUntilReady(5))
+        self.insert(7)
+        waitUntil(lambda: 7 in view)
+        self.assertEqual(1, self.manager.getServerSubscriptionCount())
+        rejectedView.stop()
+        view.stop()
+
+class TestSubscriptionGaps(unittest.TestCase):
+    
+    QUERY = "db.Sensor.find()"
+    
+    def setUp(self):
+        self.sib = RecordingSIB()
+        self.callback = MultiHandlerSSAPCallback()
+        self.endpoint = buildLoopbackEndpoint(self.sib, self.callback, serverUrl=["loopback://a", "loopback://b"])
+        self.manager = SharedSubscriptionManager.forEndpoint(self.endpoint, self.callback)
+        
+    @staticmethod
+    def buildInstance(measure):
+        # The SIB clock is far ahead of ours
+        return {"Sensor" : {"measure" : measure, "timestamp" : {"$date" : "2100-01-01T00:00:{0:02d}Z".format(measure)}}}
+        
+    def insert(self, measure):
+        self.endpoint.insert("Sensor", json.dumps(TestSubscriptionGaps.buildInstance(measure)))
+        
+    def storeWhileDisconnected(self, measures):
+        with self.sib._LoopbackSIB__lock:
+            for measure in measures:
+                self.sib._LoopbackSIB__store("Sensor", TestSubscriptionGaps.buildInstance(measure), [])
+                
+    def testGapsAreFilledOnce(self):
+        received = []
+        handle = self.manager.subscribe("Sensor", TestSubscriptionGaps.QUERY, received.append,
+                                        timestampField="Sensor.timestamp")
+        waitUntil(lambda: not handle.getSubscriptionId() is None)
+        self.insert(1)
+        waitUntil(lambda: len(received) == 1)
+        def onLost():
+            self.storeWhileDisconnected([2, 3])
+            self.sib.setResponsive(True)
+        listener = GapListener(onLost)
+        self.endpoint.addConnectionListener(listener)
+        self.sib.setResponsive(False)
+        self.endpoint.startHeartbeat(0.05, maxMissedPongs=2)
+        waitUntil(lambda: len(listener.restored) == 1)
+        self.endpoint.stopHeartbeat()
+        waitUntil(lambda: len(received) == 2)
+        self.insert(4)
+        waitUntil(lambda: len(received) == 3)
+        measures = [[instance["Sensor"]["measure"] for instance in message["body"]["data"]] for message in received]
+        self.assertEqual([[1], [2, 3], [4]], measures)
+        self.assertEqual([False, True, False], [message["body"].get("backfill", False) for message in received])
+        self.assertEqual(1, self.sib.requests.count("QUERY"))
+
+if __name__ == "__main__":
+    unittest.main()
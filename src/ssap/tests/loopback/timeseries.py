@@ -0,0 +1,68 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+'''
+import unittest
+from ssap import timeseries
+from ssap.timeseries import TimeSeriesBuffer
+
+@unittest.skipIf(timeseries.numpy is None, "NumPy is not installed")
+class TestTimeSeriesBuffer(unittest.TestCase):
+    
+    NOW = 1000000.0
+    
+    def testWindowAggregates(self):
+        buffer = TimeSeriesBuffer(capacity=8)
+        for (offset, value) in ((-50, 1.0), (-20, 2.0), (-10, 4.0), (0, 6.0)):
+            buffer.append("S_01", TestTimeSeriesBuffer.NOW + offset, value)
+        buffer.append("S_02", TestTimeSeriesBuffer.NOW - 5, 10.0)
+        buffer.append("S_03", TestTimeSeriesBuffer.NOW - 100, 3.0)
+        now = TestTimeSeriesBuffer.NOW
+        self.assertEqual(buffer.count(30, now), {"S_01" : 3, "S_02" : 1, "S_03" : 0})
+        self.assertEqual(buffer.mean(30, now), {"S_01" : 4.0, "S_02" : 10.0})
+        self.assertEqual(buffer.min(60, now), {"S_01" : 1.0, "S_02" : 10.0})
+        self.assertEqual(buffer.max(60, now), {"S_01" : 6.0, "S_02" : 10.0})
+        self.assertEqual(buffer.percentile(50, 30, now), {"S_01" : 4.0, "S_02" : 10.0})
+        # S_02 has a single sample in the window, so it has no rate
+        self.assertEqual(buffer.rate(30, now), {"S_01" : 0.2})
+        self.assertEqual(buffer.mean(1000, now)["S_03"], 3.0)
+        
+    def testRingOverwritesTheOldestSamples(self):
+        buffer = TimeSeriesBuffer(capacity=4)
+        for index in range(10):
+            buffer.append("S_01", TestTimeSeriesBuffer.NOW - 10 + index, float(index))
+        now = TestTimeSeriesBuffer.NOW
+        self.assertEqual(buffer.count(100, now), {"S_01" : 4})
+        self.assertEqual(buffer.min(100, now), {"S_01" : 6.0})
+        self.assertEqual(buffer.max(100, now), {"S_01" : 9.0})
+        # The first and last samples are found wherever the ring head is
+        self.assertEqual(buffer.rate(100, now), {"S_01" : 1.0})
+        
+    def testGrowsAndReadsInstances(self):
+        buffer = TimeSeriesBuffer(capacity=2, initialKeys=2)
+        footprint = buffer.getMemoryFootprint()
+        for index in range(5):
+            self.assertTrue(buffer.add({"Sensor" : {"assetId" : "S_%02d" % index, "measure" : index,
+                                                    "timestamp" : {"$date" : "2014-04-29T08:24:54.005Z"}}}))
+        self.assertFalse(buffer.add({"Sensor" : {"assetId" : "S_99", "measure" : True}}))
+        self.assertFalse(buffer.add({"Sensor" : {"measure" : 1}}))
+        self.assertEqual(buffer.getKeys(), ["S_%02d" % index for index in range(5)])
+        self.assertGreater(buffer.getMemoryFootprint(), footprint)
+        means = buffer.mean(10, now=1398759894.005 + 1)
+        self.assertEqual(means, dict(("S_%02d" % index, float(index)) for index in range(5)))
+        
+    def testIndications(self):
+        buffer = TimeSeriesBuffer()
+        buffer.onIndication({"body" : {"data" : [{"Sensor" : {"assetId" : "S_01", "measure" : 2}},
+                                                 {"Sensor" : {"assetId" : "S_01", "measure" : 4}}]}})
+        buffer.onIndication({"body" : {"data" : None}})
+        self.assertEqual(buffer.mean(60), {"S_01" : 3.0})
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -9,7 +9,7 @@
  All rights reserved
 '''
 
-from ssap.core import BasicSSAPCallback, SSAP_MESSAGE_TYPE, SSAPEndpoint
+from ssap.core import BasicSSAPCallback, SSAP_MESSAGE_TYPE, SSAPEndpoint, SSAPRowHandler
 
 import json
 from time import sleep
@@ -23,18 +23,24 @@ class TestCallback(BasicSSAPCallback):
         self.__ignoreJoinsAndLeaves = ignoreJoinsAndLeaves
         self.__subscriptionId = None
         self.__indicationReceived = False
+        self.__responseData = None
     
     def onSSAPMessageReceived(self, message):
         self.__prettyPrintMessage(message)
         self.__isResponseOk = SSAPEndpoint.hasOkField(message) and message["body"]["ok"]
         if (message["messageType"] == SSAP_MESSAGE_TYPE.SUBSCRIBE):
             self.__subscriptionId = message["body"]["data"]
+        if (SSAPEndpoint.hasOkField(message)):
+            self.__responseData = message["body"].get("data")
         self.__indicationReceived = message["messageType"] == SSAP_MESSAGE_TYPE.INDICATION
         self.__responseReceived = True
         
     def isSsapResponseOk(self):
         return self.__isResponseOk
     
+    def getSsapResponseData(self):
+        return self.__responseData
+    
     def wasIndicationReceived(self):
         return self.__indicationReceived
     
@@ -58,4 +64,17 @@ class TestCallback(BasicSSAPCallback):
             (message["messageType"] == SSAP_MESSAGE_TYPE.JOIN or message["messageType"] == SSAP_MESSAGE_TYPE.LEAVE)):
             return
         print("A(n) " + SSAP_MESSAGE_TYPE.toString(message["messageType"]) + " message was received!")
-        print(json.dumps(message, sort_keys=True, indent=4, separators=(",", ":")))
\ No newline at end of file
+        # The compact messages are not dictionaries, but their fields are
+        print(json.dumps(dict(message.items()), sort_keys=True, indent=4, separators=(",", ":")))
+        
+class RecordingRowHandler(SSAPRowHandler):
+    
+    def __init__(self):
+        SSAPRowHandler.__init__(self)
+        self.__rows = []
+        
+    def onRow(self, row):
+        self.__rows.append(row)
+        
+    def getRows(self):
+        return self.__rows
@@ -0,0 +1,126 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+ 
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+  
+ All rights reserved
+ 
+ Helpers for the tests that run against the in-process loopback SIB.
+'''
+import json
+from threading import Condition, Lock
+from time import monotonic, sleep
+from ssap.core import BasicSSAPCallback, SSAP_MESSAGE_TYPE
+from ssap.factories import SSAPEndpointFactory
+from ssap.implementations.loopback import LoopbackSIB, LoopbackTransportFactory
+
+TOKEN = "loopback-token"
+INSTANCE = "KPLoopback:KPLoopback01"
+
+class RecordingSIB(LoopbackSIB):
+    '''
+    A loopback SIB that records the types of the requests that it receives. It can drop or reject
+    the requests of a given type (with the error codes of errorCodes), and hold the requests until
+    the test releases them.
+    '''
+    
+    def __init__(self, **kwargs):
+        LoopbackSIB.__init__(self, **kwargs)
+        self.requests = []
+        self.dropped = {}
+        self.rejected = {}
+        self.errorCodes = {}
+        self.__lock = Lock()
+        self.__held = None
+        
+    def hold(self):
+        '''
+        Stops answering the requests until release() is invoked.
+        '''
+        with self.__lock:
+            self.__held = []
+            
+    def release(self):
+        '''
+        Answers the held requests in the order in which they were received and stops holding them.
+        '''
+        with self.__lock:
+            held = self.__held
+            self.__held = None
+        for (transport, request) in held:
+            LoopbackSIB.process(self, transport, request)
+        
+    def process(self, transport, request):
+        self.requests.append(request["messageType"])
+        remaining = self.dropped.get(request["messageType"], 0)
+        if (remaining > 0):
+            self.dropped[request["messageType"]] = remaining - 1
+            return
+        remaining = self.rejected.get(request["messageType"], 0)
+        if (remaining > 0):
+            self.rejected[request["messageType"]] = remaining - 1
+            transport._deliver(json.dumps({"messageType" : request["messageType"], "direction" : "RESPONSE",
+                                           "sessionKey" : request.get("sessionKey"), "ontology" : request.get("ontology"),
+                                           "body" : {"ok" : False, "data" : None, "error" : "Rejected by the test",
+                                                     "errorCode" : self.errorCodes.get(request["messageType"])}}).encode("utf-8"))
+            return
+        with self.__lock:
+            if (not self.__held is None):
+                self.__held.append((transport, request))
+                return
+        LoopbackSIB.process(self, transport, request)
+        
+class CollectingCallback(BasicSSAPCallback):
+    '''
+    Stores the received messages and lets the tests wait for them.
+    '''
+    
+    def __init__(self):
+        BasicSSAPCallback.__init__(self)
+        self.__condition = Condition()
+        self.messages = []
+        
+    def onSSAPMessageReceived(self, message):
+        with self.__condition:
+            self.messages.append(message)
+            self.__condition.notify_all()
+            
+    def getMessages(self, messageType):
+        with self.__condition:
+            return [message for message in self.messages if message["messageType"] == messageType]
+        
+    def waitFor(self, messageType, count=1, timeout=5):
+        '''
+        Waits until a number of messages of a type have been received. Returns them.
+        '''
+        deadline = monotonic() + timeout
+        with self.__condition:
+            while (len(self.getMessages(messageType)) < count):
+                remaining = deadline - monotonic()
+                if (remaining <= 0):
+                    raise AssertionError("Only {0} {1} messages were received".format(len(self.getMessages(messageType)),
+                                                                                     SSAP_MESSAGE_TYPE.toString(messageType)))
+                self.__condition.wait(remaining)
+            return self.getMessages(messageType)
+        
+def waitUntil(condition, timeout=5):
+    '''
+    Waits until a function returns True.
+    '''
+    deadline = monotonic() + timeout
+    while (not condition()):
+        if (monotonic() > deadline):
+            raise AssertionError("The condition was not met")
+        sleep(0.01)
+        
+def buildLoopbackEndpoint(sib, callback, flowController=None, serverUrl="loopback://sib", **kwargs):
+    '''
+    Builds an endpoint connected to a loopback SIB and joins it.
+    '''
+    endpoint = SSAPEndpointFactory.buildWebsocketBasedSSAPEndpoint(serverUrl, callback, False, flowController,
+                                                                    LoopbackTransportFactory(sib), **kwargs)
+    endpoint.joinWithToken(TOKEN, INSTANCE)
+    return endpoint
@@ -8,10 +8,11 @@
   
  All rights reserved
 '''
+import json
 import unittest
 from ssap.core import SSAP_QUERY_TYPE
 from ssap.factories import SSAPEndpointFactory
-from ssap.tests.utils.callbacks import TestCallback
+from ssap.tests.utils.callbacks import TestCallback, RecordingRowHandler
 
 class TestQueries(unittest.TestCase):
     
@@ -61,6 +62,21 @@ class TestQueries(unittest.TestCase):
         self.__callback.waitForSsapResponse()
         self.assertTrue(self.__callback.isSsapResponseOk())
         
+    def testStreamedNativeQuery(self):
+        self.__callback.prepareToReceiveSsapResponse()
+        self.__endpoint.query(TestQueries.ONTOLOGY, TestQueries.NATIVE_QUERY)
+        self.__callback.waitForSsapResponse()
+        self.assertTrue(self.__callback.isSsapResponseOk())
+        expectedRows = json.loads(self.__callback.getSsapResponseData())
+        self.assertTrue(len(expectedRows) > 0)
+        rowHandler = RecordingRowHandler()
+        self.__callback.prepareToReceiveSsapResponse()
+        self.__endpoint.query(TestQueries.ONTOLOGY, TestQueries.NATIVE_QUERY, rowHandler=rowHandler)
+        self.__callback.waitForSsapResponse()
+        self.assertTrue(self.__callback.isSsapResponseOk())
+        self.assertIsNone(self.__callback.getSsapResponseData())
+        self.assertEqual(expectedRows, rowHandler.getRows())
+        
     def testUnsuccessfulNativeQuery(self):
         self.__callback.prepareToReceiveSsapResponse()
         self.__endpoint.query(TestQueries.ONTOLOGY, "wrong query")
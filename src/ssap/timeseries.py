@@ -0,0 +1,224 @@
+# -*- coding: utf8 -*-
+'''
+Per-key time-series ring buffers with vectorized window aggregates.
+
+The samples of all the keys are stored in two fixed-width NumPy matrices (one row per key), so
+the memory footprint is bounded by the capacity of the rings and the window aggregates are
+computed for all the keys at once.
+
+This module requires NumPy.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import warnings
+from threading import RLock
+from time import time
+from ssap.utils.filters import compileFieldGetter
+from ssap.utils.timestamps import toEpochSeconds
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class TimeSeriesBuffer(object):
+    '''
+    Stores the last samples of a numeric field of the ontology instances, grouping them by a key
+    field. Each key has a ring buffer with a fixed capacity: when it is full, the oldest sample
+    is overwritten.
+    '''
+
+    def __init__(self, capacity=1024, key="Sensor.assetId", value="Sensor.measure", timestamp="Sensor.timestamp",
+                 initialKeys=64):
+        '''
+        Initializes the state of the buffer.
+
+        Keyword arguments:
+        capacity       -- the maximum number of samples that will be stored for each key.
+        key            -- the dotted path of the field that identifies the time series.
+        value          -- the dotted path of the numeric field that will be stored.
+        timestamp      -- the dotted path of the timestamp field. If an instance has no timestamp, the
+                          reception time will be used.
+        initialKeys    -- the number of keys that the buffer will be able to store before it grows.
+        '''
+        if (numpy is None):
+            raise ImportError("The time-series buffers require NumPy")
+        self.__capacity = capacity
+        self.__getKey = compileFieldGetter(key)
+        self.__getValue = compileFieldGetter(value)
+        self.__getTimestamp = compileFieldGetter(timestamp)
+        self.__lock = RLock()
+        self.__rows = {}
+        self.__keys = []
+        self.__values = numpy.full((initialKeys, capacity), numpy.nan)
+        self.__timestamps = numpy.full((initialKeys, capacity), numpy.nan)
+        self.__heads = numpy.zeros(initialKeys, dtype=numpy.int64)
+
+    def getKeys(self):
+        '''
+        Returns a list with the keys that have samples.
+        '''
+        with self.__lock:
+            return list(self.__keys)
+
+    def getMemoryFootprint(self):
+        '''
+        Returns the size (in bytes) of the sample matrices.
+        '''
+        return self.__values.nbytes + self.__timestamps.nbytes + self.__heads.nbytes
+
+    def append(self, key, timestamp, value):
+        '''
+        Stores a sample.
+
+        Keyword arguments:
+        key          -- the key of the time series.
+        timestamp    -- the time of the sample (in seconds since the epoch).
+        value        -- the value of the sample.
+        '''
+        with self.__lock:
+            row = self.__rows.get(key)
+            if (row is None):
+                row = len(self.__keys)
+                if (row == self.__values.shape[0]):
+                    self.__grow()
+                self.__rows[key] = row
+                self.__keys.append(key)
+            head = self.__heads[row]
+            self.__values[row, head] = value
+            self.__timestamps[row, head] = timestamp
+            self.__heads[row] = (head + 1) % self.__capacity
+
+    def add(self, instance):
+        '''
+        Stores the sample of an ontology instance. Returns False if it has no key or no numeric value.
+
+        Keyword arguments:
+        instance    -- the ontology instance.
+        '''
+        key = self.__getKey(instance)
+        value = self.__getValue(instance)
+        if (key is None or isinstance(value, bool) or not isinstance(value, (int, float))):
+            return False
+        timestamp = toEpochSeconds(self.__getTimestamp(instance))
+        if (timestamp is None):
+            timestamp = time()
+        self.append(key, timestamp, value)
+        return True
+
+    def onIndication(self, message):
+        '''
+        Stores the samples of an INDICATION message. This method can be registered as an INDICATION handler.
+
+        Keyword arguments:
+        message    -- a parsed INDICATION message.
+        '''
+        data = message["body"].get("data")
+        if (data is None):
+            return
+        if (not isinstance(data, list)):
+            data = [data]
+        for instance in data:
+            self.add(instance)
+
+    def count(self, windowInSeconds, now=None):
+        '''
+        Returns a dictionary with the number of samples of each key in the last windowInSeconds seconds.
+        '''
+        (keys, values, _timestamps) = self.__window(windowInSeconds, now)
+        counts = numpy.sum(~numpy.isnan(values), axis=1)
+        return self.__toDictionary(keys, counts)
+
+    def mean(self, windowInSeconds, now=None):
+        '''
+        Returns a dictionary with the mean value of each key in the last windowInSeconds seconds.
+        The keys without samples in the window are not included.
+        '''
+        return self.__aggregate(numpy.nanmean, windowInSeconds, now)
+
+    def min(self, windowInSeconds, now=None):
+        '''
+        Returns a dictionary with the minimum value of each key in the last windowInSeconds seconds.
+        '''
+        return self.__aggregate(numpy.nanmin, windowInSeconds, now)
+
+    def max(self, windowInSeconds, now=None):
+        '''
+        Returns a dictionary with the maximum value of each key in the last windowInSeconds seconds.
+        '''
+        return self.__aggregate(numpy.nanmax, windowInSeconds, now)
+
+    def percentile(self, percentile, windowInSeconds, now=None):
+        '''
+        Returns a dictionary with the given percentile (between 0 and 100) of the values of each key in
+        the last windowInSeconds seconds.
+        '''
+        return self.__aggregate(lambda values, axis: numpy.nanpercentile(values, percentile, axis=axis),
+                                windowInSeconds, now)
+
+    def rate(self, windowInSeconds, now=None):
+        '''
+        Returns a dictionary with the rate of change (in units per second) of the value of each key in
+        the last windowInSeconds seconds, computed from the first and the last samples of the window.
+        The keys with less than two samples in the window are not included.
+        '''
+        (keys, values, timestamps) = self.__window(windowInSeconds, now)
+        if (not keys):
+            return {}
+        rows = numpy.arange(len(keys))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            # nanargmin and nanargmax fail on rows without samples, so we look for +/- inf instead
+            first = numpy.argmin(numpy.where(numpy.isnan(timestamps), numpy.inf, timestamps), axis=1)
+            last = numpy.argmax(numpy.where(numpy.isnan(timestamps), -numpy.inf, timestamps), axis=1)
+            elapsed = timestamps[rows, last] - timestamps[rows, first]
+            rates = (values[rows, last] - values[rows, first]) / elapsed
+        rates[~(elapsed > 0)] = numpy.nan
+        return self.__toDictionary(keys, rates)
+
+    def __grow(self):
+        '''
+        Doubles the number of rows of the sample matrices.
+        '''
+        rows = self.__values.shape[0]
+        padding = numpy.full((rows, self.__capacity), numpy.nan)
+        self.__values = numpy.vstack((self.__values, padding))
+        self.__timestamps = numpy.vstack((self.__timestamps, padding))
+        self.__heads = numpy.concatenate((self.__heads, numpy.zeros(rows, dtype=numpy.int64)))
+
+    def __window(self, windowInSeconds, now):
+        '''
+        Returns the keys and copies of their sample matrices in which the samples that are outside
+        the window have been replaced by NaN.
+        '''
+        if (now is None):
+            now = time()
+        with self.__lock:
+            keys = list(self.__keys)
+            values = self.__values[:len(keys)].copy()
+            timestamps = self.__timestamps[:len(keys)].copy()
+        with numpy.errstate(invalid="ignore"):
+            outside = ~(timestamps >= now - windowInSeconds)
+        values[outside] = numpy.nan
+        timestamps[outside] = numpy.nan
+        return (keys, values, timestamps)
+
+    def __aggregate(self, function, windowInSeconds, now):
+        (keys, values, _timestamps) = self.__window(windowInSeconds, now)
+        if (not keys):
+            return {}
+        with warnings.catch_warnings():
+            # The rows without samples in the window produce "all-NaN slice" warnings
+            warnings.simplefilter("ignore", RuntimeWarning)
+            results = function(values, axis=1)
+        return self.__toDictionary(keys, results)
+
+    @staticmethod
+    def __toDictionary(keys, results):
+        return dict((key, result.item()) for (key, result) in zip(keys, results) if not numpy.isnan(result))
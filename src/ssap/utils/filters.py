@@ -0,0 +1,339 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+import json
+import operator
+import re
+from ssap.exceptions import InvalidSSAPFilter
+
+_TOKEN_PATTERN = re.compile(r'''
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?) |
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*') |
+        (?P<operator>==|!=|>=|<=|>|<|\(|\)) |
+        (?P<name>[A-Za-z_$][\w$]*(?:\.[A-Za-z_$][\w$]*)*)
+    )''', re.VERBOSE)
+
+_COMPARISON_OPERATORS = {"==" : operator.eq, "!=" : operator.ne, ">" : operator.gt, ">=" : operator.ge,
+                         "<" : operator.lt, "<=" : operator.le}
+
+_KEYWORDS = {"and", "or", "not"}
+
+_CONSTANTS = {"true" : True, "false" : False, "null" : None}
+
+_MISSING = object()
+
+def _tokenize(expression):
+    '''
+    Splits a filter expression into (kind, value) tuples.
+    '''
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while (position < len(expression)):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if (match is None):
+            raise InvalidSSAPFilter("Unexpected character at position {0} of '{1}'".format(position, expression))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if (kind == "name" and value.lower() in _KEYWORDS):
+            kind = "keyword"
+            value = value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+def _compilePath(path):
+    '''
+    Compiles a dotted field path into a function that extracts the field value from an ontology
+    instance. The function returns _MISSING if the field does not exist.
+    '''
+    keys = tuple(path.split("."))
+    if (len(keys) == 1):
+        key = keys[0]
+        def getValue(instance):
+            return instance.get(key, _MISSING)
+        return getValue
+    def getNestedValue(instance):
+        value = instance
+        for key in keys:
+            if (not isinstance(value, dict)):
+                return _MISSING
+            value = value.get(key, _MISSING)
+            if (value is _MISSING):
+                return _MISSING
+        return value
+    return getNestedValue
+
+def compileFieldGetter(path, default=None):
+    '''
+    Compiles a dotted field path into a function that extracts the field value from an ontology
+    instance.
+
+    Keyword arguments:
+    path       -- the dotted field path (e.g. "Sensor.assetId").
+    default    -- the value that the function will return when the field does not exist.
+    '''
+    getValue = _compilePath(path)
+    def getValueOrDefault(instance):
+        value = getValue(instance)
+        if (value is _MISSING):
+            return default
+        return value
+    return getValueOrDefault
+
+class _PredicateCompiler(object):
+    '''
+    A recursive descent compiler for filter expressions. The grammar is
+
+        expression := term ("OR" term)*
+        term       := factor ("AND" factor)*
+        factor     := "NOT" factor | "(" expression ")" | path operator literal
+    '''
+
+    def __init__(self, expression):
+        self.__expression = expression
+        self.__tokens = _tokenize(expression)
+        self.__position = 0
+
+    def compile(self):
+        if (not self.__tokens):
+            raise InvalidSSAPFilter("The filter expression is empty")
+        predicate = self.__parseExpression()
+        if (self.__position != len(self.__tokens)):
+            self.__fail("Unexpected token '{0}'".format(self.__tokens[self.__position][1]))
+        return predicate
+
+    def __peek(self):
+        if (self.__position < len(self.__tokens)):
+            return self.__tokens[self.__position]
+        return (None, None)
+
+    def __next(self):
+        token = self.__peek()
+        if (token[0] is None):
+            self.__fail("Unexpected end of expression")
+        self.__position = self.__position + 1
+        return token
+
+    def __fail(self, reason):
+        raise InvalidSSAPFilter("{0} in filter expression '{1}'".format(reason, self.__expression))
+
+    def __parseExpression(self):
+        operands = [self.__parseTerm()]
+        while (self.__peek() == ("keyword", "or")):
+            self.__next()
+            operands.append(self.__parseTerm())
+        if (len(operands) == 1):
+            return operands[0]
+        operands = tuple(operands)
+        return lambda instance: any(operand(instance) for operand in operands)
+
+    def __parseTerm(self):
+        operands = [self.__parseFactor()]
+        while (self.__peek() == ("keyword", "and")):
+            self.__next()
+            operands.append(self.__parseFactor())
+        if (len(operands) == 1):
+            return operands[0]
+        operands = tuple(operands)
+        return lambda instance: all(operand(instance) for operand in operands)
+
+    def __parseFactor(self):
+        (kind, value) = self.__next()
+        if ((kind, value) == ("keyword", "not")):
+            operand = self.__parseFactor()
+            return lambda instance: not operand(instance)
+        if ((kind, value) == ("operator", "(")):
+            predicate = self.__parseExpression()
+            if (self.__next() != ("operator", ")")):
+                self.__fail("Missing ')'")
+            return predicate
+        if (kind != "name"):
+            self.__fail("Expected a field path, found '{0}'".format(value))
+        getValue = _compilePath(value)
+        (kind, symbol) = self.__next()
+        if (kind != "operator" or not symbol in _COMPARISON_OPERATORS):
+            self.__fail("Expected a comparison operator, found '{0}'".format(symbol))
+        compare = _COMPARISON_OPERATORS[symbol]
+        literal = self.__parseLiteral()
+        def comparison(instance):
+            fieldValue = getValue(instance)
+            if (fieldValue is _MISSING):
+                return False
+            try:
+                return compare(fieldValue, literal)
+            except TypeError:
+                # Values of different types (e.g. a string and a number) never match
+                return False
+        return comparison
+
+    def __parseLiteral(self):
+        (kind, value) = self.__next()
+        if (kind == "number"):
+            if ("." in value or "e" in value or "E" in value):
+                return float(value)
+            return int(value)
+        if (kind == "string"):
+            if (value[0] == "'"):
+                value = '"' + value[1:-1].replace('\\\'', '\'').replace('"', '\\"') + '"'
+            return json.loads(value)
+        if (kind == "name" and value.lower() in _CONSTANTS):
+            return _CONSTANTS[value.lower()]
+        self.__fail("Expected a literal value, found '{0}'".format(value))
+
+def compilePredicate(expression):
+    '''
+    Compiles a filter expression into a function that receives an ontology instance and returns
+    True if it matches the expression. Comparisons with missing fields are always false.
+
+    Expressions compare dotted field paths with JSON literals, and can be combined with AND, OR,
+    NOT and parentheses. For example, "Sensor.measure > 30 AND Sensor.assetId != 'S_01'".
+
+    Keyword arguments:
+    expression    -- the filter expression.
+    '''
+    return _PredicateCompiler(expression).compile()
+
+def compileProjection(fields):
+    '''
+    Compiles a field projection into a function that receives an ontology instance and returns a
+    new instance that only contains the given fields. The nested structure of the instance is kept,
+    and the field values are not copied.
+
+    Keyword arguments:
+    fields    -- an iterable of dotted field paths (e.g. ["Sensor.assetId", "Sensor.measure"]).
+    '''
+    tree = {}
+    for field in fields:
+        node = tree
+        keys = field.split(".")
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+            if (node is None):
+                break
+        else:
+            node[keys[-1]] = None # A leaf: the whole value will be kept
+    def project(value, node):
+        result = {}
+        for (key, child) in node.items():
+            if (not key in value):
+                continue
+            if (child is None or not isinstance(value[key], dict)):
+                result[key] = value[key]
+            else:
+                result[key] = project(value[key], child)
+        return result
+    return lambda instance: project(instance, tree)
+
+def parseIndicationData(message):
+    '''
+    Returns the data of an INDICATION message: an instance, a list of instances or None. If the
+    SIB has sent it as a JSON string, it is deserialized.
+
+    Keyword arguments:
+    message    -- a parsed INDICATION message.
+    '''
+    data = message["body"].get("data")
+    if (isinstance(data, str)):
+        data = json.loads(data)
+    return data
+
+class IndicationFilter(object):
+    '''
+    Applies a compiled predicate and a compiled projection to the ontology instances of INDICATION
+    messages.
+    '''
+
+    def __init__(self, where=None, fields=None):
+        '''
+        Compiles the predicate and the projection.
+
+        Keyword arguments:
+        where     -- a filter expression (see compilePredicate). None selects all the instances.
+        fields    -- the fields that will be kept (see compileProjection). None keeps all of them.
+        '''
+        if (where is None):
+            self.__predicate = None
+        else:
+            self.__predicate = compilePredicate(where)
+        if (fields is None):
+            self.__projection = None
+        else:
+            self.__projection = compileProjection(fields)
+
+    def apply(self, message, data=None):
+        '''
+        Filters an INDICATION message. Returns None if none of its instances matches the predicate.
+        Otherwise, it returns a shallow copy of the message that only contains the projected instances
+        that matched it. A single instance is kept as is, and a list of instances is returned as a new
+        list. The original message is not modified.
+
+        Keyword arguments:
+        message    -- a parsed INDICATION message.
+        data       -- the data of the message, as returned by parseIndicationData(). If it is None, the
+                      data will be read from the message.
+        '''
+        if (data is None):
+            data = parseIndicationData(message)
+            if (data is None):
+                return None
+        predicate = self.__predicate
+        projection = self.__projection
+        if (not isinstance(data, (list, tuple))):
+            if (not predicate is None and not predicate(data)):
+                return None
+            if (not projection is None):
+                data = projection(data)
+        else:
+            if (not predicate is None):
+                data = [instance for instance in data if predicate(instance)]
+                if (not data):
+                    return None
+            if (not projection is None):
+                data = [projection(instance) for instance in data]
+        filteredMessage = dict(message)
+        filteredMessage["body"] = dict(message["body"])
+        filteredMessage["body"]["data"] = data
+        return filteredMessage
+
+class FilteredHandler(object):
+    '''
+    Wraps a subscription message handler so that it only receives the filtered messages. Wrappers
+    compare equal to the handlers they wrap, so they can be unregistered as usual.
+    '''
+
+    def __init__(self, handler, indicationFilter):
+        self.__handler = handler
+        self.__filter = indicationFilter
+
+    def __call__(self, message, data=None):
+        '''
+        Hands the filtered message to the wrapped handler.
+
+        Keyword arguments:
+        message    -- a parsed INDICATION message.
+        data       -- the data of the message, as returned by parseIndicationData(). The callbacks
+                      deserialize it once for all the filtered handlers of a message.
+        '''
+        filteredMessage = self.__filter.apply(message, data)
+        if (not filteredMessage is None):
+            self.__handler(filteredMessage)
+
+    def __eq__(self, other):
+        if (isinstance(other, FilteredHandler)):
+            return self is other
+        return self.__handler == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.__handler)
@@ -0,0 +1,189 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+from threading import Lock
+from time import monotonic
+from ssap.core import SSAP_ERROR_CODE
+
+class TokenBucket(object):
+    '''
+    A token bucket rate limiter. It is not blocking: when there are no tokens left, it returns
+    the time that the caller must wait.
+    '''
+
+    def __init__(self, rate, capacity=None):
+        '''
+        Initializes the state of the bucket. It will be full.
+
+        Keyword arguments:
+        rate        -- the number of tokens per second that will be added to the bucket.
+        capacity    -- the maximum number of tokens that the bucket can hold (i.e. the burst size).
+                       By default, one second worth of tokens.
+        '''
+        if (capacity is None):
+            capacity = max(rate, 1.0)
+        self.__lock = Lock()
+        self.__rate = float(rate)
+        self.__capacity = float(capacity)
+        self.__tokens = float(capacity)
+        self.__lastRefill = monotonic()
+
+    def getRate(self):
+        '''
+        Returns the current refill rate (in tokens per second).
+        '''
+        return self.__rate
+
+    def setRate(self, rate):
+        '''
+        Changes the refill rate of the bucket.
+
+        Keyword arguments:
+        rate    -- the new number of tokens per second.
+        '''
+        with self.__lock:
+            self.__refill()
+            self.__rate = float(rate)
+
+    def tryAcquire(self, tokens=1):
+        '''
+        Tries to take tokens from the bucket. Returns 0 if they were taken, or the number of seconds
+        to wait until they are available.
+
+        Keyword arguments:
+        tokens    -- the number of tokens to take.
+        '''
+        with self.__lock:
+            self.__refill()
+            if (self.__tokens >= tokens):
+                self.__tokens -= tokens
+                return 0
+            return (tokens - self.__tokens) / self.__rate
+
+    def __refill(self):
+        now = monotonic()
+        self.__tokens = min(self.__capacity, self.__tokens + (now - self.__lastRefill) * self.__rate)
+        self.__lastRefill = now
+
+class AIMDFlowController(object):
+    '''
+    An adaptive flow controller for the outbound SSAP requests. It limits both the number of
+    unanswered requests and the send rate, and adjusts them using additive increase and
+    multiplicative decrease (AIMD): they grow slowly while the SIB answers quickly and without
+    errors, and they are halved when the SIB reports that it is overloaded or its response
+    latency goes above the target.
+    '''
+
+    # The SSAP error codes that the SIB sends when it is overloaded
+    OVERLOAD_ERROR_CODES = (SSAP_ERROR_CODE.PROCESSOR, SSAP_ERROR_CODE.PERSISTENCE)
+
+    def __init__(self, maxInFlight=1, maxRate=None, minRate=1.0, rateStep=10.0, latencyTarget=None,
+                 latencyTolerance=3.0, decreaseFactor=0.5):
+        '''
+        Initializes the state of the controller.
+
+        Keyword arguments:
+        maxInFlight       -- the maximum number of unanswered requests. With more than one, the SIB must
+                             answer the requests of a connection in order.
+        maxRate           -- the maximum send rate (in requests per second). None disables the rate limiter.
+        minRate           -- the send rate will never go below this value.
+        rateStep          -- the send rate will grow by this number of requests per second every second.
+        latencyTarget     -- the response latency (in seconds) above which the SIB is considered overloaded.
+                             By default, it will be latencyTolerance times the lowest latency observed.
+        latencyTolerance  -- see latencyTarget.
+        decreaseFactor    -- the factor that will be applied to the limits when the SIB is overloaded.
+        '''
+        self.__lock = Lock()
+        self.__maxInFlight = maxInFlight
+        self.__window = 1.0
+        self.__maxRate = maxRate
+        self.__minRate = minRate
+        self.__rateStep = rateStep
+        if (maxRate is None):
+            self.__bucket = None
+        else:
+            self.__bucket = TokenBucket(maxRate)
+        self.__latencyTarget = latencyTarget
+        self.__latencyTolerance = latencyTolerance
+        self.__decreaseFactor = decreaseFactor
+        self.__minLatency = None
+        self.__smoothedLatency = 0
+        self.__lastDecrease = 0
+        self.__overloads = 0
+
+    def getInFlightLimit(self):
+        '''
+        Returns the current limit of unanswered requests.
+        '''
+        return int(self.__window)
+
+    def getRate(self):
+        '''
+        Returns the current send rate, or None if the rate limiter is disabled.
+        '''
+        if (self.__bucket is None):
+            return None
+        return self.__bucket.getRate()
+
+    def getStats(self):
+        '''
+        Returns a dictionary with the current state of the controller.
+        '''
+        return {"inFlightLimit" : self.getInFlightLimit(), "rate" : self.getRate(),
+                "smoothedLatency" : self.__smoothedLatency, "overloads" : self.__overloads}
+
+    def tryAcquire(self):
+        '''
+        Asks for permission to send a request. Returns 0 if it can be sent right now, or the
+        number of seconds to wait.
+        '''
+        if (self.__bucket is None):
+            return 0
+        return self.__bucket.tryAcquire()
+
+    def onResponse(self, latency, errorCode=None):
+        '''
+        Updates the limits after receiving a SSAP response.
+
+        Keyword arguments:
+        latency     -- the response latency (in seconds).
+        errorCode   -- the SSAP error code of the response. None if there were no errors.
+        '''
+        with self.__lock:
+            if (self.__minLatency is None or latency < self.__minLatency):
+                self.__minLatency = latency
+            self.__smoothedLatency = 0.875 * self.__smoothedLatency + 0.125 * latency
+            if (errorCode in AIMDFlowController.OVERLOAD_ERROR_CODES or latency > self.__getLatencyTarget()):
+                self.__decrease()
+            elif (errorCode is None):
+                self.__increase()
+
+    def __getLatencyTarget(self):
+        if (not self.__latencyTarget is None):
+            return self.__latencyTarget
+        return self.__minLatency * self.__latencyTolerance
+
+    def __increase(self):
+        self.__window = min(self.__maxInFlight, self.__window + 1.0 / self.__window)
+        if (not self.__bucket is None):
+            rate = self.__bucket.getRate()
+            self.__bucket.setRate(min(self.__maxRate, rate + self.__rateStep / rate))
+
+    def __decrease(self):
+        # The limits are decreased at most once per round trip. Otherwise, a burst of slow or
+        # failed responses would make them collapse.
+        now = monotonic()
+        if (now - self.__lastDecrease < self.__smoothedLatency):
+            return
+        self.__lastDecrease = now
+        self.__overloads = self.__overloads + 1
+        self.__window = max(1.0, self.__window * self.__decreaseFactor)
+        if (not self.__bucket is None):
+            self.__bucket.setRate(max(self.__minRate, self.__bucket.getRate() * self.__decreaseFactor))
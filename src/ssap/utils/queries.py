@@ -0,0 +1,44 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+import json
+import re
+from ssap.exceptions import InvalidSSAPOperation
+
+_NATIVE_FIND_QUERY = re.compile(r"^\s*db\.([^.\s]+)\.find\((.*)\)\s*;?\s*$", re.DOTALL)
+
+def restrictNativeQuery(query, condition, sortField=None):
+    '''
+    Adds a condition to a "db.<ontology>.find(<criteria>)" native query. Optionally, the results
+    are sorted by a field.
+
+    Keyword arguments:
+    query        -- the native query.
+    condition    -- a dictionary with the MongoDB criteria that the results must also match.
+    sortField    -- the dotted path of the field that will sort the results (in ascending order).
+    '''
+    match = _NATIVE_FIND_QUERY.match(query)
+    if (match is None):
+        raise InvalidSSAPOperation("Only db.<ontology>.find(<criteria>) queries can be restricted: " + query)
+    criteria = match.group(2).strip()
+    try:
+        criteria = json.loads(criteria) if criteria else {}
+    except ValueError:
+        criteria = None
+    if (not isinstance(criteria, dict)):
+        raise InvalidSSAPOperation("The criteria of the query must be a JSON object: " + query)
+    if (criteria):
+        criteria = {"$and" : [criteria, condition]}
+    else:
+        criteria = condition
+    restrictedQuery = "db.{0}.find({1})".format(match.group(1), json.dumps(criteria, sort_keys=True))
+    if (not sortField is None):
+        restrictedQuery += ".sort({0})".format(json.dumps({sortField : 1}))
+    return restrictedQuery
@@ -0,0 +1,50 @@
+# -*- coding: utf8 -*-
+'''
+ Python SSAP API
+ Version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+from calendar import timegm
+from datetime import datetime, timezone
+
+def toEpochSeconds(value):
+    '''
+    Converts a SSAP timestamp to seconds since the epoch. The timestamps can be numbers (in seconds
+    or milliseconds), ISO 8601 strings or MongoDB extended JSON dates (e.g. {"$date" : "2014-04-29T08:24:54.005Z"}).
+    Returns None if the value cannot be converted.
+
+    Keyword arguments:
+    value    -- the timestamp.
+    '''
+    if (isinstance(value, dict)):
+        value = value.get("$date")
+    if (isinstance(value, bool) or value is None):
+        return None
+    if (isinstance(value, (int, float))):
+        if (value > 1e11):
+            return value / 1000.0 # Milliseconds
+        return float(value)
+    if (isinstance(value, str)):
+        text = value.rstrip("Z")
+        for timestampFormat in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+            try:
+                parsed = datetime.strptime(text, timestampFormat)
+            except ValueError:
+                continue
+            return timegm(parsed.timetuple()) + parsed.microsecond / 1e6
+    return None
+
+def toExtendedJsonDate(epochSeconds):
+    '''
+    Converts seconds since the epoch to a MongoDB extended JSON date with millisecond precision
+    (e.g. {"$date" : "2014-04-29T08:24:54.005Z"}).
+
+    Keyword arguments:
+    epochSeconds    -- the timestamp.
+    '''
+    text = datetime.fromtimestamp(epochSeconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    return {"$date" : text}
@@ -0,0 +1,256 @@
+# -*- coding: utf8 -*-
+'''
+Local materialized views of ontologies.
+
+A view subscribes to an ontology, takes a QUERY snapshot of it and then applies the INDICATION
+messages incrementally to an in-memory keyed store, so that reads do not need a round trip to
+the SIB.
+
+This module is part of the Python SSAP API, version 1.5
+
+ © Indra Sistemas, S.A.
+ 2014  SPAIN
+
+ All rights reserved
+'''
+
+import logging
+from threading import RLock, Event
+from ssap.core import SSAP_QUERY_TYPE, SSAPRowHandler, MultiHandlerSSAPCallback
+from ssap.exceptions import InvalidSSAPOperation, InvalidSSAPCallback
+from ssap.subscriptions import SharedSubscriptionManager
+from ssap.utils.filters import compileFieldGetter
+from ssap.utils.logs import LogFactory
+
+class MaterializedView(SSAPRowHandler):
+    '''
+    An in-memory copy of the instances of an ontology, indexed by a key field and, optionally,
+    by other fields.
+
+    The bootstrap is gap-free: the subscription is sent before the snapshot QUERY, so the SIB
+    starts notifying the changes before it evaluates the query. The INDICATION messages received
+    while the snapshot is being loaded are buffered and applied after it.
+    '''
+
+    def __init__(self, endpoint, ontology, key="Sensor.assetId", indexes=(), query=None,
+                 queryType=SSAP_QUERY_TYPE.NATIVE, refreshTimeInMillis=1000, versionField=None,
+                 subscriptionManager=None, debugMode=False):
+        '''
+        Initializes the state of the view. The view will be empty until start() is invoked.
+
+        Keyword arguments:
+        endpoint             -- a joined SSAP endpoint. Its callback must be a MultiHandlerSSAPCallback.
+        ontology             -- the ontology whose instances will be stored in the view.
+        key                  -- the dotted path of the field that identifies the instances.
+        indexes              -- the dotted paths of the fields that will have a secondary index.
+        query                -- the query that selects the instances of the view. By default, all of them.
+        queryType            -- the type of the query (NATIVE, SQL-LIKE, CDB, SIB-DEFINED).
+        refreshTimeInMillis  -- the refresh time of the subscription.
+        versionField         -- the dotted path of a field that grows every time an instance changes. If
+                                it is set, the changes that are older than the stored instances will be
+                                discarded.
+        subscriptionManager  -- the SharedSubscriptionManager of the endpoint. By default, the one returned by
+                                SharedSubscriptionManager.forEndpoint().
+        debugMode            -- enables debug log messages.
+        '''
+        if (debugMode) :
+            logLevel = logging.DEBUG
+        else:
+            logLevel = logging.INFO
+        self.__logger = LogFactory.configureLogger(self, logLevel, LogFactory.DEFAULT_LOG_FILE)
+        if (subscriptionManager is None):
+            callback = endpoint._callback
+            if (not isinstance(callback, MultiHandlerSSAPCallback)):
+                raise InvalidSSAPCallback("Materialized views require an endpoint with a MultiHandlerSSAPCallback")
+            subscriptionManager = SharedSubscriptionManager.forEndpoint(endpoint, callback, debugMode)
+        if (query is None):
+            query = "db.{0}.find()".format(ontology)
+        self.__endpoint = endpoint
+        self.__subscriptionManager = subscriptionManager
+        self.__ontology = ontology
+        self.__query = query
+        self.__queryType = queryType
+        self.__refreshTimeInMillis = refreshTimeInMillis
+        self.__getKey = compileFieldGetter(key)
+        if (versionField is None):
+            self.__getVersion = None
+        else:
+            self.__getVersion = compileFieldGetter(versionField)
+        self.__indexGetters = dict((field, compileFieldGetter(field)) for field in indexes)
+        self.__lock = RLock()
+        self.__instances = {}
+        self.__indexes = dict((field, {}) for field in indexes)
+        self.__snapshot = None
+        self.__bufferedMessages = None
+        self.__subscription = None
+        self.__ready = Event()
+        self.__error = None
+
+    def start(self):
+        '''
+        Subscribes to the ontology and requests the snapshot. Use waitUntilReady() to wait for the
+        snapshot to be loaded.
+        '''
+        with self.__lock:
+            if (not self.__subscription is None):
+                raise InvalidSSAPOperation("The view has already been started")
+            self.__snapshot = {}
+            self.__bufferedMessages = []
+            self.__subscription = self.__subscriptionManager.subscribe(self.__ontology, self.__query, self.__onIndication,
+                                                                       self.__queryType, self.__refreshTimeInMillis,
+                                                                       errorHandler=self.__onSubscriptionRejected)
+            self.__endpoint.query(self.__ontology, self.__query, self.__queryType, rowHandler=self)
+
+    def stop(self):
+        '''
+        Cancels the subscription. The view will keep its current contents, but they will not be updated.
+        '''
+        with self.__lock:
+            if (self.__subscription is None):
+                raise InvalidSSAPOperation("The view has not been started")
+            self.__subscription.cancel()
+            self.__subscription = None
+
+    def waitUntilReady(self, timeout=None):
+        '''
+        Waits until the snapshot has been loaded. Returns True if it has been loaded, and False if the
+        timeout expired. If the SIB rejected the snapshot QUERY or the subscription, an InvalidSSAPOperation
+        will be raised.
+
+        Keyword arguments:
+        timeout    -- the maximum waiting time (in seconds). By default, there is no timeout.
+        '''
+        ready = self.__ready.wait(timeout)
+        if (not self.__error is None):
+            raise InvalidSSAPOperation("The snapshot could not be loaded: {0}".format(self.__error))
+        return ready
+
+    def isReady(self):
+        '''
+        Checks if the snapshot has been loaded.
+        '''
+        return self.__ready.is_set()
+
+    def get(self, key, default=None):
+        '''
+        Returns the instance that has the given key.
+
+        Keyword arguments:
+        key        -- the value of the key field.
+        default    -- the value that will be returned if there is no such instance.
+        '''
+        return self.__instances.get(key, default)
+
+    def find(self, field, value):
+        '''
+        Returns the instances whose indexed field has the given value.
+
+        Keyword arguments:
+        field    -- the dotted path of an indexed field.
+        value    -- the value of the field.
+        '''
+        if (not field in self.__indexes):
+            raise InvalidSSAPOperation("The field {0} is not indexed".format(field))
+        with self.__lock:
+            keys = self.__indexes[field].get(value, ())
+            return [self.__instances[key] for key in keys]
+
+    def getKeys(self):
+        '''
+        Returns a list with the keys of all the instances of the view.
+        '''
+        with self.__lock:
+            return list(self.__instances.keys())
+
+    def __len__(self):
+        return len(self.__instances)
+
+    def __contains__(self, key):
+        return key in self.__instances
+
+    def onRow(self, row):
+        # Do not call this method from client code!!!
+        key = self.__getKey(row)
+        if (key is None):
+            return
+        self.__snapshot[key] = row
+
+    def onQueryCompleted(self, message):
+        # Do not call this method from client code!!!
+        with self.__lock:
+            if (not message["body"]["ok"]):
+                self.__error = message["body"].get("error")
+                self.__logger.error("The SIB rejected the snapshot QUERY of the {0} view".format(self.__ontology))
+                self.__ready.set()
+                return
+            for instance in self.__snapshot.values():
+                self.__store(instance)
+            self.__snapshot = None
+            bufferedMessages = self.__bufferedMessages
+            self.__bufferedMessages = None
+            for bufferedMessage in bufferedMessages:
+                self.__apply(bufferedMessage)
+            self.__logger.debug("The {0} view has been loaded: {1} instances, {2} buffered notifications".format(
+                self.__ontology, len(self.__instances), len(bufferedMessages)))
+            self.__ready.set()
+
+    def __onSubscriptionRejected(self, message):
+        with self.__lock:
+            self.__error = message["body"].get("error")
+            self.__logger.error("The SIB rejected the subscription of the {0} view".format(self.__ontology))
+            self.__ready.set()
+
+    def __onIndication(self, message):
+        with self.__lock:
+            if (not self.__bufferedMessages is None):
+                self.__bufferedMessages.append(message)
+            else:
+                self.__apply(message)
+
+    def __apply(self, message):
+        '''
+        Stores the instances of an INDICATION message.
+        '''
+        data = message["body"].get("data")
+        if (data is None):
+            return
+        if (not isinstance(data, list)):
+            data = [data]
+        for instance in data:
+            self.__store(instance)
+
+    def __store(self, instance):
+        '''
+        Inserts or replaces an instance and updates the secondary indexes.
+        '''
+        key = self.__getKey(instance)
+        if (key is None):
+            return
+        previous = self.__instances.get(key)
+        if (not previous is None):
+            if (not self.__getVersion is None):
+                version = self.__getVersion(instance)
+                previousVersion = self.__getVersion(previous)
+                if (not version is None and not previousVersion is None and version < previousVersion):
+                    return # A stale change (e.g. a buffered notification that is older than the snapshot)
+            self.__updateIndexes(key, previous, False)
+        self.__instances[key] = instance
+        self.__updateIndexes(key, instance, True)
+
+    def __updateIndexes(self, key, instance, add):
+        for (field, getValue) in self.__indexGetters.items():
+            value = getValue(instance)
+            if (value is None):
+                continue
+            index = self.__indexes[field]
+            try:
+                if (add):
+                    index.setdefault(value, set()).add(key)
+                else:
+                    keys = index.get(value)
+                    if (not keys is None):
+                        keys.discard(key)
+                        if (not keys):
+                            del index[value]
+            except TypeError:
+                pass # Unhashable values (e.g. arrays) cannot be indexed